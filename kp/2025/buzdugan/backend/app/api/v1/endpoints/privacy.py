@@ -3,7 +3,9 @@
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import structlog
@@ -11,6 +13,8 @@ import structlog
 from app.core.database import get_db
 from app.models.privacy_policy import PrivacyPolicy
 from app.services.privacy_service import PrivacyService
+from app.services.query_service import QueryService
+from app.services.anonymization.streaming import STREAM_ENCODERS
 from app.services.auth_service import AuthService, get_current_user
 
 logger = structlog.get_logger(__name__)
@@ -45,11 +49,36 @@ class AnonymizationRequest(BaseModel):
     policy_id: str
     user_context: Optional[Dict[str, Any]] = None
 
+class StreamingAnonymizationRequest(AnonymizationRequest):
+    output_format: str = "ndjson"
+    chunk_size: Optional[int] = None
+
 class AnonymizationResponse(BaseModel):
     anonymized_data: List[Dict[str, Any]]
     applied_policy: str
     privacy_metrics: Dict[str, Any]
 
+async def check_query_access(db: Session, sql: str, current_user):
+    """Валидация запроса и проверка прав доступа к таблицам, как в /query/execute"""
+    query_service = QueryService(db)
+    
+    validation_result = await query_service.validate_query(sql)
+    if not validation_result["is_valid"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Невалидный SQL запрос: {validation_result['errors']}"
+        )
+    
+    access_check = await query_service.check_table_access(
+        validation_result["tables_accessed"],
+        current_user
+    )
+    if not access_check["allowed"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Нет доступа к таблицам: {access_check['denied_tables']}"
+        )
+
 @router.get("/policies", response_model=List[PrivacyPolicyResponse])
 async def get_privacy_policies(
     db: Session = Depends(get_db),
@@ -174,6 +203,11 @@ async def update_privacy_policy(
         
     except HTTPException:
         raise
+    except StaleDataError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Политика изменена другим запросом, повторите обновление"
+        )
     except Exception as e:
         logger.error(f"Ошибка обновления политики приватности: {e}")
         raise HTTPException(
@@ -238,6 +272,9 @@ async def anonymize_data(
                 detail="Политика не найдена"
             )
         
+        # Валидация запроса и проверка прав доступа к таблицам
+        await check_query_access(db, request.query, current_user)
+        
         # Применение анонимизации
         result = await privacy_service.apply_anonymization(
             table_name=request.table_name,
@@ -266,6 +303,74 @@ async def anonymize_data(
             detail="Внутренняя ошибка сервера"
         )
 
+@router.post("/anonymize/stream")
+async def anonymize_data_stream(
+    request: StreamingAnonymizationRequest,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Потоковая анонимизация данных: результат читается и отдаётся чанками
+    в формате NDJSON или Arrow IPC stream
+    """
+    try:
+        if request.output_format not in STREAM_ENCODERS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Неподдерживаемый формат: {request.output_format}"
+            )
+        if request.chunk_size is not None and request.chunk_size <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Размер чанка должен быть положительным"
+            )
+        
+        privacy_service = PrivacyService(db)
+        
+        # Получение политики
+        policy = await privacy_service.get_policy_by_id(request.policy_id)
+        if not policy:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Политика не найдена"
+            )
+        
+        # Валидация запроса и проверка прав доступа к таблицам
+        await check_query_access(db, request.query, current_user)
+        
+        stream = privacy_service.stream_anonymization(
+            query=request.query,
+            policy=policy,
+            output_format=request.output_format,
+            chunk_size=request.chunk_size
+        )
+        
+        # Первая часть вычисляется до отправки заголовков: ошибки запроса и
+        # первого прохода возвращаются кодом ответа, а не обрывом потока
+        first = await anext(stream, b"")
+        
+        async def body():
+            yield first
+            async for payload in stream:
+                yield payload
+        
+        logger.info("Начата потоковая анонимизация данных",
+                   policy_name=policy.name,
+                   table_name=request.table_name,
+                   output_format=request.output_format,
+                   user=current_user.username)
+        
+        return StreamingResponse(body(), media_type=STREAM_ENCODERS[request.output_format].media_type)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка потоковой анонимизации данных: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Внутренняя ошибка сервера"
+        )
+
 @router.get("/metrics")
 async def get_privacy_metrics(
     db: Session = Depends(get_db),
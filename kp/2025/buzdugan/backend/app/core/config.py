@@ -37,6 +37,11 @@ class Settings(BaseSettings):
     DEFAULT_L_DIVERSITY: int = 3
     DEFAULT_EPSILON: float = 1.0
     DEFAULT_DELTA: float = 0.00001
+    MONDRIAN_WORKERS: int = 0  # процессов для Mondrian (0 - по числу CPU)
+    MONDRIAN_PARALLEL_ROWS: int = 500_000  # строк, начиная с которых Mondrian использует пул процессов
+    HIERARCHY_CACHE_POLICIES: int = 128  # политик в кэше иерархий обобщения
+    HIERARCHY_MAX_CATEGORIES: int = 1_000_000  # значений в таблицах одной иерархии
+    ANONYMIZATION_CHUNK_SIZE: int = 50_000  # строк в чанке при чтении выборки серверным курсором
     
     # Логирование
     LOG_LEVEL: str = "INFO"
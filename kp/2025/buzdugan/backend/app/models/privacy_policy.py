@@ -2,7 +2,7 @@
 Модель политики приватности
 """
 
-from sqlalchemy import Column, String, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, String, Boolean, DateTime, Text, ForeignKey, Integer
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
@@ -19,6 +19,7 @@ class PrivacyPolicy(Base):
     policy_type = Column(String(50), nullable=False, index=True)  # 'k_anonymity', 'l_diversity', 'differential_privacy'
     parameters = Column(JSONB, nullable=False)
     is_active = Column(Boolean, default=True)
+    version = Column(Integer, nullable=False, default=1)  # растёт при каждом изменении политики
     created_by = Column(UUID(as_uuid=True), ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -26,6 +27,10 @@ class PrivacyPolicy(Base):
     # Связи
     creator = relationship("User", back_populates="created_policies")
     
+    # Версия увеличивается SQLAlchemy при каждом UPDATE; по ней
+    # инвалидируются скомпилированные иерархии обобщения
+    __mapper_args__ = {"version_id_col": version}
+    
     def __repr__(self):
         return f"<PrivacyPolicy(id={self.id}, name='{self.name}', type='{self.policy_type}')>"
     
@@ -37,6 +42,7 @@ class PrivacyPolicy(Base):
             "policy_type": self.policy_type,
             "parameters": self.parameters,
             "is_active": self.is_active,
+            "version": self.version,
             "created_by": str(self.created_by) if self.created_by else None,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
@@ -0,0 +1,320 @@
+"""
+Иерархии обобщения квази-идентификаторов
+
+Иерархия колонки задаёт значения на каждом уровне обобщения: уровень 0 -
+исходные значения, уровни 1..levels - всё более грубые (интервалы чисел,
+префиксы строк, усечение дат, таксономия пользователя). Иерархия
+компилируется в таблицы поиска: каждое значение получает код категории, и
+для каждого уровня хранится массив обобщённых значений по кодам. Применение
+уровня L - одна выборка tables[L][codes].
+
+Скомпилированные таблицы кэшируются по id и версии политики приватности, так
+что повторные запросы с той же политикой обобщают только новые значения.
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+
+
+class Hierarchy(ABC):
+    """Иерархия обобщения колонки"""
+
+    levels = 0
+
+    @abstractmethod
+    def generalize_values(self, values: pd.Index, level: int) -> np.ndarray:
+        """Обобщённые значения уровня level (1..levels) для уникальных значений"""
+
+
+class IdentityHierarchy(Hierarchy):
+    """Колонка без обобщения"""
+
+    def generalize_values(self, values: pd.Index, level: int) -> np.ndarray:
+        return values.to_numpy()
+
+
+class IntervalHierarchy(Hierarchy):
+    """
+    Числовые интервалы: на уровне L значения объединяются в интервалы ширины
+    widths[L-1]. style='interval' даёт подписи 'lo-hi' (hi не включается),
+    style='round' - округление до ближайшего кратного ширины.
+    """
+
+    def __init__(self, widths: List[float], style: str = "interval"):
+        if style not in ("interval", "round"):
+            raise ValueError(f"Unsupported interval style: {style}")
+        self.widths = list(widths)
+        self.style = style
+        self.levels = len(self.widths)
+
+    def generalize_values(self, values: pd.Index, level: int) -> np.ndarray:
+        width = self.widths[level - 1]
+        numbers = values.to_numpy(dtype=np.float64)
+        if self.style == "round":
+            return np.round(numbers / width) * width
+        low = np.floor(numbers / width) * width
+        return np.array([f"{lo:g}-{lo + width:g}" for lo in low], dtype=object)
+
+
+class PrefixHierarchy(Hierarchy):
+    """Префиксы строк: на уровне L остаются первые lengths[L-1] символов и маска"""
+
+    def __init__(self, lengths: List[int], mask: str = "*"):
+        self.lengths = list(lengths)
+        self.mask = mask
+        self.levels = len(self.lengths)
+
+    def generalize_values(self, values: pd.Index, level: int) -> np.ndarray:
+        prefixes = values.astype(str).str[:self.lengths[level - 1]] + self.mask
+        return prefixes.to_numpy(dtype=object)
+
+
+class DateHierarchy(Hierarchy):
+    """Усечение дат: на уровне L дата усекается до единицы units[L-1]"""
+
+    UNITS = ("day", "month", "quarter", "year", "decade")
+
+    def __init__(self, units: List[str]):
+        unsupported = [unit for unit in units if unit not in self.UNITS]
+        if unsupported:
+            raise ValueError(f"Unsupported date units: {unsupported}")
+        self.units = list(units)
+        self.levels = len(self.units)
+
+    def generalize_values(self, values: pd.Index, level: int) -> np.ndarray:
+        dates = pd.DatetimeIndex(values)
+        if dates.tz is not None:
+            dates = dates.tz_localize(None)
+        unit = self.units[level - 1]
+        if unit == "year":
+            return dates.year.to_numpy()
+        if unit == "decade":
+            return (dates.year // 10 * 10).to_numpy()
+        if unit == "day":
+            return dates.normalize().to_numpy()
+        return dates.to_period("M" if unit == "month" else "Q").to_timestamp().to_numpy()
+
+
+class TaxonomyHierarchy(Hierarchy):
+    """
+    Пользовательская таксономия {значение: родитель}: уровень L - предок на L
+    шагов выше. Значения вне таксономии и выше корня обобщаются до '*'.
+    """
+
+    ROOT = "*"
+
+    def __init__(self, parents: Dict[Any, Any]):
+        self.parents = dict(parents)
+        self.levels = max((self._depth(value) for value in self.parents), default=0)
+
+    def _depth(self, value: Any) -> int:
+        depth, seen = 0, set()
+        while value in self.parents:
+            if value in seen:
+                raise ValueError(f"Taxonomy has a cycle at '{value}'")
+            seen.add(value)
+            value = self.parents[value]
+            depth += 1
+        return depth
+
+    def generalize_values(self, values: pd.Index, level: int) -> np.ndarray:
+        current = pd.Index(values, dtype=object)
+        for _ in range(level):
+            current = current.map(lambda value: self.parents.get(value, self.ROOT))
+        return current.to_numpy(dtype=object)
+
+
+def build_hierarchy(config: Dict[str, Any]) -> Hierarchy:
+    """Иерархия из описания в параметрах политики"""
+    kind = config.get("type")
+    if kind == "interval":
+        return IntervalHierarchy(config["widths"], config.get("style", "interval"))
+    if kind == "prefix":
+        return PrefixHierarchy(config["lengths"], config.get("mask", "*"))
+    if kind == "date":
+        return DateHierarchy(config.get("units", ["month", "year"]))
+    if kind == "taxonomy":
+        return TaxonomyHierarchy(config["parents"])
+    raise ValueError(f"Unsupported generalization hierarchy: {kind}")
+
+
+def default_hierarchy(column: pd.Series, prefix_length: int, mask: str) -> Hierarchy:
+    """
+    Иерархия по умолчанию для колонки без описания в политике - одноуровневое
+    фиксированное обобщение: префикс строки, округление до десятков, год даты.
+    """
+    if column.dtype == "object":
+        return PrefixHierarchy([prefix_length], mask)
+    if pd.api.types.is_numeric_dtype(column):
+        return IntervalHierarchy([10], style="round")
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return DateHierarchy(["year"])
+    return IdentityHierarchy()
+
+
+class CompiledHierarchy:
+    """
+    Таблицы поиска иерархии: категории (уникальные значения) и массив
+    обобщённых значений по коду категории для каждого уровня.
+
+    Таблицы дополняются только новыми значениями; если категорий становится
+    больше max_categories, они перестраиваются по значениям текущей колонки.
+    """
+
+    def __init__(self, hierarchy: Hierarchy, max_categories: int):
+        self.hierarchy = hierarchy
+        self.max_categories = max_categories
+        # Категории и таблицы заменяются одним присваиванием
+        self._state: Tuple[Optional[pd.Index], List[np.ndarray]] = (None, [])
+
+    @property
+    def categories(self) -> int:
+        categories, _ = self._state
+        return 0 if categories is None else len(categories)
+
+    def _compile(self, values: pd.Index) -> List[np.ndarray]:
+        return [self.hierarchy.generalize_values(values, level) for level in range(1, self.hierarchy.levels + 1)]
+
+    def codes(self, column: pd.Series) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """Коды категорий колонки (-1 - пропуск) и таблицы, к которым они относятся"""
+        # Значения колонки кодируются локально, а с категориями таблиц
+        # сопоставляются только уникальные значения
+        local_codes, uniques = pd.factorize(column)
+        categories, tables = self._state
+        if categories is None:
+            positions = np.full(len(uniques), -1, dtype=np.intp)
+        else:
+            positions = categories.get_indexer(uniques)
+
+        unseen = positions < 0
+        if unseen.any():
+            new = uniques[unseen]
+            if categories is None or len(categories) + len(new) > self.max_categories:
+                # Таблицы строятся заново по значениям колонки
+                categories, tables = uniques, self._compile(uniques)
+                positions = np.arange(len(uniques), dtype=np.intp)
+            else:
+                # Компилируются только значения, которых ещё нет в таблицах
+                positions[unseen] = np.arange(len(categories), len(categories) + len(new))
+                categories = categories.append(new)
+                tables = [np.concatenate([table, added]) for table, added in zip(tables, self._compile(new))]
+            self._state = (categories, tables)
+
+        return np.append(positions, -1).take(local_codes), tables
+
+    def generalize(self, column: pd.Series, level: int) -> pd.Series:
+        """Значения колонки на уровне level - одна выборка из таблицы уровня"""
+        level = min(level, self.hierarchy.levels)
+        if level <= 0:
+            return column
+        codes, tables = self.codes(column)
+        if not tables:
+            # Таблиц ещё нет только у пустой колонки или колонки из пропусков
+            return column
+        result = pd.Series(tables[level - 1].take(codes), index=column.index, name=column.name)
+        missing = codes < 0
+        if missing.any():
+            result = result.where(~missing)
+        return result
+
+
+class GeneralizationHierarchies:
+    """
+    Иерархии квази-идентификаторов одной политики.
+
+    parameters["hierarchies"] описывает иерархии колонок
+    ({колонка: {"type": "interval" | "prefix" | "date" | "taxonomy", ...}}),
+    parameters["generalization_level"] - уровень обобщения, общий или
+    {колонка: уровень} (по умолчанию 1). Для колонок без описания
+    используется default(column) по типу данных.
+    """
+
+    def __init__(
+        self,
+        parameters: Dict[str, Any],
+        default: Callable[[pd.Series], Hierarchy],
+        max_categories: int
+    ):
+        self.configured = {
+            column: build_hierarchy(config)
+            for column, config in (parameters.get("hierarchies") or {}).items()
+        }
+        self.level = parameters.get("generalization_level", 1)
+        self.default = default
+        self.max_categories = max_categories
+        self.compiled: Dict[Tuple[str, str], CompiledHierarchy] = {}
+
+    def _compiled(self, column: pd.Series) -> CompiledHierarchy:
+        # Иерархия по умолчанию зависит от типа колонки
+        key = (column.name, "" if column.name in self.configured else column.dtype.kind)
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            hierarchy = self.configured.get(column.name) or self.default(column)
+            compiled = self.compiled[key] = CompiledHierarchy(hierarchy, self.max_categories)
+        return compiled
+
+    def level_for(self, column: str) -> int:
+        if isinstance(self.level, dict):
+            return int(self.level.get(column, 1))
+        return int(self.level)
+
+    def generalize(self, column: pd.Series, level: Optional[int] = None) -> pd.Series:
+        """Обобщение колонки до уровня level (по умолчанию - уровень из политики)"""
+        if level is None:
+            level = self.level_for(column.name)
+        return self._compiled(column).generalize(column, level)
+
+
+class HierarchyCache:
+    """
+    Кэш скомпилированных иерархий по (пространство, id политики, версия).
+
+    Новая версия политики вытесняет прежние версии той же политики; общее
+    число политик ограничено max_policies (вытесняются давно не
+    использованные).
+    """
+
+    def __init__(self, max_policies: int, max_categories: int):
+        self.max_policies = max_policies
+        self.max_categories = max_categories
+        self._entries: "OrderedDict[Tuple[Hashable, ...], GeneralizationHierarchies]" = OrderedDict()
+
+    def get(
+        self,
+        namespace: str,
+        policy_key: Optional[Tuple[Hashable, Hashable]],
+        parameters: Dict[str, Any],
+        default: Callable[[pd.Series], Hierarchy]
+    ) -> GeneralizationHierarchies:
+        """Иерархии политики; без policy_key строятся заново и не кэшируются"""
+        if policy_key is None:
+            return GeneralizationHierarchies(parameters, default, self.max_categories)
+
+        key = (namespace, *policy_key)
+        hierarchies = self._entries.get(key)
+        if hierarchies is not None:
+            self._entries.move_to_end(key)
+            return hierarchies
+
+        for stale in [cached for cached in self._entries if cached[:2] == key[:2]]:
+            del self._entries[stale]
+        hierarchies = self._entries[key] = GeneralizationHierarchies(parameters, default, self.max_categories)
+        while len(self._entries) > self.max_policies:
+            self._entries.popitem(last=False)
+        return hierarchies
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Глобальный кэш иерархий
+hierarchy_cache = HierarchyCache(
+    max_policies=settings.HIERARCHY_CACHE_POLICIES,
+    max_categories=settings.HIERARCHY_MAX_CATEGORIES
+)
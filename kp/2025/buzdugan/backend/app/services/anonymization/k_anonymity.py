@@ -2,20 +2,54 @@
 Реализация алгоритма k-анонимности
 """
 
+import asyncio
+import os
+from functools import partial
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
 import structlog
 
+from app.core.config import settings
+from app.services.anonymization.hierarchy import (
+    GeneralizationHierarchies,
+    default_hierarchy,
+    hierarchy_cache
+)
+from app.services.anonymization.mondrian import (
+    encode_quasi_identifiers,
+    generalize_partitions,
+    mondrian_partition
+)
+from app.services.anonymization.streaming import GroupCounter, suppress_groups
+
 logger = structlog.get_logger(__name__)
 
+# Алгоритмы k-анонимности
+K_ANONYMITY_ALGORITHMS = ("generalization", "mondrian")
+
 class KAnonymityService:
     """Сервис для применения k-анонимности"""
     
     def __init__(self):
         self.logger = logger
+        # Без описания в политике: строки - 3 символа и '***', числа - до десятков, даты - год
+        self.default_hierarchy = partial(default_hierarchy, prefix_length=3, mask="***")
+    
+    def hierarchies(
+        self,
+        parameters: Dict[str, Any],
+        policy_key: Optional[Tuple[Any, Any]] = None
+    ) -> GeneralizationHierarchies:
+        """Иерархии обобщения политики из кэша по (id, версия) политики"""
+        return hierarchy_cache.get("k_anonymity", policy_key, parameters, self.default_hierarchy)
     
-    async def apply(self, data: pd.DataFrame, parameters: Dict[str, Any]) -> pd.DataFrame:
+    async def apply(
+        self,
+        data: pd.DataFrame,
+        parameters: Dict[str, Any],
+        policy_key: Optional[Tuple[Any, Any]] = None
+    ) -> pd.DataFrame:
         """
         Применение k-анонимности к данным
         
@@ -24,29 +58,51 @@ class KAnonymityService:
             parameters: Параметры k-анонимности
                 - k: минимальное количество записей в группе
                 - quasi_identifiers: список квази-идентификаторов
+                - algorithm: 'generalization' (фиксированное обобщение колонок,
+                  по умолчанию) или 'mondrian' (многомерное разбиение по медианам)
+                - ordinal_orders: для mondrian - порядок значений нечисловых
+                  квази-идентификаторов, {колонка: [значения]}
+                - n_jobs: для mondrian - число процессов (по умолчанию из настроек)
+                - hierarchies, generalization_level: для generalization -
+                  иерархии обобщения колонок и уровень (см. GeneralizationHierarchies)
+            policy_key: (id, версия) политики для кэша иерархий обобщения
         
         Returns:
-            Анонимизированные данные
+            Анонимизированные данные; для mondrian метрики потери информации
+            лежат в attrs["information_loss"]. Если ни одна группа не набирает
+            k записей, возвращается пустой DataFrame. Без квази-идентификаторов
+            в данных выбрасывается ValueError; ошибки пробрасываются, исходные
+            строки не возвращаются.
         """
+        algorithm = parameters.get("algorithm", "generalization")
+        if algorithm not in K_ANONYMITY_ALGORITHMS:
+            raise ValueError(f"Unsupported k-anonymity algorithm: {algorithm}")
+        
         try:
             k = parameters.get("k", 5)
             quasi_identifiers = parameters.get("quasi_identifiers", [])
             
-            if not quasi_identifiers:
-                self.logger.warning("Не указаны квази-идентификаторы для k-анонимности")
-                return data
-            
-            # Проверка наличия квази-идентификаторов в данных
+            # Без квази-идентификаторов анонимизировать нечего: ошибка вместо
+            # исходных строк, как в stream
             available_qi = [col for col in quasi_identifiers if col in data.columns]
             if not available_qi:
-                self.logger.warning("Квази-идентификаторы не найдены в данных")
-                return data
+                raise ValueError(f"Quasi-identifiers {quasi_identifiers} are not in the data")
             
             # Применение k-анонимности
-            anonymized_data = await self._apply_k_anonymity(data, available_qi, k)
+            if algorithm == "mondrian":
+                anonymized_data = await self._apply_mondrian(
+                    data, available_qi, k,
+                    parameters.get("ordinal_orders"),
+                    parameters.get("n_jobs", settings.MONDRIAN_WORKERS)
+                )
+            else:
+                anonymized_data = await self._apply_k_anonymity(
+                    data, available_qi, k, self.hierarchies(parameters, policy_key)
+                )
             
             self.logger.info("Применена k-анонимность",
                            k=k,
+                           algorithm=algorithm,
                            quasi_identifiers=available_qi,
                            original_rows=len(data),
                            anonymized_rows=len(anonymized_data))
@@ -55,93 +111,170 @@ class KAnonymityService:
             
         except Exception as e:
             self.logger.error(f"Ошибка применения k-анонимности: {e}")
-            return data
+            raise
     
     async def _apply_k_anonymity(
         self, 
         data: pd.DataFrame, 
         quasi_identifiers: List[str], 
-        k: int
+        k: int,
+        hierarchies: Optional[GeneralizationHierarchies] = None
     ) -> pd.DataFrame:
-        """Применение алгоритма k-анонимности"""
+        """
+        Применение алгоритма k-анонимности.
+        
+        Квази-идентификаторы обобщаются один раз по колонкам выборкой из
+        скомпилированных иерархий, размер группы каждой строки считается по
+        обобщённым значениям через transform('size'), а группы меньше k
+        подавляются булевой маской - без обхода групп в Python.
+        """
         try:
-            # Создание копии данных
-            anonymized_data = data.copy()
-            
-            # Группировка по квази-идентификаторам
-            groups = anonymized_data.groupby(quasi_identifiers)
-            
-            # Фильтрация групп с размером >= k
-            valid_groups = []
-            for name, group in groups:
-                if len(group) >= k:
-                    valid_groups.append(group)
-                else:
-                    # Для групп с размером < k применяем обобщение
-                    generalized_group = await self._generalize_group(group, quasi_identifiers)
-                    if len(generalized_group) >= k:
-                        valid_groups.append(generalized_group)
-            
-            if not valid_groups:
-                self.logger.warning("Не удалось создать группы с k-анонимностью")
-                return data
+            generalized = self._generalize(data, quasi_identifiers, hierarchies)
+            
+            # Размер группы для каждой строки; строки с пропусками в
+            # квази-идентификаторах не попадают ни в одну группу (NaN)
+            group_sizes = generalized.groupby(quasi_identifiers, sort=False).transform('size')
+            mask = (group_sizes >= k).to_numpy()
             
-            # Объединение валидных групп
-            result = pd.concat(valid_groups, ignore_index=True)
+            if not mask.any():
+                self.logger.warning("Не удалось создать группы с k-анонимностью")
+                return data.iloc[:0]
             
-            # Применение обобщения к квази-идентификаторам
+            # Подавление малых групп и подстановка обобщённых значений
+            result = data[mask].reset_index(drop=True)
             for qi in quasi_identifiers:
-                if qi in result.columns:
-                    result[qi] = await self._generalize_column(result[qi])
+                result[qi] = generalized[qi].to_numpy()[mask]
             
             return result
             
         except Exception as e:
             self.logger.error(f"Ошибка применения алгоритма k-анонимности: {e}")
-            return data
+            raise
     
-    async def _generalize_group(
-        self, 
-        group: pd.DataFrame, 
-        quasi_identifiers: List[str]
+    async def stream(
+        self,
+        read_chunks: Callable[[], AsyncIterator[pd.DataFrame]],
+        parameters: Dict[str, Any],
+        policy_key: Optional[Tuple[Any, Any]] = None
+    ) -> AsyncIterator[pd.DataFrame]:
+        """
+        Потоковое применение k-анонимности к выборке, читаемой чанками
+        
+        read_chunks() при каждом вызове заново читает выборку (асинхронно,
+        чтение из базы идёт вне цикла событий). Первый проход считает размеры
+        групп обобщённых квази-идентификаторов, второй выдаёт строки групп не
+        меньше k. Mondrian делит всю выборку сразу, поэтому для него чанки
+        собираются и анонимизируются вместе. Параметры - как в apply; если
+        квази-идентификаторов нет в выборке, выдаётся ошибка, а не исходные строки.
+        """
+        k = parameters.get("k", 5)
+        quasi_identifiers = parameters.get("quasi_identifiers", [])
+        algorithm = parameters.get("algorithm", "generalization")
+        
+        if algorithm not in K_ANONYMITY_ALGORITHMS:
+            raise ValueError(f"Unsupported k-anonymity algorithm: {algorithm}")
+        if algorithm == "mondrian":
+            data = pd.concat([chunk async for chunk in read_chunks()], ignore_index=True)
+            if not any(col in data.columns for col in quasi_identifiers):
+                raise ValueError(f"Quasi-identifiers {quasi_identifiers} are not in the query result")
+            yield await self.apply(data, parameters, policy_key)
+            return
+        
+        hierarchies = self.hierarchies(parameters, policy_key)
+        
+        # Первый проход: размеры групп; колонки выборки известны по первому чанку
+        counter, available_qi = None, []
+        chunks = read_chunks()
+        async for chunk in chunks:
+            if counter is None:
+                available_qi = [col for col in quasi_identifiers if col in chunk.columns]
+                if not available_qi:
+                    break
+                counter = GroupCounter(available_qi)
+            counter.add(self._generalize(chunk, available_qi, hierarchies))
+        await chunks.aclose()
+        
+        if counter is None:
+            raise ValueError(f"Quasi-identifiers {quasi_identifiers} are not in the query result")
+        
+        counts = counter.counts()
+        groups = counts[counts >= k].index.to_frame(index=False)
+        
+        # Второй проход: строки групп не меньше k
+        rows = 0
+        async for chunk in read_chunks():
+            result = suppress_groups(chunk, self._generalize(chunk, available_qi, hierarchies), available_qi, groups)
+            rows += len(result)
+            yield result
+        
+        self.logger.info("Применена потоковая k-анонимность",
+                       k=k,
+                       quasi_identifiers=available_qi,
+                       groups=len(counts),
+                       kept_groups=len(groups),
+                       anonymized_rows=rows)
+    
+    def _generalize(
+        self,
+        data: pd.DataFrame,
+        quasi_identifiers: List[str],
+        hierarchies: Optional[GeneralizationHierarchies]
     ) -> pd.DataFrame:
-        """Обобщение группы для достижения k-анонимности"""
+        """Обобщённые квази-идентификаторы: одна выборка по каждой колонке"""
+        hierarchies = hierarchies or self.hierarchies({})
+        return pd.DataFrame(
+            {qi: hierarchies.generalize(data[qi]) for qi in quasi_identifiers},
+            index=data.index
+        )
+    
+    async def _apply_mondrian(
+        self,
+        data: pd.DataFrame,
+        quasi_identifiers: List[str],
+        k: int,
+        ordinal_orders: Dict[str, List[Any]] = None,
+        n_jobs: int = 0
+    ) -> pd.DataFrame:
+        """
+        Применение k-анонимности разбиением Mondrian.
+        
+        Записи делятся по медианам квази-идентификаторов, пока обе половины
+        содержат не меньше k записей; значения в каждом разделе заменяются
+        интервалом [min, max] раздела. Обобщение подстраивается под данные,
+        поэтому k достигается без подавления (кроме строк с пропусками).
+        Кодирование, разбиение и обобщение выполняются в потоке, чтобы не
+        блокировать цикл событий.
+        """
         try:
-            generalized_group = group.copy()
+            encoded = await asyncio.to_thread(
+                encode_quasi_identifiers, data, quasi_identifiers, ordinal_orders
+            )
+            labels = await asyncio.to_thread(
+                mondrian_partition, encoded, k,
+                workers=n_jobs or os.cpu_count() or 1,
+                parallel_rows=settings.MONDRIAN_PARALLEL_ROWS
+            )
+            mask = labels >= 0
             
-            for qi in quasi_identifiers:
-                if qi in generalized_group.columns:
-                    # Применение обобщения к колонке
-                    generalized_group[qi] = await self._generalize_column(generalized_group[qi])
-            
-            return generalized_group
+            if not mask.any():
+                self.logger.warning("Не удалось создать группы с k-анонимностью")
+                return data.iloc[:0]
             
-        except Exception as e:
-            self.logger.error(f"Ошибка обобщения группы: {e}")
-            return group
-    
-    async def _generalize_column(self, column: pd.Series) -> pd.Series:
-        """Обобщение значений в колонке"""
-        try:
-            if column.dtype == 'object':
-                # Для строковых данных - обрезание до первых символов
-                return column.astype(str).str[:3] + "***"
+            generalized, information_loss = await asyncio.to_thread(
+                generalize_partitions, encoded, labels, k
+            )
             
-            elif pd.api.types.is_numeric_dtype(column):
-                # Для числовых данных - округление до ближайшего десятка
-                return (column / 10).round() * 10
+            result = data[mask].reset_index(drop=True)
+            for qi, values in zip(quasi_identifiers, generalized):
+                result[qi] = values
+            result.attrs["information_loss"] = information_loss
             
-            elif pd.api.types.is_datetime64_any_dtype(column):
-                # Для дат - округление до года
-                return column.dt.year
+            self.logger.info("Разбиение Mondrian", k=k, **information_loss)
+            return result
             
-            else:
-                # Для других типов - возврат без изменений
-                return column
-                
         except Exception as e:
-            self.logger.error(f"Ошибка обобщения колонки: {e}")
-            return column
+            self.logger.error(f"Ошибка применения Mondrian: {e}")
+            raise
     
     async def calculate_k_anonymity_level(
         self, 
@@ -153,13 +286,13 @@ class KAnonymityService:
             if not quasi_identifiers:
                 return 0
             
-            # Группировка по квази-идентификаторам
-            groups = data.groupby(quasi_identifiers)
+            # Размеры всех групп одним проходом
+            group_sizes = data.groupby(quasi_identifiers, sort=False).size()
+            if group_sizes.empty:
+                return 0
             
             # Поиск минимального размера группы
-            min_group_size = min(len(group) for _, group in groups)
-            
-            return min_group_size
+            return int(group_sizes.min())
             
         except Exception as e:
             self.logger.error(f"Ошибка вычисления уровня k-анонимности: {e}")
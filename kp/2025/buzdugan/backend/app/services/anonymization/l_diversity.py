@@ -2,20 +2,46 @@
 Реализация алгоритма l-разнообразия
 """
 
+from functools import partial
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
 import structlog
 
+from app.services.anonymization.hierarchy import (
+    GeneralizationHierarchies,
+    default_hierarchy,
+    hierarchy_cache
+)
+from app.services.anonymization.streaming import GroupCounter, suppress_groups
+
 logger = structlog.get_logger(__name__)
 
+# Варианты l-разнообразия
+DIVERSITY_VARIANTS = ("distinct", "entropy", "recursive")
+
 class LDiversityService:
     """Сервис для применения l-разнообразия"""
     
     def __init__(self):
         self.logger = logger
+        # Без описания в политике: строки - 2 символа и '**', числа - до десятков, даты - год
+        self.default_hierarchy = partial(default_hierarchy, prefix_length=2, mask="**")
     
-    async def apply(self, data: pd.DataFrame, parameters: Dict[str, Any]) -> pd.DataFrame:
+    def hierarchies(
+        self,
+        parameters: Dict[str, Any],
+        policy_key: Optional[Tuple[Any, Any]] = None
+    ) -> GeneralizationHierarchies:
+        """Иерархии обобщения политики из кэша по (id, версия) политики"""
+        return hierarchy_cache.get("l_diversity", policy_key, parameters, self.default_hierarchy)
+    
+    async def apply(
+        self,
+        data: pd.DataFrame,
+        parameters: Dict[str, Any],
+        policy_key: Optional[Tuple[Any, Any]] = None
+    ) -> pd.DataFrame:
         """
         Применение l-разнообразия к данным
         
@@ -25,40 +51,57 @@ class LDiversityService:
                 - l: минимальное количество различных значений чувствительного атрибута
                 - sensitive_attribute: чувствительный атрибут
                 - quasi_identifiers: список квази-идентификаторов
+                - diversity: 'distinct' (не меньше l различных значений, по
+                  умолчанию), 'entropy' (энтропия группы не меньше log l) или
+                  'recursive' (рекурсивное (c,l): r1 < c·(r_l + ... + r_m))
+                - c: константа рекурсивного (c,l)-разнообразия
+                - report_only: вернуть только отчёт о разнообразии групп
+                  (см. diversity_report) без анонимизированных данных
+                - hierarchies, generalization_level: иерархии обобщения колонок
+                  и уровень (см. GeneralizationHierarchies)
+            policy_key: (id, версия) политики для кэша иерархий обобщения
         
         Returns:
-            Анонимизированные данные
+            Анонимизированные данные или отчёт о группах при report_only.
+            Если ни одна группа не удовлетворяет l-разнообразию, возвращается
+            пустой DataFrame. Без чувствительного атрибута или
+            квази-идентификаторов в данных выбрасывается ValueError; ошибки
+            пробрасываются, исходные строки не возвращаются.
         """
+        diversity = parameters.get("diversity", "distinct")
+        if diversity not in DIVERSITY_VARIANTS:
+            raise ValueError(f"Unsupported l-diversity variant: {diversity}")
+        
         try:
             l = parameters.get("l", 3)
             sensitive_attribute = parameters.get("sensitive_attribute")
             quasi_identifiers = parameters.get("quasi_identifiers", [])
+            c = parameters.get("c", 1.0)
             
-            if not sensitive_attribute:
-                self.logger.warning("Не указан чувствительный атрибут для l-разнообразия")
-                return data
-            
-            if sensitive_attribute not in data.columns:
-                self.logger.warning(f"Чувствительный атрибут '{sensitive_attribute}' не найден в данных")
-                return data
+            # Без чувствительного атрибута или квази-идентификаторов анонимизировать
+            # нечего: ошибка вместо исходных строк, как в stream
+            available_qi = [col for col in quasi_identifiers if col in data.columns]
+            if not sensitive_attribute or sensitive_attribute not in data.columns or not available_qi:
+                raise ValueError(
+                    f"Sensitive attribute '{sensitive_attribute}' or quasi-identifiers "
+                    f"{quasi_identifiers} are not in the data"
+                )
             
-            if not quasi_identifiers:
-                self.logger.warning("Не указаны квази-идентификаторы для l-разнообразия")
-                return data
+            hierarchies = self.hierarchies(parameters, policy_key)
             
-            # Проверка наличия квази-идентификаторов в данных
-            available_qi = [col for col in quasi_identifiers if col in data.columns]
-            if not available_qi:
-                self.logger.warning("Квази-идентификаторы не найдены в данных")
-                return data
+            if parameters.get("report_only"):
+                return await self.diversity_report(
+                    data, available_qi, sensitive_attribute, l, diversity, c, hierarchies
+                )
             
             # Применение l-разнообразия
             anonymized_data = await self._apply_l_diversity(
-                data, available_qi, sensitive_attribute, l
+                data, available_qi, sensitive_attribute, l, hierarchies, diversity, c
             )
             
             self.logger.info("Применено l-разнообразие",
                            l=l,
+                           diversity=diversity,
                            sensitive_attribute=sensitive_attribute,
                            quasi_identifiers=available_qi,
                            original_rows=len(data),
@@ -68,108 +111,282 @@ class LDiversityService:
             
         except Exception as e:
             self.logger.error(f"Ошибка применения l-разнообразия: {e}")
-            return data
+            raise
     
     async def _apply_l_diversity(
         self, 
         data: pd.DataFrame, 
         quasi_identifiers: List[str], 
         sensitive_attribute: str, 
-        l: int
+        l: int,
+        hierarchies: Optional[GeneralizationHierarchies] = None,
+        diversity: str = "distinct",
+        c: float = 1.0
     ) -> pd.DataFrame:
-        """Применение алгоритма l-разнообразия"""
+        """
+        Применение алгоритма l-разнообразия.
+        
+        Квази-идентификаторы обобщаются один раз по колонкам, показатели
+        разнообразия всех групп считаются одним проходом по матрице
+        сопряжённости, а группы без l-разнообразия подавляются булевой маской.
+        """
         try:
-            # Создание копии данных
-            anonymized_data = data.copy()
+            generalized = self._generalize(data, quasi_identifiers, hierarchies)
+            group_codes, report = self._group_diversity(
+                generalized, quasi_identifiers, data[sensitive_attribute], l, diversity, c
+            )
             
-            # Группировка по квази-идентификаторам
-            groups = anonymized_data.groupby(quasi_identifiers)
+            # Код -1 (пропуск в квази-идентификаторах) выбирает последний элемент - False
+            mask = np.append(report["satisfied"].to_numpy(), False)[group_codes]
             
-            # Фильтрация групп с l-разнообразием
-            valid_groups = []
-            for name, group in groups:
-                # Подсчет уникальных значений чувствительного атрибута
-                unique_sensitive_values = group[sensitive_attribute].nunique()
-                
-                if unique_sensitive_values >= l:
-                    valid_groups.append(group)
-                else:
-                    # Для групп без l-разнообразия применяем обобщение
-                    generalized_group = await self._generalize_for_l_diversity(
-                        group, quasi_identifiers, sensitive_attribute, l
-                    )
-                    if generalized_group is not None:
-                        valid_groups.append(generalized_group)
-            
-            if not valid_groups:
+            if not mask.any():
                 self.logger.warning("Не удалось создать группы с l-разнообразием")
-                return data
-            
-            # Объединение валидных групп
-            result = pd.concat(valid_groups, ignore_index=True)
+                return data.iloc[:0]
             
-            # Применение обобщения к квази-идентификаторам
+            # Подавление групп без l-разнообразия и подстановка обобщённых значений
+            result = data[mask].reset_index(drop=True)
             for qi in quasi_identifiers:
-                if qi in result.columns:
-                    result[qi] = await self._generalize_column(result[qi])
+                result[qi] = generalized[qi].to_numpy()[mask]
             
             return result
             
         except Exception as e:
             self.logger.error(f"Ошибка применения алгоритма l-разнообразия: {e}")
-            return data
+            raise
     
-    async def _generalize_for_l_diversity(
-        self, 
-        group: pd.DataFrame, 
-        quasi_identifiers: List[str], 
-        sensitive_attribute: str, 
-        l: int
+    async def diversity_report(
+        self,
+        data: pd.DataFrame,
+        quasi_identifiers: List[str],
+        sensitive_attribute: str,
+        l: int,
+        diversity: str = "distinct",
+        c: float = 1.0,
+        hierarchies: Optional[GeneralizationHierarchies] = None
     ) -> pd.DataFrame:
-        """Обобщение группы для достижения l-разнообразия"""
+        """
+        Отчёт о разнообразии групп без построения анонимизированных данных.
+        
+        Строка на группу обобщённых квази-идентификаторов: size, distinct
+        (различных значений чувствительного атрибута), entropy (в натах),
+        recursive_ratio (r1 / (r_l + ... + r_m); группа удовлетворяет
+        рекурсивному (c,l), если он меньше c) и satisfied для выбранного варианта.
+        """
         try:
-            generalized_group = group.copy()
+            generalized = self._generalize(data, quasi_identifiers, hierarchies)
+            _, report = self._group_diversity(
+                generalized, quasi_identifiers, data[sensitive_attribute], l, diversity, c
+            )
+            return report
             
-            # Применение обобщения к квази-идентификаторам
-            for qi in quasi_identifiers:
-                if qi in generalized_group.columns:
-                    generalized_group[qi] = await self._generalize_column(generalized_group[qi])
-            
-            # Проверка l-разнообразия после обобщения
-            unique_sensitive_values = generalized_group[sensitive_attribute].nunique()
-            
-            if unique_sensitive_values >= l:
-                return generalized_group
-            else:
-                # Если l-разнообразие не достигнуто, возвращаем None
-                return None
-                
         except Exception as e:
-            self.logger.error(f"Ошибка обобщения группы для l-разнообразия: {e}")
-            return None
+            self.logger.error(f"Ошибка построения отчёта l-разнообразия: {e}")
+            raise
     
-    async def _generalize_column(self, column: pd.Series) -> pd.Series:
-        """Обобщение значений в колонке"""
-        try:
-            if column.dtype == 'object':
-                # Для строковых данных - обрезание до первых символов
-                return column.astype(str).str[:2] + "**"
-            
-            elif pd.api.types.is_numeric_dtype(column):
-                # Для числовых данных - округление до ближайшего десятка
-                return (column / 10).round() * 10
-            
-            elif pd.api.types.is_datetime64_any_dtype(column):
-                # Для дат - округление до года
-                return column.dt.year
-            
-            else:
-                # Для других типов - возврат без изменений
-                return column
-                
-        except Exception as e:
-            self.logger.error(f"Ошибка обобщения колонки: {e}")
-            return column
+    async def stream(
+        self,
+        read_chunks: Callable[[], AsyncIterator[pd.DataFrame]],
+        parameters: Dict[str, Any],
+        policy_key: Optional[Tuple[Any, Any]] = None
+    ) -> AsyncIterator[pd.DataFrame]:
+        """
+        Потоковое применение l-разнообразия к выборке, читаемой чанками
+        
+        read_chunks() при каждом вызове заново читает выборку (асинхронно,
+        чтение из базы идёт вне цикла событий). Первый проход накапливает
+        число строк по парам (обобщённые квази-идентификаторы, значение
+        чувствительного атрибута), из которых считаются показатели
+        разнообразия групп; второй выдаёт строки групп, удовлетворяющих
+        варианту diversity. При report_only выдаётся только отчёт о группах
+        после первого прохода. Параметры - как в apply; если чувствительного
+        атрибута или квази-идентификаторов нет в выборке, выдаётся ошибка, а
+        не исходные строки.
+        """
+        l = parameters.get("l", 3)
+        sensitive_attribute = parameters.get("sensitive_attribute")
+        quasi_identifiers = parameters.get("quasi_identifiers", [])
+        diversity = parameters.get("diversity", "distinct")
+        c = parameters.get("c", 1.0)
+        report_only = parameters.get("report_only", False)
+        
+        if diversity not in DIVERSITY_VARIANTS:
+            raise ValueError(f"Unsupported l-diversity variant: {diversity}")
+        
+        hierarchies = self.hierarchies(parameters, policy_key)
+        
+        def generalize(chunk: pd.DataFrame) -> pd.DataFrame:
+            generalized = self._generalize(chunk, available_qi, hierarchies)
+            generalized[sensitive_attribute] = chunk[sensitive_attribute]
+            return generalized
+        
+        # Первый проход: матрица сопряжённости; колонки выборки известны по первому чанку
+        cells, sizes, available_qi = None, None, []
+        chunks = read_chunks()
+        async for chunk in chunks:
+            if cells is None:
+                available_qi = [col for col in quasi_identifiers if col in chunk.columns]
+                if not sensitive_attribute or sensitive_attribute not in chunk.columns or not available_qi:
+                    break
+                cells = GroupCounter(available_qi + [sensitive_attribute])
+                sizes = GroupCounter(available_qi) if report_only else None
+            generalized = generalize(chunk)
+            cells.add(generalized)
+            if sizes is not None:
+                sizes.add(generalized[available_qi])
+        await chunks.aclose()
+        
+        if cells is None:
+            raise ValueError(
+                f"Sensitive attribute '{sensitive_attribute}' or quasi-identifiers "
+                f"{quasi_identifiers} are not in the query result"
+            )
+        
+        if report_only:
+            yield self._counts_report(cells.counts(), l, diversity, c, sizes.counts())
+            return
+        
+        report = self._counts_report(cells.counts(), l, diversity, c)
+        groups = report.loc[report["satisfied"], available_qi]
+        
+        # Второй проход: строки групп с l-разнообразием
+        rows = 0
+        async for chunk in read_chunks():
+            result = suppress_groups(chunk, generalize(chunk), available_qi, groups)
+            rows += len(result)
+            yield result
+        
+        self.logger.info("Применено потоковое l-разнообразие",
+                       l=l,
+                       diversity=diversity,
+                       sensitive_attribute=sensitive_attribute,
+                       quasi_identifiers=available_qi,
+                       groups=len(report),
+                       kept_groups=len(groups),
+                       anonymized_rows=rows)
+    
+    def _generalize(
+        self,
+        data: pd.DataFrame,
+        quasi_identifiers: List[str],
+        hierarchies: Optional[GeneralizationHierarchies]
+    ) -> pd.DataFrame:
+        """Обобщённые квази-идентификаторы: одна выборка по каждой колонке"""
+        hierarchies = hierarchies or self.hierarchies({})
+        return pd.DataFrame(
+            {qi: hierarchies.generalize(data[qi]) for qi in quasi_identifiers},
+            index=data.index
+        )
+    
+    def _group_diversity(
+        self,
+        generalized: pd.DataFrame,
+        quasi_identifiers: List[str],
+        sensitive: pd.Series,
+        l: int,
+        diversity: str,
+        c: float
+    ) -> Tuple[np.ndarray, pd.DataFrame]:
+        """
+        Коды групп строк (-1 - строка без группы) и показатели разнообразия групп.
+        
+        Все варианты считаются из одной разреженной матрицы сопряжённости
+        группа × значение чувствительного атрибута, заданной тройками
+        (группа, значение, число строк), отсортированными по группе.
+        """
+        group_codes = generalized.groupby(quasi_identifiers, sort=False).ngroup()
+        group_codes = group_codes.fillna(-1).to_numpy(dtype=np.int64)
+        # Первая строка каждой группы - позиция в полном наборе строк, а не среди сгруппированных
+        grouped_rows = np.flatnonzero(group_codes >= 0)
+        first_rows = grouped_rows[np.unique(group_codes[grouped_rows], return_index=True)[1]]
+        groups = len(first_rows)
+        
+        # Ненулевые ячейки матрицы сопряжённости
+        value_codes, values = pd.factorize(sensitive)
+        width = max(len(values), 1)
+        counted = (group_codes >= 0) & (value_codes >= 0)
+        cells, counts = np.unique(group_codes[counted] * width + value_codes[counted], return_counts=True)
+        
+        report = generalized.iloc[first_rows].reset_index(drop=True)
+        report["size"] = np.bincount(group_codes[group_codes >= 0], minlength=groups)
+        for name, column in self._diversity(cells // width, counts, groups, l, diversity, c).items():
+            report[name] = column
+        return group_codes, report
+    
+    def _diversity(
+        self,
+        cell_groups: np.ndarray,
+        counts: np.ndarray,
+        groups: int,
+        l: int,
+        diversity: str,
+        c: float
+    ) -> Dict[str, np.ndarray]:
+        """
+        Показатели разнообразия groups групп по ненулевым ячейкам матрицы
+        сопряжённости в любом порядке: cell_groups - группа ячейки, counts -
+        число строк.
+        """
+        distinct = np.bincount(cell_groups, minlength=groups)
+        totals = np.bincount(cell_groups, weights=counts, minlength=groups)
+        shares = counts / totals[cell_groups]
+        entropy = np.bincount(cell_groups, weights=-shares * np.log(shares), minlength=groups)
+        
+        # Частоты в каждой группе по убыванию: r1 - первая, хвост - начиная с l-й
+        order = np.lexsort((-counts, cell_groups))
+        starts = np.concatenate(([0], np.cumsum(distinct)[:-1]))
+        rank = np.arange(len(order)) - starts[cell_groups[order]]
+        top = np.zeros(groups)
+        top[cell_groups[order][rank == 0]] = counts[order][rank == 0]
+        tail = np.bincount(cell_groups[order], weights=np.where(rank >= l - 1, counts[order], 0), minlength=groups)
+        with np.errstate(divide="ignore"):
+            recursive_ratio = np.where(tail > 0, top / np.where(tail > 0, tail, 1), np.inf)
+        
+        if diversity == "entropy":
+            # Допуск на округление: равномерная группа из l значений имеет энтропию ровно log l
+            satisfied = entropy >= np.log(l) - 1e-9
+        elif diversity == "recursive":
+            satisfied = (distinct >= l) & (recursive_ratio < c)
+        else:
+            satisfied = distinct >= l
+        
+        return {
+            "distinct": distinct,
+            "entropy": entropy,
+            "recursive_ratio": recursive_ratio,
+            "satisfied": satisfied
+        }
+    
+    def _counts_report(
+        self,
+        cells: pd.Series,
+        l: int,
+        diversity: str,
+        c: float,
+        sizes: Optional[pd.Series] = None
+    ) -> pd.DataFrame:
+        """
+        Отчёт о разнообразии групп по накопленным числам строк: cells - по
+        (квази-идентификаторы..., значение чувствительного атрибута), sizes -
+        по группам. Без sizes в отчёт попадают только группы с известным
+        значением и нет колонки size.
+        """
+        cell_keys = cells.index.droplevel(-1)
+        if sizes is None:
+            cell_groups, groups = cell_keys.factorize()
+            groups = groups.set_names(cell_keys.names)
+        else:
+            groups = sizes.index
+            cell_groups = groups.get_indexer(cell_keys)
+        
+        report = groups.to_frame(index=False)
+        if sizes is not None:
+            report["size"] = sizes.to_numpy()
+        diversity_values = self._diversity(
+            cell_groups, cells.to_numpy(dtype=np.int64), len(groups), l, diversity, c
+        )
+        for name, column in diversity_values.items():
+            report[name] = column
+        return report
     
     async def calculate_l_diversity_level(
         self, 
@@ -182,16 +399,13 @@ class LDiversityService:
             if not quasi_identifiers or sensitive_attribute not in data.columns:
                 return 0
             
-            # Группировка по квази-идентификаторам
-            groups = data.groupby(quasi_identifiers)
+            # Число уникальных значений чувствительного атрибута во всех группах одним проходом
+            diversity = data.groupby(quasi_identifiers, sort=False)[sensitive_attribute].nunique()
+            if diversity.empty:
+                return 0
             
             # Поиск минимального количества уникальных значений чувствительного атрибута
-            min_diversity = min(
-                group[sensitive_attribute].nunique() 
-                for _, group in groups
-            )
-            
-            return min_diversity
+            return int(diversity.min())
             
         except Exception as e:
             self.logger.error(f"Ошибка вычисления уровня l-разнообразия: {e}")
@@ -0,0 +1,251 @@
+"""
+Многомерное разбиение Mondrian для k-анонимности
+
+Квази-идентификаторы кодируются порядковыми кодами (числа и даты - по
+значению, строки - лексикографически или по заданному порядку), после чего
+пространство записей рекурсивно делится по медиане самого широкого
+измерения, пока обе половины содержат не меньше k записей. Каждый уровень
+обходит все строки за O(n·d), глубина - O(log n), поэтому всё разбиение
+занимает O(n log n) поверх массивов NumPy.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class EncodedQuasiIdentifiers:
+    """Квази-идентификаторы в виде матрицы порядковых кодов"""
+
+    def __init__(self, codes: np.ndarray, positions: List[np.ndarray], uniques: List[pd.Index], numeric: List[bool]):
+        # codes: (n, d), -1 - пропуск; positions[j][code] - положение значения в [0, 1]
+        self.codes = codes
+        self.positions = positions
+        self.uniques = uniques
+        self.numeric = numeric
+
+
+def encode_quasi_identifiers(
+    data: pd.DataFrame,
+    quasi_identifiers: List[str],
+    ordinal_orders: Optional[Dict[str, Sequence[Any]]] = None
+) -> EncodedQuasiIdentifiers:
+    """
+    Кодирование квази-идентификаторов для разбиения.
+
+    Числовые колонки и даты упорядочиваются по значению, и ширина интервала
+    считается по значениям; остальные колонки - порядковые: по заданному в
+    ordinal_orders порядку или лексикографически, ширина - по числу шагов.
+    """
+    ordinal_orders = ordinal_orders or {}
+    codes = np.empty((len(data), len(quasi_identifiers)), dtype=np.int64)
+    positions, uniques, numeric = [], [], []
+
+    for j, qi in enumerate(quasi_identifiers):
+        column = data[qi]
+        if qi in ordinal_orders:
+            categorical = pd.Categorical(column, categories=list(ordinal_orders[qi]), ordered=True)
+            unknown = categorical.isna() & column.notna().to_numpy()
+            if unknown.any():
+                raise ValueError(f"Values of '{qi}' are missing from its ordinal order")
+            codes[:, j] = categorical.codes
+            values = pd.Index(categorical.categories)
+        else:
+            codes[:, j], values = pd.factorize(column, sort=True)
+
+        is_numeric = (
+            qi not in ordinal_orders
+            and (pd.api.types.is_numeric_dtype(column) or pd.api.types.is_datetime64_any_dtype(column))
+            and not pd.api.types.is_bool_dtype(column)
+        )
+        if is_numeric and len(values) > 1:
+            scale = values.to_numpy().astype(np.float64) if not pd.api.types.is_datetime64_any_dtype(values) \
+                else values.asi8.astype(np.float64)
+            position = (scale - scale[0]) / (scale[-1] - scale[0])
+        elif len(values) > 1:
+            position = np.arange(len(values), dtype=np.float64) / (len(values) - 1)
+        else:
+            position = np.zeros(len(values), dtype=np.float64)
+
+        positions.append(position)
+        uniques.append(values)
+        numeric.append(is_numeric)
+
+    return EncodedQuasiIdentifiers(codes, positions, uniques, numeric)
+
+
+def _split(codes: np.ndarray, positions: List[np.ndarray], rows: np.ndarray, k: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """Медианный разрез раздела по самому широкому допустимому измерению"""
+    part = codes[rows]
+    lo, hi = part.min(axis=0), part.max(axis=0)
+    widths = np.array([positions[j][hi[j]] - positions[j][lo[j]] for j in range(part.shape[1])])
+
+    for j in np.argsort(-widths, kind="stable"):
+        if widths[j] <= 0:
+            break
+        column = part[:, j]
+        middle = len(column) // 2
+        median = np.partition(column, middle)[middle]
+        # Строгий разрез: значения, равные медиане, уходят в одну половину
+        left = column < median
+        left_size = np.count_nonzero(left)
+        if left_size < k:
+            left = column <= median
+            left_size = np.count_nonzero(left)
+        if k <= left_size <= len(rows) - k:
+            return rows[left], rows[~left]
+    return None
+
+
+def _partition(
+    codes: np.ndarray,
+    positions: List[np.ndarray],
+    k: int,
+    partitions: List[np.ndarray],
+    min_rows: int = 0
+) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Разбиение сверху вниз стеком вместо рекурсии.
+
+    Разделы меньше min_rows не делятся, а возвращаются во втором списке -
+    так верхние уровни строятся в основном процессе, а поддеревья
+    передаются пулу.
+    """
+    finished, pending = [], []
+    stack = list(partitions)
+    while stack:
+        rows = stack.pop()
+        if len(rows) < min_rows:
+            pending.append(rows)
+            continue
+        # Раздел меньше 2k нельзя разрезать на две допустимые половины
+        halves = _split(codes, positions, rows, k) if len(rows) >= 2 * k else None
+        if halves is None:
+            finished.append(rows)
+        else:
+            stack.extend(halves)
+    return finished, pending
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def shared_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Пул процессов, общий для всех разбиений процесса приложения.
+
+    Создаётся при первом параллельном разбиении с workers процессами и
+    переиспользуется следующими запросами; пересоздаётся, если процесс пула
+    упал и пул стал непригодным.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None or getattr(_process_pool, "_broken", False):
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+        return _process_pool
+
+
+def _partition_subtree(args: Tuple[np.ndarray, List[np.ndarray], int]) -> List[np.ndarray]:
+    """Разбиение поддерева в процессе пула; индексы локальны для подматрицы"""
+    codes, positions, k = args
+    finished, _ = _partition(codes, positions, k, [np.arange(len(codes))])
+    return finished
+
+
+def mondrian_partition(
+    encoded: EncodedQuasiIdentifiers,
+    k: int,
+    workers: int = 1,
+    parallel_rows: int = 0
+) -> np.ndarray:
+    """
+    Номер раздела для каждой строки (-1 - строка подавлена).
+
+    Строки с пропусками в квази-идентификаторах подавляются. Если строк не
+    меньше parallel_rows и workers > 1, верхние уровни делятся в основном
+    процессе до разделов размером около n / (4·workers), а поддеревья
+    разбиваются параллельно в общем пуле процессов (shared_process_pool).
+    """
+    codes, positions = encoded.codes, encoded.positions
+    labels = np.full(len(codes), -1, dtype=np.int64)
+    rows = np.flatnonzero((codes >= 0).all(axis=1))
+    if len(rows) < k:
+        return labels
+
+    if workers > 1 and parallel_rows and len(rows) >= parallel_rows:
+        min_rows = max(len(rows) // (4 * workers), 2 * k)
+        partitions, pending = _partition(codes, positions, k, [rows], min_rows)
+        tasks = ((codes[part], positions, k) for part in pending)
+        local_partitions = shared_process_pool(workers).map(_partition_subtree, tasks)
+        for part, local in zip(pending, local_partitions):
+            partitions.extend(part[subtree] for subtree in local)
+    else:
+        partitions, _ = _partition(codes, positions, k, [rows])
+
+    sizes = np.fromiter((len(part) for part in partitions), dtype=np.int64, count=len(partitions))
+    labels[np.concatenate(partitions)] = np.repeat(np.arange(len(partitions)), sizes)
+    return labels
+
+
+def _format_range(values: pd.Index, lo: np.ndarray, hi: np.ndarray, numeric: bool) -> np.ndarray:
+    """Подписи интервалов [lo, hi]; каждая пара форматируется один раз"""
+    text = values.astype(str).to_numpy(dtype=object)
+    pairs, inverse = np.unique(lo * len(values) + hi, return_inverse=True)
+    # Даты сами содержат дефис, поэтому интервал дат записывается через тильду
+    separator = "-" if numeric and not pd.api.types.is_datetime64_any_dtype(values) else "~"
+    labels = np.array([
+        text[pair // len(values)] if pair // len(values) == pair % len(values)
+        else f"{text[pair // len(values)]}{separator}{text[pair % len(values)]}"
+        for pair in pairs
+    ], dtype=object)
+    return labels[inverse]
+
+
+def generalize_partitions(
+    encoded: EncodedQuasiIdentifiers,
+    labels: np.ndarray,
+    k: int
+) -> Tuple[List[np.ndarray], Dict[str, Any]]:
+    """
+    Обобщённые значения квази-идентификаторов для строк с labels >= 0
+    (в исходном порядке строк) и метрики потери информации.
+
+    Метрики:
+        - ncp: нормированный штраф неопределённости - средняя по строкам и
+          квази-идентификаторам доля ширины интервала от ширины домена
+        - discernibility: сумма квадратов размеров классов плюс n за каждую
+          подавленную строку
+        - avg_class_size: средний размер класса эквивалентности, делённый на k
+    """
+    kept = np.flatnonzero(labels >= 0)
+    partitions = int(labels.max()) + 1 if len(kept) else 0
+    sizes = np.bincount(labels[kept], minlength=partitions)
+
+    # Границы разделов по каждому измерению одним проходом reduceat
+    order = kept[np.argsort(labels[kept], kind="stable")]
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1])) if partitions else np.empty(0, dtype=np.int64)
+    part_codes = encoded.codes[order]
+    lo = np.minimum.reduceat(part_codes, starts, axis=0) if partitions else part_codes
+    hi = np.maximum.reduceat(part_codes, starts, axis=0) if partitions else part_codes
+
+    generalized, widths = [], np.zeros(partitions, dtype=np.float64)
+    for j, values in enumerate(encoded.uniques):
+        ranges = _format_range(values, lo[:, j], hi[:, j], encoded.numeric[j])
+        generalized.append(ranges[labels[kept]])
+        widths += encoded.positions[j][hi[:, j]] - encoded.positions[j][lo[:, j]]
+
+    suppressed = len(labels) - len(kept)
+    dimensions = max(len(encoded.uniques), 1)
+    metrics = {
+        "partitions": partitions,
+        "min_partition_size": int(sizes.min()) if partitions else 0,
+        "suppressed_rows": suppressed,
+        "ncp": float((widths * sizes).sum() / (len(kept) * dimensions)) if len(kept) else 0.0,
+        "discernibility": int((sizes ** 2).sum()) + suppressed * len(labels),
+        "avg_class_size": float(len(kept) / (partitions * k)) if partitions else 0.0,
+    }
+    return generalized, metrics
@@ -0,0 +1,198 @@
+"""
+Потоковая анонимизация больших выборок
+
+Результат запроса читается чанками через серверный курсор. Построчные
+преобразования (шум дифференциальной приватности) применяются к каждому
+чанку отдельно. k-анонимности и l-разнообразию нужна статистика по всей
+выборке, поэтому они выполняются в два прохода: первый накапливает число
+строк по группам обобщённых квази-идентификаторов (для l-разнообразия - по
+парам группа × значение чувствительного атрибута), второй перечитывает
+выборку и выдаёт строки допустимых групп. В памяти держится один чанк и
+счётчики групп.
+
+Чанки результата кодируются в NDJSON или Arrow IPC stream.
+"""
+
+import io
+from typing import List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+class GroupCounter:
+    """
+    Число строк по значениям колонок keys, накопленное по чанкам.
+
+    Счётчики чанков складываются в список и раз в compact_every чанков
+    сворачиваются одной группировкой, чтобы не пересчитывать все группы
+    на каждом чанке. Строки с пропусками в ключе не считаются.
+    """
+
+    def __init__(self, keys: List[str], compact_every: int = 16):
+        self.keys = list(keys)
+        self.compact_every = compact_every
+        self._parts: List[pd.Series] = []
+
+    def add(self, frame: pd.DataFrame):
+        self._parts.append(frame.groupby(self.keys, sort=False).size())
+        if len(self._parts) >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        if len(self._parts) > 1:
+            merged = pd.concat(self._parts)
+            self._parts = [merged.groupby(level=list(range(len(self.keys))), sort=False).sum()]
+
+    def counts(self) -> pd.Series:
+        """Число строк по группам; индекс - значения ключа"""
+        self._compact()
+        if not self._parts:
+            return pd.DataFrame(columns=self.keys).groupby(self.keys).size()
+        return self._parts[0]
+
+
+def key_index(frame: pd.DataFrame, keys: List[str]) -> pd.Index:
+    """Значения ключа строк в виде индекса (MultiIndex для нескольких колонок)"""
+    if len(keys) == 1:
+        return pd.Index(frame[keys[0]])
+    return pd.MultiIndex.from_frame(frame[keys])
+
+
+def group_mask(generalized: pd.DataFrame, keys: List[str], groups: pd.DataFrame) -> np.ndarray:
+    """Строки, ключ которых есть среди groups; строки с пропусками в ключе не проходят"""
+    if groups.empty:
+        return np.zeros(len(generalized), dtype=bool)
+    return key_index(generalized, keys).isin(key_index(groups, keys))
+
+
+def suppress_groups(
+    chunk: pd.DataFrame,
+    generalized: pd.DataFrame,
+    quasi_identifiers: List[str],
+    groups: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Строки чанка из допустимых групп groups (таблица обобщённых
+    квази-идентификаторов) с подстановкой обобщённых значений
+    """
+    mask = group_mask(generalized, quasi_identifiers, groups)
+    result = chunk[mask].reset_index(drop=True)
+    for qi in quasi_identifiers:
+        result[qi] = generalized[qi].to_numpy()[mask]
+    return result
+
+
+class NDJSONEncoder:
+    """Чанки в виде NDJSON: одна JSON-запись на строку"""
+
+    media_type = "application/x-ndjson"
+
+    def encode(self, chunk: pd.DataFrame) -> bytes:
+        if chunk.empty:
+            return b""
+        return chunk.to_json(orient="records", lines=True, date_format="iso", force_ascii=False).encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class ArrowStreamEncoder:
+    """
+    Чанки в виде Arrow IPC stream: одна схема на весь поток, затем по record
+    batch на чанк.
+
+    Схему нельзя поменять после первой записи, поэтому она выбирается с
+    запасом. Пока в чанках есть колонки из одних пропусков (тип null), чанки
+    копятся до max_pending_rows строк, их схемы объединяются с повышением
+    типов. Целые колонки расширяются до float64: pandas переводит целую
+    колонку в float, как только в чанке встречается пропуск, а шум и данные
+    следующих чанков могут быть дробными. Колонки, оставшиеся null, пишутся
+    строками. Следующие чанки приводятся к выбранной схеме.
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+
+    def __init__(self, max_pending_rows: int = 100_000):
+        self.max_pending_rows = max_pending_rows
+        self._sink = io.BytesIO()
+        self._writer = None
+        self._schema = None
+        self._pending: List[pa.Table] = []
+        self._pending_rows = 0
+        self._columns = pd.DataFrame()
+
+    def _drain(self) -> bytes:
+        payload = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return payload
+
+    @staticmethod
+    def _widen(field: pa.Field) -> pa.Field:
+        if pa.types.is_integer(field.type):
+            return field.with_type(pa.float64())
+        if pa.types.is_null(field.type):
+            return field.with_type(pa.string())
+        return field
+
+    def _write(self, table: pa.Table):
+        if not table.schema.equals(self._schema):
+            table = table.cast(self._schema)
+        self._writer.write_table(table)
+
+    def _start(self, schema: pa.Schema):
+        # pandas-метаданные описывают типы первого чанка, а не расширенные
+        self._schema = pa.schema([self._widen(field) for field in schema])
+        self._writer = pa.ipc.new_stream(self._sink, self._schema)
+        for table in self._pending:
+            self._write(table)
+        self._pending = []
+
+    def _pending_schema(self) -> pa.Schema:
+        return pa.unify_schemas(
+            [table.schema for table in self._pending], promote_options="permissive"
+        )
+
+    def encode(self, chunk: pd.DataFrame) -> bytes:
+        if chunk.empty:
+            # Колонки пустого результата нужны для схемы в finish
+            self._columns = chunk
+            return b""
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self._writer is not None:
+            self._write(table)
+            return self._drain()
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        schema = self._pending_schema()
+        if self._pending_rows < self.max_pending_rows and any(
+            pa.types.is_null(field.type) for field in schema
+        ):
+            return b""
+        self._start(schema)
+        return self._drain()
+
+    def finish(self) -> bytes:
+        if self._writer is None:
+            if self._pending:
+                self._start(self._pending_schema())
+            else:
+                self._start(pa.Schema.from_pandas(self._columns, preserve_index=False))
+        self._writer.close()
+        return self._drain()
+
+
+# Кодировщики по формату потокового ответа
+STREAM_ENCODERS = {
+    "ndjson": NDJSONEncoder,
+    "arrow": ArrowStreamEncoder,
+}
+
+
+def stream_encoder(output_format: str):
+    """Кодировщик чанков для формата ответа"""
+    if output_format not in STREAM_ENCODERS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    return STREAM_ENCODERS[output_format]()
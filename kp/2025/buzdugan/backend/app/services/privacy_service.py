@@ -2,19 +2,25 @@
 Сервис для работы с политиками приватности и анонимизацией данных
 """
 
-from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Any, Optional
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import LabelEncoder
 import structlog
+import sqlparse
 import asyncio
 
+from app.core.config import settings
 from app.models.privacy_policy import PrivacyPolicy
 from app.models.user import User
 from app.services.anonymization.k_anonymity import KAnonymityService
 from app.services.anonymization.l_diversity import LDiversityService
 from app.services.anonymization.differential_privacy import DifferentialPrivacyService
+from app.services.anonymization.streaming import stream_encoder
 
 logger = structlog.get_logger(__name__)
 
@@ -116,6 +122,11 @@ class PrivacyService:
             logger.info("Обновлена политика приватности", policy_id=policy_id)
             return policy
             
+        except StaleDataError:
+            # Версия политики изменилась после чтения: параллельное обновление
+            self.db.rollback()
+            logger.warning("Конфликт версий при обновлении политики приватности", policy_id=policy_id)
+            raise
         except Exception as e:
             self.db.rollback()
             logger.error(f"Ошибка обновления политики приватности: {e}")
@@ -161,14 +172,18 @@ class PrivacyService:
                     "metrics": {"rows_processed": 0}
                 }
             
+            # Скомпилированные иерархии обобщения переиспользуются, пока
+            # политика не изменилась
+            policy_key = (str(policy.id), policy.version) if policy.id is not None else None
+            
             # Применение соответствующего алгоритма анонимизации
             if policy.policy_type == "k_anonymity":
                 anonymized_data = await self.k_anonymity_service.apply(
-                    data, policy.parameters
+                    data, policy.parameters, policy_key
                 )
             elif policy.policy_type == "l_diversity":
                 anonymized_data = await self.l_diversity_service.apply(
-                    data, policy.parameters
+                    data, policy.parameters, policy_key
                 )
             elif policy.policy_type == "differential_privacy":
                 anonymized_data = await self.differential_privacy_service.apply(
@@ -197,6 +212,72 @@ class PrivacyService:
             logger.error(f"Ошибка применения анонимизации: {e}")
             raise
     
+    async def stream_anonymization(
+        self,
+        query: str,
+        policy: PrivacyPolicy,
+        output_format: str = "ndjson",
+        chunk_size: Optional[int] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Потоковая анонимизация результата запроса
+        
+        Выборка читается серверным курсором чанками по chunk_size строк (по
+        умолчанию ANONYMIZATION_CHUNK_SIZE) и выдаётся частями NDJSON или
+        Arrow IPC stream, не собираясь в памяти целиком. Дифференциальная
+        приватность применяется к каждому чанку; k-анонимность и
+        l-разнообразие перечитывают выборку в два прохода внутри одной
+        транзакции, чтобы оба прохода видели одни и те же строки.
+        """
+        encoder = stream_encoder(output_format)
+        chunk_size = chunk_size or settings.ANONYMIZATION_CHUNK_SIZE
+        policy_key = (str(policy.id), policy.version) if policy.id is not None else None
+        parameters = policy.parameters or {}
+        rows = 0
+        
+        try:
+            async with self._snapshot() as connection:
+                def read_chunks() -> AsyncIterator[pd.DataFrame]:
+                    return self._aiter_query(connection, query, chunk_size)
+                
+                if policy.policy_type == "k_anonymity":
+                    chunks = self.k_anonymity_service.stream(read_chunks, parameters, policy_key)
+                elif policy.policy_type == "l_diversity":
+                    chunks = self.l_diversity_service.stream(read_chunks, parameters, policy_key)
+                elif policy.policy_type == "differential_privacy":
+                    chunks = self._stream_differential_privacy(read_chunks, parameters)
+                else:
+                    raise ValueError(f"Неподдерживаемый тип политики: {policy.policy_type}")
+                
+                async for chunk in chunks:
+                    rows += len(chunk)
+                    payload = encoder.encode(chunk)
+                    if payload:
+                        yield payload
+            
+            payload = encoder.finish()
+            if payload:
+                yield payload
+            
+            logger.info("Применена потоковая анонимизация данных",
+                       policy_type=policy.policy_type,
+                       output_format=output_format,
+                       chunk_size=chunk_size,
+                       anonymized_rows=rows)
+            
+        except Exception as e:
+            logger.error(f"Ошибка потоковой анонимизации: {e}")
+            raise
+    
+    async def _stream_differential_privacy(
+        self,
+        read_chunks: Callable[[], AsyncIterator[pd.DataFrame]],
+        parameters: Dict[str, Any]
+    ) -> AsyncIterator[pd.DataFrame]:
+        """Шум дифференциальной приватности независим по строкам - чанки обрабатываются по одному"""
+        async for chunk in read_chunks():
+            yield await self.differential_privacy_service.apply(chunk, parameters)
+    
     async def analyze_privacy_risks(
         self,
         query: str,
@@ -299,15 +380,95 @@ class PrivacyService:
             return {}
     
     async def _execute_query(self, query: str) -> pd.DataFrame:
-        """Выполнение SQL запроса и возврат данных в виде DataFrame"""
+        """
+        Выполнение SQL запроса и возврат данных в виде DataFrame.
+        Ошибки (запрос не единственный SELECT, ошибка базы) пробрасываются,
+        как при потоковой анонимизации.
+        """
         try:
-            # Здесь должна быть логика выполнения SQL запроса
-            # Для демонстрации возвращаем пустой DataFrame
-            return pd.DataFrame()
+            async with self._snapshot() as connection:
+                chunks = [
+                    chunk async for chunk in self._aiter_query(connection, query, settings.ANONYMIZATION_CHUNK_SIZE)
+                ]
+            return pd.concat(chunks, ignore_index=True)
             
         except Exception as e:
             logger.error(f"Ошибка выполнения запроса: {e}")
-            return pd.DataFrame()
+            raise
+    
+    @asynccontextmanager
+    async def _snapshot(self) -> AsyncIterator[Connection]:
+        """
+        Отдельное соединение с одной транзакцией только для чтения на все
+        проходы по выборке; в PostgreSQL - REPEATABLE READ, чтобы повторное
+        чтение видело тот же снимок. Транзакция всегда откатывается.
+        Подключение и освобождение соединения выполняются в пуле потоков.
+        """
+        connection = await asyncio.to_thread(self._begin_snapshot)
+        try:
+            yield connection
+        finally:
+            await asyncio.to_thread(self._end_snapshot, connection)
+    
+    def _begin_snapshot(self) -> Connection:
+        connection = self.db.get_bind().connect()
+        try:
+            if connection.dialect.name == "postgresql":
+                connection.execution_options(isolation_level="REPEATABLE READ", postgresql_readonly=True)
+            connection.begin()
+            if connection.dialect.name == "sqlite":
+                connection.exec_driver_sql("PRAGMA query_only = ON")
+            return connection
+        except Exception:
+            connection.close()
+            raise
+    
+    def _end_snapshot(self, connection: Connection):
+        try:
+            connection.rollback()
+            if connection.dialect.name == "sqlite":
+                connection.exec_driver_sql("PRAGMA query_only = OFF")
+        finally:
+            connection.close()
+    
+    def _select_statement(self, query: str) -> str:
+        """Запрос без завершающей ';'; допускается только один оператор SELECT"""
+        statements = [statement for statement in sqlparse.parse(query) if str(statement).strip(" \t\r\n;")]
+        if len(statements) != 1 or statements[0].get_type() != "SELECT":
+            raise ValueError("Only a single SELECT statement can be anonymized")
+        return str(statements[0]).strip().rstrip(";")
+    
+    def _iter_query(self, connection: Connection, query: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """
+        Чтение результата запроса чанками через серверный курсор (stream_results).
+        Пустой результат даёт один пустой чанк с колонками запроса.
+        """
+        result = connection.exec_driver_sql(
+            self._select_statement(query),
+            execution_options={"stream_results": True, "max_row_buffer": chunk_size}
+        )
+        try:
+            columns = list(result.keys())
+            empty = True
+            for rows in result.partitions(chunk_size):
+                empty = False
+                yield pd.DataFrame.from_records(rows, columns=columns)
+            if empty:
+                yield pd.DataFrame(columns=columns)
+        finally:
+            result.close()
+    
+    async def _aiter_query(self, connection: Connection, query: str, chunk_size: int) -> AsyncIterator[pd.DataFrame]:
+        """_iter_query, в котором выполнение запроса и чтение каждого чанка идут в пуле потоков"""
+        chunks = self._iter_query(connection, query, chunk_size)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await asyncio.to_thread(chunks.close)
     
     async def _calculate_privacy_metrics(
         self,
@@ -329,6 +490,9 @@ class PrivacyService:
                 k_value = policy.parameters.get("k", 0)
                 metrics["k_value"] = k_value
                 metrics["anonymization_ratio"] = len(anonymized_data) / len(original_data) if len(original_data) > 0 else 0
+                metrics["algorithm"] = policy.parameters.get("algorithm", "generalization")
+                if "information_loss" in anonymized_data.attrs:
+                    metrics["information_loss"] = anonymized_data.attrs["information_loss"]
             
             elif policy.policy_type == "l_diversity":
                 l_value = policy.parameters.get("l", 0)
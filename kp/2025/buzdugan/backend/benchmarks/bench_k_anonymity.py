@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк k-анонимности: прежний обход групп в Python (копия и обобщение
+каждой группы, pd.concat) против векторизованного KAnonymityService -
+размеры групп через transform('size'), булева маска и однократное
+обобщение колонок.
+
+Синтетические данные: возраст, индекс (высокая кардинальность), пол и
+диагноз. Прежний алгоритм запускается на первых --legacy-rows строках,
+векторизованный - на всех --rows. Результат проверяется через
+validate_k_anonymity: векторизованный вариант и Mondrian (--mondrian)
+обязаны пройти проверку, для прежнего выводится её результат; для Mondrian
+также печатаются метрики потери информации.
+
+Запуск из каталога backend:
+    python benchmarks/bench_k_anonymity.py --rows 1000000
+    python benchmarks/bench_k_anonymity.py --rows 10000000
+    python benchmarks/bench_k_anonymity.py --rows 1000000 --legacy-rows 0 --mondrian
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.anonymization.k_anonymity import KAnonymityService
+
+QUASI_IDENTIFIERS = ["age", "zipcode", "gender"]
+
+
+def synthetic_data(rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "age": rng.integers(18, 91, rows),
+        "zipcode": pd.Series(rng.integers(100000, 200000, rows)).astype(str).to_numpy(dtype=object),
+        "gender": rng.choice(np.array(["M", "F"], dtype=object), rows),
+        "disease": rng.choice(np.array(["A", "B", "C", "D", "E"], dtype=object), rows),
+    })
+
+
+def legacy_generalize_column(column: pd.Series) -> pd.Series:
+    """Прежний _generalize_column: обобщение всей колонки при каждом вызове"""
+    if column.dtype == 'object':
+        return column.astype(str).str[:3] + "***"
+    elif pd.api.types.is_numeric_dtype(column):
+        return (column / 10).round() * 10
+    elif pd.api.types.is_datetime64_any_dtype(column):
+        return column.dt.year
+    return column
+
+
+async def legacy_apply(data: pd.DataFrame, quasi_identifiers: List[str], k: int) -> pd.DataFrame:
+    """Прежняя реализация _apply_k_anonymity: обход групп в Python"""
+    valid_groups = []
+    for _, group in data.copy().groupby(quasi_identifiers):
+        if len(group) >= k:
+            valid_groups.append(group)
+        else:
+            generalized_group = group.copy()
+            for qi in quasi_identifiers:
+                generalized_group[qi] = legacy_generalize_column(generalized_group[qi])
+            if len(generalized_group) >= k:
+                valid_groups.append(generalized_group)
+    if not valid_groups:
+        return data
+    result = pd.concat(valid_groups, ignore_index=True)
+    for qi in quasi_identifiers:
+        result[qi] = legacy_generalize_column(result[qi])
+    return result
+
+
+async def timed(func, *args):
+    start = time.perf_counter()
+    result = await func(*args)
+    return result, time.perf_counter() - start
+
+
+async def run(args):
+    service = KAnonymityService()
+    data = synthetic_data(args.rows, args.seed)
+    subset = data.iloc[:min(args.legacy_rows, args.rows)]
+
+    print(f"k={args.k} quasi_identifiers={QUASI_IDENTIFIERS}")
+    print(f"{'rows':>10} {'algorithm':>10} {'seconds':>9} {'rows/s':>12} {'kept':>10} {'valid':>6}")
+
+    results = []
+    if len(subset):
+        legacy, legacy_seconds = await timed(legacy_apply, subset, QUASI_IDENTIFIERS, args.k)
+        vectorized, vectorized_seconds = await timed(service._apply_k_anonymity, subset, QUASI_IDENTIFIERS, args.k)
+        # Прежний вариант подавлял малые группы до обобщения, поэтому
+        # сохраняет подмножество строк векторизованного; если ни одна
+        # группа не набрала k, он возвращал исходные данные
+        if await service.validate_k_anonymity(legacy, QUASI_IDENTIFIERS, args.k):
+            assert len(vectorized) >= len(legacy)
+        results.append((len(subset), "legacy", legacy_seconds, legacy))
+        results.append((len(subset), "vectorized", vectorized_seconds, vectorized))
+
+    if args.rows > len(subset):
+        full, full_seconds = await timed(service._apply_k_anonymity, data, QUASI_IDENTIFIERS, args.k)
+        results.append((args.rows, "vectorized", full_seconds, full))
+
+    if args.mondrian:
+        mondrian, mondrian_seconds = await timed(
+            service._apply_mondrian, data, QUASI_IDENTIFIERS, args.k, None, args.n_jobs
+        )
+        results.append((args.rows, "mondrian", mondrian_seconds, mondrian))
+
+    for rows, algorithm, seconds, result in results:
+        valid = await service.validate_k_anonymity(result, QUASI_IDENTIFIERS, args.k)
+        if algorithm != "legacy":
+            assert valid, f"{algorithm} result is not {args.k}-anonymous"
+        print(f"{rows:>10} {algorithm:>10} {seconds:>9.2f} {rows / seconds:>12.0f} {len(result):>10} {str(valid):>6}")
+        if "information_loss" in result.attrs:
+            print(f"{'':>21} information loss: {result.attrs['information_loss']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--legacy-rows", type=int, default=20_000,
+                        help="строк для прежнего алгоритма (0 - не запускать)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mondrian", action="store_true", help="также замерить разбиение Mondrian")
+    parser.add_argument("--n-jobs", type=int, default=0, help="процессов для Mondrian (0 - по числу CPU)")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк l-разнообразия: прежний обход групп в Python (nunique и копия
+каждой группы, pd.concat) против векторизованного LDiversityService -
+одна матрица сопряжённости группа × диагноз для всех вариантов
+(distinct, entropy, recursive) и отчёт по группам без построения данных.
+
+Синтетические данные: возраст, индекс, пол и диагноз с неравномерным
+распределением. Прежний алгоритм запускается на первых --legacy-rows
+строках, векторизованные варианты - на всех --rows. Результат каждого
+варианта проверяется: validate_l_diversity и независимый подсчёт по группам.
+
+Запуск из каталога backend:
+    python benchmarks/bench_l_diversity.py --rows 1000000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.anonymization.l_diversity import LDiversityService
+
+QUASI_IDENTIFIERS = ["age", "zipcode", "gender"]
+SENSITIVE_ATTRIBUTE = "disease"
+
+
+def synthetic_data(rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    diseases = np.array(["flu", "asthma", "diabetes", "cancer", "hiv", "fracture"], dtype=object)
+    return pd.DataFrame({
+        "age": rng.integers(18, 91, rows),
+        "zipcode": pd.Series(rng.integers(100000, 200000, rows)).astype(str).to_numpy(dtype=object),
+        "gender": rng.choice(np.array(["M", "F"], dtype=object), rows),
+        SENSITIVE_ATTRIBUTE: rng.choice(diseases, rows, p=[0.45, 0.2, 0.15, 0.1, 0.05, 0.05]),
+    })
+
+
+def legacy_generalize_column(column: pd.Series) -> pd.Series:
+    """Прежний _generalize_column l-разнообразия"""
+    if column.dtype == 'object':
+        return column.astype(str).str[:2] + "**"
+    elif pd.api.types.is_numeric_dtype(column):
+        return (column / 10).round() * 10
+    elif pd.api.types.is_datetime64_any_dtype(column):
+        return column.dt.year
+    return column
+
+
+async def legacy_apply(data: pd.DataFrame, quasi_identifiers: List[str], sensitive_attribute: str,
+                       l: int) -> pd.DataFrame:
+    """Прежняя реализация _apply_l_diversity: обход групп в Python"""
+    valid_groups = []
+    for _, group in data.copy().groupby(quasi_identifiers):
+        if group[sensitive_attribute].nunique() >= l:
+            valid_groups.append(group)
+        else:
+            generalized_group = group.copy()
+            for qi in quasi_identifiers:
+                generalized_group[qi] = legacy_generalize_column(generalized_group[qi])
+            if generalized_group[sensitive_attribute].nunique() >= l:
+                valid_groups.append(generalized_group)
+    if not valid_groups:
+        return data
+    result = pd.concat(valid_groups, ignore_index=True)
+    for qi in quasi_identifiers:
+        result[qi] = legacy_generalize_column(result[qi])
+    return result
+
+
+def check(result: pd.DataFrame, l: int, diversity: str, c: float) -> bool:
+    """Независимая проверка варианта: подсчёт по группам средствами pandas"""
+    levels = list(range(len(QUASI_IDENTIFIERS)))
+    counts = result.groupby(QUASI_IDENTIFIERS + [SENSITIVE_ATTRIBUTE]).size().sort_values(ascending=False)
+    groups = counts.groupby(level=levels)
+    if (groups.size() < l).any():
+        return False
+    if diversity == "entropy":
+        shares = counts / groups.transform("sum")
+        entropy = (-shares * np.log(shares)).groupby(level=levels).sum()
+        return bool((entropy >= np.log(l) - 1e-9).all())
+    if diversity == "recursive":
+        rank = groups.cumcount()
+        top = counts[rank == 0].groupby(level=levels).sum()
+        tail = counts[rank >= l - 1].groupby(level=levels).sum()
+        return bool((top < c * tail.reindex(top.index, fill_value=0)).all())
+    return True
+
+
+async def timed(func, *args):
+    start = time.perf_counter()
+    result = await func(*args)
+    return result, time.perf_counter() - start
+
+
+async def run(args):
+    service = LDiversityService()
+    data = synthetic_data(args.rows, args.seed)
+    # Индекс обобщается до --zip-prefix символов: мелкие группы, часть которых не проходит
+    hierarchies = service.hierarchies({"hierarchies": {"zipcode": {"type": "prefix", "lengths": [args.zip_prefix]}}})
+    subset = data.iloc[:min(args.legacy_rows, args.rows)]
+
+    print(f"l={args.l} c={args.c} quasi_identifiers={QUASI_IDENTIFIERS} sensitive={SENSITIVE_ATTRIBUTE}")
+    print(f"{'rows':>10} {'algorithm':>18} {'seconds':>9} {'rows/s':>12} {'kept':>10} {'valid':>6}")
+
+    if len(subset):
+        legacy, seconds = await timed(legacy_apply, subset, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, args.l)
+        valid = await service.validate_l_diversity(legacy, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, args.l)
+        print(f"{len(subset):>10} {'legacy':>18} {seconds:>9.2f} {len(subset) / seconds:>12.0f} {len(legacy):>10} {str(valid):>6}")
+
+    for diversity in ("distinct", "entropy", "recursive"):
+        result, seconds = await timed(
+            service._apply_l_diversity, data, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, args.l, hierarchies, diversity, args.c
+        )
+        valid = await service.validate_l_diversity(result, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, args.l)
+        assert valid and check(result, args.l, diversity, args.c), f"{diversity} result is not l-diverse"
+        print(f"{args.rows:>10} {diversity:>18} {seconds:>9.2f} {args.rows / seconds:>12.0f} {len(result):>10} {str(valid):>6}")
+
+    report, seconds = await timed(
+        service.diversity_report, data, QUASI_IDENTIFIERS, SENSITIVE_ATTRIBUTE, args.l, "recursive", args.c, hierarchies
+    )
+    print(f"{args.rows:>10} {'report only':>18} {seconds:>9.2f} {args.rows / seconds:>12.0f} "
+          f"{len(report):>10} groups, {int(report['satisfied'].sum())} satisfy recursive")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--legacy-rows", type=int, default=20_000,
+                        help="строк для прежнего алгоритма (0 - не запускать)")
+    parser.add_argument("--l", type=int, default=3)
+    parser.add_argument("--c", type=float, default=2.0)
+    parser.add_argument("--zip-prefix", type=int, default=5, help="символов индекса после обобщения")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк потоковой анонимизации: прежний путь (вся выборка в DataFrame,
+анонимизация и to_dict('records')) против stream_anonymization - чтение
+серверным курсором чанками по --chunk-size строк, два прохода для
+k-анонимности и l-разнообразия и выдача NDJSON или Arrow IPC stream.
+
+Замеряются время и пик памяти Python (tracemalloc, включая буферы NumPy).
+По умолчанию используется временная SQLite база; для замера на PostgreSQL
+передайте --db-url (таблица bench_patients пересоздаётся).
+
+Запуск из каталога backend:
+    python benchmarks/bench_streaming.py --rows 1000000
+    python benchmarks/bench_streaming.py --rows 1000000 --policy l_diversity --format arrow
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.privacy_service import PrivacyService
+
+TABLE = "bench_patients"
+QUERY = f"SELECT * FROM {TABLE}"
+
+POLICIES = {
+    "k_anonymity": {"k": 5, "quasi_identifiers": ["age", "zipcode", "gender"]},
+    "l_diversity": {
+        "l": 3,
+        "sensitive_attribute": "disease",
+        "quasi_identifiers": ["age", "zipcode", "gender"],
+        "hierarchies": {"zipcode": {"type": "prefix", "lengths": [4]}},
+    },
+    "differential_privacy": {"epsilon": 1.0},
+}
+
+
+def fill(engine, rows: int, seed: int):
+    rng = np.random.default_rng(seed)
+    batch = 200_000
+    for start in range(0, rows, batch):
+        size = min(batch, rows - start)
+        pd.DataFrame({
+            "age": rng.integers(18, 91, size),
+            "zipcode": pd.Series(rng.integers(100000, 200000, size)).astype(str),
+            "gender": rng.choice(np.array(["M", "F"], dtype=object), size),
+            "disease": rng.choice(np.array(["A", "B", "C", "D", "E"], dtype=object), size),
+        }).to_sql(TABLE, engine, index=False, if_exists="replace" if start == 0 else "append")
+
+
+async def legacy(service: PrivacyService, policy) -> int:
+    """Прежний путь: вся выборка и весь результат в памяти"""
+    result = await service.apply_anonymization(TABLE, QUERY, policy)
+    return len(result["data"])
+
+
+async def streaming(service: PrivacyService, policy, output_format: str, chunk_size: int) -> int:
+    """Потоковый путь: байты ответа отбрасываются, как при отправке клиенту"""
+    size = 0
+    async for payload in service.stream_anonymization(QUERY, policy, output_format, chunk_size):
+        size += len(payload)
+    return size
+
+
+async def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = await func(*args)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="k_anonymity")
+    parser.add_argument("--format", choices=["ndjson", "arrow"], default="ndjson")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db-url", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        fill(engine, args.rows, args.seed)
+        policy = SimpleNamespace(
+            id=None, version=1, name=args.policy, policy_type=args.policy, parameters=POLICIES[args.policy]
+        )
+
+        with Session(bind=engine) as db:
+            service = PrivacyService(db)
+            kept, legacy_seconds, legacy_peak = asyncio.run(measure(legacy, service, policy))
+            size, stream_seconds, stream_peak = asyncio.run(
+                measure(streaming, service, policy, args.format, args.chunk_size)
+            )
+
+        print(f"{args.rows} rows, policy={args.policy}, chunk_size={args.chunk_size}")
+        print(f"{'path':>22} {'seconds':>9} {'peak MiB':>10} {'output':>16}")
+        print(f"{'legacy to_dict':>22} {legacy_seconds:>9.2f} {legacy_peak:>10.1f} {kept:>11} rows")
+        print(f"{'stream ' + args.format:>22} {stream_seconds:>9.2f} {stream_peak:>10.1f} {size / 2 ** 20:>12.1f} MiB")
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
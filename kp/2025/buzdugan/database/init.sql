@@ -33,6 +33,7 @@ CREATE TABLE privacy_policies (
     policy_type VARCHAR(50) NOT NULL, -- 'k_anonymity', 'l_diversity', 'differential_privacy'
     parameters JSONB NOT NULL,
     is_active BOOLEAN DEFAULT TRUE,
+    version INTEGER NOT NULL DEFAULT 1,
     created_by UUID REFERENCES users(id),
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -0,0 +1,4 @@
+-- Версия политики приватности: SQLAlchemy увеличивает её при каждом UPDATE
+-- (version_id_col), по ней инвалидируется кэш иерархий обобщения.
+-- Для баз, созданных до появления колонки в init.sql.
+ALTER TABLE privacy_policies ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
@@ -2,12 +2,25 @@
 Тесты для алгоритмов приватности
 """
 
+import io
+import threading
+from types import SimpleNamespace
+
 import pytest
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 from app.services.anonymization.k_anonymity import KAnonymityService
+from app.services.anonymization.mondrian import (
+    encode_quasi_identifiers, mondrian_partition, shared_process_pool
+)
+from app.services.anonymization.hierarchy import Hierarchy, HierarchyCache, GeneralizationHierarchies
 from app.services.anonymization.l_diversity import LDiversityService
 from app.services.anonymization.differential_privacy import DifferentialPrivacyService
+from app.services.privacy_service import PrivacyService
 
 class TestKAnonymity:
     """Тесты для k-анонимности"""
@@ -61,6 +74,105 @@ class TestKAnonymity:
         
         # Результат должен быть булевым значением
         assert isinstance(is_valid, bool)
+    
+    @pytest.mark.asyncio
+    async def test_k_anonymity_vectorized(self):
+        """Тест векторизованной k-анонимности: малые группы объединяются обобщением"""
+        quasi_identifiers = ['age', 'zipcode', 'gender']
+        data = pd.DataFrame({
+            'age': [21, 22, 23, 24, 41, 42, 43, 61],
+            'zipcode': ['101001', '101002', '101003', '101004', '102001', '102002', '102003', '103001'],
+            'gender': ['M', 'M', 'M', 'M', 'F', 'F', 'F', 'F'],
+            'disease': ['A', 'B', 'A', 'B', 'A', 'B', 'A', 'B']
+        })
+        
+        result = await self.k_anonymity_service._apply_k_anonymity(data, quasi_identifiers, 3)
+        
+        # Исходно все группы единичные; после обобщения остаются две группы,
+        # строка без пары подавляется, порядок строк сохраняется
+        assert result['disease'].tolist() == ['A', 'B', 'A', 'B', 'A', 'B', 'A']
+        assert result['zipcode'].tolist() == ['101***'] * 4 + ['102***'] * 3
+        assert result['age'].tolist() == [20.0] * 4 + [40.0] * 3
+        assert await self.k_anonymity_service.validate_k_anonymity(result, quasi_identifiers, 3)
+        assert await self.k_anonymity_service.calculate_k_anonymity_level(result, quasi_identifiers) == 3
+    
+    @pytest.mark.asyncio
+    async def test_k_anonymity_mondrian(self):
+        """Тест разбиения Mondrian: k достигается без подавления строк"""
+        parameters = {
+            'k': 3,
+            'algorithm': 'mondrian',
+            'quasi_identifiers': ['age', 'zipcode', 'gender'],
+            'ordinal_orders': {'gender': ['M', 'F']}
+        }
+        
+        result = await self.k_anonymity_service.apply(self.test_data, parameters)
+        
+        assert len(result) == len(self.test_data)
+        assert await self.k_anonymity_service.validate_k_anonymity(
+            result, parameters['quasi_identifiers'], 3
+        )
+        # Возраст обобщается интервалом раздела, а не округлением
+        assert set(result['age']) <= {'25', '30', '35', '25-30', '25-35', '30-35'}
+        information_loss = result.attrs['information_loss']
+        assert information_loss['min_partition_size'] >= 3
+        assert information_loss['suppressed_rows'] == 0
+        assert 0 <= information_loss['ncp'] <= 1
+    
+    @pytest.mark.asyncio
+    async def test_k_anonymity_failures_do_not_return_data(self):
+        """Тест: ошибки параметров и невыполнимая k-анонимность не возвращают исходные строки"""
+        quasi_identifiers = ['age', 'zipcode', 'gender']
+        with pytest.raises(ValueError):
+            await self.k_anonymity_service.apply(
+                self.test_data, {'k': 3, 'algorithm': 'Mondrian', 'quasi_identifiers': quasi_identifiers}
+            )
+        with pytest.raises(ValueError):
+            await self.k_anonymity_service.apply(self.test_data, {
+                'k': 3,
+                'algorithm': 'mondrian',
+                'quasi_identifiers': quasi_identifiers,
+                'ordinal_orders': {'gender': ['M']}
+            })
+        
+        for missing in [[], ['city']]:
+            with pytest.raises(ValueError):
+                await self.k_anonymity_service.apply(
+                    self.test_data, {'k': 3, 'quasi_identifiers': missing}
+                )
+        
+        for algorithm in ['generalization', 'mondrian']:
+            result = await self.k_anonymity_service.apply(
+                self.test_data, {'k': 20, 'algorithm': algorithm, 'quasi_identifiers': quasi_identifiers}
+            )
+            assert result.empty
+            assert list(result.columns) == list(self.test_data.columns)
+    
+    def test_mondrian_parallel_partition(self):
+        """Тест параллельного разбиения: те же разделы, что и в одном процессе"""
+        rng = np.random.default_rng(0)
+        data = pd.DataFrame({
+            'age': rng.integers(18, 90, 5000),
+            'zipcode': rng.integers(100000, 100500, 5000).astype(str),
+            'gender': rng.choice(['M', 'F'], 5000)
+        })
+        encoded = encode_quasi_identifiers(data, ['age', 'zipcode', 'gender'])
+        
+        serial = mondrian_partition(encoded, 5)
+        parallel = mondrian_partition(encoded, 5, workers=2, parallel_rows=1000)
+        
+        def classes(labels):
+            return {frozenset(np.flatnonzero(labels == label)) for label in np.unique(labels)}
+        
+        assert (serial >= 0).all()
+        assert np.bincount(serial).min() >= 5
+        assert classes(serial) == classes(parallel)
+        
+        # Пул процессов создаётся один раз и переиспользуется следующими разбиениями
+        pool = shared_process_pool(2)
+        again = mondrian_partition(encoded, 5, workers=2, parallel_rows=1000)
+        assert shared_process_pool(2) is pool
+        assert classes(again) == classes(serial)
 
 class TestLDiversity:
     """Тесты для l-разнообразия"""
@@ -116,6 +228,176 @@ class TestLDiversity:
         
         # Результат должен быть булевым значением
         assert isinstance(is_valid, bool)
+    
+    @pytest.mark.asyncio
+    async def test_l_diversity_variants(self):
+        """Тест вариантов l-разнообразия: distinct, entropy и рекурсивное (c,l)"""
+        data = pd.DataFrame({
+            'age': [21, 22, 23, 24, 41, 42, 43, 44, 61, 62],
+            'zipcode': ['101000'] * 10,
+            'disease': ['A', 'A', 'B', 'C', 'A', 'A', 'A', 'B', 'A', 'A']
+        })
+        quasi_identifiers = ['age', 'zipcode']
+        
+        # Группа 20: A×2, B, C; группа 40: A×3, B; группа 60: только A
+        kept = {}
+        for diversity in ['distinct', 'entropy', 'recursive']:
+            result = await self.l_diversity_service._apply_l_diversity(
+                data, quasi_identifiers, 'disease', 2, None, diversity, 1.5
+            )
+            kept[diversity] = sorted(set(result['age']))
+            assert await self.l_diversity_service.validate_l_diversity(result, quasi_identifiers, 'disease', 2)
+        
+        assert kept == {'distinct': [20.0, 40.0], 'entropy': [20.0], 'recursive': [20.0]}
+    
+    @pytest.mark.asyncio
+    async def test_l_diversity_report_only(self):
+        """Тест отчёта о разнообразии групп без построения данных"""
+        parameters = {
+            'l': 2,
+            'sensitive_attribute': 'disease',
+            'quasi_identifiers': ['age', 'zipcode'],
+            'diversity': 'recursive',
+            'c': 2,
+            'report_only': True
+        }
+        
+        report = await self.l_diversity_service.apply(self.test_data, parameters)
+        
+        assert list(report.columns) == [
+            'age', 'zipcode', 'size', 'distinct', 'entropy', 'recursive_ratio', 'satisfied'
+        ]
+        assert report['size'].sum() == len(self.test_data)
+        assert report['distinct'].tolist() == [2, 2, 2]
+        assert np.allclose(report['entropy'], np.log(2), atol=0.2)
+        assert (report['satisfied'] == (report['recursive_ratio'] < 2)).all()
+
+    @pytest.mark.asyncio
+    async def test_l_diversity_report_with_missing_quasi_identifiers(self):
+        """Тест: строки с пропуском в квази-идентификаторах не сдвигают ключи групп отчёта"""
+        data = pd.DataFrame({
+            'age': [30, 31, 32, 50, 51],
+            'zipcode': [None, '11111', '11111', '22222', '22222'],
+            'disease': ['A', 'A', 'B', 'A', 'B']
+        })
+        parameters = {
+            'l': 2,
+            'sensitive_attribute': 'disease',
+            'quasi_identifiers': ['age', 'zipcode'],
+            'report_only': True
+        }
+        
+        report = await self.l_diversity_service.apply(data, parameters)
+        
+        assert report[['age', 'zipcode']].values.tolist() == [[30.0, '11**'], [50.0, '22**']]
+        assert report['size'].tolist() == [2, 2]
+        assert report['satisfied'].all()
+
+    @pytest.mark.asyncio
+    async def test_l_diversity_failures_do_not_return_data(self):
+        """Тест: неизвестный вариант и невыполнимое l-разнообразие не возвращают исходные строки"""
+        parameters = {
+            'l': 2,
+            'sensitive_attribute': 'disease',
+            'quasi_identifiers': ['age', 'zipcode']
+        }
+        with pytest.raises(ValueError):
+            await self.l_diversity_service.apply(self.test_data, {**parameters, 'diversity': 'Entropy'})
+        for missing in [
+            {'sensitive_attribute': None},
+            {'sensitive_attribute': 'diagnosis'},
+            {'quasi_identifiers': []},
+            {'quasi_identifiers': ['city']},
+        ]:
+            with pytest.raises(ValueError):
+                await self.l_diversity_service.apply(self.test_data, {**parameters, **missing})
+        with pytest.raises(KeyError):
+            await self.l_diversity_service.diversity_report(self.test_data, ['age'], 'diagnosis', 2)
+        
+        result = await self.l_diversity_service.apply(self.test_data, {**parameters, 'l': 3})
+        assert result.empty
+        assert list(result.columns) == list(self.test_data.columns)
+
+class TestGeneralizationHierarchy:
+    """Тесты для иерархий обобщения"""
+    
+    def setup_method(self):
+        """Настройка тестовых данных"""
+        self.k_anonymity_service = KAnonymityService()
+        self.parameters = {
+            'hierarchies': {
+                'age': {'type': 'interval', 'widths': [5, 20]},
+                'zipcode': {'type': 'prefix', 'lengths': [4, 2]},
+                'visit': {'type': 'date', 'units': ['month', 'year']},
+                'disease': {'type': 'taxonomy', 'parents': {
+                    'flu': 'respiratory', 'asthma': 'respiratory',
+                    'respiratory': 'any', 'fracture': 'any'
+                }}
+            },
+            'generalization_level': {'age': 1, 'zipcode': 2, 'visit': 1, 'disease': 2}
+        }
+        self.test_data = pd.DataFrame({
+            'age': [23, 27, 41, np.nan],
+            'zipcode': ['101000', '101555', '102000', '103000'],
+            'visit': pd.to_datetime(['2024-01-15', '2024-01-20', '2024-03-02', '2023-12-31']),
+            'disease': ['flu', 'asthma', 'fracture', 'unknown'],
+            'gender': ['M', 'F', 'M', 'F']
+        })
+    
+    def test_hierarchy_levels(self):
+        """Тест уровней иерархий: интервалы, префиксы, даты и таксономия"""
+        hierarchies = self.k_anonymity_service.hierarchies(self.parameters)
+        data = self.test_data
+        
+        age = hierarchies.generalize(data['age'])
+        assert age[:3].tolist() == ['20-25', '25-30', '40-45']
+        assert pd.isna(age[3])
+        assert hierarchies.generalize(data['age'], level=2)[:3].tolist() == ['20-40', '20-40', '40-60']
+        assert hierarchies.generalize(data['zipcode']).tolist() == ['10*', '10*', '10*', '10*']
+        assert hierarchies.generalize(data['zipcode'], level=1).tolist() == ['1010*', '1015*', '1020*', '1030*']
+        assert hierarchies.generalize(data['visit']).dt.month.tolist() == [1, 1, 3, 12]
+        assert hierarchies.generalize(data['visit'], level=2).tolist() == [2024, 2024, 2024, 2023]
+        assert hierarchies.generalize(data['disease'], level=1).tolist() == ['respiratory', 'respiratory', 'any', '*']
+        assert hierarchies.generalize(data['disease']).tolist() == ['any', 'any', '*', '*']
+        # Уровень выше вершины иерархии ограничивается вершиной, уровень 0 - исходные значения
+        assert hierarchies.generalize(data['disease'], level=5).tolist() == ['any', 'any', '*', '*']
+        assert hierarchies.generalize(data['zipcode'], level=0).equals(data['zipcode'])
+        # Колонка без описания обобщается по умолчанию, как прежде
+        assert hierarchies.generalize(data['gender']).tolist() == ['M***', 'F***', 'M***', 'F***']
+    
+    def test_incomplete_hierarchy_fails_on_creation(self):
+        """Тест: иерархия без generalize_values не создаётся"""
+        class Incomplete(Hierarchy):
+            levels = 1
+        
+        with pytest.raises(TypeError):
+            Incomplete()
+    
+    def test_hierarchy_cache(self):
+        """Тест кэша: таблицы компилируются один раз на версию политики"""
+        cache = HierarchyCache(max_policies=2, max_categories=100)
+        default = self.k_anonymity_service.default_hierarchy
+        
+        hierarchies = cache.get('k_anonymity', ('policy', 1), self.parameters, default)
+        assert cache.get('k_anonymity', ('policy', 1), self.parameters, default) is hierarchies
+        
+        hierarchies.generalize(self.test_data['zipcode'])
+        compiled = hierarchies.compiled[('zipcode', '')]
+        assert compiled.categories == 4
+        
+        # Повторное обобщение дополняет таблицы только новыми значениями
+        more = pd.Series(['101000', '104000'], name='zipcode')
+        assert hierarchies.generalize(more, level=1).tolist() == ['1010*', '1040*']
+        assert compiled.categories == 5
+        
+        # Новая версия политики вытесняет прежнюю
+        updated = cache.get('k_anonymity', ('policy', 2), self.parameters, default)
+        assert updated is not hierarchies
+        assert list(cache._entries) == [('k_anonymity', 'policy', 2)]
+        
+        # Без ключа политики иерархии не кэшируются
+        assert isinstance(cache.get('k_anonymity', None, {}, default), GeneralizationHierarchies)
+        assert len(cache._entries) == 1
 
 class TestDifferentialPrivacy:
     """Тесты для дифференциальной приватности"""
@@ -206,5 +488,169 @@ class TestDifferentialPrivacy:
         assert 'overall_utility_loss' in utility_loss
         assert utility_loss['overall_utility_loss'] >= 0
 
+class TestStreamingAnonymization:
+    """Тесты для потоковой анонимизации"""
+    
+    def setup_method(self):
+        """Настройка тестовой базы"""
+        rng = np.random.default_rng(7)
+        rows = 2000
+        self.test_data = pd.DataFrame({
+            'age': rng.integers(18, 90, rows),
+            'zipcode': pd.Series(rng.integers(100000, 110000, rows)).astype(str),
+            'gender': rng.choice(['M', 'F'], rows),
+            'disease': rng.choice(['A', 'B', 'C', 'D'], rows)
+        })
+        self.engine = create_engine(
+            'sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False}
+        )
+        self.test_data.to_sql('patients', self.engine, index=False)
+        self.privacy_service = PrivacyService(Session(bind=self.engine))
+    
+    def teardown_method(self):
+        self.engine.dispose()
+    
+    async def _stream(self, policy_type, parameters, output_format, query='SELECT * FROM patients'):
+        policy = SimpleNamespace(id=None, version=1, policy_type=policy_type, parameters=parameters)
+        payload = b''.join([
+            part async for part in self.privacy_service.stream_anonymization(
+                query, policy, output_format, chunk_size=300
+            )
+        ])
+        if output_format == 'arrow':
+            return pa.ipc.open_stream(payload).read_all().to_pandas()
+        return pd.read_json(io.BytesIO(payload), lines=True, dtype=False)
+    
+    @pytest.mark.asyncio
+    async def test_two_pass_matches_in_memory(self):
+        """Тест двух проходов по чанкам: тот же результат, что и по всей выборке"""
+        k_parameters = {'k': 5, 'quasi_identifiers': ['age', 'zipcode', 'gender']}
+        l_parameters = {
+            'l': 3,
+            'sensitive_attribute': 'disease',
+            'quasi_identifiers': ['age', 'zipcode'],
+            'diversity': 'entropy',
+            'hierarchies': {'zipcode': {'type': 'prefix', 'lengths': [4]}}
+        }
+        expected = {
+            'k_anonymity': await KAnonymityService().apply(self.test_data, k_parameters),
+            'l_diversity': await LDiversityService().apply(self.test_data, l_parameters)
+        }
+        
+        for policy_type, parameters in [('k_anonymity', k_parameters), ('l_diversity', l_parameters)]:
+            # Группы собираются из нескольких чанков
+            assert 0 < len(expected[policy_type]) < len(self.test_data)
+            for output_format in ['ndjson', 'arrow']:
+                result = await self._stream(policy_type, parameters, output_format)
+                pd.testing.assert_frame_equal(
+                    result.astype(str), expected[policy_type].astype(str)
+                )
+    
+    @pytest.mark.asyncio
+    async def test_chunked_transforms(self):
+        """Тест шума по чанкам, отчёта l-разнообразия и пустой выборки"""
+        noisy = await self._stream('differential_privacy', {'epsilon': 1.0}, 'arrow')
+        assert len(noisy) == len(self.test_data)
+        assert not np.allclose(noisy['age'], self.test_data['age'])
+        
+        report = await self._stream('l_diversity', {
+            'l': 2,
+            'sensitive_attribute': 'disease',
+            'quasi_identifiers': ['zipcode'],
+            'report_only': True
+        }, 'arrow')
+        assert report['size'].sum() == len(self.test_data)
+        assert report['satisfied'].all()
+        
+        empty = await self._stream(
+            'k_anonymity', {'k': 5, 'quasi_identifiers': ['age']}, 'arrow',
+            query='SELECT * FROM patients WHERE age < 0'
+        )
+        assert empty.empty
+        assert list(empty.columns) == list(self.test_data.columns)
+
+    @pytest.mark.asyncio
+    async def test_arrow_schema_survives_type_changes_between_chunks(self):
+        """Тест: пропуски только в первом чанке и дробные значения после целых"""
+        rows = len(self.test_data)
+        visits = pd.DataFrame({
+            'gender': self.test_data['gender'],
+            'note': [None] * 300 + ['visit'] * (rows - 300),
+            'score': list(range(300)) + [0.5] * (rows - 300)
+        }).astype({'note': object, 'score': object})
+        visits.to_sql('visits', self.engine, index=False)
+
+        result = await self._stream(
+            'k_anonymity', {'k': 1, 'quasi_identifiers': ['gender']}, 'arrow',
+            query='SELECT * FROM visits'
+        )
+        assert len(result) == rows
+        assert result['note'].isna().sum() == 300
+        assert (result['note'].iloc[300:] == 'visit').all()
+        assert result['score'].tolist() == visits['score'].astype(float).tolist()
+
+        # Колонка, в которой так и не появилось значений, пишется строками
+        empty_notes = await self._stream(
+            'k_anonymity', {'k': 1, 'quasi_identifiers': ['gender']}, 'arrow',
+            query='SELECT gender, NULL AS note FROM visits'
+        )
+        assert len(empty_notes) == rows
+        assert empty_notes['note'].isna().all()
+
+    @pytest.mark.asyncio
+    async def test_missing_columns_do_not_stream_data(self):
+        """Тест: без квази-идентификаторов или чувствительного атрибута строки не выдаются"""
+        for policy_type, parameters in [
+            ('k_anonymity', {'k': 5, 'quasi_identifiers': ['salary']}),
+            ('l_diversity', {'l': 2, 'sensitive_attribute': 'salary', 'quasi_identifiers': ['age']}),
+            ('l_diversity', {'l': 2, 'sensitive_attribute': 'disease', 'quasi_identifiers': ['salary']})
+        ]:
+            with pytest.raises(ValueError):
+                await self._stream(policy_type, parameters, 'ndjson')
+    
+    @pytest.mark.asyncio
+    async def test_query_is_read_only(self):
+        """Тест: анонимизируется только один SELECT, изменения данных не проходят"""
+        policy = SimpleNamespace(id=None, version=1, policy_type='differential_privacy', parameters={})
+        for query in [
+            'DELETE FROM patients RETURNING age',
+            'SELECT * FROM patients; DELETE FROM patients',
+            'UPDATE patients SET age = 0'
+        ]:
+            with pytest.raises(ValueError):
+                async for _ in self.privacy_service.stream_anonymization(query, policy):
+                    pass
+            with pytest.raises(ValueError):
+                await self.privacy_service.apply_anonymization('patients', query, policy)
+        
+        # Ошибка базы тоже не превращается в пустой результат
+        with pytest.raises(Exception):
+            await self.privacy_service._execute_query('SELECT * FROM missing_table')
+        
+        # Проходы по выборке идут в транзакции только для чтения
+        with pytest.raises(Exception):
+            async with self.privacy_service._snapshot() as connection:
+                connection.exec_driver_sql('DELETE FROM patients')
+        
+        data = await self.privacy_service._execute_query('SELECT * FROM patients;')
+        assert len(data) == len(self.test_data)
+
+    @pytest.mark.asyncio
+    async def test_reads_off_event_loop(self):
+        """Тест: запрос и чтение чанков выполняются вне потока цикла событий"""
+        read_threads = set()
+        iter_query = self.privacy_service._iter_query
+        
+        def tracked(*args):
+            for chunk in iter_query(*args):
+                read_threads.add(threading.get_ident())
+                yield chunk
+        
+        self.privacy_service._iter_query = tracked
+        result = await self._stream('k_anonymity', {'k': 5, 'quasi_identifiers': ['age']}, 'ndjson')
+        
+        assert len(result) == len(self.test_data)
+        assert read_threads and threading.get_ident() not in read_threads
+
 if __name__ == '__main__':
     pytest.main([__file__])
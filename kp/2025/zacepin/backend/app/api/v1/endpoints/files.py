@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional
 import pandas as pd
+import aiofiles
+import asyncio
 import os
 from datetime import datetime
 
@@ -9,6 +12,8 @@ from app.core.database import get_db_write, get_db_read
 from app.models.csv_file import CSVFile
 from app.core.config import settings
 from app.core.monitoring import monitor_performance
+from app.services.csv_index import RowIndexBuilder
+from app.services.dataset_storage import prepare_dataset, open_dataset, remove_dataset
 
 router = APIRouter()
 
@@ -17,7 +22,7 @@ router = APIRouter()
 async def upload_csv_file(
     file: UploadFile = File(...),
     uploaded_by: str = "anonymous",
-    db: Session = Depends(get_db_write)
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Загрузить CSV файл для разметки"""
     try:
@@ -31,15 +36,41 @@ async def upload_csv_file(
         # Создание директории для загрузки
         os.makedirs(settings.upload_dir, exist_ok=True)
         
-        # Сохранение файла
+        # Потоковое сохранение файла кусками фиксированного размера:
+        # в том же проходе считаются строки и строится индекс смещений
         file_path = os.path.join(settings.upload_dir, file.filename)
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        # Чтение CSV для получения информации
-        df = pd.read_csv(file_path)
-        total_rows = len(df)
+        part_path = file_path + ".part"
+        index_builder = RowIndexBuilder()
+        file_size = 0
+        try:
+            async with aiofiles.open(part_path, "wb") as buffer:
+                while True:
+                    chunk = await file.read(settings.upload_chunk_size)
+                    if not chunk:
+                        break
+                    
+                    file_size += len(chunk)
+                    if file_size > settings.max_file_size:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"File exceeds maximum size of {settings.max_file_size} bytes"
+                        )
+                    
+                    await buffer.write(chunk)
+                    index_builder.feed(chunk)
+            
+            os.replace(part_path, file_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        
+        index = index_builder.finish(file_path)
+        index.save()
+        total_rows = index.total_rows
+        
+        # Однократная конвертация в колоночный формат (если включена в настройках);
+        # выполняется в пуле потоков, чтобы не блокировать event loop
+        await asyncio.to_thread(prepare_dataset, file_path)
         
         # Создание записи в БД
         db_file = CSVFile(
@@ -51,8 +82,8 @@ async def upload_csv_file(
         )
         
         db.add(db_file)
-        db.commit()
-        db.refresh(db_file)
+        await db.commit()
+        await db.refresh(db_file)
         
         return {
             "id": db_file.id,
@@ -62,7 +93,10 @@ async def upload_csv_file(
             "uploaded_at": db_file.uploaded_at.isoformat()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to upload file: {str(e)}"
@@ -71,11 +105,11 @@ async def upload_csv_file(
 @router.get("/", response_model=List[Dict[str, Any]])
 @monitor_performance("files_list")
 async def list_files(
-    db: Session = Depends(get_db_read)
+    db: AsyncSession = Depends(get_db_read)
 ):
     """Получить список загруженных файлов"""
     try:
-        files = db.query(CSVFile).all()
+        files = (await db.scalars(select(CSVFile))).all()
         
         result = []
         for file in files:
@@ -104,12 +138,13 @@ async def get_file_data(
     file_id: int,
     limit: int = 100,
     offset: int = 0,
-    db: Session = Depends(get_db_read)
+    columns: Optional[str] = None,
+    db: AsyncSession = Depends(get_db_read)
 ):
-    """Получить данные из CSV файла"""
+    """Получить данные из CSV файла (columns - список колонок через запятую)"""
     try:
         # Поиск файла в БД
-        db_file = db.query(CSVFile).filter(CSVFile.id == file_id).first()
+        db_file = await db.get(CSVFile, file_id)
         
         if not db_file:
             raise HTTPException(
@@ -117,18 +152,27 @@ async def get_file_data(
                 detail="File not found"
             )
         
-        # Чтение CSV файла
-        df = pd.read_csv(db_file.file_path)
+        # Чтение только запрошенной страницы и колонок (файловый ввод-вывод в пуле потоков)
+        dataset = await asyncio.to_thread(open_dataset, db_file.file_path)
+        
+        selected_columns = None
+        if columns:
+            selected_columns = [c.strip() for c in columns.split(",") if c.strip()]
+            unknown = set(selected_columns) - set(dataset.columns)
+            if unknown:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown columns: {', '.join(sorted(unknown))}"
+                )
         
-        # Применение пагинации
-        paginated_df = df.iloc[offset:offset + limit]
+        paginated_df = await asyncio.to_thread(dataset.read_rows, offset, limit, selected_columns)
         
         return {
             "data": paginated_df.to_dict('records'),
-            "total_rows": len(df),
+            "total_rows": dataset.total_rows,
             "offset": offset,
             "limit": limit,
-            "has_more": offset + limit < len(df)
+            "has_more": offset + limit < dataset.total_rows
         }
         
     except HTTPException:
@@ -144,11 +188,11 @@ async def get_file_data(
 async def update_file_progress(
     file_id: int,
     processed_rows: int,
-    db: Session = Depends(get_db_write)
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Обновить прогресс обработки файла"""
     try:
-        db_file = db.query(CSVFile).filter(CSVFile.id == file_id).first()
+        db_file = await db.get(CSVFile, file_id)
         
         if not db_file:
             raise HTTPException(
@@ -157,7 +201,7 @@ async def update_file_progress(
             )
         
         db_file.update_progress(processed_rows)
-        db.commit()
+        await db.commit()
         
         return {
             "message": "Progress updated successfully",
@@ -169,7 +213,7 @@ async def update_file_progress(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update progress: {str(e)}"
@@ -179,11 +223,11 @@ async def update_file_progress(
 @monitor_performance("file_delete")
 async def delete_file(
     file_id: int,
-    db: Session = Depends(get_db_write)
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Удалить файл"""
     try:
-        db_file = db.query(CSVFile).filter(CSVFile.id == file_id).first()
+        db_file = await db.get(CSVFile, file_id)
         
         if not db_file:
             raise HTTPException(
@@ -191,20 +235,19 @@ async def delete_file(
                 detail="File not found"
             )
         
-        # Удаление файла с диска
-        if os.path.exists(db_file.file_path):
-            os.remove(db_file.file_path)
+        # Удаление файла с диска вместе с индексом и колоночной копией
+        remove_dataset(db_file.file_path)
         
         # Удаление записи из БД
-        db.delete(db_file)
-        db.commit()
+        await db.delete(db_file)
+        await db.commit()
         
         return {"message": "File deleted successfully"}
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to delete file: {str(e)}"
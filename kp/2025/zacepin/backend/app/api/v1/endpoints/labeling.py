@@ -1,11 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, Header, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, insert, or_, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional
 from datetime import datetime
+import asyncio
 
-from app.core.database import get_db_write, get_db_read
+from app.core.conflict_index import conflict_index
+from app.core.database import SESSION_TOKEN_HEADER, db_manager, get_db_write, get_db_read
+from app.core.event_stream import event_stream, parse_event_id
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.core.serialization import (
+    LABELED_DATA_COLUMNS, dumps, json_response, labeled_data_dict, labeled_data_json, labeled_data_row
+)
 from app.models.labeled_data import LabeledData
 from app.models.vector_clock import vector_clock_manager
+from app.services.annotator_stats import StatsDelta
+from app.services.consistency_monitor import consistency_monitor
+from app.services.vector_clock_engine import ClockMatrix
 from app.core.monitoring import session_monitor, monitor_performance
 from app.schemas.labeling import (
     LabeledDataCreate, LabeledDataResponse, LabeledDataUpdate,
@@ -14,17 +26,44 @@ from app.schemas.labeling import (
 
 router = APIRouter()
 
+
+async def ensure_conflict_index(db: AsyncSession, session_id: str):
+    """Один раз заполнить индекс конфликтов сессии из БД"""
+    if conflict_index.is_indexed(session_id):
+        return
+    rows = (await db.execute(
+        select(LabeledData.data_id, LabeledData.id, LabeledData.label).where(
+            LabeledData.session_id == session_id
+        )
+    )).all()
+    conflict_index.rebuild(session_id, [tuple(row) for row in rows])
+
+
+async def publish_label_events(event_type: str, session_id: str, rows: List[Any]):
+    """Разослать push-клиентам сессии записанные разметки (кортежи LABELED_DATA_COLUMNS)"""
+    events = []
+    for row in rows:
+        record = labeled_data_dict(row)
+        events.append((event_type, record))
+        if record["is_conflict"]:
+            events.append(("conflict_detected", {"id": record["id"], "data_id": record["data_id"]}))
+    await event_stream.publish(session_id, events)
+
+
 @router.post("/", response_model=LabeledDataResponse)
 @monitor_performance("labeling_create")
 async def create_labeled_data(
     labeled_data: LabeledDataCreate,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Создать новую разметку данных"""
     try:
         # Проверка vector clock на конфликты
-        conflicts = vector_clock_manager.detect_conflicts(
-            labeled_data.session_id, 
+        # Хранилище clocks может обращаться к Redis или БД - не в цикле событий
+        conflicts = await asyncio.to_thread(
+            vector_clock_manager.detect_conflicts,
+            labeled_data.session_id,
             labeled_data.vector_clock
         )
         
@@ -44,67 +83,114 @@ async def create_labeled_data(
         )
         
         db.add(db_labeled_data)
-        db.commit()
-        db.refresh(db_labeled_data)
+        # Rollup статистики разметчика меняется в той же транзакции
+        stats = StatsDelta()
+        stats.add(db_labeled_data.annotator_id, db_labeled_data.confidence, db_labeled_data.is_conflict)
+        await stats.apply_async(db)
+        await db.commit()
+        await db.refresh(db_labeled_data)
+        # High-water mark: чтения сессии пойдут только на догнавшие реплики
+        position = await db_manager.mark_write(db, labeled_data.session_id)
+        response.headers[SESSION_TOKEN_HEADER] = str(position)
+        conflict_index.record(
+            db_labeled_data.session_id,
+            [(db_labeled_data.data_id, db_labeled_data.id, db_labeled_data.label)]
+        )
+        consistency_monitor.mark_dirty(db_labeled_data.session_id, position)
         
         # Обновление vector clock
-        vector_clock_manager.merge_clocks(labeled_data.session_id, labeled_data.vector_clock)
-        
-        return LabeledDataResponse(
-            id=db_labeled_data.id,
-            session_id=db_labeled_data.session_id,
-            annotator_id=db_labeled_data.annotator_id,
-            data_id=db_labeled_data.data_id,
-            original_text=db_labeled_data.original_text,
-            label=db_labeled_data.label,
-            confidence=db_labeled_data.confidence,
-            vector_clock=db_labeled_data.vector_clock,
-            created_at=db_labeled_data.created_at,
-            updated_at=db_labeled_data.updated_at,
-            is_conflict=db_labeled_data.is_conflict,
-            conflict_resolution=db_labeled_data.conflict_resolution
+        await asyncio.to_thread(
+            vector_clock_manager.merge_clocks, labeled_data.session_id, labeled_data.vector_clock
         )
         
+        row = labeled_data_row(db_labeled_data)
+        await publish_label_events("label_created", db_labeled_data.session_id, [row])
+        
+        # Ответ кодируется сразу в JSON, без повторной валидации response_model
+        return json_response(dumps(labeled_data_dict(row)), response)
+        
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create labeled data: {str(e)}"
         )
 
+@router.get("/stream/{session_id}")
+async def stream_session_events(
+    session_id: str,
+    after: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Push-поток событий разметки и конфликтов сессии (Server-Sent Events).
+    
+    Заменяет опрос /{session_id} и /conflicts/{session_id}: клиент получает
+    события label_created, label_updated, conflict_detected, conflict_resolved.
+    Поток возобновляется с id последнего полученного события: заголовок
+    Last-Event-ID (EventSource передаёт его сам) или параметр after.
+    """
+    resume_from = last_event_id or after
+    if resume_from:
+        try:
+            parse_event_id(resume_from)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid event id"
+            )
+    
+    return StreamingResponse(
+        event_stream.events(session_id, resume_from),
+        media_type="text/event-stream",
+        # Без буферизации на прокси: события должны уходить клиенту сразу
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/{session_id}", response_model=List[LabeledDataResponse])
 @monitor_performance("labeling_get_by_session")
 async def get_labeled_data_by_session(
     session_id: str,
+    response: Response,
     limit: int = 100,
     offset: int = 0,
-    db: Session = Depends(get_db_read)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db_read)
 ):
-    """Получить разметку данных по сессии"""
+    """
+    Получить разметку данных по сессии.
+    
+    Записи упорядочены по id. Курсор следующей страницы возвращается в
+    заголовке X-Next-Cursor: с ним выборка продолжается после последней
+    записи по индексу (session_id, id), и стоимость страницы не зависит от
+    её глубины. offset оставлен для совместимости.
+    """
     try:
-        labeled_data_list = db.query(LabeledData).filter(
+        query = select(*LABELED_DATA_COLUMNS).where(
             LabeledData.session_id == session_id
-        ).offset(offset).limit(limit).all()
-        
-        result = []
-        for item in labeled_data_list:
-            result.append(LabeledDataResponse(
-                id=item.id,
-                session_id=item.session_id,
-                annotator_id=item.annotator_id,
-                data_id=item.data_id,
-                original_text=item.original_text,
-                label=item.label,
-                confidence=item.confidence,
-                vector_clock=item.vector_clock,
-                created_at=item.created_at,
-                updated_at=item.updated_at,
-                is_conflict=item.is_conflict,
-                conflict_resolution=item.conflict_resolution
-            ))
-        
-        return result
+        ).order_by(LabeledData.id).limit(limit)
+        
+        if cursor is not None:
+            try:
+                last_id = decode_cursor(cursor, session_id)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid cursor: {str(e)}"
+                )
+            query = query.where(LabeledData.id > last_id)
+        else:
+            query = query.offset(offset)
+        
+        # Строки кортежами кодируются сразу в JSON: без ORM-объектов и pydantic-моделей
+        rows = (await db.execute(query)).all()
+        if rows and len(rows) == limit:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(session_id, rows[-1].id)
+        
+        return json_response(labeled_data_json(rows), response)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -116,12 +202,13 @@ async def get_labeled_data_by_session(
 async def update_labeled_data(
     data_id: int,
     update_data: LabeledDataUpdate,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Обновить разметку данных"""
     try:
         # Поиск записи
-        db_labeled_data = db.query(LabeledData).filter(LabeledData.id == data_id).first()
+        db_labeled_data = await db.get(LabeledData, data_id)
         
         if not db_labeled_data:
             raise HTTPException(
@@ -129,9 +216,12 @@ async def update_labeled_data(
                 detail="Labeled data not found"
             )
         
+        old_confidence, old_conflict = db_labeled_data.confidence, db_labeled_data.is_conflict
+        
         # Проверка vector clock на конфликты
         if update_data.vector_clock:
-            conflicts = vector_clock_manager.detect_conflicts(
+            conflicts = await asyncio.to_thread(
+                vector_clock_manager.detect_conflicts,
                 db_labeled_data.session_id,
                 update_data.vector_clock
             )
@@ -148,35 +238,41 @@ async def update_labeled_data(
         if update_data.vector_clock is not None:
             db_labeled_data.vector_clock = update_data.vector_clock
         
-        db.commit()
-        db.refresh(db_labeled_data)
+        stats = StatsDelta()
+        stats.replace(
+            db_labeled_data.annotator_id, old_confidence, old_conflict,
+            db_labeled_data.confidence, db_labeled_data.is_conflict
+        )
+        await stats.apply_async(db)
+        await db.commit()
+        await db.refresh(db_labeled_data)
+        # High-water mark: чтения сессии пойдут только на догнавшие реплики
+        position = await db_manager.mark_write(db, db_labeled_data.session_id)
+        response.headers[SESSION_TOKEN_HEADER] = str(position)
+        conflict_index.record(
+            db_labeled_data.session_id,
+            [(db_labeled_data.data_id, db_labeled_data.id, db_labeled_data.label)]
+        )
+        consistency_monitor.mark_dirty(db_labeled_data.session_id, position)
         
         # Обновление vector clock
         if update_data.vector_clock:
-            vector_clock_manager.merge_clocks(
-                db_labeled_data.session_id, 
+            await asyncio.to_thread(
+                vector_clock_manager.merge_clocks,
+                db_labeled_data.session_id,
                 update_data.vector_clock
             )
         
-        return LabeledDataResponse(
-            id=db_labeled_data.id,
-            session_id=db_labeled_data.session_id,
-            annotator_id=db_labeled_data.annotator_id,
-            data_id=db_labeled_data.data_id,
-            original_text=db_labeled_data.original_text,
-            label=db_labeled_data.label,
-            confidence=db_labeled_data.confidence,
-            vector_clock=db_labeled_data.vector_clock,
-            created_at=db_labeled_data.created_at,
-            updated_at=db_labeled_data.updated_at,
-            is_conflict=db_labeled_data.is_conflict,
-            conflict_resolution=db_labeled_data.conflict_resolution
-        )
+        row = labeled_data_row(db_labeled_data)
+        await publish_label_events("label_updated", db_labeled_data.session_id, [row])
+        
+        # Ответ кодируется сразу в JSON, без повторной валидации response_model
+        return json_response(dumps(labeled_data_dict(row)), response)
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update labeled data: {str(e)}"
@@ -186,59 +282,71 @@ async def update_labeled_data(
 @monitor_performance("labeling_batch")
 async def batch_labeling(
     batch_request: BatchLabelingRequest,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
-    """Пакетная разметка данных"""
+    """
+    Пакетная разметка данных.
+    
+    Все записи вставляются одним INSERT ... RETURNING (SQLAlchemy разбивает
+    большие пакеты на страницы insertmanyvalues), ответ строится из
+    возвращённых строк без повторного чтения, а vector clocks пакета
+    объединяются с clock сессии одной операцией.
+    """
     try:
-        results = []
-        
-        for label_data in batch_request.labels:
-            # Создание записи для каждого элемента
-            db_labeled_data = LabeledData(
-                session_id=batch_request.session_id,
-                annotator_id=batch_request.annotator_id,
-                data_id=label_data.get('data_id'),
-                original_text=label_data.get('original_text'),
-                label=label_data.get('label'),
-                confidence=label_data.get('confidence', 0.0),
-                vector_clock=label_data.get('vector_clock', {})
-            )
-            
-            db.add(db_labeled_data)
-            results.append(db_labeled_data)
+        rows = [
+            {
+                "session_id": batch_request.session_id,
+                "annotator_id": batch_request.annotator_id,
+                "data_id": label_data.get('data_id'),
+                "original_text": label_data.get('original_text'),
+                "label": label_data.get('label'),
+                "confidence": label_data.get('confidence', 0.0),
+                "vector_clock": label_data.get('vector_clock', {})
+            }
+            for label_data in batch_request.labels
+        ]
+        
+        if not rows:
+            return []
+        
+        inserted = (await db.execute(
+            insert(LabeledData).returning(*LABELED_DATA_COLUMNS),
+            rows
+        )).all()
+        stats = StatsDelta()
+        for row in inserted:
+            stats.add(row.annotator_id, row.confidence, row.is_conflict)
+        await stats.apply_async(db)
+        await db.commit()
+        # High-water mark: чтения сессии пойдут только на догнавшие реплики
+        position = await db_manager.mark_write(db, batch_request.session_id)
+        response.headers[SESSION_TOKEN_HEADER] = str(position)
+        
+        # Порядок строк RETURNING не гарантирован, а id выдаются в порядке VALUES.
+        # sort_by_parameter_order не используем: без sentinel-колонки SQLite
+        # откатывается на отдельный INSERT для каждой строки
+        inserted.sort(key=lambda row: row.id)
+        conflict_index.record(
+            batch_request.session_id,
+            [(row.data_id, row.id, row.label) for row in inserted]
+        )
+        consistency_monitor.mark_dirty(batch_request.session_id, position)
         
-        db.commit()
+        # Обновление vector clock сессии максимумом по всем записям пакета
+        await asyncio.to_thread(
+            vector_clock_manager.merge_clocks,
+            batch_request.session_id,
+            ClockMatrix([row.vector_clock for row in inserted]).merged()
+        )
         
-        # Обновление vector clock для всех записей
-        for result in results:
-            db.refresh(result)
-            vector_clock_manager.merge_clocks(
-                batch_request.session_id,
-                result.vector_clock
-            )
+        await publish_label_events("label_created", batch_request.session_id, inserted)
         
-        # Преобразование в response format
-        response_results = []
-        for item in results:
-            response_results.append(LabeledDataResponse(
-                id=item.id,
-                session_id=item.session_id,
-                annotator_id=item.annotator_id,
-                data_id=item.data_id,
-                original_text=item.original_text,
-                label=item.label,
-                confidence=item.confidence,
-                vector_clock=item.vector_clock,
-                created_at=item.created_at,
-                updated_at=item.updated_at,
-                is_conflict=item.is_conflict,
-                conflict_resolution=item.conflict_resolution
-            ))
-        
-        return response_results
+        # Ответ строится из возвращённых кортежей без pydantic-моделей
+        return json_response(labeled_data_json(inserted), response)
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process batch labeling: {str(e)}"
@@ -248,33 +356,31 @@ async def batch_labeling(
 @monitor_performance("labeling_get_conflicts")
 async def get_conflicts(
     session_id: str,
-    db: Session = Depends(get_db_read)
+    db: AsyncSession = Depends(get_db_read)
 ):
-    """Получить конфликты для сессии"""
+    """
+    Получить конфликты для сессии.
+    
+    Возвращаются записи двух видов: помеченные is_conflict (concurrent
+    записи по vector clock) и все записи data_id, для которых в сессии есть
+    разные метки, даже если is_conflict у них False.
+    """
     try:
-        conflicts = db.query(LabeledData).filter(
-            LabeledData.session_id == session_id,
-            LabeledData.is_conflict == True
-        ).all()
-        
-        result = []
-        for conflict in conflicts:
-            result.append(LabeledDataResponse(
-                id=conflict.id,
-                session_id=conflict.session_id,
-                annotator_id=conflict.annotator_id,
-                data_id=conflict.data_id,
-                original_text=conflict.original_text,
-                label=conflict.label,
-                confidence=conflict.confidence,
-                vector_clock=conflict.vector_clock,
-                created_at=conflict.created_at,
-                updated_at=conflict.updated_at,
-                is_conflict=conflict.is_conflict,
-                conflict_resolution=conflict.conflict_resolution
-            ))
-        
-        return result
+        await ensure_conflict_index(db, session_id)
+        record_ids = [
+            record_id
+            for conflict in conflict_index.conflicts(session_id)
+            for record_id in conflict["records"]
+        ]
+        
+        conflicts = (await db.execute(
+            select(*LABELED_DATA_COLUMNS).where(
+                LabeledData.session_id == session_id,
+                or_(LabeledData.is_conflict == True, LabeledData.id.in_(record_ids))
+            )
+        )).all()
+        
+        return json_response(labeled_data_json(conflicts))
         
     except Exception as e:
         raise HTTPException(
@@ -286,14 +392,13 @@ async def get_conflicts(
 @monitor_performance("labeling_resolve_conflict")
 async def resolve_conflict(
     resolution: ConflictResolution,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Разрешить конфликт"""
     try:
         # Поиск конфликтной записи
-        db_labeled_data = db.query(LabeledData).filter(
-            LabeledData.id == resolution.conflict_id
-        ).first()
+        db_labeled_data = await db.get(LabeledData, resolution.conflict_id)
         
         if not db_labeled_data:
             raise HTTPException(
@@ -302,20 +407,38 @@ async def resolve_conflict(
             )
         
         # Применение разрешения
+        if db_labeled_data.is_conflict:
+            stats = StatsDelta()
+            stats.conflict_resolved(db_labeled_data.annotator_id)
+            await stats.apply_async(db)
         db_labeled_data.is_conflict = False
         db_labeled_data.conflict_resolution = resolution.resolution
         
         if resolution.chosen_label:
             db_labeled_data.label = resolution.chosen_label
         
-        db.commit()
+        await db.commit()
+        # High-water mark: чтения сессии пойдут только на догнавшие реплики
+        position = await db_manager.mark_write(db, db_labeled_data.session_id)
+        response.headers[SESSION_TOKEN_HEADER] = str(position)
+        conflict_index.record(
+            db_labeled_data.session_id,
+            [(db_labeled_data.data_id, db_labeled_data.id, db_labeled_data.label)]
+        )
+        consistency_monitor.mark_dirty(db_labeled_data.session_id, position)
+        await event_stream.publish(db_labeled_data.session_id, [("conflict_resolved", {
+            "id": db_labeled_data.id,
+            "data_id": db_labeled_data.data_id,
+            "label": db_labeled_data.label,
+            "resolution": db_labeled_data.conflict_resolution
+        })])
         
         return {"message": "Conflict resolved successfully"}
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to resolve conflict: {str(e)}"
@@ -325,40 +448,27 @@ async def resolve_conflict(
 @monitor_performance("labeling_get_stats")
 async def get_labeling_stats(
     annotator_id: str,
-    db: Session = Depends(get_db_read)
+    db: AsyncSession = Depends(get_db_read)
 ):
     """Получить статистику разметки для разметчика"""
     try:
-        # Подсчет статистики
-        total_labels = db.query(LabeledData).filter(
-            LabeledData.annotator_id == annotator_id
-        ).count()
-        
-        conflicts = db.query(LabeledData).filter(
-            LabeledData.annotator_id == annotator_id,
-            LabeledData.is_conflict == True
-        ).count()
-        
-        # Средняя уверенность
-        avg_confidence_result = db.query(LabeledData.confidence).filter(
-            LabeledData.annotator_id == annotator_id
-        ).all()
-        
-        avg_confidence = 0.0
-        if avg_confidence_result:
-            confidences = [float(item.confidence) for item in avg_confidence_result if item.confidence]
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-        
-        # Последняя активность
-        last_activity = db.query(LabeledData.updated_at).filter(
-            LabeledData.annotator_id == annotator_id
-        ).order_by(LabeledData.updated_at.desc()).first()
+        # Вся статистика одним агрегирующим запросом; в среднее входят только ненулевые уверенности
+        stats = (await db.execute(
+            select(
+                func.count(LabeledData.id).label("total_labels"),
+                func.coalesce(func.sum(case((LabeledData.is_conflict == True, 1), else_=0)), 0).label("conflicts"),
+                func.avg(func.nullif(LabeledData.confidence, 0)).label("avg_confidence"),
+                func.max(LabeledData.updated_at).label("last_activity")
+            ).where(
+                LabeledData.annotator_id == annotator_id
+            )
+        )).one()
         
         return LabelingStats(
-            total_labels=total_labels,
-            conflicts=conflicts,
-            avg_confidence=avg_confidence,
-            last_activity=last_activity.updated_at if last_activity else None
+            total_labels=stats.total_labels,
+            conflicts=stats.conflicts,
+            avg_confidence=float(stats.avg_confidence or 0.0),
+            last_activity=stats.last_activity
         )
         
     except Exception as e:
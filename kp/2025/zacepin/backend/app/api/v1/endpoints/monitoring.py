@@ -1,12 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import Dict, Any, List
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
-import json
+import asyncio
 
 from app.core.database import get_db_read, db_manager
 from app.core.monitoring import metrics, session_monitor
 from app.core.config import settings
+from app.services.consistency_monitor import consistency_monitor
 
 router = APIRouter()
 
@@ -15,18 +17,23 @@ async def health_check():
     """Проверка здоровья системы"""
     try:
         # Проверка здоровья реплик
-        db_manager.update_replica_health()
+        await db_manager.update_replica_health()
         
-        # Получение метрик из Redis
-        active_sessions = metrics.redis_client.get(f"{metrics.metrics_prefix}gauge:active_sessions") or 0
-        total_requests = metrics.redis_client.get(f"{metrics.metrics_prefix}counter:total_requests") or 0
+        # Получение метрик из Redis одним запросом в потоке, не в цикле событий
+        active_sessions, total_requests = await asyncio.to_thread(
+            metrics.redis_client.mget,
+            [
+                f"{metrics.metrics_prefix}gauge:active_sessions",
+                f"{metrics.metrics_prefix}counter:total_requests"
+            ]
+        )
         
         return {
             "status": "healthy",
             "timestamp": datetime.utcnow().isoformat(),
             "replicas": db_manager.replica_health,
-            "active_sessions": int(active_sessions),
-            "total_requests": int(total_requests)
+            "active_sessions": int(active_sessions or 0),
+            "total_requests": int(total_requests or 0)
         }
         
     except Exception as e:
@@ -36,42 +43,22 @@ async def health_check():
         )
 
 @router.get("/metrics")
-async def get_metrics():
-    """Получить метрики системы"""
+async def get_metrics(window: int = Query(300, gt=0)):
+    """Получить метрики системы; окно квантилей не больше срока хранения гистограмм"""
+    window = min(window, settings.metrics_histogram_retention)
     try:
-        # Получение различных типов метрик
-        counters = {}
-        timings = {}
-        gauges = {}
-        
-        # Счетчики
-        counter_keys = metrics.redis_client.keys(f"{metrics.metrics_prefix}counter:*")
-        for key in counter_keys:
-            metric_name = key.replace(f"{metrics.metrics_prefix}counter:", "")
-            counters[metric_name] = int(metrics.redis_client.get(key) or 0)
-        
-        # Временные метрики
-        timing_keys = metrics.redis_client.keys(f"{metrics.metrics_prefix}timing:*")
-        for key in timing_keys:
-            metric_name = key.replace(f"{metrics.metrics_prefix}timing:", "")
-            timings_raw = metrics.redis_client.lrange(key, 0, -1)
-            timings[metric_name] = {
-                "count": len(timings_raw),
-                "avg": sum(float(t) for t in timings_raw) / len(timings_raw) if timings_raw else 0,
-                "min": min(float(t) for t in timings_raw) if timings_raw else 0,
-                "max": max(float(t) for t in timings_raw) if timings_raw else 0
-            }
-        
-        # Gauge метрики
-        gauge_keys = metrics.redis_client.keys(f"{metrics.metrics_prefix}gauge:*")
-        for key in gauge_keys:
-            metric_name = key.replace(f"{metrics.metrics_prefix}gauge:", "")
-            gauges[metric_name] = float(metrics.redis_client.get(key) or 0)
+        # Буфер этого процесса попадает в ответ без ожидания фонового сброса;
+        # обращения к Redis выполняются в потоке, не в цикле событий
+        await asyncio.to_thread(metrics.flush)
+        
+        # Счетчики, gauge и квантили timing по реестру метрик, без KEYS
+        snapshot = await asyncio.to_thread(metrics.snapshot, window=window)
         
         return {
-            "counters": counters,
-            "timings": timings,
-            "gauges": gauges,
+            "counters": snapshot["counters"],
+            "timings": snapshot["timings"],
+            "gauges": snapshot["gauges"],
+            "window": window,
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -88,29 +75,9 @@ async def get_events(
 ):
     """Получить события системы"""
     try:
-        events = []
-        
-        if event_type:
-            # Получение событий конкретного типа
-            event_keys = [f"{metrics.metrics_prefix}events:{event_type}"]
-        else:
-            # Получение всех событий
-            event_keys = metrics.redis_client.keys(f"{metrics.metrics_prefix}events:*")
-        
-        for key in event_keys:
-            event_type_name = key.replace(f"{metrics.metrics_prefix}events:", "")
-            event_data = metrics.redis_client.lrange(key, 0, limit - 1)
-            
-            for event_json in event_data:
-                try:
-                    event = json.loads(event_json)
-                    event["event_type"] = event_type_name
-                    events.append(event)
-                except json.JSONDecodeError:
-                    continue
-        
-        # Сортировка по времени
-        events.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+        await asyncio.to_thread(metrics.flush)
+        
+        events = await asyncio.to_thread(metrics.read_events, event_type, limit)
         
         return {
             "events": events[:limit],
@@ -129,17 +96,11 @@ async def get_replica_status():
     """Получить статус реплик"""
     try:
         # Обновление статуса здоровья
-        db_manager.update_replica_health()
-        
-        replica_status = {}
-        for replica_name, is_healthy in db_manager.replica_health.items():
-            replica_status[replica_name] = {
-                "healthy": is_healthy,
-                "last_check": datetime.utcnow().isoformat()
-            }
+        await db_manager.update_replica_health()
         
         return {
-            "replicas": replica_status,
+            "replicas": db_manager.replica_status(),
+            "routing_strategy": db_manager.router.strategy,
             "timestamp": datetime.utcnow().isoformat()
         }
         
@@ -149,33 +110,48 @@ async def get_replica_status():
             detail=f"Failed to get replica status: {str(e)}"
         )
 
+@router.get("/consistency")
+async def get_consistency_report():
+    """Отчёт последней проверки изменённых сессий с временем по shard'ам"""
+    return {
+        "report": consistency_monitor.last_report,
+        "pending_sessions": await asyncio.to_thread(consistency_monitor.dirty.pending),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
 @router.get("/sessions/stats")
 async def get_session_stats(
-    db: Session = Depends(get_db_read)
+    db: AsyncSession = Depends(get_db_read)
 ):
     """Получить статистику сессий"""
     try:
         from app.models.annotator_session import AnnotatorSession
         
         # Общее количество сессий
-        total_sessions = db.query(AnnotatorSession).count()
-        active_sessions = db.query(AnnotatorSession).filter(
-            AnnotatorSession.is_active == True
-        ).count()
+        total_sessions = await db.scalar(select(func.count(AnnotatorSession.id)))
+        active_sessions = await db.scalar(
+            select(func.count(AnnotatorSession.id)).where(
+                AnnotatorSession.is_active == True
+            )
+        )
         
         # Сессии по репликам
         replica_stats = {}
         for replica in ['master', 'replica1', 'replica2']:
-            count = db.query(AnnotatorSession).filter(
-                AnnotatorSession.current_replica == replica,
-                AnnotatorSession.is_active == True
-            ).count()
+            count = await db.scalar(
+                select(func.count(AnnotatorSession.id)).where(
+                    AnnotatorSession.current_replica == replica,
+                    AnnotatorSession.is_active == True
+                )
+            )
             replica_stats[replica] = count
         
         # Последние активные сессии
-        recent_sessions = db.query(AnnotatorSession).filter(
-            AnnotatorSession.is_active == True
-        ).order_by(AnnotatorSession.last_activity.desc()).limit(10).all()
+        recent_sessions = (await db.scalars(
+            select(AnnotatorSession).where(
+                AnnotatorSession.is_active == True
+            ).order_by(AnnotatorSession.last_activity.desc()).limit(10)
+        )).all()
         
         recent_sessions_data = []
         for session in recent_sessions:
@@ -202,32 +178,38 @@ async def get_session_stats(
 
 @router.get("/conflicts/stats")
 async def get_conflict_stats(
-    db: Session = Depends(get_db_read)
+    db: AsyncSession = Depends(get_db_read)
 ):
     """Получить статистику конфликтов"""
     try:
         from app.models.labeled_data import LabeledData
         
         # Общее количество конфликтов
-        total_conflicts = db.query(LabeledData).filter(
-            LabeledData.is_conflict == True
-        ).count()
+        total_conflicts = await db.scalar(
+            select(func.count(LabeledData.id)).where(
+                LabeledData.is_conflict == True
+            )
+        )
         
         # Конфликты по сессиям
-        conflicts_by_session = db.query(
-            LabeledData.session_id,
-            db.func.count(LabeledData.id).label('conflict_count')
-        ).filter(
-            LabeledData.is_conflict == True
-        ).group_by(LabeledData.session_id).all()
+        conflicts_by_session = (await db.execute(
+            select(
+                LabeledData.session_id,
+                func.count(LabeledData.id).label('conflict_count')
+            ).where(
+                LabeledData.is_conflict == True
+            ).group_by(LabeledData.session_id)
+        )).all()
         
         # Конфликты по типам разрешения
-        resolution_stats = db.query(
-            LabeledData.conflict_resolution,
-            db.func.count(LabeledData.id).label('count')
-        ).filter(
-            LabeledData.is_conflict == True
-        ).group_by(LabeledData.conflict_resolution).all()
+        resolution_stats = (await db.execute(
+            select(
+                LabeledData.conflict_resolution,
+                func.count(LabeledData.id).label('resolution_count')
+            ).where(
+                LabeledData.is_conflict == True
+            ).group_by(LabeledData.conflict_resolution)
+        )).all()
         
         return {
             "total_conflicts": total_conflicts,
@@ -236,7 +218,7 @@ async def get_conflict_stats(
                 for item in conflicts_by_session
             ],
             "resolution_stats": [
-                {"resolution": item.conflict_resolution, "count": item.count}
+                {"resolution": item.conflict_resolution, "count": item.resolution_count}
                 for item in resolution_stats
             ],
             "timestamp": datetime.utcnow().isoformat()
@@ -247,3 +229,33 @@ async def get_conflict_stats(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get conflict stats: {str(e)}"
         )
+
+@router.get("/annotators/stats")
+async def get_annotator_stats(
+    annotator_id: Optional[List[str]] = Query(None),
+    db: AsyncSession = Depends(get_db_read)
+):
+    """
+    Статистика разметчиков из rollup-таблицы annotator_stats.
+    
+    Таблица обновляется при записи разметок, поэтому опрос дашборда читает
+    по строке на разметчика вместо агрегации по всем разметкам.
+    """
+    try:
+        from app.models.annotator_stats import AnnotatorStats
+        
+        query = select(AnnotatorStats).order_by(AnnotatorStats.annotator_id)
+        if annotator_id:
+            query = query.where(AnnotatorStats.annotator_id.in_(annotator_id))
+        annotators = (await db.scalars(query)).all()
+        
+        return {
+            "annotators": [item.to_dict() for item in annotators],
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get annotator stats: {str(e)}"
+        )
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Any
 import uuid
+import asyncio
 from datetime import datetime
 
-from app.core.database import get_db_write, get_db_read, db_manager
+from app.core.database import SESSION_TOKEN_HEADER, get_db_write, get_db_read, db_manager
 from app.models.annotator_session import AnnotatorSession
 from app.models.vector_clock import VectorClock, vector_clock_manager
 from app.core.monitoring import session_monitor, monitor_performance
@@ -16,7 +18,8 @@ router = APIRouter()
 @monitor_performance("session_create")
 async def create_session(
     session_data: SessionCreate,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Создать новую сессию разметчика"""
     try:
@@ -32,11 +35,11 @@ async def create_session(
         )
         
         db.add(db_session)
-        db.commit()
-        db.refresh(db_session)
+        await db.commit()
+        await db.refresh(db_session)
         
         # Создание vector clock для сессии
-        vector_clock = vector_clock_manager.create_clock(session_id, 'master')
+        vector_clock = await asyncio.to_thread(vector_clock_manager.create_clock, session_id, 'master')
         
         # Сохранение vector clock в БД
         db_clock = VectorClock(
@@ -44,7 +47,9 @@ async def create_session(
             clock_data=vector_clock
         )
         db.add(db_clock)
-        db.commit()
+        await db.commit()
+        session_token = await db_manager.mark_write(db, session_id)
+        response.headers[SESSION_TOKEN_HEADER] = str(session_token)
         
         # Логирование события
         session_monitor.session_created(session_id, session_data.annotator_id, 'master')
@@ -54,11 +59,12 @@ async def create_session(
             annotator_id=session_data.annotator_id,
             current_replica='master',
             is_active=True,
-            vector_clock=vector_clock
+            vector_clock=vector_clock,
+            session_token=session_token
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create session: {str(e)}"
@@ -68,14 +74,14 @@ async def create_session(
 @monitor_performance("session_get")
 async def get_session(
     session_id: str,
-    db: Session = Depends(get_db_read)
+    db: AsyncSession = Depends(get_db_read)
 ):
     """Получить информацию о сессии"""
     try:
         # Поиск сессии в БД
-        db_session = db.query(AnnotatorSession).filter(
-            AnnotatorSession.session_id == session_id
-        ).first()
+        db_session = await db.scalar(
+            select(AnnotatorSession).where(AnnotatorSession.session_id == session_id)
+        )
         
         if not db_session:
             raise HTTPException(
@@ -84,7 +90,7 @@ async def get_session(
             )
         
         # Получение vector clock
-        vector_clock = vector_clock_manager.get_clock(session_id)
+        vector_clock = await asyncio.to_thread(vector_clock_manager.get_clock, session_id)
         
         return SessionResponse(
             session_id=db_session.session_id,
@@ -92,7 +98,8 @@ async def get_session(
             current_replica=db_session.current_replica,
             is_active=db_session.is_active,
             vector_clock=vector_clock,
-            last_activity=db_session.last_activity
+            last_activity=db_session.last_activity,
+            session_token=db_manager.session_positions.get(session_id)
         )
         
     except HTTPException:
@@ -108,14 +115,15 @@ async def get_session(
 async def switch_replica(
     session_id: str,
     replica: str,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Переключить сессию на другую реплику"""
     try:
         # Поиск сессии
-        db_session = db.query(AnnotatorSession).filter(
-            AnnotatorSession.session_id == session_id
-        ).first()
+        db_session = await db.scalar(
+            select(AnnotatorSession).where(AnnotatorSession.session_id == session_id)
+        )
         
         if not db_session:
             raise HTTPException(
@@ -132,7 +140,9 @@ async def switch_replica(
         
         old_replica = db_session.current_replica
         db_session.switch_replica(replica)
-        db.commit()
+        await db.commit()
+        # High-water mark: чтения сессии пойдут только на догнавшие реплики
+        response.headers[SESSION_TOKEN_HEADER] = str(await db_manager.mark_write(db, session_id))
         
         # Логирование события
         session_monitor.replica_switched(session_id, old_replica, replica)
@@ -142,7 +152,7 @@ async def switch_replica(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to switch replica: {str(e)}"
@@ -152,13 +162,14 @@ async def switch_replica(
 @monitor_performance("session_update_activity")
 async def update_activity(
     session_id: str,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Обновить время последней активности сессии"""
     try:
-        db_session = db.query(AnnotatorSession).filter(
-            AnnotatorSession.session_id == session_id
-        ).first()
+        db_session = await db.scalar(
+            select(AnnotatorSession).where(AnnotatorSession.session_id == session_id)
+        )
         
         if not db_session:
             raise HTTPException(
@@ -167,14 +178,16 @@ async def update_activity(
             )
         
         db_session.update_activity()
-        db.commit()
+        await db.commit()
+        # High-water mark: чтения сессии пойдут только на догнавшие реплики
+        response.headers[SESSION_TOKEN_HEADER] = str(await db_manager.mark_write(db, session_id))
         
         return {"message": "Activity updated successfully"}
         
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to update activity: {str(e)}"
@@ -184,13 +197,14 @@ async def update_activity(
 @monitor_performance("session_end")
 async def end_session(
     session_id: str,
-    db: Session = Depends(get_db_write)
+    response: Response,
+    db: AsyncSession = Depends(get_db_write)
 ):
     """Завершить сессию"""
     try:
-        db_session = db.query(AnnotatorSession).filter(
-            AnnotatorSession.session_id == session_id
-        ).first()
+        db_session = await db.scalar(
+            select(AnnotatorSession).where(AnnotatorSession.session_id == session_id)
+        )
         
         if not db_session:
             raise HTTPException(
@@ -202,7 +216,9 @@ async def end_session(
         duration = (datetime.utcnow() - db_session.created_at).total_seconds()
         
         db_session.deactivate()
-        db.commit()
+        await db.commit()
+        # High-water mark: чтения сессии пойдут только на догнавшие реплики
+        response.headers[SESSION_TOKEN_HEADER] = str(await db_manager.mark_write(db, session_id))
         
         # Логирование события
         session_monitor.session_ended(session_id, db_session.annotator_id, duration)
@@ -212,7 +228,7 @@ async def end_session(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to end session: {str(e)}"
@@ -222,19 +238,23 @@ async def end_session(
 @monitor_performance("sessions_list")
 async def list_sessions(
     active_only: bool = True,
-    db: Session = Depends(get_db_read)
+    db: AsyncSession = Depends(get_db_read)
 ):
     """Получить список всех сессий"""
     try:
-        query = db.query(AnnotatorSession)
+        query = select(AnnotatorSession)
         if active_only:
-            query = query.filter(AnnotatorSession.is_active == True)
+            query = query.where(AnnotatorSession.is_active == True)
+        
+        sessions = (await db.scalars(query)).all()
         
-        sessions = query.all()
+        # Clocks всех сессий читаются одним переходом в поток
+        clocks = await asyncio.to_thread(
+            lambda: [vector_clock_manager.get_clock(session.session_id) for session in sessions]
+        )
         
         result = []
-        for session in sessions:
-            vector_clock = vector_clock_manager.get_clock(session.session_id)
+        for session, vector_clock in zip(sessions, clocks):
             result.append(SessionResponse(
                 session_id=session.session_id,
                 annotator_id=session.annotator_id,
@@ -0,0 +1,617 @@
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Callable, Any, Tuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class ClockStore(ABC):
+    """
+    Хранилище vector clocks сессий.
+
+    Все изменяющие операции атомарны и возвращают итоговый clock,
+    чтобы вызывающему коду не требовался отдельный запрос на чтение.
+
+    Для сборки мусора хранилище дополнительно ведёт:
+    - время последней записи в сессию (вытеснение неактивных сессий);
+    - view узла - clock, полученный узлом при последнем инкременте, или clock,
+      с которым при объединении пришло его последнее событие (запись узла
+      увеличилась), то есть нижнюю границу того, что узел уже видел;
+    - retired - записи выбывших узлов, которые видели все живые узлы. Они
+      убраны из clock; входящие значения не больше сохранённого игнорируются,
+      а инкремент выбывшего узла продолжает счёт с него. Сами retired записи
+      удаляются через TTL, как и неактивные сессии.
+    """
+
+    def __init__(self, time_func: Callable[[], float] = time.time):
+        self.time_func = time_func
+
+    @abstractmethod
+    def get(self, session_id: str) -> Dict[str, int]:
+        """Текущий clock сессии (пустой для неизвестной сессии)"""
+
+    @abstractmethod
+    def set(self, session_id: str, clock: Dict[str, int]) -> Dict[str, int]:
+        """Заменить clock сессии"""
+
+    @abstractmethod
+    def increment(self, session_id: str, node_id: str) -> Dict[str, int]:
+        """Увеличить счётчик узла в clock сессии"""
+
+    @abstractmethod
+    def merge(self, session_id: str, other_clock: Dict[str, int]) -> Dict[str, int]:
+        """
+        Слить clock сессии с other_clock (поэлементный максимум).
+
+        Узлы, чьи записи увеличились, получают other_clock как view.
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Удалить clock сессии"""
+
+    @abstractmethod
+    def sessions(self) -> List[str]:
+        """Идентификаторы сессий, clocks которых хранятся"""
+
+    @abstractmethod
+    def views(self, session_id: str) -> Dict[str, Tuple[float, Dict[str, int]]]:
+        """View узлов сессии: узел -> (время последней записи узла, clock)"""
+
+    @abstractmethod
+    def retired(self, session_id: str) -> Dict[str, int]:
+        """Записи выбывших узлов сессии"""
+
+    @abstractmethod
+    def retire(self, session_id: str, entries: Dict[str, int]) -> int:
+        """
+        Перенести записи узлов из clock в retired.
+
+        Запись переносится, только если её значение не изменилось с момента
+        решения GC. Возвращает число перенесённых записей.
+        """
+
+    @abstractmethod
+    def expire_retired(self, session_id: str, max_age: float) -> int:
+        """Удалить retired записи старше max_age секунд"""
+
+    @abstractmethod
+    def evict_idle(self, max_idle: float) -> List[str]:
+        """Удалить сессии без записей дольше max_idle секунд"""
+
+    def start(self):
+        """Запуск фоновых задач хранилища"""
+
+    def stop(self):
+        """Остановка фоновых задач хранилища"""
+
+
+class InMemoryClockStore(ClockStore):
+    """Clocks в памяти процесса (один worker, тесты)"""
+
+    def __init__(self, time_func: Callable[[], float] = time.time):
+        super().__init__(time_func)
+        self.clocks: Dict[str, Dict[str, int]] = {}
+        self.accessed: Dict[str, float] = {}
+        self._views: Dict[str, Dict[str, Tuple[float, Dict[str, int]]]] = {}
+        # узел -> (значение, время выбывания)
+        self._retired: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Dict[str, int]:
+        return self.clocks.get(session_id, {}).copy()
+
+    def set(self, session_id: str, clock: Dict[str, int]) -> Dict[str, int]:
+        with self._lock:
+            self.clocks[session_id] = dict(clock)
+            self._views.pop(session_id, None)
+            self._retired.pop(session_id, None)
+            self.accessed[session_id] = self.time_func()
+            return dict(clock)
+
+    def increment(self, session_id: str, node_id: str) -> Dict[str, int]:
+        with self._lock:
+            now = self.time_func()
+            clock = self.clocks.setdefault(session_id, {})
+            retired = self._retired.get(session_id)
+            if retired and node_id in retired:
+                clock.setdefault(node_id, retired.pop(node_id)[0])
+            clock[node_id] = clock.get(node_id, 0) + 1
+            self._views.setdefault(session_id, {})[node_id] = (now, clock.copy())
+            self.accessed[session_id] = now
+            return clock.copy()
+
+    def merge(self, session_id: str, other_clock: Dict[str, int]) -> Dict[str, int]:
+        with self._lock:
+            now = self.time_func()
+            clock = self.clocks.setdefault(session_id, {})
+            retired = self._retired.get(session_id, {})
+            writers = []
+            for node_id, timestamp in other_clock.items():
+                if node_id in retired:
+                    if timestamp <= retired[node_id][0]:
+                        continue
+                    del retired[node_id]
+                if node_id not in clock or timestamp > clock[node_id]:
+                    clock[node_id] = timestamp
+                    writers.append(node_id)
+            if writers:
+                views = self._views.setdefault(session_id, {})
+                for node_id in writers:
+                    views[node_id] = (now, dict(other_clock))
+            self.accessed[session_id] = now
+            return clock.copy()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+    def _drop(self, session_id: str):
+        self.clocks.pop(session_id, None)
+        self.accessed.pop(session_id, None)
+        self._views.pop(session_id, None)
+        self._retired.pop(session_id, None)
+
+    def sessions(self) -> List[str]:
+        return list(self.clocks)
+
+    def views(self, session_id: str) -> Dict[str, Tuple[float, Dict[str, int]]]:
+        return dict(self._views.get(session_id, {}))
+
+    def retired(self, session_id: str) -> Dict[str, int]:
+        return {
+            node_id: value
+            for node_id, (value, _) in self._retired.get(session_id, {}).items()
+        }
+
+    def retire(self, session_id: str, entries: Dict[str, int]) -> int:
+        with self._lock:
+            clock = self.clocks.get(session_id)
+            if clock is None:
+                return 0
+            now = self.time_func()
+            views = self._views.get(session_id, {})
+            retired = self._retired.setdefault(session_id, {})
+            moved = 0
+            for node_id, value in entries.items():
+                if clock.get(node_id) == value:
+                    del clock[node_id]
+                    retired[node_id] = (value, now)
+                    views.pop(node_id, None)
+                    moved += 1
+            return moved
+
+    def expire_retired(self, session_id: str, max_age: float) -> int:
+        with self._lock:
+            retired = self._retired.get(session_id, {})
+            cutoff = self.time_func() - max_age
+            expired = [node_id for node_id, (_, at) in retired.items() if at < cutoff]
+            for node_id in expired:
+                del retired[node_id]
+            return len(expired)
+
+    def evict_idle(self, max_idle: float) -> List[str]:
+        with self._lock:
+            cutoff = self.time_func() - max_idle
+            evicted = [
+                session_id for session_id, accessed in self.accessed.items()
+                if accessed < cutoff
+            ]
+            for session_id in evicted:
+                self._drop(session_id)
+            return evicted
+
+
+# Ключи скриптов: clock, views, retired, реестр сессий (sorted set по времени записи).
+# Значение retired хранится как "значение:время выбывания".
+# Атомарный инкремент: продолжение счёта выбывшего узла, HINCRBY, view узла
+# и чтение результата за один round trip. View хранится строкой
+# "время\nузел\nзначение\n...", так как cjson доступен не во всех окружениях.
+_INCREMENT_SCRIPT = """
+local base = redis.call('HGET', KEYS[3], ARGV[1])
+if base then
+    redis.call('HSETNX', KEYS[1], ARGV[1], string.match(base, '^[^:]+'))
+    redis.call('HDEL', KEYS[3], ARGV[1])
+end
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+local clock = redis.call('HGETALL', KEYS[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2] .. '\\n' .. table.concat(clock, '\\n'))
+redis.call('ZADD', KEYS[4], ARGV[2], ARGV[3])
+return clock
+""".strip()
+
+# Атомарное объединение: максимум по каждому узлу на стороне сервера; узлы,
+# чьи записи увеличились, получают входящий clock как view
+_MERGE_SCRIPT = """
+local view = nil
+for i = 3, #ARGV, 2 do
+    local timestamp = tonumber(ARGV[i + 1])
+    local floor = redis.call('HGET', KEYS[3], ARGV[i])
+    if floor then
+        floor = tonumber(string.match(floor, '^[^:]+'))
+    end
+    if not floor or timestamp > floor then
+        if floor then
+            redis.call('HDEL', KEYS[3], ARGV[i])
+        end
+        local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]))
+        if not current or current < timestamp then
+            redis.call('HSET', KEYS[1], ARGV[i], timestamp)
+            view = view or ARGV[1] .. '\\n' .. table.concat(ARGV, '\\n', 3)
+            redis.call('HSET', KEYS[2], ARGV[i], view)
+        end
+    end
+end
+redis.call('ZADD', KEYS[4], ARGV[1], ARGV[2])
+return redis.call('HGETALL', KEYS[1])
+""".strip()
+
+# Перенос записей в retired, только если значение не изменилось
+_RETIRE_SCRIPT = """
+local moved = 0
+for i = 2, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        redis.call('HDEL', KEYS[2], ARGV[i])
+        redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 1] .. ':' .. ARGV[1])
+        moved = moved + 1
+    end
+end
+return moved
+""".strip()
+
+# Вытеснение сессии, если в неё не писали после cutoff
+_EVICT_SCRIPT = """
+local accessed = tonumber(redis.call('ZSCORE', KEYS[4], ARGV[1]))
+if accessed and accessed >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+redis.call('ZREM', KEYS[4], ARGV[1])
+return 1
+""".strip()
+
+
+class RedisClockStore(ClockStore):
+    """
+    Clocks в Redis: один hash на сессию (узел -> счётчик).
+
+    Инкремент и объединение выполняются Lua-скриптами, поэтому они атомарны
+    между всеми worker'ами и занимают один round trip.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        prefix: str = "labeling_system:clock:",
+        time_func: Callable[[], float] = time.time
+    ):
+        super().__init__(time_func)
+        self.redis = redis_client
+        self.prefix = prefix
+        self.registry_key = f"{prefix}sessions"
+        self._increment = self.redis.register_script(_INCREMENT_SCRIPT)
+        self._merge = self.redis.register_script(_MERGE_SCRIPT)
+        self._retire = self.redis.register_script(_RETIRE_SCRIPT)
+        self._evict = self.redis.register_script(_EVICT_SCRIPT)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    def _keys(self, session_id: str) -> List[str]:
+        """Все ключи сессии в порядке, который ожидают скрипты"""
+        return [
+            self._key(session_id),
+            f"{self.prefix}views:{session_id}",
+            f"{self.prefix}retired:{session_id}",
+            self.registry_key
+        ]
+
+    @staticmethod
+    def _parse_flat(values: List[Any]) -> Dict[str, int]:
+        """Ответ HGETALL из Lua приходит плоским списком [узел, значение, ...]"""
+        return {
+            _to_str(values[i]): int(values[i + 1])
+            for i in range(0, len(values), 2)
+        }
+
+    def get(self, session_id: str) -> Dict[str, int]:
+        raw = self.redis.hgetall(self._key(session_id))
+        return {_to_str(node_id): int(value) for node_id, value in raw.items()}
+
+    def set(self, session_id: str, clock: Dict[str, int]) -> Dict[str, int]:
+        keys = self._keys(session_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(*keys[:3])
+        if clock:
+            pipe.hset(keys[0], mapping=clock)
+        pipe.zadd(self.registry_key, {session_id: self.time_func()})
+        pipe.execute()
+        return dict(clock)
+
+    def increment(self, session_id: str, node_id: str) -> Dict[str, int]:
+        return self._parse_flat(self._increment(
+            keys=self._keys(session_id),
+            args=[node_id, self.time_func(), session_id]
+        ))
+
+    def merge(self, session_id: str, other_clock: Dict[str, int]) -> Dict[str, int]:
+        args = [self.time_func(), session_id]
+        for node_id, timestamp in other_clock.items():
+            args.extend((node_id, int(timestamp)))
+        return self._parse_flat(self._merge(keys=self._keys(session_id), args=args))
+
+    def delete(self, session_id: str):
+        keys = self._keys(session_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(*keys[:3])
+        pipe.zrem(self.registry_key, session_id)
+        pipe.execute()
+
+    def sessions(self) -> List[str]:
+        return [_to_str(session_id) for session_id in self.redis.zrange(self.registry_key, 0, -1)]
+
+    def views(self, session_id: str) -> Dict[str, Tuple[float, Dict[str, int]]]:
+        raw = self.redis.hgetall(self._keys(session_id)[1])
+        views = {}
+        for node_id, value in raw.items():
+            parts = _to_str(value).split("\n")
+            views[_to_str(node_id)] = (float(parts[0]), self._parse_flat(parts[1:]))
+        return views
+
+    def _retired_entries(self, session_id: str) -> Dict[str, Tuple[int, float]]:
+        raw = self.redis.hgetall(self._keys(session_id)[2])
+        entries = {}
+        for node_id, value in raw.items():
+            number, retired_at = _to_str(value).split(":")
+            entries[_to_str(node_id)] = (int(number), float(retired_at))
+        return entries
+
+    def retired(self, session_id: str) -> Dict[str, int]:
+        return {
+            node_id: value
+            for node_id, (value, _) in self._retired_entries(session_id).items()
+        }
+
+    def retire(self, session_id: str, entries: Dict[str, int]) -> int:
+        if not entries:
+            return 0
+        args = [self.time_func()]
+        for node_id, value in entries.items():
+            args.extend((node_id, int(value)))
+        return int(self._retire(keys=self._keys(session_id)[:3], args=args))
+
+    def expire_retired(self, session_id: str, max_age: float) -> int:
+        cutoff = self.time_func() - max_age
+        expired = [
+            node_id for node_id, (_, retired_at) in self._retired_entries(session_id).items()
+            if retired_at < cutoff
+        ]
+        if expired:
+            self.redis.hdel(self._keys(session_id)[2], *expired)
+        return len(expired)
+
+    def evict_idle(self, max_idle: float) -> List[str]:
+        cutoff = self.time_func() - max_idle
+        candidates = [
+            _to_str(session_id)
+            for session_id in self.redis.zrangebyscore(self.registry_key, "-inf", f"({cutoff}")
+        ]
+        if not candidates:
+            return []
+
+        pipe = self.redis.pipeline(transaction=False)
+        for session_id in candidates:
+            self._evict(keys=self._keys(session_id), args=[session_id, cutoff], client=pipe)
+        results = pipe.execute()
+        return [session_id for session_id, evicted in zip(candidates, results) if evicted]
+
+    def load_scripts(self):
+        """Заранее загрузить Lua-скрипты в кэш скриптов сервера"""
+        for script in (_INCREMENT_SCRIPT, _MERGE_SCRIPT, _RETIRE_SCRIPT, _EVICT_SCRIPT):
+            self.redis.script_load(script)
+
+    def start(self):
+        try:
+            self.load_scripts()
+        except Exception as e:
+            logger.error(f"Failed to load vector clock scripts: {e}")
+
+
+class WriteBehindClockStore(ClockStore):
+    """
+    Обёртка, асинхронно сохраняющая изменённые clocks в таблицу vector_clocks.
+
+    Операции выполняются над основным хранилищем, а идентификаторы изменённых
+    сессий накапливаются и раз в flush_interval секунд записываются в БД одной
+    транзакцией. Clock сессии, отсутствующей в основном хранилище (например,
+    после перезапуска in-memory хранилища), один раз подгружается из БД.
+    """
+
+    def __init__(
+        self,
+        primary: ClockStore,
+        session_factory: Callable,
+        model,
+        flush_interval: float = 5.0
+    ):
+        super().__init__(primary.time_func)
+        self.primary = primary
+        self.session_factory = session_factory
+        self.model = model
+        self.flush_interval = flush_interval
+        self._dirty = set()
+        self._hydrated = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def clocks(self) -> Dict[str, Dict[str, int]]:
+        return getattr(self.primary, "clocks", {})
+
+    def _mark_dirty(self, session_id: str):
+        with self._lock:
+            self._dirty.add(session_id)
+
+    def _hydrate(self, session_id: str):
+        """Подгрузить clock из БД, если основное хранилище о сессии не знает"""
+        if session_id in self._hydrated:
+            return
+        self._hydrated.add(session_id)
+
+        try:
+            db = self.session_factory()
+            try:
+                row = db.query(self.model).filter(
+                    self.model.session_id == session_id
+                ).order_by(self.model.last_updated.desc()).first()
+            finally:
+                db.close()
+        except Exception as e:
+            logger.error(f"Failed to load vector clock for session {session_id}: {e}")
+            return
+
+        if row and row.clock_data:
+            self.primary.merge(session_id, row.clock_data)
+
+    def get(self, session_id: str) -> Dict[str, int]:
+        clock = self.primary.get(session_id)
+        if not clock and session_id not in self._hydrated:
+            self._hydrate(session_id)
+            clock = self.primary.get(session_id)
+        return clock
+
+    def set(self, session_id: str, clock: Dict[str, int]) -> Dict[str, int]:
+        self._hydrated.add(session_id)
+        result = self.primary.set(session_id, clock)
+        self._mark_dirty(session_id)
+        return result
+
+    def increment(self, session_id: str, node_id: str) -> Dict[str, int]:
+        self._hydrate(session_id)
+        result = self.primary.increment(session_id, node_id)
+        self._mark_dirty(session_id)
+        return result
+
+    def merge(self, session_id: str, other_clock: Dict[str, int]) -> Dict[str, int]:
+        self._hydrate(session_id)
+        result = self.primary.merge(session_id, other_clock)
+        self._mark_dirty(session_id)
+        return result
+
+    def delete(self, session_id: str):
+        self.primary.delete(session_id)
+        with self._lock:
+            self._dirty.discard(session_id)
+        self._hydrated.discard(session_id)
+
+    def sessions(self) -> List[str]:
+        return self.primary.sessions()
+
+    def views(self, session_id: str) -> Dict[str, Tuple[float, Dict[str, int]]]:
+        return self.primary.views(session_id)
+
+    def retired(self, session_id: str) -> Dict[str, int]:
+        return self.primary.retired(session_id)
+
+    def retire(self, session_id: str, entries: Dict[str, int]) -> int:
+        moved = self.primary.retire(session_id, entries)
+        if moved:
+            self._mark_dirty(session_id)
+        return moved
+
+    def expire_retired(self, session_id: str, max_age: float) -> int:
+        return self.primary.expire_retired(session_id, max_age)
+
+    def evict_idle(self, max_idle: float) -> List[str]:
+        # Вытесняемые clocks должны остаться в БД
+        self.flush()
+        evicted = self.primary.evict_idle(max_idle)
+        # Отметки остаются только у сессий основного хранилища: вытесненные и
+        # прочитанные, но не записанные сессии при обращении подгрузятся заново
+        self._hydrated.intersection_update(self.primary.sessions())
+        return evicted
+
+    def flush(self) -> int:
+        """Записать изменённые clocks в БД; возвращает число сохранённых сессий"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+
+        try:
+            db = self.session_factory()
+            try:
+                existing = {
+                    row.session_id: row
+                    for row in db.query(self.model).filter(
+                        self.model.session_id.in_(dirty)
+                    ).all()
+                }
+                for session_id in dirty:
+                    clock = compact_clock(self.primary.get(session_id))
+                    if session_id in existing:
+                        existing[session_id].clock_data = clock
+                    else:
+                        db.add(self.model(session_id=session_id, clock_data=clock))
+                db.commit()
+            finally:
+                db.close()
+        except Exception as e:
+            logger.error(f"Failed to flush vector clocks: {e}")
+            # Повторим при следующем сбросе
+            with self._lock:
+                self._dirty |= dirty
+            return 0
+
+        return len(dirty)
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        self.primary.start()
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="vector-clock-write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        self.primary.stop()
+
+
+def compact_clock(clock: Dict[str, int], retired: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """
+    Убрать записи, не влияющие на сравнение clocks.
+
+    Нулевая запись эквивалентна отсутствующей, запись выбывшего узла не больше
+    retired известна всем живым узлам.
+    """
+    retired = retired or {}
+    return {
+        node_id: value for node_id, value in clock.items()
+        if value and value > retired.get(node_id, 0)
+    }
+
+
+def clock_size(clock: Dict[str, int]) -> int:
+    """Размер clock в компактном JSON (как он хранится в БД), байт"""
+    return len(json.dumps(clock, separators=(",", ":")).encode())
+
+
+def _to_str(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
@@ -20,7 +20,33 @@ class Settings(BaseSettings):
     
     # Vector clock settings
     max_clock_size: int = 1000
-    clock_cleanup_interval: int = 3600  # seconds
+    clock_cleanup_interval: int = 3600  # seconds, период сборки мусора clocks
+    vector_clock_ttl: int = 24 * 3600  # seconds без записей до вытеснения сессии
+    vector_clock_node_ttl: int = 3600  # seconds без записей узла до выбывания
+    consistency_max_issues: int = 1000  # максимум concurrent пар в отчёте
+    vector_clock_store: str = "memory"  # memory | redis (общий для всех worker'ов)
+    vector_clock_write_behind: bool = False  # сохранять clocks в таблицу vector_clocks
+    vector_clock_flush_interval: float = 5.0  # seconds
+    conflict_index_store: str = "memory"  # memory (свой у каждого worker'а) | redis, индекс конфликтов меток
+    conflict_index_max_sessions: int = 1000  # сессий в in-memory индексе конфликтов worker'а
+    conflict_resolution_chunk_size: int = 10_000  # data_id на транзакцию разрешения конфликтов
+    consistency_check_interval: float = 60.0  # seconds между проверками изменённых сессий
+    consistency_workers: int = 4  # shard'ов, проверяемых параллельно
+    consistency_shard_size: int = 100  # сессий в shard'е
+    consistency_replica_qps: float = 50.0  # бюджет запросов проверки на реплику, 0 - без ограничения
+    consistency_dirty_store: str = "memory"  # memory | redis, множество изменённых сессий
+    
+    # Event stream settings (SSE)
+    event_stream_store: str = "memory"  # memory | redis (pub/sub + Streams, общий для worker'ов)
+    event_stream_history: int = 10_000  # событий сессии для возобновления по Last-Event-ID
+    event_stream_ttl: int = 24 * 3600  # seconds хранения истории сессии без публикаций
+    event_stream_queue_size: int = 256  # публикаций в очереди клиента до его отключения
+    event_stream_heartbeat: float = 15.0  # seconds между keepalive-комментариями
+    
+    # Metrics settings
+    metrics_flush_interval: float = 1.0  # seconds между сбросами буфера метрик в Redis
+    metrics_histogram_slot: int = 60  # seconds, шаг скользящего окна гистограмм
+    metrics_histogram_retention: int = 24 * 3600  # seconds хранения слотов гистограмм
     
     # Session settings
     session_timeout: int = 3600  # seconds
@@ -30,10 +56,18 @@ class Settings(BaseSettings):
     max_file_size: int = 100 * 1024 * 1024  # 100MB
     allowed_file_types: List[str] = [".csv", ".txt"]
     upload_dir: str = "/app/data"
+    upload_chunk_size: int = 1024 * 1024  # размер куска при потоковой загрузке
+    csv_index_stride: int = 1000  # строк между опорными смещениями в индексе
+    storage_format: str = "csv"  # csv | arrow (колоночная копия в Arrow IPC)
+    arrow_block_size: int = 4 * 1024 * 1024  # байт CSV на один record batch
     
     # Replica settings
     replica_read_timeout: float = 5.0
-    replica_health_check_interval: int = 30
+    replica_health_check_interval: int = 30  # seconds между фоновыми пробами реплик
+    replica_routing_strategy: str = "power_of_two"  # power_of_two | least_latency
+    replica_latency_alpha: float = 0.3  # вес нового замера в EWMA задержки
+    replica_max_staleness: float = 5.0  # seconds отставания, допустимые для чтения
+    session_token_cache_size: int = 100_000  # сессий с запомненным high-water mark
     
     class Config:
         env_file = ".env"
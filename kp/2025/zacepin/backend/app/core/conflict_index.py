@@ -0,0 +1,317 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import redis
+
+from app.core.config import settings
+from app.core.database import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Запись индекса: (data_id, id записи, метка)
+Entry = Tuple[str, int, str]
+
+
+class ConflictIndex(ABC):
+    """
+    Инкрементальный индекс конфликтов меток.
+
+    Для каждой сессии хранится data_id -> {id записи: метка} и множество
+    data_id, у которых больше одной различной метки. Индекс обновляется при
+    записи разметок, поэтому список конфликтов сессии строится за
+    O(конфликтов), а не полным чтением её разметок.
+
+    Сессии, индекс которых ещё не построен (например, после перезапуска
+    in-memory индекса), заполняются один раз через rebuild().
+    """
+
+    @abstractmethod
+    def record(self, session_id: str, entries: Iterable[Entry]):
+        """Добавить или обновить метки записей"""
+
+    @abstractmethod
+    def discard(self, session_id: str, entries: Iterable[Tuple[str, int]]):
+        """Убрать удалённые записи (data_id, id записи)"""
+
+    @abstractmethod
+    def conflicts(self, session_id: str) -> List[Dict[str, Any]]:
+        """Конфликты меток сессии в формате отчёта о согласованности"""
+
+    @abstractmethod
+    def conflict_counts(self) -> Dict[str, int]:
+        """Число конфликтующих data_id по сессиям (только сессии с конфликтами)"""
+
+    @abstractmethod
+    def is_indexed(self, session_id: str) -> bool:
+        """Построен ли индекс сессии"""
+
+    @abstractmethod
+    def mark_indexed(self, session_id: str):
+        """Отметить индекс сессии построенным"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Удалить индекс сессии"""
+
+    def rebuild(self, session_id: str, entries: Iterable[Entry]):
+        """
+        Заполнить индекс сессии записями из БД.
+
+        Записи добавляются поверх текущего состояния: изменения, проиндексированные
+        параллельно с чтением из БД, не теряются.
+        """
+        self.record(session_id, entries)
+        self.mark_indexed(session_id)
+
+    @staticmethod
+    def _conflict(data_id: str, records: Dict[Any, str]) -> Dict[str, Any]:
+        return {
+            "type": "label_conflict",
+            "data_id": data_id,
+            "conflicting_labels": sorted(set(records.values())),
+            "records": sorted(int(record_id) for record_id in records)
+        }
+
+
+class InMemoryConflictIndex(ConflictIndex):
+    """
+    Индекс в памяти процесса.
+
+    Индекс свой у каждого worker'а (для нескольких worker'ов нужен
+    RedisConflictIndex) и хранит метки всех затронутых сессий, поэтому его
+    размер ограничен: хранится не больше max_sessions последних сессий, а
+    сессии без обращений дольше ttl секунд вытесняются. Вытеснение
+    проверяется при обращениях к индексу; вытесненная сессия перестаёт
+    считаться проиндексированной и при следующем обращении строится из БД.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl: float = 24 * 3600,
+        time_func: Callable[[], float] = time.time
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.time_func = time_func
+        self.labels: Dict[str, Dict[str, Dict[int, str]]] = defaultdict(lambda: defaultdict(dict))
+        self.conflicting: Dict[str, set] = defaultdict(set)
+        self.indexed = set()
+        # сессия -> время последнего обращения, от давних к недавним
+        self.accessed: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, session_id: str):
+        """Отметить обращение к сессии и вытеснить лишние и неактивные сессии"""
+        now = self.time_func()
+        self.accessed[session_id] = now
+        self.accessed.move_to_end(session_id)
+        cutoff = now - self.ttl
+        while len(self.accessed) > 1:
+            oldest, accessed = next(iter(self.accessed.items()))
+            if len(self.accessed) <= self.max_sessions and accessed >= cutoff:
+                break
+            self._drop(oldest)
+
+    def _drop(self, session_id: str):
+        self.labels.pop(session_id, None)
+        self.conflicting.pop(session_id, None)
+        self.indexed.discard(session_id)
+        self.accessed.pop(session_id, None)
+
+    def _refresh(self, session_id: str, data_id: str):
+        records = self.labels[session_id].get(data_id)
+        if records and len(set(records.values())) > 1:
+            self.conflicting[session_id].add(data_id)
+        else:
+            self.conflicting[session_id].discard(data_id)
+            if not records:
+                self.labels[session_id].pop(data_id, None)
+        if not self.conflicting[session_id]:
+            del self.conflicting[session_id]
+
+    def record(self, session_id: str, entries: Iterable[Entry]):
+        with self._lock:
+            self._touch(session_id)
+            for data_id, record_id, label in entries:
+                self.labels[session_id][data_id][record_id] = label
+                self._refresh(session_id, data_id)
+
+    def discard(self, session_id: str, entries: Iterable[Tuple[str, int]]):
+        with self._lock:
+            self._touch(session_id)
+            for data_id, record_id in entries:
+                self.labels[session_id].get(data_id, {}).pop(record_id, None)
+                self._refresh(session_id, data_id)
+
+    def conflicts(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._touch(session_id)
+            return [
+                self._conflict(data_id, dict(self.labels[session_id][data_id]))
+                for data_id in sorted(self.conflicting.get(session_id, ()))
+            ]
+
+    def conflict_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {session_id: len(data_ids) for session_id, data_ids in self.conflicting.items()}
+
+    def is_indexed(self, session_id: str) -> bool:
+        return session_id in self.indexed
+
+    def mark_indexed(self, session_id: str):
+        with self._lock:
+            self._touch(session_id)
+            self.indexed.add(session_id)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+
+# KEYS: метки data_id, конфликтующие data_id сессии, все data_id сессии, счётчики сессий
+# ARGV: сессия, data_id, затем пары (id записи, метка); пустая метка - удаление записи
+_UPDATE_SCRIPT = """
+for i = 3, #ARGV, 2 do
+    if ARGV[i + 1] == '' then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    else
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+local distinct, n = {}, 0
+for _, label in ipairs(redis.call('HVALS', KEYS[1])) do
+    if not distinct[label] then
+        distinct[label] = true
+        n = n + 1
+    end
+end
+if n > 1 then
+    redis.call('SADD', KEYS[2], ARGV[2])
+else
+    redis.call('SREM', KEYS[2], ARGV[2])
+end
+if n > 0 then
+    redis.call('SADD', KEYS[3], ARGV[2])
+else
+    redis.call('SREM', KEYS[3], ARGV[2])
+end
+local count = redis.call('SCARD', KEYS[2])
+if count > 0 then
+    redis.call('HSET', KEYS[4], ARGV[1], count)
+else
+    redis.call('HDEL', KEYS[4], ARGV[1])
+end
+return n
+""".strip()
+
+
+class RedisConflictIndex(ConflictIndex):
+    """
+    Индекс в Redis, общий для всех worker'ов: hash меток на data_id и set
+    конфликтующих data_id на сессию.
+
+    Изменения одного data_id применяются Lua-скриптом атомарно, изменения
+    пакета отправляются одним pipeline.
+    """
+
+    def __init__(self, redis_client: redis.Redis, prefix: str = "labeling_system:conflicts:"):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.counts_key = f"{prefix}counts"
+        self.indexed_key = f"{prefix}indexed"
+        self._update = self.redis.register_script(_UPDATE_SCRIPT)
+
+    def _labels_key(self, session_id: str, data_id: str) -> str:
+        return f"{self.prefix}{session_id}:labels:{data_id}"
+
+    def _conflicting_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}:conflicting"
+
+    def _data_ids_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}:data_ids"
+
+    def _apply(self, session_id: str, changes: Dict[str, List[Any]]):
+        """Применить изменения {data_id: [id записи, метка, ...]} одним pipeline"""
+        if not changes:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for data_id, args in changes.items():
+            self._update(
+                keys=[
+                    self._labels_key(session_id, data_id),
+                    self._conflicting_key(session_id),
+                    self._data_ids_key(session_id),
+                    self.counts_key
+                ],
+                args=[session_id, data_id, *args],
+                client=pipe
+            )
+        pipe.execute()
+
+    def record(self, session_id: str, entries: Iterable[Entry]):
+        changes = defaultdict(list)
+        for data_id, record_id, label in entries:
+            changes[data_id].extend((record_id, label))
+        self._apply(session_id, changes)
+
+    def discard(self, session_id: str, entries: Iterable[Tuple[str, int]]):
+        changes = defaultdict(list)
+        for data_id, record_id in entries:
+            changes[data_id].extend((record_id, ""))
+        self._apply(session_id, changes)
+
+    def conflicts(self, session_id: str) -> List[Dict[str, Any]]:
+        data_ids = sorted(_to_str(data_id) for data_id in self.redis.smembers(self._conflicting_key(session_id)))
+        pipe = self.redis.pipeline(transaction=False)
+        for data_id in data_ids:
+            pipe.hgetall(self._labels_key(session_id, data_id))
+        return [
+            self._conflict(data_id, {_to_str(k): _to_str(v) for k, v in records.items()})
+            for data_id, records in zip(data_ids, pipe.execute())
+            if records
+        ]
+
+    def conflict_counts(self) -> Dict[str, int]:
+        return {
+            _to_str(session_id): int(count)
+            for session_id, count in self.redis.hgetall(self.counts_key).items()
+        }
+
+    def is_indexed(self, session_id: str) -> bool:
+        return bool(self.redis.sismember(self.indexed_key, session_id))
+
+    def mark_indexed(self, session_id: str):
+        self.redis.sadd(self.indexed_key, session_id)
+
+    def delete(self, session_id: str):
+        data_ids = [_to_str(data_id) for data_id in self.redis.smembers(self._data_ids_key(session_id))]
+        pipe = self.redis.pipeline(transaction=True)
+        for data_id in data_ids:
+            pipe.delete(self._labels_key(session_id, data_id))
+        pipe.delete(self._conflicting_key(session_id), self._data_ids_key(session_id))
+        pipe.hdel(self.counts_key, session_id)
+        pipe.srem(self.indexed_key, session_id)
+        pipe.execute()
+
+
+def create_conflict_index() -> ConflictIndex:
+    """Создать индекс конфликтов по настройкам"""
+    if settings.conflict_index_store == "redis":
+        return RedisConflictIndex(get_redis())
+    return InMemoryConflictIndex(
+        max_sessions=settings.conflict_index_max_sessions,
+        ttl=settings.vector_clock_ttl
+    )
+
+
+def _to_str(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+# Глобальный индекс конфликтов
+conflict_index = create_conflict_index()
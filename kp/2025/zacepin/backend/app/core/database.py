@@ -1,27 +1,57 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, MetaData, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 import redis
-from typing import Generator, Dict, Any
+from collections import OrderedDict
+from fastapi import HTTPException, Request, status
+from typing import AsyncGenerator, Dict, Any, Optional, Tuple
 import asyncio
+import json
 import logging
+import time
 
 from app.core.config import settings
+from app.core.replica_router import REPLICATION_LAG_QUERIES, REPLICATION_POSITION_QUERIES, ReplicaRouter
 
 logger = logging.getLogger(__name__)
 
 # Создание базового класса для моделей
 Base = declarative_base()
 
-# Создание движков для разных реплик
+
+def compact_json(value: Any) -> str:
+    """JSON колонок без пробелов между элементами (vector clocks занимают меньше места)"""
+    return json.dumps(value, separators=(",", ":"))
+
+
+# Асинхронные драйверы для синхронных URL из настроек
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_db_url(url: str) -> str:
+    """URL той же БД для асинхронного драйвера (asyncpg, aiosqlite)"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+# Синхронные движки: фоновые потоки (write-behind, мониторинг) и сервисы
+
 master_engine = create_engine(
     settings.master_db_url,
     poolclass=QueuePool,
     pool_size=10,
     max_overflow=20,
     pool_pre_ping=True,
-    echo=settings.debug
+    echo=settings.debug,
+    json_serializer=compact_json
 )
 
 replica1_engine = create_engine(
@@ -47,91 +77,344 @@ MasterSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=master
 Replica1SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica1_engine)
 Replica2SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica2_engine)
 
+# Асинхронные движки для эндпоинтов: запросы не блокируют event loop
+master_async_engine = create_async_engine(
+    async_db_url(settings.master_db_url),
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+    echo=settings.debug,
+    json_serializer=compact_json
+)
+
+replica1_async_engine = create_async_engine(
+    async_db_url(settings.replica1_db_url),
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=5,
+    max_overflow=10,
+    pool_pre_ping=True,
+    echo=settings.debug
+)
+
+replica2_async_engine = create_async_engine(
+    async_db_url(settings.replica2_db_url),
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=5,
+    max_overflow=10,
+    pool_pre_ping=True,
+    echo=settings.debug
+)
+
+# expire_on_commit=False: после commit атрибуты читаются без ленивой загрузки
+MasterAsyncSessionLocal = async_sessionmaker(
+    bind=master_async_engine, autoflush=False, expire_on_commit=False
+)
+Replica1AsyncSessionLocal = async_sessionmaker(
+    bind=replica1_async_engine, autoflush=False, expire_on_commit=False
+)
+Replica2AsyncSessionLocal = async_sessionmaker(
+    bind=replica2_async_engine, autoflush=False, expire_on_commit=False
+)
+
+# Заголовок с high-water mark записей сессии (read-your-writes)
+SESSION_TOKEN_HEADER = "X-Session-Token"
+
 # Redis клиент
 redis_client = redis.from_url(settings.redis_url, decode_responses=True)
 
 class DatabaseManager:
     """Менеджер для работы с множественными репликами БД"""
     
-    def __init__(self):
-        self.replicas = {
+    def __init__(self, replicas: Dict = None, async_replicas: Dict = None, router: ReplicaRouter = None):
+        self.replicas = replicas or {
             'master': MasterSessionLocal,
             'replica1': Replica1SessionLocal,
             'replica2': Replica2SessionLocal
         }
-        self.current_replica = 'master'
-        self.replica_health = {
-            'master': True,
-            'replica1': True,
-            'replica2': True
+        self.async_replicas = async_replicas or {
+            'master': MasterAsyncSessionLocal,
+            'replica1': Replica1AsyncSessionLocal,
+            'replica2': Replica2AsyncSessionLocal
         }
+        self.current_replica = 'master'
+        self.replica_health = {replica: True for replica in self.replicas}
+        self.router = router or ReplicaRouter(
+            self.replicas.keys(),
+            strategy=settings.replica_routing_strategy,
+            alpha=settings.replica_latency_alpha
+        )
+        self.lag_queries = dict(REPLICATION_LAG_QUERIES)
+        self.position_queries = dict(REPLICATION_POSITION_QUERIES)
+        # High-water mark записей по session_id, старые сессии вытесняются
+        self.session_positions: OrderedDict[str, int] = OrderedDict()
+        self._local_version = 0
+        self._probe_task: Optional[asyncio.Task] = None
     
     def get_write_session(self) -> Session:
         """Получить сессию для записи (только master)"""
         return self.replicas['master']()
     
-    def get_read_session(self, replica: str = None) -> Session:
-        """Получить сессию для чтения с балансировкой нагрузки"""
+    def _choose_replica(self, replica: str = None, max_staleness: float = None, min_position: int = None):
+        """Реплика и причина выбора: явно запрошенная или выбранная роутером"""
         if replica and replica in self.replicas:
-            return self.replicas[replica]()
-        
-        # Выбор здоровой реплики для чтения
+            return replica, "requested"
+        if max_staleness is None:
+            max_staleness = settings.replica_max_staleness
         healthy_replicas = [r for r, healthy in self.replica_health.items() if healthy]
-        if not healthy_replicas:
-            # Если все реплики недоступны, используем master
-            return self.replicas['master']()
+        return self.router.choose(healthy_replicas, max_staleness, min_position)
+    
+    def select_read_replica(self, replica: str = None, max_staleness: float = None, min_position: int = None) -> str:
+        """Выбрать реплику для чтения по задержке и отставанию репликации"""
+        selected, reason = self._choose_replica(replica, max_staleness, min_position)
+        # Метрики решений публикуются пачкой вместе с результатами проб
+        self.router.record(selected, reason)
+        return selected
+    
+    def get_read_session(self, replica: str = None, max_staleness: float = None) -> Session:
+        """Получить сессию для чтения с балансировкой нагрузки"""
+        return self.replicas[self.select_read_replica(replica, max_staleness)]()
+    
+    def get_consistent_read_session_sync(self, min_position: int = None) -> Tuple[str, Session]:
+        """
+        Синхронная сессия чтения, видящая записи до min_position, и её узел.
+        
+        Аналог get_consistent_read_session для фоновых потоков: позиция
+        реплики, не догнавшей min_position по данным проб, проверяется
+        запросом, не догнавшая реплика заменяется на master.
+        """
+        selected = self.select_read_replica(min_position=min_position)
+        session = self.replicas[selected]()
+        if self.router.caught_up(selected, min_position):
+            return selected, session
+        
+        query = self.position_queries.get(session.bind.dialect.name)
+        try:
+            position = None if query is None else session.scalar(text(query))
+        except Exception as e:
+            logger.warning(f"Replica {selected} position check failed: {e}")
+            position = None
+        position = None if position is None else int(position)
         
-        # Простая round-robin балансировка
-        selected_replica = healthy_replicas[self.current_replica_index % len(healthy_replicas)]
-        self.current_replica_index = (self.current_replica_index + 1) % len(healthy_replicas)
+        self.router.observe_position(selected, position)
+        if position is not None and position >= min_position:
+            return selected, session
         
-        return self.replicas[selected_replica]()
+        session.close()
+        self.router.record(self.router.primary, "read_your_writes")
+        return self.router.primary, self.replicas[self.router.primary]()
     
-    def check_replica_health(self, replica: str) -> bool:
-        """Проверить здоровье реплики"""
+    def get_async_write_session(self) -> AsyncSession:
+        """Получить асинхронную сессию для записи (только master)"""
+        return self.async_replicas['master']()
+    
+    def get_async_read_session(self, replica: str = None, max_staleness: float = None) -> AsyncSession:
+        """Получить асинхронную сессию для чтения с балансировкой нагрузки"""
+        return self.async_replicas[self.select_read_replica(replica, max_staleness)]()
+    
+    async def get_consistent_read_session(
+        self,
+        replica: str = None,
+        max_staleness: float = None,
+        min_position: int = None
+    ) -> AsyncSession:
+        """
+        Асинхронная сессия чтения, видящая записи сессии до min_position.
+        
+        Если по данным проб выбранная реплика отстаёт, её позиция проверяется
+        запросом в той же сессии; не догнавшая реплика заменяется на master.
+        """
+        selected, reason = self._choose_replica(replica, max_staleness, min_position)
+        session = self.async_replicas[selected]()
+        if reason == "requested" or self.router.caught_up(selected, min_position):
+            self.router.record(selected, reason)
+            return session
+        
         try:
-            session = self.replicas[replica]()
-            session.execute("SELECT 1")
-            session.close()
+            position = await asyncio.wait_for(
+                self._replication_position(session),
+                timeout=settings.replica_read_timeout
+            )
+        except Exception as e:
+            logger.warning(f"Replica {selected} position check failed: {e}")
+            position = None
+        
+        self.router.observe_position(selected, position)
+        if position is not None and position >= min_position:
+            self.router.record(selected, "caught_up")
+            return session
+        
+        await session.close()
+        self.router.record(self.router.primary, "read_your_writes")
+        return self.async_replicas[self.router.primary]()
+    
+    async def _replication_position(self, session: AsyncSession) -> Optional[int]:
+        """Позиция репликации узла или None, если диалект её не сообщает"""
+        query = self.position_queries.get(session.bind.dialect.name)
+        if query is None:
+            return None
+        position = await session.scalar(text(query))
+        return None if position is None else int(position)
+    
+    async def mark_write(self, db: AsyncSession, session_id: str) -> int:
+        """
+        Запомнить high-water mark записи сессии после commit на master.
+        
+        Для PostgreSQL это LSN master; для БД без позиции журнала -
+        монотонная версия процесса, которую не догоняет ни одна реплика,
+        поэтому чтения такой сессии идут с master.
+        """
+        position = await self._replication_position(db)
+        if position is None:
+            self._local_version += 1
+            position = self._local_version
+        return self.advance_session_position(session_id, position)
+    
+    def advance_session_position(self, session_id: str, position: int) -> int:
+        """Поднять high-water mark сессии до position"""
+        position = max(position, self.session_positions.pop(session_id, 0))
+        self.session_positions[session_id] = position
+        while len(self.session_positions) > settings.session_token_cache_size:
+            self.session_positions.popitem(last=False)
+        return position
+    
+    def session_position(self, session_id: str = None, token: str = None) -> Optional[int]:
+        """High-water mark чтения: максимум из известного и переданного клиентом"""
+        positions = [self.session_positions.get(session_id, 0)] if session_id else []
+        if token:
+            positions.append(int(token))
+        return max(positions, default=0) or None
+    
+    async def _replication_lag(self, session: AsyncSession, replica: str) -> float:
+        """Отставание реплики в секундах (0 для диалектов без запроса отставания)"""
+        query = self.lag_queries.get(session.bind.dialect.name)
+        if replica == self.router.primary or query is None:
+            return 0.0
+        lag = await session.scalar(text(query))
+        return float(lag or 0.0)
+    
+    async def check_replica_health(self, replica: str) -> bool:
+        """Проверить здоровье реплики, замерить задержку и отставание"""
+        try:
+            async with self.async_replicas[replica]() as session:
+                start = time.perf_counter()
+                await asyncio.wait_for(
+                    session.execute(text("SELECT 1")),
+                    timeout=settings.replica_read_timeout
+                )
+                latency = time.perf_counter() - start
+                lag = await asyncio.wait_for(
+                    self._replication_lag(session, replica),
+                    timeout=settings.replica_read_timeout
+                )
+                position = await asyncio.wait_for(
+                    self._replication_position(session),
+                    timeout=settings.replica_read_timeout
+                )
+            self.router.observe(replica, latency, lag, position)
             return True
         except Exception as e:
             logger.error(f"Replica {replica} health check failed: {e}")
             return False
     
-    def update_replica_health(self):
-        """Обновить статус здоровья всех реплик"""
-        for replica in self.replicas.keys():
-            self.replica_health[replica] = self.check_replica_health(replica)
+    async def update_replica_health(self):
+        """Обновить статус здоровья всех реплик (параллельно)"""
+        replicas = list(self.async_replicas.keys())
+        results = await asyncio.gather(*(self.check_replica_health(r) for r in replicas))
+        for replica, healthy in zip(replicas, results):
+            self.replica_health[replica] = healthy
+        self.publish_metrics()
+    
+    def publish_metrics(self):
+        """Записать задержку, отставание реплик и решения маршрутизации в метрики"""
+        # Импорт здесь: модуль мониторинга сам зависит от database
+        from app.core.monitoring import metrics
+        for (replica, reason), count in self.router.drain_decisions().items():
+            metrics.increment_counter("db.read_route", count, tags={"replica": replica, "reason": reason})
+        for replica, state in self.router.states.items():
+            tags = {"replica": replica}
+            metrics.set_gauge("db.replica_healthy", int(self.replica_health.get(replica, False)), tags)
+            if state.latency is not None:
+                metrics.set_gauge("db.replica_latency_ms", round(state.latency * 1000, 3), tags)
+            if state.lag is not None:
+                metrics.set_gauge("db.replica_lag_seconds", state.lag, tags)
+    
+    def replica_status(self) -> Dict[str, Dict[str, Any]]:
+        """Здоровье, задержка и отставание реплик"""
+        snapshot = self.router.snapshot()
+        return {
+            replica: {"healthy": self.replica_health.get(replica, False), **snapshot[replica]}
+            for replica in self.replicas
+        }
+    
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(settings.replica_health_check_interval)
+            try:
+                await self.update_replica_health()
+            except Exception as e:
+                logger.error(f"Replica probe failed: {e}")
+    
+    def start(self):
+        """Запустить фоновую пробу реплик в текущем event loop"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_loop())
+    
+    async def stop(self):
+        """Остановить фоновую пробу реплик"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
 
 # Глобальный экземпляр менеджера БД
 db_manager = DatabaseManager()
 
 # Зависимости для FastAPI
-def get_db_write() -> Generator[Session, None, None]:
+async def get_db_write() -> AsyncGenerator[AsyncSession, None]:
     """Зависимость для получения сессии записи"""
-    db = db_manager.get_write_session()
-    try:
+    async with db_manager.get_async_write_session() as db:
         yield db
-    finally:
-        db.close()
 
-def get_db_read(replica: str = None) -> Generator[Session, None, None]:
-    """Зависимость для получения сессии чтения"""
-    db = db_manager.get_read_session(replica)
+async def get_db_read(
+    request: Request,
+    replica: str = None,
+    max_staleness: float = None
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Зависимость для получения сессии чтения.
+    
+    max_staleness - допустимое отставание реплики, seconds. Чтения сессии
+    (session_id в пути или токен в заголовке X-Session-Token) видят её
+    собственные записи.
+    """
     try:
+        min_position = db_manager.session_position(
+            request.path_params.get("session_id"),
+            request.headers.get(SESSION_TOKEN_HEADER)
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid {SESSION_TOKEN_HEADER} header"
+        )
+    
+    async with await db_manager.get_consistent_read_session(replica, max_staleness, min_position) as db:
         yield db
-    finally:
-        db.close()
 
 async def init_db():
     """Инициализация базы данных"""
     try:
         # Создание таблиц
-        Base.metadata.create_all(bind=master_engine)
+        async with master_async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
         logger.info("Database initialized successfully")
         
         # Проверка здоровья реплик
-        db_manager.update_replica_health()
+        await db_manager.update_replica_health()
         logger.info(f"Replica health status: {db_manager.replica_health}")
         
     except Exception as e:
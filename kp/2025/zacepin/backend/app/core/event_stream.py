@@ -0,0 +1,381 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from itertools import chain
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import redis.asyncio as aioredis
+
+from app.core.config import settings
+from app.core.monitoring import metrics
+from app.core.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Событие потока: (ключ id для сравнения, готовый SSE-кадр). Кадр кодируется
+# один раз при публикации и отправляется всем подпискам сессии как есть
+EventKey = Tuple[int, int]
+Event = Tuple[EventKey, str]
+
+_KEEPALIVE = ": keepalive\n\n"
+
+
+def parse_event_id(event_id: str) -> EventKey:
+    """Разобрать id события '<ms>-<seq>' (формат id Redis Streams)"""
+    ms, _, seq = event_id.partition("-")
+    if not ms.isdigit() or not (seq.isdigit() or seq == ""):
+        raise ValueError(f"Invalid event id: {event_id}")
+    return int(ms), int(seq or 0)
+
+
+def sse_frame(event_type: str, data: str, event_id: Optional[str] = None) -> str:
+    """Кадр Server-Sent Events; data - JSON без переводов строк"""
+    frame = f"event: {event_type}\ndata: {data}\n\n"
+    return f"id: {event_id}\n{frame}" if event_id else frame
+
+
+class Subscription:
+    """
+    Подписка одного клиента на события сессии.
+
+    Очередь ограничена event_stream_queue_size публикациями: клиент, который
+    не успевает читать, отключается (close), не задерживая рассылку остальным.
+    Переподключившись с последним полученным id, он дочитывает пропущенное
+    из истории сессии.
+    """
+
+    def __init__(self, session_id: str, queue_size: int):
+        self.session_id = session_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.loop = asyncio.get_running_loop()
+        self.closed = False
+
+    def offer(self, events: List[Event]):
+        """Поставить события одной публикации в очередь (в event loop подписки)"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(events)
+        except asyncio.QueueFull:
+            self.close("lagged")
+
+    def close(self, reason: str):
+        """Отключить клиента: очередь освобождается, читатель сразу видит причину"""
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(reason)
+
+
+class EventStream:
+    """
+    Поток событий разметки по сессиям для push-клиентов (SSE).
+
+    События получают id вида '<ms>-<seq>' и хранятся в истории сессии (до
+    event_stream_history событий), поэтому клиент после переподключения
+    возобновляет поток с последнего полученного id. Живые события рассылаются
+    подпискам текущего процесса.
+
+    Базовая реализация хранит историю в памяти процесса и подходит для
+    одного worker'а. История сессии без публикаций дольше ttl секунд
+    удаляется, как и TTL потока сессии в Redis.
+    """
+
+    def __init__(self, history: int = None, queue_size: int = None, heartbeat: float = None, ttl: int = None):
+        self.history_size = history or settings.event_stream_history
+        self.queue_size = queue_size or settings.event_stream_queue_size
+        self.heartbeat = heartbeat or settings.event_stream_heartbeat
+        self.ttl = ttl or settings.event_stream_ttl
+        self.subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._events: Dict[str, Deque[Event]] = defaultdict(lambda: deque(maxlen=self.history_size))
+        # Время последней публикации по сессиям в порядке публикаций:
+        # устаревшие сессии всегда в начале
+        self._published: "OrderedDict[str, float]" = OrderedDict()
+        self._last_key: EventKey = (0, 0)
+        self._lock = threading.Lock()
+
+    async def publish(self, session_id: str, events: Iterable[Tuple[str, Any]]) -> List[str]:
+        """
+        Опубликовать события (тип, данные) сессии; возвращает их id.
+
+        Ошибки публикации логируются и не прерывают запись разметок: клиенты
+        догонят состояние через REST.
+        """
+        encoded = [(event_type, dumps(data).decode()) for event_type, data in events]
+        if not encoded:
+            return []
+        try:
+            return await self._publish(session_id, encoded)
+        except Exception as e:
+            logger.error(f"Failed to publish events for session {session_id}: {e}")
+            return []
+
+    def _next_key(self) -> EventKey:
+        ms = int(time.time() * 1000)
+        if ms <= self._last_key[0]:
+            self._last_key = (self._last_key[0], self._last_key[1] + 1)
+        else:
+            self._last_key = (ms, 0)
+        return self._last_key
+
+    def _evict_idle(self, now: float):
+        """Удалить историю сессий без публикаций дольше ttl (под self._lock)"""
+        while self._published:
+            session_id, published_at = next(iter(self._published.items()))
+            if now - published_at < self.ttl:
+                break
+            del self._published[session_id]
+            self._events.pop(session_id, None)
+
+    async def _publish(self, session_id: str, events: List[Tuple[str, str]]) -> List[str]:
+        published = []
+        now = time.monotonic()
+        with self._lock:
+            for event_type, data in events:
+                key = self._next_key()
+                event_id = f"{key[0]}-{key[1]}"
+                published.append((key, sse_frame(event_type, data, event_id)))
+            self._events[session_id].extend(published)
+            self._published[session_id] = now
+            self._published.move_to_end(session_id)
+            self._evict_idle(now)
+        self._dispatch(session_id, published)
+        return [f"{key[0]}-{key[1]}" for key, _ in published]
+
+    def _dispatch(self, session_id: str, events: List[Event]):
+        """Разослать события публикации подпискам сессии в этом процессе"""
+        with self._lock:
+            subscriptions = list(self.subscriptions.get(session_id, ()))
+        if not subscriptions:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        for subscription in subscriptions:
+            if subscription.loop is loop:
+                subscription.offer(events)
+            else:
+                subscription.loop.call_soon_threadsafe(subscription.offer, events)
+
+    async def history(self, session_id: str, after: EventKey) -> Tuple[List[Event], bool]:
+        """События сессии после after и признак, что часть пропущенного вытеснена из истории"""
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            events = list(self._events.get(session_id, ()))
+        truncated = len(events) >= self.history_size and events[0][0] > after
+        return [event for event in events if event[0] > after], truncated
+
+    async def subscribe(self, session_id: str) -> Subscription:
+        subscription = Subscription(session_id, self.queue_size)
+        with self._lock:
+            self.subscriptions[session_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self.subscriptions.get(subscription.session_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.session_id]
+
+    def connections(self) -> int:
+        """Число подключённых клиентов в этом процессе"""
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+    async def events(self, session_id: str, after: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        SSE-поток сессии: события после after из истории, затем живые.
+
+        Без событий каждые heartbeat секунд отправляется keepalive-комментарий.
+        Если часть пропущенного уже вытеснена из истории, первым приходит
+        событие reset (состояние нужно перечитать через REST). Отключённый
+        клиент получает событие reconnect с причиной, после чего поток
+        закрывается; EventSource переподключается с Last-Event-ID.
+        """
+        last = parse_event_id(after) if after else None
+        subscription = await self.subscribe(session_id)
+        metrics.increment_counter("event_stream.connections")
+        try:
+            # Подписка оформлена до чтения истории: события между ними придут
+            # в очередь, повторы отсекаются сравнением id
+            if last is not None:
+                missed, truncated = await self.history(session_id, last)
+                if truncated:
+                    yield sse_frame("reset", "{}")
+                if missed:
+                    last = missed[-1][0]
+                    yield "".join(frame for _, frame in missed)
+
+            while True:
+                try:
+                    batch: Union[List[Event], str] = await asyncio.wait_for(
+                        subscription.queue.get(), self.heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield _KEEPALIVE
+                    continue
+                if isinstance(batch, str):
+                    metrics.increment_counter("event_stream.disconnects", tags={"reason": batch})
+                    yield sse_frame("reconnect", json.dumps({"reason": batch}))
+                    return
+                frames = [frame for key, frame in batch if last is None or key > last]
+                if frames:
+                    last = batch[-1][0]
+                    yield "".join(frames)
+        finally:
+            self.unsubscribe(subscription)
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+# KEYS: поток событий сессии, канал рассылки
+# ARGV: сессия, MAXLEN истории, TTL истории, затем пары (тип, данные).
+# Вся публикация уходит одним сообщением: строка сессии и строки "id тип данные"
+_PUBLISH_SCRIPT = """
+local ids, lines = {}, {ARGV[1]}
+for i = 4, #ARGV, 2 do
+    local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], '*', 'type', ARGV[i], 'data', ARGV[i + 1])
+    ids[#ids + 1] = id
+    lines[#lines + 1] = id .. ' ' .. ARGV[i] .. ' ' .. ARGV[i + 1]
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('PUBLISH', KEYS[2], table.concat(lines, '\\n'))
+return ids
+""".strip()
+
+
+class RedisEventStream(EventStream):
+    """
+    События в Redis, общие для всех worker'ов.
+
+    История сессии хранится в Redis Stream (XADD с MAXLEN ~ event_stream_history
+    и TTL event_stream_ttl), публикация рассылается одним сообщением pub/sub.
+    Каждый worker держит одну подписку на канал и раздаёт события своим
+    клиентам. При потере подписки клиенты worker'а отключаются с причиной
+    resubscribe и дочитывают пропущенное из истории при переподключении.
+    """
+
+    def __init__(
+        self,
+        async_redis_client: aioredis.Redis,
+        prefix: str = "labeling_system:events:",
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.async_redis = async_redis_client
+        self.prefix = prefix
+        self.channel = f"{prefix}channel"
+        self._publish_script = self.async_redis.register_script(_PUBLISH_SCRIPT)
+        self._listener: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def _stream_key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    async def _publish(self, session_id: str, events: List[Tuple[str, str]]) -> List[str]:
+        ids = await self._publish_script(
+            keys=[self._stream_key(session_id), self.channel],
+            args=[session_id, self.history_size, self.ttl, *chain.from_iterable(events)]
+        )
+        return [_to_str(event_id) for event_id in ids]
+
+    async def history(self, session_id: str, after: EventKey) -> Tuple[List[Event], bool]:
+        key = self._stream_key(session_id)
+        pipe = self.async_redis.pipeline(transaction=False)
+        pipe.xlen(key)
+        pipe.xrange(key, count=1)
+        pipe.xrange(key, min=f"{after[0]}-{after[1]}")
+        length, first, entries = await pipe.execute()
+
+        events = []
+        for event_id, fields in entries:
+            event_id = _to_str(event_id)
+            event_key = parse_event_id(event_id)
+            if event_key > after:
+                fields = {_to_str(name): _to_str(value) for name, value in fields.items()}
+                events.append((event_key, sse_frame(fields["type"], fields["data"], event_id)))
+        truncated = length >= self.history_size and bool(first) and parse_event_id(_to_str(first[0][0])) > after
+        return events, truncated
+
+    async def subscribe(self, session_id: str) -> Subscription:
+        self.start()
+        # Клиент подключается только при активной подписке worker'а на канал
+        await asyncio.wait_for(self._ready.wait(), self.heartbeat)
+        return await super().subscribe(session_id)
+
+    def _on_message(self, message: str):
+        session_id, _, body = message.partition("\n")
+        if session_id not in self.subscriptions:
+            return
+        events = []
+        for line in body.split("\n"):
+            event_id, event_type, data = line.split(" ", 2)
+            events.append((parse_event_id(event_id), sse_frame(event_type, data, event_id)))
+        self._dispatch(session_id, events)
+
+    def _close_all(self, reason: str):
+        with self._lock:
+            subscriptions = [s for group in self.subscriptions.values() for s in group]
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.close, reason)
+
+    async def _listen(self):
+        while True:
+            pubsub = self.async_redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self._ready.set()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._on_message(_to_str(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event stream subscription failed: {e}")
+                await asyncio.sleep(1.0)
+            finally:
+                # События, пришедшие без подписки, клиенты дочитают из истории
+                self._ready.clear()
+                self._close_all("resubscribe")
+                await pubsub.aclose()
+
+    def start(self):
+        """Запустить подписку worker'а на канал событий в текущем event loop"""
+        if self._listener is None or self._listener.done():
+            self._ready = asyncio.Event()
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self):
+        """Остановить подписку на канал событий"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+
+def create_event_stream() -> EventStream:
+    """Создать поток событий по настройкам"""
+    if settings.event_stream_store == "redis":
+        return RedisEventStream(aioredis.from_url(settings.redis_url, decode_responses=True))
+    return EventStream()
+
+
+def _to_str(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+# Глобальный поток событий разметки
+event_stream = create_event_stream()
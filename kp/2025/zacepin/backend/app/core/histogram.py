@@ -0,0 +1,105 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, Optional
+
+# Относительная погрешность квантилей (DDSketch): 1%
+RELATIVE_ACCURACY = 0.01
+
+# Служебные поля в сериализованном виде; остальные поля - индексы корзин
+COUNT_FIELD = "count"
+SUM_FIELD = "sum"
+ZERO_FIELD = "zero"
+
+
+class LogHistogram:
+    """
+    Гистограмма с логарифмическими корзинами в стиле DDSketch.
+
+    Значение x > 0 попадает в корзину ceil(log_gamma(x)), gamma = (1 + a) / (1 - a),
+    поэтому любой квантиль оценивается с относительной погрешностью a.
+    Гистограммы объединяются сложением счётчиков корзин, что позволяет
+    копить их в Redis через HINCRBY из нескольких worker'ов.
+    """
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def bucket(self, value: float) -> int:
+        """Индекс корзины для положительного значения"""
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def add(self, value: float, count: int = 1):
+        """Добавить значение"""
+        if value > 0:
+            self.buckets[self.bucket(value)] += count
+        else:
+            self.zero_count += count
+        self.count += count
+        self.sum += value * count
+
+    def merge(self, other: "LogHistogram"):
+        """Добавить счётчики другой гистограммы с той же точностью"""
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Оценка квантиля q (0..1); None для пустой гистограммы"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Середина корзины (gamma^(i-1), gamma^i] в смысле относительной ошибки
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def percentiles(self, quantiles: Iterable[float]) -> Dict[str, Optional[float]]:
+        """Квантили в виде {"p50": ..., "p999": ...}"""
+        return {percentile_name(q): self.quantile(q) for q in quantiles}
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def to_fields(self) -> Dict[str, float]:
+        """Поля для HINCRBY / HSET: индексы корзин и служебные счётчики"""
+        fields = {str(index): count for index, count in self.buckets.items() if count}
+        if self.zero_count:
+            fields[ZERO_FIELD] = self.zero_count
+        fields[COUNT_FIELD] = self.count
+        fields[SUM_FIELD] = self.sum
+        return fields
+
+    @classmethod
+    def from_fields(cls, fields: Dict[str, str], relative_accuracy: float = RELATIVE_ACCURACY) -> "LogHistogram":
+        """Восстановить гистограмму из полей Redis hash"""
+        histogram = cls(relative_accuracy)
+        for field, value in fields.items():
+            if field == COUNT_FIELD:
+                histogram.count = int(value)
+            elif field == SUM_FIELD:
+                histogram.sum = float(value)
+            elif field == ZERO_FIELD:
+                histogram.zero_count = int(value)
+            else:
+                histogram.buckets[int(field)] = int(value)
+        return histogram
+
+
+def percentile_name(q: float) -> str:
+    """0.5 -> p50, 0.999 -> p999"""
+    digits = f"{q * 100:g}".replace(".", "")
+    return f"p{digits}"
@@ -1,74 +1,380 @@
+import asyncio
 import logging
+import threading
 import time
+from collections import defaultdict, deque
 from functools import wraps
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, List, Optional
 import json
 from datetime import datetime
 
+from app.core.config import settings
 from app.core.database import get_redis
+from app.core.histogram import SUM_FIELD, LogHistogram
 
 logger = logging.getLogger(__name__)
 
+# Сколько последних событий хранится в списке
+HISTORY_SIZE = 1000
+METRICS_TTL = 86400  # TTL 24 часа
+
+# Квантили, которые отдаёт API по гистограммам времени выполнения
+PERCENTILES = (0.5, 0.95, 0.99, 0.999)
+
 class MetricsCollector:
-    """Сборщик метрик для мониторинга системы"""
+    """
+    Сборщик метрик для мониторинга системы.
+    
+    До start() каждая метрика сразу пишется в Redis. После start() метрики
+    накапливаются в памяти процесса (счётчики суммируются, gauge хранит
+    последнее значение, timing - гистограмма, события - последние
+    HISTORY_SIZE значений) и сбрасываются фоновым потоком одним pipeline
+    раз в metrics_flush_interval.
+    
+    Время выполнения хранится гистограммами LogHistogram: один Redis hash на
+    метрику, набор тегов и слот времени (metrics_histogram_slot секунд).
+    Worker'ы складывают корзины через HINCRBY, квантили за скользящее окно
+    считаются объединением слотов окна.
+    
+    Ключи каждого типа метрик регистрируются в Redis set (registry:<тип>),
+    поэтому чтение не сканирует keyspace: SMEMBERS реестров и MGET / HGETALL
+    по известным ключам выполняются парой pipeline. Реестр гистограмм -
+    sorted set registry:hist_slots со score последнего записанного слота:
+    метрики, все слоты которых истекли, удаляются из него при чтении.
+    """
     
     def __init__(self):
         self.redis_client = get_redis()
         self.metrics_prefix = "labeling_system:metrics:"
+        self.buffered = False
+        self.time_func = time.time
+        self._lock = threading.Lock()
+        self._reset_buffer()
+        self._flush_stop = threading.Event()
+        self._flush_thread: Optional[threading.Thread] = None
+    
+    def _reset_buffer(self):
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[tuple, LogHistogram] = defaultdict(LogHistogram)
+        self._events: Dict[str, deque] = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+    
+    def _key(self, kind: str, metric_name: str, tags: Dict[str, str] = None) -> str:
+        key = f"{self.metrics_prefix}{kind}:{metric_name}"
+        if tags:
+            key += ":" + ":".join(f"{k}={v}" for k, v in tags.items())
+        return key
     
     def increment_counter(self, metric_name: str, value: int = 1, tags: Dict[str, str] = None):
         """Увеличить счетчик метрики"""
+        key = self._key("counter", metric_name, tags)
+        if self.buffered:
+            with self._lock:
+                self._counters[key] += value
+            return
         try:
-            key = f"{self.metrics_prefix}counter:{metric_name}"
-            if tags:
-                key += ":" + ":".join(f"{k}={v}" for k, v in tags.items())
-            
-            self.redis_client.incr(key, value)
-            self.redis_client.expire(key, 86400)  # TTL 24 часа
+            self._write(counters={key: value})
         except Exception as e:
             logger.error(f"Failed to increment counter {metric_name}: {e}")
     
+    def _slot(self, timestamp: float) -> int:
+        """Начало слота гистограммы, в который попадает timestamp"""
+        return int(timestamp // settings.metrics_histogram_slot) * settings.metrics_histogram_slot
+    
+    def _slot_keys(self, key: str, window: int) -> List[str]:
+        """
+        Ключи слотов гистограммы, покрывающих последние window секунд.
+        
+        Окно больше metrics_histogram_retention сокращается до него: более
+        старые слоты уже удалены по TTL.
+        """
+        if window <= 0:
+            raise ValueError(f"Window must be positive: {window}")
+        window = min(window, settings.metrics_histogram_retention)
+        now = self.time_func()
+        step = settings.metrics_histogram_slot
+        return [f"{key}:{slot}" for slot in range(self._slot(now - window + 1), self._slot(now) + step, step)]
+    
+    def _write_histogram(self, pipe, key: str, slot: int, histogram: LogHistogram):
+        slot_key = f"{key}:{slot}"
+        for field, value in histogram.to_fields().items():
+            if field == SUM_FIELD:
+                pipe.hincrbyfloat(slot_key, field, value)
+            else:
+                pipe.hincrby(slot_key, field, value)
+        pipe.expire(slot_key, settings.metrics_histogram_retention)
+    
     def record_timing(self, metric_name: str, duration: float, tags: Dict[str, str] = None):
-        """Записать время выполнения операции"""
+        """Записать время выполнения операции в гистограмму текущего слота"""
+        key = self._key("hist", metric_name, tags)
+        slot = self._slot(self.time_func())
+        if self.buffered:
+            with self._lock:
+                self._timings[(key, slot)].add(duration)
+            return
         try:
-            key = f"{self.metrics_prefix}timing:{metric_name}"
-            if tags:
-                key += ":" + ":".join(f"{k}={v}" for k, v in tags.items())
-            
-            # Сохраняем время выполнения
-            self.redis_client.lpush(key, duration)
-            self.redis_client.ltrim(key, 0, 999)  # Храним последние 1000 записей
-            self.redis_client.expire(key, 86400)
+            histogram = LogHistogram()
+            histogram.add(duration)
+            self._write(timings={(key, slot): histogram})
         except Exception as e:
             logger.error(f"Failed to record timing {metric_name}: {e}")
     
     def set_gauge(self, metric_name: str, value: float, tags: Dict[str, str] = None):
         """Установить значение метрики"""
+        key = self._key("gauge", metric_name, tags)
+        if self.buffered:
+            with self._lock:
+                self._gauges[key] = value
+            return
         try:
-            key = f"{self.metrics_prefix}gauge:{metric_name}"
-            if tags:
-                key += ":" + ":".join(f"{k}={v}" for k, v in tags.items())
-            
-            self.redis_client.set(key, value)
-            self.redis_client.expire(key, 86400)
+            self._write(gauges={key: value})
         except Exception as e:
             logger.error(f"Failed to set gauge {metric_name}: {e}")
     
     def record_event(self, event_name: str, data: Dict[str, Any]):
         """Записать событие"""
+        event = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "event": event_name,
+            "data": data
+        }
+        key = f"{self.metrics_prefix}events:{event_name}"
+        if self.buffered:
+            with self._lock:
+                self._events[key].append(json.dumps(event))
+            return
         try:
-            event = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "event": event_name,
-                "data": data
-            }
-            
-            key = f"{self.metrics_prefix}events:{event_name}"
-            self.redis_client.lpush(key, json.dumps(event))
-            self.redis_client.ltrim(key, 0, 999)  # Храним последние 1000 событий
-            self.redis_client.expire(key, 86400)
+            self._write(events={key: [json.dumps(event)]})
         except Exception as e:
             logger.error(f"Failed to record event {event_name}: {e}")
+    
+    def _registry_key(self, kind: str) -> str:
+        return f"{self.metrics_prefix}registry:{kind}"
+    
+    def _register(self, pipe, kind: str, keys: Iterable[str], ttl: int):
+        keys = list(keys)
+        if keys:
+            pipe.sadd(self._registry_key(kind), *keys)
+            pipe.expire(self._registry_key(kind), ttl)
+    
+    def _register_histograms(self, pipe, timings: Iterable[tuple]):
+        """Зарегистрировать гистограммы с последним записанным слотом"""
+        slots: Dict[str, int] = {}
+        for key, slot in timings:
+            slots[key] = max(slot, slots.get(key, slot))
+        if slots:
+            registry = self._registry_key("hist_slots")
+            pipe.zadd(registry, slots, gt=True)
+            pipe.expire(registry, settings.metrics_histogram_retention)
+    
+    def _write(self, counters: Dict = None, gauges: Dict = None, timings: Dict = None, events: Dict = None):
+        """Записать метрики и зарегистрировать их ключи одним pipeline"""
+        counters, gauges = counters or {}, gauges or {}
+        timings, events = timings or {}, events or {}
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key, value in counters.items():
+            pipe.incrby(key, value)
+            pipe.expire(key, METRICS_TTL)
+        for key, value in gauges.items():
+            pipe.set(key, value, ex=METRICS_TTL)
+        for (key, slot), histogram in timings.items():
+            self._write_histogram(pipe, key, slot, histogram)
+        for key, values in events.items():
+            # Новые события в начале списка
+            pipe.lpush(key, *values)
+            pipe.ltrim(key, 0, HISTORY_SIZE - 1)
+            pipe.expire(key, METRICS_TTL)
+        
+        self._register(pipe, "counter", counters, METRICS_TTL)
+        self._register(pipe, "gauge", gauges, METRICS_TTL)
+        self._register_histograms(pipe, timings)
+        self._register(pipe, "events", events, METRICS_TTL)
+        pipe.execute()
+    
+    def flush(self) -> int:
+        """Сбросить накопленные метрики в Redis одним pipeline; возвращает число ключей"""
+        with self._lock:
+            counters, gauges = self._counters, self._gauges
+            timings, events = self._timings, self._events
+            self._reset_buffer()
+        
+        keys = len(counters) + len(gauges) + len(timings) + len(events)
+        if not keys:
+            return 0
+        
+        try:
+            self._write(counters, gauges, timings, events)
+        except Exception as e:
+            logger.error(f"Failed to flush {keys} metrics: {e}")
+            return 0
+        return keys
+    
+    def _registered(self, *kinds: str) -> List[List[str]]:
+        """
+        Зарегистрированные ключи каждого типа (один pipeline SMEMBERS / ZRANGE).
+        
+        Гистограммы без слотов в пределах metrics_histogram_retention
+        удаляются из реестра в том же pipeline.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for kind in kinds:
+            if kind == "hist":
+                registry = self._registry_key("hist_slots")
+                oldest = self._slot(self.time_func() - settings.metrics_histogram_retention + 1)
+                pipe.zremrangebyscore(registry, "-inf", f"({oldest}")
+                pipe.zrange(registry, 0, -1)
+            else:
+                pipe.smembers(self._registry_key(kind))
+        
+        results = iter(pipe.execute())
+        registered = []
+        for kind in kinds:
+            if kind == "hist":
+                next(results)  # число удалённых из реестра гистограмм
+            registered.append(sorted(next(results)))
+        return registered
+    
+    def _name(self, kind: str, key: str) -> str:
+        return key[len(f"{self.metrics_prefix}{kind}:"):]
+    
+    def timing_metrics(self) -> List[str]:
+        """Имена метрик времени выполнения (с тегами), по которым есть гистограммы"""
+        hist_keys, = self._registered("hist")
+        return [self._name("hist", key) for key in hist_keys]
+    
+    def timing_histogram(self, metric_name: str, tags: Dict[str, str] = None, window: int = 300) -> LogHistogram:
+        """Гистограмма метрики за последние window секунд (объединение слотов)"""
+        key = self._key("hist", metric_name, tags)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for slot_key in self._slot_keys(key, window):
+            pipe.hgetall(slot_key)
+        return self._merge_slots(pipe.execute())
+    
+    def _merge_slots(self, slots: Iterable[Dict[str, str]]) -> LogHistogram:
+        histogram = LogHistogram()
+        for fields in slots:
+            if fields:
+                histogram.merge(LogHistogram.from_fields(fields))
+        return histogram
+    
+    def _stats(self, histogram: LogHistogram, quantiles: Iterable[float] = PERCENTILES) -> Dict[str, Any]:
+        return {
+            "count": histogram.count,
+            "avg": histogram.mean or 0,
+            **histogram.percentiles(quantiles)
+        }
+    
+    def timing_stats(
+        self,
+        metric_name: str,
+        tags: Dict[str, str] = None,
+        window: int = 300,
+        quantiles: Iterable[float] = PERCENTILES
+    ) -> Dict[str, Any]:
+        """Число замеров, среднее и квантили метрики за скользящее окно"""
+        return self._stats(self.timing_histogram(metric_name, tags, window), quantiles)
+    
+    def snapshot(self, window: int = 300) -> Dict[str, Dict[str, Any]]:
+        """
+        Все счётчики, gauge и квантили timing за window секунд.
+        
+        Стоимость зависит только от числа метрик, а не от размера keyspace:
+        один pipeline SMEMBERS по реестрам и один pipeline MGET / HGETALL.
+        Ключи с истёкшим TTL удаляются из реестров.
+        """
+        counter_keys, gauge_keys, hist_keys = self._registered("counter", "gauge", "hist")
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for keys in (counter_keys, gauge_keys):
+            if keys:
+                pipe.mget(keys)
+        slots = {key: self._slot_keys(key, window) for key in hist_keys}
+        for slot_keys in slots.values():
+            for slot_key in slot_keys:
+                pipe.hgetall(slot_key)
+        results = iter(pipe.execute())
+        
+        counter_values = next(results) if counter_keys else []
+        gauge_values = next(results) if gauge_keys else []
+        timings = {
+            self._name("hist", key): self._stats(
+                self._merge_slots(next(results) for _ in slot_keys)
+            )
+            for key, slot_keys in slots.items()
+        }
+        
+        stale = self._prune_stale("counter", counter_keys, counter_values)
+        stale += self._prune_stale("gauge", gauge_keys, gauge_values)
+        if stale:
+            logger.debug(f"Pruned {stale} expired metric keys from registry")
+        
+        return {
+            "counters": {
+                self._name("counter", key): int(value)
+                for key, value in zip(counter_keys, counter_values) if value is not None
+            },
+            "gauges": {
+                self._name("gauge", key): float(value)
+                for key, value in zip(gauge_keys, gauge_values) if value is not None
+            },
+            "timings": timings
+        }
+    
+    def _prune_stale(self, kind: str, keys: List[str], values: List[Optional[str]]) -> int:
+        stale = [key for key, value in zip(keys, values) if value is None]
+        if stale:
+            self.redis_client.srem(self._registry_key(kind), *stale)
+        return len(stale)
+    
+    def read_events(self, event_type: str = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Последние события (всех типов или одного), новые первыми"""
+        if event_type:
+            event_keys = [f"{self.metrics_prefix}events:{event_type}"]
+        else:
+            event_keys, = self._registered("events")
+        
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in event_keys:
+            pipe.lrange(key, 0, limit - 1)
+        
+        events = []
+        for key, event_data in zip(event_keys, pipe.execute()):
+            event_type_name = self._name("events", key)
+            for event_json in event_data:
+                try:
+                    event = json.loads(event_json)
+                    event["event_type"] = event_type_name
+                    events.append(event)
+                except json.JSONDecodeError:
+                    continue
+        
+        # Сортировка по времени
+        events.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+        return events
+    
+    def _run_flush(self):
+        while not self._flush_stop.wait(settings.metrics_flush_interval):
+            self.flush()
+    
+    def start(self):
+        """Включить буферизацию и фоновый сброс метрик"""
+        self.buffered = True
+        if self._flush_thread is None:
+            self._flush_stop.clear()
+            self._flush_thread = threading.Thread(
+                target=self._run_flush, name="metrics-flush", daemon=True
+            )
+            self._flush_thread.start()
+    
+    def stop(self):
+        """Остановить фоновый сброс и записать остаток буфера"""
+        if self._flush_thread is not None:
+            self._flush_stop.set()
+            self._flush_thread.join()
+            self._flush_thread = None
+        self.buffered = False
+        self.flush()
 
 # Глобальный экземпляр сборщика метрик
 metrics = MetricsCollector()
@@ -0,0 +1,24 @@
+import base64
+import binascii
+import json
+
+# Заголовок ответа с курсором следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(session_id: str, last_id: int) -> str:
+    """Непрозрачный курсор keyset-пагинации: позиция после записи last_id"""
+    payload = json.dumps({"s": session_id, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, session_id: str) -> int:
+    """id последней записи предыдущей страницы; ValueError для чужого или испорченного курсора"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        last_id = payload["id"]
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError) as e:
+        raise ValueError(f"Malformed cursor: {e}")
+    if payload.get("s") != session_id or not isinstance(last_id, int):
+        raise ValueError("Cursor does not belong to this session")
+    return last_id
@@ -0,0 +1,162 @@
+import random
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Отставание реплики по данным PostgreSQL: 0 на master и на догнавшей реплике
+POSTGRES_LAG_QUERY = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+# Позиция журнала в байтах: на master - текущая вставка, на реплике - применённая
+POSTGRES_POSITION_QUERY = (
+    "SELECT (CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() "
+    "ELSE pg_current_wal_insert_lsn() END) - '0/0'::pg_lsn"
+)
+
+# Запросы отставания репликации по диалекту БД
+REPLICATION_LAG_QUERIES = {
+    "postgresql": POSTGRES_LAG_QUERY,
+}
+
+# Запросы позиции репликации (LSN) по диалекту БД
+REPLICATION_POSITION_QUERIES = {
+    "postgresql": POSTGRES_POSITION_QUERY,
+}
+
+
+class ReplicaState:
+    """Наблюдаемое состояние реплики по результатам проб"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latency: Optional[float] = None  # EWMA задержки, seconds
+        self.lag: Optional[float] = None  # отставание репликации, seconds
+        self.position: Optional[int] = None  # последняя известная позиция репликации
+        self.probed_at: Optional[datetime] = None
+        self.selected = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 3),
+            "lag_seconds": self.lag,
+            "position": self.position,
+            "last_probe": self.probed_at.isoformat() if self.probed_at else None,
+            "selected": self.selected,
+        }
+
+
+class ReplicaRouter:
+    """Выбор реплики для чтения по задержке и отставанию репликации"""
+
+    STRATEGIES = ("power_of_two", "least_latency")
+
+    def __init__(
+        self,
+        replicas: Iterable[str],
+        primary: str = "master",
+        strategy: str = "power_of_two",
+        alpha: float = 0.3,
+        rng: random.Random = None
+    ):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.primary = primary
+        self.strategy = strategy
+        self.alpha = alpha
+        self.rng = rng or random.Random()
+        self.states = {name: ReplicaState(name) for name in replicas}
+        # Решения с последней публикации метрик: (реплика, причина) -> число
+        self.decisions = Counter()
+        # master не отстаёт от самого себя
+        self.states[primary].lag = 0.0
+
+    def observe(
+        self,
+        replica: str,
+        latency: float,
+        lag: Optional[float] = None,
+        position: Optional[int] = None
+    ):
+        """Учесть результат пробы: задержка сглаживается EWMA"""
+        state = self.states[replica]
+        if state.latency is None:
+            state.latency = latency
+        else:
+            state.latency = self.alpha * latency + (1 - self.alpha) * state.latency
+        if replica != self.primary:
+            state.lag = lag
+        self.observe_position(replica, position)
+        state.probed_at = datetime.utcnow()
+
+    def observe_position(self, replica: str, position: Optional[int]):
+        """Запомнить позицию репликации (она только растёт)"""
+        state = self.states[replica]
+        if position is not None and (state.position is None or position > state.position):
+            state.position = position
+
+    def caught_up(self, replica: str, min_position: Optional[int]) -> bool:
+        """Реплика по последним данным видит записи до min_position"""
+        if not min_position or replica == self.primary:
+            return True
+        position = self.states[replica].position
+        return position is not None and position >= min_position
+
+    def _cost(self, replica: str) -> float:
+        # Реплика без замеров считается быстрой, чтобы получить первые запросы
+        return self.states[replica].latency or 0.0
+
+    def eligible(self, healthy: Iterable[str], max_staleness: Optional[float] = None) -> List[str]:
+        """Здоровые реплики, отставание которых не превышает max_staleness"""
+        result = []
+        for replica in healthy:
+            lag = self.states[replica].lag
+            if max_staleness is not None and (lag is None or lag > max_staleness):
+                continue
+            result.append(replica)
+        return result
+
+    def choose(
+        self,
+        healthy: Iterable[str],
+        max_staleness: Optional[float] = None,
+        min_position: Optional[int] = None
+    ) -> Tuple[str, str]:
+        """
+        Выбрать реплику; возвращает (реплика, причина выбора).
+        
+        При min_position предпочтение отдаётся репликам, которые по
+        последним данным уже догнали эту позицию.
+        """
+        candidates = self.eligible(healthy, max_staleness)
+        if min_position:
+            caught_up = [r for r in candidates if self.caught_up(r, min_position)]
+            if any(r != self.primary for r in caught_up):
+                candidates = caught_up
+        if not candidates:
+            # Подходящих реплик нет: читаем с master
+            replica, reason = self.primary, "fallback"
+        elif self.strategy == "least_latency" or len(candidates) == 1:
+            replica, reason = min(candidates, key=self._cost), self.strategy
+        else:
+            first, second = self.rng.sample(candidates, 2)
+            replica = first if self._cost(first) <= self._cost(second) else second
+            reason = self.strategy
+
+        return replica, reason
+
+    def record(self, replica: str, reason: str):
+        """Учесть решение маршрутизации"""
+        self.states[replica].selected += 1
+        self.decisions[(replica, reason)] += 1
+
+    def drain_decisions(self) -> Dict[Tuple[str, str], int]:
+        """Забрать накопленные решения для публикации в метрики"""
+        decisions, self.decisions = self.decisions, Counter()
+        return dict(decisions)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Состояние всех реплик для мониторинга"""
+        return {name: state.to_dict() for name, state in self.states.items()}
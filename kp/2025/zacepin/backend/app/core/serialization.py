@@ -0,0 +1,68 @@
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import orjson
+from fastapi import Response
+
+from app.models.labeled_data import LabeledData
+
+# Поля ответа разметки в порядке LabeledDataResponse
+LABELED_DATA_FIELDS = (
+    "id", "session_id", "annotator_id", "data_id", "original_text", "label",
+    "confidence", "vector_clock", "created_at", "updated_at",
+    "is_conflict", "conflict_resolution"
+)
+
+# Колонки для выборки разметок кортежами, без построения ORM-объектов
+LABELED_DATA_COLUMNS = tuple(getattr(LabeledData, name) for name in LABELED_DATA_FIELDS)
+
+# Время в UTC кодируется с суффиксом Z, как в pydantic
+_OPTIONS = orjson.OPT_UTC_Z
+
+
+def _default(value: Any) -> Any:
+    # Decimal кодируется строкой, как в pydantic
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """JSON в байтах: datetime, Decimal и вложенные структуры без промежуточных моделей"""
+    return orjson.dumps(value, default=_default, option=_OPTIONS)
+
+
+def labeled_data_row(item: LabeledData) -> Sequence[Any]:
+    """Кортеж полей ответа из ORM-объекта"""
+    return tuple(getattr(item, name) for name in LABELED_DATA_FIELDS)
+
+
+def labeled_data_dict(row: Sequence[Any]) -> Dict[str, Any]:
+    """Словарь ответа из кортежа LABELED_DATA_COLUMNS"""
+    return dict(zip(LABELED_DATA_FIELDS, row))
+
+
+def labeled_data_json(rows: Iterable[Sequence[Any]]) -> bytes:
+    """
+    JSON-массив разметок из кортежей LABELED_DATA_COLUMNS.
+
+    Совпадает побайтно с сериализацией List[LabeledDataResponse] в FastAPI,
+    но без создания и повторной валидации pydantic-моделей.
+    """
+    return dumps([dict(zip(LABELED_DATA_FIELDS, row)) for row in rows])
+
+
+def json_response(content: bytes, response: Optional[Response] = None) -> Response:
+    """
+    Ответ с готовым JSON; FastAPI отдаёт его без response_model.
+
+    Заголовки, выставленные эндпоинтом во внедрённый response (токен сессии,
+    курсор), переносятся в ответ.
+    """
+    headers = None
+    if response is not None:
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name != "content-length"
+        }
+    return Response(content, media_type="application/json", headers=headers)
@@ -2,5 +2,6 @@ from .labeled_data import LabeledData
 from .annotator_session import AnnotatorSession
 from .vector_clock import VectorClock
 from .csv_file import CSVFile
+from .annotator_stats import AnnotatorStats
 
-__all__ = ["LabeledData", "AnnotatorSession", "VectorClock", "CSVFile"]
+__all__ = ["LabeledData", "AnnotatorSession", "VectorClock", "CSVFile", "AnnotatorStats"]
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, DECIMAL, DateTime
+from app.core.database import Base
+from typing import Dict, Any
+
+
+class AnnotatorStats(Base):
+    """
+    Rollup-статистика разметчика, обновляемая при записи разметок.
+    
+    Средняя уверенность хранится суммой и числом ненулевых значений, чтобы
+    изменения можно было применять инкрементально.
+    """
+    __tablename__ = "annotator_stats"
+    
+    annotator_id = Column(String(255), primary_key=True)
+    total_labels = Column(Integer, nullable=False, default=0)
+    conflicts = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(DECIMAL(14, 2), nullable=False, default=0)
+    confidence_count = Column(Integer, nullable=False, default=0)
+    last_activity = Column(DateTime(timezone=True))
+    
+    def __repr__(self):
+        return f"<AnnotatorStats(annotator_id={self.annotator_id}, total_labels={self.total_labels})>"
+    
+    @property
+    def avg_confidence(self) -> float:
+        return float(self.confidence_sum) / self.confidence_count if self.confidence_count else 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Преобразование в словарь для API"""
+        return {
+            "annotator_id": self.annotator_id,
+            "total_labels": self.total_labels,
+            "conflicts": self.conflicts,
+            "avg_confidence": self.avg_confidence,
+            "last_activity": self.last_activity.isoformat() if self.last_activity else None
+        }
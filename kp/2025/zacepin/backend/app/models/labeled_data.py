@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DECIMAL, JSON, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Text, DECIMAL, JSON, Boolean, DateTime, Index
 from sqlalchemy.sql import func
 from app.core.database import Base
 from datetime import datetime
@@ -21,6 +21,11 @@ class LabeledData(Base):
     is_conflict = Column(Boolean, default=False)
     conflict_resolution = Column(String(50), default='pending')
     
+    __table_args__ = (
+        # Keyset-пагинация разметки сессии: WHERE session_id = ? AND id > ? ORDER BY id
+        Index("idx_labeled_data_session_keyset", "session_id", "id"),
+    )
+    
     def __repr__(self):
         return f"<LabeledData(id={self.id}, session_id={self.session_id}, label={self.label})>"
     
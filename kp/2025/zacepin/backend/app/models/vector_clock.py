@@ -1,9 +1,19 @@
 from sqlalchemy import Column, Integer, String, JSON, DateTime
 from sqlalchemy.sql import func
-from app.core.database import Base
+from app.core.database import Base, MasterSessionLocal, get_redis
+from app.core.clock_store import (
+    ClockStore, InMemoryClockStore, RedisClockStore, WriteBehindClockStore,
+    clock_size
+)
+from app.core.config import settings
+from app.core.monitoring import metrics
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 
 class VectorClock(Base):
@@ -12,7 +22,7 @@ class VectorClock(Base):
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String(255), nullable=False, index=True)
     clock_data = Column(JSON, nullable=False)
-    last_updated = Column(DateTime(timezone=True), server_default=func.now())
+    last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     def __repr__(self):
         return f"<VectorClock(id={self.id}, session_id={self.session_id})>"
@@ -38,45 +48,31 @@ class VectorClock(Base):
 class VectorClockManager:
     """Менеджер для работы с vector clocks"""
     
-    def __init__(self):
-        self.clocks: Dict[str, Dict[str, int]] = {}
+    def __init__(self, store: ClockStore = None):
+        self.store = store or InMemoryClockStore()
+        self._gc_stop = threading.Event()
+        self._gc_thread: Optional[threading.Thread] = None
+    
+    @property
+    def clocks(self) -> Dict[str, Dict[str, int]]:
+        """Clocks, хранящиеся в памяти процесса (пусто для Redis)"""
+        return getattr(self.store, "clocks", {})
     
     def create_clock(self, session_id: str, node_id: str) -> Dict[str, int]:
         """Создать новый vector clock для сессии"""
-        clock = {node_id: 0}
-        self.clocks[session_id] = clock
-        return clock.copy()
+        return self.store.set(session_id, {node_id: 0})
     
     def get_clock(self, session_id: str) -> Dict[str, int]:
         """Получить vector clock для сессии"""
-        return self.clocks.get(session_id, {}).copy()
+        return self.store.get(session_id)
     
     def increment_clock(self, session_id: str, node_id: str) -> Dict[str, int]:
         """Увеличить счетчик для узла в vector clock"""
-        if session_id not in self.clocks:
-            self.clocks[session_id] = {}
-        
-        if node_id not in self.clocks[session_id]:
-            self.clocks[session_id][node_id] = 0
-        
-        self.clocks[session_id][node_id] += 1
-        return self.clocks[session_id].copy()
+        return self.store.increment(session_id, node_id)
     
     def merge_clocks(self, session_id: str, other_clock: Dict[str, int]) -> Dict[str, int]:
         """Объединить vector clocks (максимум по каждому узлу)"""
-        if session_id not in self.clocks:
-            self.clocks[session_id] = {}
-        
-        for node_id, timestamp in other_clock.items():
-            if node_id not in self.clocks[session_id]:
-                self.clocks[session_id][node_id] = timestamp
-            else:
-                self.clocks[session_id][node_id] = max(
-                    self.clocks[session_id][node_id], 
-                    timestamp
-                )
-        
-        return self.clocks[session_id].copy()
+        return self.store.merge(session_id, other_clock)
     
     def compare_clocks(self, clock1: Dict[str, int], clock2: Dict[str, int]) -> str:
         """
@@ -112,7 +108,15 @@ class VectorClockManager:
         if not current_clock:
             return []
         
-        comparison = self.compare_clocks(current_clock, new_clock)
+        # Записи выбывших узлов, которые видели все, на порядок не влияют
+        retired = self.store.retired(session_id)
+        comparison = self.compare_clocks(
+            current_clock,
+            {
+                node_id: timestamp for node_id, timestamp in new_clock.items()
+                if timestamp > retired.get(node_id, -1)
+            }
+        )
         conflicts = []
         
         if comparison == 'concurrent':
@@ -125,11 +129,116 @@ class VectorClockManager:
         
         return conflicts
     
-    def cleanup_old_clocks(self, max_age_hours: int = 24):
-        """Очистить старые vector clocks"""
-        # В реальной реализации здесь была бы логика очистки
-        # старых clocks из базы данных
-        pass
+    def cleanup_old_clocks(self, max_age_hours: Optional[float] = None) -> Dict[str, int]:
+        """
+        Сборка мусора vector clocks.
+        
+        1. Вытесняются сессии без записей дольше TTL (max_age_hours или
+           settings.vector_clock_ttl).
+        2. Узел, не писавший в сессию дольше vector_clock_node_ttl (ни
+           инкрементом, ни объединением clock с его новым событием),
+           считается выбывшим. Его запись убирается из clock, если view каждого
+           живого узла уже содержит её значение - то есть все живые узлы видели
+           последнее событие выбывшего узла (stability frontier).
+        3. Записи выбывших узлов забываются через тот же TTL: клиент, молчавший
+           дольше TTL, считается ушедшим так же, как неактивная сессия.
+        
+        Возвращает статистику прохода и публикует её в метрики.
+        """
+        ttl = max_age_hours * 3600 if max_age_hours is not None else settings.vector_clock_ttl
+        evicted = self.store.evict_idle(ttl)
+        
+        now = self.store.time_func()
+        pruned = 0
+        held = 0
+        used_bytes = 0
+        
+        for session_id in self.store.sessions():
+            clock = self.store.get(session_id)
+            views = self.store.views(session_id)
+            
+            live = [
+                view for node_id, (updated, view) in views.items()
+                if now - updated <= settings.vector_clock_node_ttl
+            ]
+            if live:
+                # Минимум по живым узлам: то, что видели все
+                stable = {
+                    node_id: value for node_id, value in clock.items()
+                    if all(view.get(node_id, 0) >= value for view in live)
+                }
+                retiring = {
+                    node_id: value for node_id, value in stable.items()
+                    if node_id not in views or now - views[node_id][0] > settings.vector_clock_node_ttl
+                }
+                if retiring:
+                    pruned += self.store.retire(session_id, retiring)
+                    clock = self.store.get(session_id)
+                    views = self.store.views(session_id)
+            
+            pruned += self.store.expire_retired(session_id, ttl)
+            
+            held += 1
+            used_bytes += clock_size(clock) + clock_size(self.store.retired(session_id))
+            used_bytes += sum(clock_size(view) for _, view in views.values())
+        
+        stats = {
+            "clocks_held": held,
+            "bytes_used": used_bytes,
+            "entries_pruned": pruned,
+            "sessions_evicted": len(evicted)
+        }
+        
+        metrics.set_gauge("vector_clocks.held", held)
+        metrics.set_gauge("vector_clocks.bytes", used_bytes)
+        metrics.increment_counter("vector_clocks.entries_pruned", pruned)
+        metrics.increment_counter("vector_clocks.sessions_evicted", len(evicted))
+        
+        return stats
+    
+    def _run_gc(self):
+        while not self._gc_stop.wait(settings.clock_cleanup_interval):
+            try:
+                self.cleanup_old_clocks()
+            except Exception as e:
+                logger.error(f"Vector clock cleanup failed: {e}")
+    
+    def start(self):
+        """Запустить фоновые задачи хранилища (write-behind) и сборку мусора"""
+        self.store.start()
+        if self._gc_thread is None:
+            self._gc_stop.clear()
+            self._gc_thread = threading.Thread(
+                target=self._run_gc, name="vector-clock-gc", daemon=True
+            )
+            self._gc_thread.start()
+    
+    def stop(self):
+        """Остановить фоновые задачи и сбросить несохранённые clocks"""
+        if self._gc_thread is not None:
+            self._gc_stop.set()
+            self._gc_thread.join()
+            self._gc_thread = None
+        self.store.stop()
+
+
+def create_clock_store() -> ClockStore:
+    """Создать хранилище vector clocks по настройкам"""
+    if settings.vector_clock_store == "redis":
+        store = RedisClockStore(get_redis())
+    else:
+        store = InMemoryClockStore()
+    
+    if settings.vector_clock_write_behind:
+        store = WriteBehindClockStore(
+            store,
+            session_factory=MasterSessionLocal,
+            model=VectorClock,
+            flush_interval=settings.vector_clock_flush_interval
+        )
+    
+    return store
+
 
 # Глобальный экземпляр менеджера vector clocks
-vector_clock_manager = VectorClockManager()
+vector_clock_manager = VectorClockManager(create_clock_store())
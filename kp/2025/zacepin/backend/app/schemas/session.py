@@ -21,6 +21,7 @@ class SessionResponse(BaseModel):
     vector_clock: Dict[str, int] = Field(..., description="Vector clock")
     last_activity: Optional[datetime] = Field(None, description="Последняя активность")
     created_at: Optional[datetime] = Field(None, description="Время создания")
+    session_token: Optional[int] = Field(None, description="High-water mark записей сессии (read-your-writes)")
 
     class Config:
         from_attributes = True
@@ -0,0 +1,104 @@
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.annotator_stats import AnnotatorStats
+
+# Диалекты с INSERT ... ON CONFLICT DO UPDATE
+_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+_COUNTERS = ("total_labels", "conflicts", "confidence_sum", "confidence_count")
+
+
+class StatsDelta:
+    """
+    Изменения rollup-статистики разметчиков в одной транзакции.
+
+    Эндпоинты записи накапливают изменения и применяют их одним upsert
+    в annotator_stats до commit, так что rollup меняется атомарно с
+    разметками. Уверенность учитывается так же, как в get_labeling_stats:
+    в среднее входят только ненулевые значения.
+    """
+
+    def __init__(self):
+        self.rows: Dict[str, Dict[str, Any]] = {}
+
+    def _row(self, annotator_id: str) -> Dict[str, Any]:
+        if annotator_id not in self.rows:
+            self.rows[annotator_id] = dict.fromkeys(_COUNTERS, 0)
+            self.rows[annotator_id]["touched"] = False
+        return self.rows[annotator_id]
+
+    def add(self, annotator_id: str, confidence: Optional[float], is_conflict: bool = False, sign: int = 1):
+        """Учесть добавленную (sign=1) или удалённую (sign=-1) запись"""
+        row = self._row(annotator_id)
+        row["total_labels"] += sign
+        if is_conflict:
+            row["conflicts"] += sign
+        if confidence:
+            row["confidence_sum"] += sign * float(confidence)
+            row["confidence_count"] += sign
+        if sign > 0:
+            row["touched"] = True
+
+    def replace(
+        self,
+        annotator_id: str,
+        old_confidence: Optional[float],
+        old_conflict: bool,
+        new_confidence: Optional[float],
+        new_conflict: bool
+    ):
+        """Учесть изменение существующей записи разметчиком"""
+        self.add(annotator_id, old_confidence, old_conflict, sign=-1)
+        self.add(annotator_id, new_confidence, new_conflict)
+
+    def conflict_resolved(self, annotator_id: str, count: int = 1):
+        """Учесть снятие флага конфликта без удаления записей"""
+        self._row(annotator_id)["conflicts"] -= count
+
+    def statement(self, dialect_name: str):
+        """Upsert накопленных изменений; None, если менять нечего"""
+        if dialect_name not in _INSERTS:
+            raise ValueError(f"Annotator stats rollup is not supported for dialect: {dialect_name}")
+
+        values = [
+            {
+                "annotator_id": annotator_id,
+                **{name: row[name] for name in _COUNTERS},
+                # Удаления и снятие флагов не считаются активностью
+                "last_activity": func.now() if row["touched"] else None
+            }
+            for annotator_id, row in sorted(self.rows.items())
+            if row["touched"] or any(row[name] for name in _COUNTERS)
+        ]
+        if not values:
+            return None
+
+        stmt = _INSERTS[dialect_name](AnnotatorStats).values(values)
+        table = AnnotatorStats.__table__
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.annotator_id],
+            set_={
+                **{name: table.c[name] + stmt.excluded[name] for name in _COUNTERS},
+                "last_activity": func.coalesce(stmt.excluded.last_activity, table.c.last_activity)
+            }
+        )
+
+    def apply(self, db: Session):
+        """Применить изменения в текущей транзакции синхронной сессии"""
+        stmt = self.statement(db.get_bind().dialect.name)
+        if stmt is not None:
+            db.execute(stmt)
+
+    async def apply_async(self, db: AsyncSession):
+        """Применить изменения в текущей транзакции асинхронной сессии"""
+        stmt = self.statement(db.get_bind().dialect.name)
+        if stmt is not None:
+            await db.execute(stmt)
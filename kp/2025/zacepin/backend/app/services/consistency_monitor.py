@@ -0,0 +1,276 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import redis
+
+from app.core.config import settings
+from app.core.database import db_manager, get_redis
+from app.core.monitoring import metrics
+from app.services.consistency_service import ConsistencyService
+
+logger = logging.getLogger(__name__)
+
+
+class DirtySessions:
+    """
+    Сессии, изменённые с последней проверки (в памяти процесса).
+
+    Для каждой сессии хранится high-water mark её записей (позиция
+    репликации из db_manager.mark_write): проверка читает только узел,
+    который уже видит эти записи.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, session_id: str, position: int = 0):
+        with self._lock:
+            self.sessions[session_id] = max(position, self.sessions.get(session_id, 0))
+
+    def drain(self) -> Dict[str, int]:
+        """Забрать накопленные сессии с позициями их записей, очистив множество"""
+        with self._lock:
+            sessions, self.sessions = self.sessions, {}
+        return dict(sorted(sessions.items()))
+
+    def pending(self) -> int:
+        """Число сессий, ожидающих проверки"""
+        return len(self.sessions)
+
+
+class RedisDirtySessions(DirtySessions):
+    """
+    Изменённые сессии в Redis, общие для всех worker'ов: sorted set, score -
+    high-water mark записей сессии
+    """
+
+    def __init__(self, redis_client: redis.Redis, key: str = "labeling_system:consistency:dirty_positions"):
+        self.redis = redis_client
+        self.key = key
+
+    def add(self, session_id: str, position: int = 0):
+        # GT: позиция сессии только растёт, новая сессия добавляется
+        self.redis.zadd(self.key, {session_id: position}, gt=True)
+
+    def drain(self) -> Dict[str, int]:
+        # ZRANGE и DEL в одной транзакции: пометки, пришедшие позже, не теряются
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrange(self.key, 0, -1, withscores=True)
+        pipe.delete(self.key)
+        sessions, _ = pipe.execute()
+        return dict(sorted(
+            (s.decode() if isinstance(s, bytes) else s, int(position)) for s, position in sessions
+        ))
+
+    def pending(self) -> int:
+        return self.redis.zcard(self.key)
+
+
+class RateBudget:
+    """
+    Бюджет запросов к реплике: token bucket на rate запросов в секунду.
+
+    acquire() резервирует запрос и ждёт, пока бюджет его покроет; несколько
+    shard'ов, читающих одну реплику, делят один бюджет.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        time_func: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.time_func = time_func
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.updated = time_func()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Зарезервировать один запрос; возвращает время ожидания, seconds"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self.time_func()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class ConsistencyMonitor:
+    """
+    Периодическая проверка согласованности изменённых сессий.
+
+    Проверяются только сессии из dirty-множества (их помечают эндпоинты
+    записи). Сессии делятся на shard'ы по consistency_shard_size, shard'ы
+    выполняются пулом из consistency_workers потоков. Каждый shard читает
+    одну реплику через одну сессию БД: реплику, догнавшую последние записи
+    сессий shard'а, иначе master. Запросы к узлу ограничены общим
+    бюджетом consistency_replica_qps. Сессии, проверка которых не удалась,
+    возвращаются в dirty-множество до следующего запуска.
+    """
+
+    def __init__(
+        self,
+        dirty: DirtySessions = None,
+        service: ConsistencyService = None,
+        workers: int = None,
+        shard_size: int = None,
+        replica_qps: float = None
+    ):
+        self.dirty = dirty or DirtySessions()
+        self.service = service or ConsistencyService()
+        self.workers = workers or settings.consistency_workers
+        self.shard_size = shard_size or settings.consistency_shard_size
+        self.replica_qps = replica_qps if replica_qps is not None else settings.consistency_replica_qps
+        self.budgets: Dict[str, RateBudget] = {}
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._budgets_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark_dirty(self, session_id: str, position: int = 0):
+        """Отметить сессию для проверки при следующем запуске; position - high-water mark её записей"""
+        try:
+            self.dirty.add(session_id, position)
+        except Exception as e:
+            logger.error(f"Failed to mark session {session_id} for consistency check: {e}")
+
+    def _budget(self, replica: str) -> RateBudget:
+        with self._budgets_lock:
+            if replica not in self.budgets:
+                self.budgets[replica] = RateBudget(self.replica_qps)
+            return self.budgets[replica]
+
+    def _check_shard(
+        self,
+        shard: int,
+        session_ids: List[str],
+        min_position: int
+    ) -> Tuple[Dict[str, Any], List[str]]:
+        """Проверить сессии shard'а через одну сессию узла, видящего записи до min_position"""
+        started = time.perf_counter()
+        replica, db = db_manager.get_consistent_read_session_sync(min_position)
+        budget = self._budget(replica)
+        waited = 0.0
+        conflicts = concurrent_pairs = 0
+        failed = []
+
+        try:
+            for session_id in session_ids:
+                waited += budget.acquire()
+                try:
+                    result = self.service.check_consistency(session_id, db, count_only=True)
+                    conflicts += len(result["conflicts"])
+                    concurrent_pairs += result["clock_consistency"].get("concurrent_pairs", 0)
+                except Exception as e:
+                    logger.error(f"Failed to check consistency for session {session_id}: {e}")
+                    db.rollback()
+                    failed.append(session_id)
+        finally:
+            db.close()
+
+        return {
+            "shard": shard,
+            "replica": replica,
+            "sessions": len(session_ids),
+            "failed": len(failed),
+            "conflicts": conflicts,
+            "concurrent_pairs": concurrent_pairs,
+            "seconds": round(time.perf_counter() - started, 6),
+            "budget_wait_seconds": round(waited, 6)
+        }, failed
+
+    def run_once(self) -> Dict[str, Any]:
+        """Проверить сессии, изменённые с прошлого запуска"""
+        started = time.perf_counter()
+        dirty = self.dirty.drain()
+        session_ids = list(dirty)
+        shards = [
+            session_ids[i:i + self.shard_size]
+            for i in range(0, len(session_ids), self.shard_size)
+        ]
+        positions = [max(dirty[session_id] for session_id in shard) for shard in shards]
+
+        shard_reports = []
+        failed = []
+        if shards:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="consistency-shard") as pool:
+                reports = pool.map(self._check_shard, range(len(shards)), shards, positions)
+                for shard_report, shard_failed in reports:
+                    shard_reports.append(shard_report)
+                    failed.extend(shard_failed)
+        for session_id in failed:
+            self.mark_dirty(session_id, dirty[session_id])
+
+        conflicts = sum(shard["conflicts"] for shard in shard_reports)
+        if failed:
+            overall_status = "error"
+        elif conflicts or any(shard["concurrent_pairs"] for shard in shard_reports):
+            overall_status = "degraded"
+        else:
+            overall_status = "healthy"
+
+        report = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "sessions_checked": len(session_ids) - len(failed),
+            "sessions_failed": len(failed),
+            "conflicts_found": conflicts,
+            "concurrent_pairs": sum(shard["concurrent_pairs"] for shard in shard_reports),
+            "shards": shard_reports,
+            "workers": self.workers,
+            "duration_seconds": round(time.perf_counter() - started, 6),
+            "overall_status": overall_status
+        }
+
+        metrics.set_gauge("consistency.sessions_checked", report["sessions_checked"])
+        metrics.set_gauge("consistency.conflicts_found", conflicts)
+        metrics.record_timing("consistency.run", report["duration_seconds"])
+        for shard in shard_reports:
+            metrics.record_timing("consistency.shard", shard["seconds"], tags={"replica": shard["replica"]})
+
+        self.last_report = report
+        return report
+
+    def _run(self):
+        while not self._stop.wait(settings.consistency_check_interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Consistency monitor run failed: {e}")
+
+    def start(self):
+        """Запустить периодическую проверку в фоновом потоке"""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="consistency-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+
+def create_consistency_monitor() -> ConsistencyMonitor:
+    """Создать монитор согласованности по настройкам"""
+    if settings.consistency_dirty_store == "redis":
+        return ConsistencyMonitor(RedisDirtySessions(get_redis()))
+    return ConsistencyMonitor()
+
+
+# Глобальный монитор согласованности
+consistency_monitor = create_consistency_monitor()
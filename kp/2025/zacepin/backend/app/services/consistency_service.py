@@ -1,4 +1,5 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import logging
@@ -6,11 +7,18 @@ import logging
 from app.models.labeled_data import LabeledData
 from app.models.annotator_session import AnnotatorSession
 from app.models.vector_clock import vector_clock_manager
+from app.core.conflict_index import conflict_index
 from app.core.database import db_manager
 from app.core.monitoring import metrics
+from app.core.config import settings
+from app.services.annotator_stats import StatsDelta
+from app.services.vector_clock_engine import check_concurrency
 
 logger = logging.getLogger(__name__)
 
+# Стратегия разрешения конфликтов: (session_id, db) -> число разрешённых записей
+ConflictResolver = Callable[[str, Session], int]
+
 
 class ConsistencyService:
     """Сервис для обеспечения согласованности данных"""
@@ -22,8 +30,17 @@ class ConsistencyService:
             'confidence_based': self._confidence_based_resolution
         }
     
-    def check_consistency(self, session_id: str, db: Session) -> Dict[str, Any]:
-        """Проверить согласованность данных для сессии"""
+    def register_strategy(self, name: str, resolver: ConflictResolver):
+        """Зарегистрировать стратегию разрешения конфликтов"""
+        self.conflict_resolution_strategies[name] = resolver
+    
+    def check_consistency(
+        self, 
+        session_id: str, 
+        db: Session,
+        count_only: bool = False
+    ) -> Dict[str, Any]:
+        """Проверить согласованность данных для сессии (count_only - без списка пар)"""
         try:
             # Получение всех записей сессии
             labeled_data = db.query(LabeledData).filter(
@@ -31,10 +48,10 @@ class ConsistencyService:
             ).all()
             
             # Проверка vector clocks
-            clock_consistency = self._check_clock_consistency(labeled_data)
+            clock_consistency = self._check_clock_consistency(labeled_data, count_only)
             
             # Проверка конфликтов
-            conflicts = self._detect_data_conflicts(labeled_data)
+            conflicts = self._detect_data_conflicts(session_id, labeled_data)
             
             # Проверка репликации
             replication_status = self._check_replication_status(session_id)
@@ -52,58 +69,68 @@ class ConsistencyService:
             logger.error(f"Consistency check failed for session {session_id}: {e}")
             raise
     
-    def _check_clock_consistency(self, labeled_data: List[LabeledData]) -> Dict[str, Any]:
-        """Проверить согласованность vector clocks"""
+    def _check_clock_consistency(
+        self, 
+        labeled_data: List[LabeledData],
+        count_only: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Проверить согласованность vector clocks
+        
+        Clocks сравниваются пакетно в виде матрицы (см. vector_clock_engine),
+        в отчёт попадает не более settings.consistency_max_issues пар.
+        """
         if not labeled_data:
             return {"status": "empty", "issues": []}
         
-        issues = []
         clocks = [item.vector_clock for item in labeled_data]
-        
-        # Проверка на concurrent операции
-        for i, clock1 in enumerate(clocks):
-            for j, clock2 in enumerate(clocks[i+1:], i+1):
-                comparison = vector_clock_manager.compare_clocks(clock1, clock2)
-                if comparison == 'concurrent':
-                    issues.append({
-                        "type": "concurrent_operations",
-                        "record1": i,
-                        "record2": j,
-                        "clock1": clock1,
-                        "clock2": clock2
-                    })
-        
-        return {
-            "status": "consistent" if not issues else "inconsistent",
-            "issues": issues,
-            "total_clocks": len(clocks)
-        }
+        return check_concurrency(
+            clocks,
+            max_issues=settings.consistency_max_issues,
+            count_only=count_only
+        )
     
-    def _detect_data_conflicts(self, labeled_data: List[LabeledData]) -> List[Dict[str, Any]]:
-        """Обнаружить конфликты в данных"""
-        conflicts = []
+    def _detect_data_conflicts(
+        self,
+        session_id: str,
+        labeled_data: List[LabeledData]
+    ) -> List[Dict[str, Any]]:
+        """
+        Обнаружить конфликты в данных
         
-        # Группировка по data_id для поиска конфликтов
-        data_groups = {}
-        for item in labeled_data:
-            if item.data_id not in data_groups:
-                data_groups[item.data_id] = []
-            data_groups[item.data_id].append(item)
+        Конфликты берутся из инкрементального индекса (conflict_index);
+        записи сессии нужны только при первом обращении к неиндексированной сессии.
+        """
+        if not conflict_index.is_indexed(session_id):
+            conflict_index.rebuild(
+                session_id,
+                [(item.data_id, item.id, item.label) for item in labeled_data]
+            )
+        return conflict_index.conflicts(session_id)
+    
+    def _index_sessions(self, session_ids: List[str], db: Session):
+        """Заполнить индекс конфликтов неиндексированных сессий одним запросом"""
+        missing = [session_id for session_id in session_ids if not conflict_index.is_indexed(session_id)]
+        if not missing:
+            return
         
-        # Поиск конфликтов в каждой группе
-        for data_id, items in data_groups.items():
-            if len(items) > 1:
-                # Проверка на разные метки для одного data_id
-                labels = set(item.label for item in items)
-                if len(labels) > 1:
-                    conflicts.append({
-                        "type": "label_conflict",
-                        "data_id": data_id,
-                        "conflicting_labels": list(labels),
-                        "records": [item.id for item in items]
-                    })
+        entries = {session_id: [] for session_id in missing}
+        rows = db.query(
+            LabeledData.session_id, LabeledData.data_id, LabeledData.id, LabeledData.label
+        ).filter(LabeledData.session_id.in_(missing))
+        for session_id, data_id, record_id, label in rows:
+            entries[session_id].append((data_id, record_id, label))
         
-        return conflicts
+        for session_id, session_entries in entries.items():
+            conflict_index.rebuild(session_id, session_entries)
+    
+    def _discard_deleted(self, deleted: List[Tuple[str, str, int]]):
+        """Убрать удалённые записи (сессия, data_id, id) из индекса конфликтов"""
+        by_session = {}
+        for session_id, data_id, record_id in deleted:
+            by_session.setdefault(session_id, []).append((data_id, record_id))
+        for session_id, entries in by_session.items():
+            conflict_index.discard(session_id, entries)
     
     def _check_replication_status(self, session_id: str) -> Dict[str, Any]:
         """Проверить статус репликации"""
@@ -133,18 +160,18 @@ class ConsistencyService:
             raise ValueError(f"Unknown conflict resolution strategy: {strategy}")
         
         try:
-            # Получение конфликтных записей
-            conflicts = db.query(LabeledData).filter(
+            # Наличие конфликтных записей (сами записи стратегии обрабатывают в БД)
+            has_conflicts = db.query(LabeledData.id).filter(
                 LabeledData.session_id == session_id,
                 LabeledData.is_conflict == True
-            ).all()
+            ).first()
             
-            if not conflicts:
+            if not has_conflicts:
                 return {"message": "No conflicts found", "resolved": 0}
             
             # Применение стратегии разрешения
             resolver = self.conflict_resolution_strategies[strategy]
-            resolved_count = resolver(conflicts, db)
+            resolved_count = resolver(session_id, db)
             
             # Логирование события
             metrics.record_event("conflicts_resolved", {
@@ -163,105 +190,138 @@ class ConsistencyService:
             logger.error(f"Conflict resolution failed for session {session_id}: {e}")
             raise
     
-    def _last_write_wins(self, conflicts: List[LabeledData], db: Session) -> int:
+    def _last_write_wins(self, session_id: str, db: Session) -> int:
         """Стратегия: последняя запись побеждает"""
-        resolved = 0
-        
-        # Группировка по data_id
-        data_groups = {}
-        for conflict in conflicts:
-            if conflict.data_id not in data_groups:
-                data_groups[conflict.data_id] = []
-            data_groups[conflict.data_id].append(conflict)
-        
-        for data_id, items in data_groups.items():
-            # Сортировка по времени обновления (последняя запись)
-            latest_item = max(items, key=lambda x: x.updated_at)
-            
-            # Удаление остальных записей
-            for item in items:
-                if item.id != latest_item.id:
-                    db.delete(item)
-                    resolved += 1
-                else:
-                    # Снятие флага конфликта с оставшейся записи
-                    item.is_conflict = False
-                    item.conflict_resolution = 'last_write_wins'
-        
-        db.commit()
-        return resolved
+        return self._keep_best(
+            session_id, db,
+            order_by=(LabeledData.updated_at.desc(), LabeledData.id.desc()),
+            resolution='last_write_wins'
+        )
     
-    def _manual_resolution(self, conflicts: List[LabeledData], db: Session) -> int:
+    def _manual_resolution(self, session_id: str, db: Session) -> int:
         """Стратегия: ручное разрешение (требует дополнительных данных)"""
         # В реальной реализации здесь была бы логика для ручного разрешения
         # Пока просто снимаем флаги конфликтов
-        resolved = 0
-        
-        for conflict in conflicts:
-            conflict.is_conflict = False
-            conflict.conflict_resolution = 'manual'
-            resolved += 1
+        resolved = db.execute(
+            update(LabeledData).where(
+                LabeledData.session_id == session_id,
+                LabeledData.is_conflict == True
+            ).values(
+                is_conflict=False,
+                conflict_resolution='manual'
+            ).returning(LabeledData.annotator_id).execution_options(synchronize_session=False)
+        ).scalars().all()
         
+        stats = StatsDelta()
+        for annotator_id in resolved:
+            stats.conflict_resolved(annotator_id)
+        stats.apply(db)
         db.commit()
-        return resolved
+        return len(resolved)
     
-    def _confidence_based_resolution(self, conflicts: List[LabeledData], db: Session) -> int:
+    def _confidence_based_resolution(self, session_id: str, db: Session) -> int:
         """Стратегия: разрешение на основе уверенности"""
-        resolved = 0
+        return self._keep_best(
+            session_id, db,
+            order_by=(func.coalesce(LabeledData.confidence, 0).desc(), LabeledData.id),
+            resolution='confidence_based'
+        )
+    
+    def _keep_best(self, session_id: str, db: Session, order_by, resolution: str) -> int:
+        """
+        Оставить одну конфликтную запись на data_id, остальные удалить.
         
-        # Группировка по data_id
-        data_groups = {}
-        for conflict in conflicts:
-            if conflict.data_id not in data_groups:
-                data_groups[conflict.data_id] = []
-            data_groups[conflict.data_id].append(conflict)
+        Победитель выбирается в БД оконной функцией row_number() по order_by,
+        проигравшие удаляются одним DELETE, с победителей флаг снимается одним
+        UPDATE. data_id обрабатываются диапазонами по
+        settings.conflict_resolution_chunk_size, каждый в своей транзакции.
+        """
+        resolved = 0
+        lower = None
         
-        for data_id, items in data_groups.items():
-            # Выбор записи с наибольшей уверенностью
-            best_item = max(items, key=lambda x: float(x.confidence or 0))
+        while True:
+            conflicting = [LabeledData.session_id == session_id, LabeledData.is_conflict == True]
+            if lower is not None:
+                conflicting.append(LabeledData.data_id > lower)
+            
+            # Верхняя граница очередного диапазона data_id
+            chunk = select(LabeledData.data_id).where(*conflicting).distinct().order_by(
+                LabeledData.data_id
+            ).limit(settings.conflict_resolution_chunk_size).subquery()
+            upper = db.scalar(select(func.max(chunk.c.data_id)))
+            if upper is None:
+                break
+            conflicting.append(LabeledData.data_id <= upper)
             
-            # Удаление остальных записей
-            for item in items:
-                if item.id != best_item.id:
-                    db.delete(item)
-                    resolved += 1
-                else:
-                    # Снятие флага конфликта с оставшейся записи
-                    item.is_conflict = False
-                    item.conflict_resolution = 'confidence_based'
+            ranked = select(
+                LabeledData.id,
+                func.row_number().over(
+                    partition_by=LabeledData.data_id,
+                    order_by=order_by
+                ).label("rank")
+            ).where(*conflicting).subquery()
+            
+            deleted = db.execute(
+                delete(LabeledData).where(
+                    LabeledData.id.in_(select(ranked.c.id).where(ranked.c.rank > 1))
+                ).returning(
+                    LabeledData.data_id, LabeledData.id, LabeledData.annotator_id, LabeledData.confidence
+                ).execution_options(synchronize_session=False)
+            ).all()
+            # После удаления в диапазоне остались только победители
+            winners = db.execute(
+                update(LabeledData).where(*conflicting).values(
+                    is_conflict=False,
+                    conflict_resolution=resolution
+                ).returning(LabeledData.annotator_id).execution_options(synchronize_session=False)
+            ).scalars().all()
+            
+            stats = StatsDelta()
+            for _, _, annotator_id, confidence in deleted:
+                stats.add(annotator_id, confidence, is_conflict=True, sign=-1)
+            for annotator_id in winners:
+                stats.conflict_resolved(annotator_id)
+            stats.apply(db)
+            db.commit()
+            
+            self._discard_deleted([(session_id, data_id, record_id) for data_id, record_id, _, _ in deleted])
+            resolved += len(deleted)
+            lower = upper
         
-        db.commit()
         return resolved
     
     def monitor_consistency(self, check_interval: int = 300) -> Dict[str, Any]:
         """Мониторинг согласованности системы"""
         try:
-            # Получение активных сессий
-            active_sessions = db_manager.get_read_session().query(AnnotatorSession).filter(
-                AnnotatorSession.is_active == True
-            ).all()
-            
-            consistency_report = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "total_active_sessions": len(active_sessions),
-                "sessions_checked": 0,
-                "conflicts_found": 0,
-                "replica_health": db_manager.replica_health,
-                "overall_status": "healthy"
-            }
-            
-            # Проверка каждой активной сессии
-            for session in active_sessions:
+            # Одна сессия чтения на проверку, закрывается при выходе
+            with db_manager.get_read_session() as db:
+                # Получение активных сессий
+                active_sessions = db.query(AnnotatorSession).filter(
+                    AnnotatorSession.is_active == True
+                ).all()
+                
+                consistency_report = {
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "total_active_sessions": len(active_sessions),
+                    "sessions_checked": 0,
+                    "conflicts_found": 0,
+                    "replica_health": db_manager.replica_health,
+                    "overall_status": "healthy"
+                }
+                
+                # Конфликты активных сессий из индекса: O(конфликтов), без чтения разметок
+                session_ids = [session.session_id for session in active_sessions]
                 try:
-                    session_consistency = self.check_consistency(session.session_id, db_manager.get_read_session())
-                    consistency_report["sessions_checked"] += 1
-                    
-                    if session_consistency["conflicts"]:
-                        consistency_report["conflicts_found"] += len(session_consistency["conflicts"])
+                    self._index_sessions(session_ids, db)
+                    counts = conflict_index.conflict_counts()
+                    consistency_report["sessions_checked"] = len(session_ids)
+                    consistency_report["conflicts_found"] = sum(
+                        counts.get(session_id, 0) for session_id in session_ids
+                    )
+                    if consistency_report["conflicts_found"]:
                         consistency_report["overall_status"] = "degraded"
-                        
                 except Exception as e:
-                    logger.error(f"Failed to check consistency for session {session.session_id}: {e}")
+                    logger.error(f"Failed to check conflicts of active sessions: {e}")
                     consistency_report["overall_status"] = "error"
             
             # Запись метрик
@@ -288,6 +348,7 @@ class ConsistencyService:
             sessions_deleted = len(old_sessions)
             for session in old_sessions:
                 db.delete(session)
+                conflict_index.delete(session.session_id)
             
             # Удаление старых разметок
             old_labeled_data = db.query(LabeledData).filter(
@@ -296,10 +357,16 @@ class ConsistencyService:
             ).all()
             
             data_deleted = len(old_labeled_data)
+            deleted = []
+            stats = StatsDelta()
             for data in old_labeled_data:
                 db.delete(data)
+                deleted.append((data.session_id, data.data_id, data.id))
+                stats.add(data.annotator_id, data.confidence, sign=-1)
             
+            stats.apply(db)
             db.commit()
+            self._discard_deleted(deleted)
             
             return {
                 "message": f"Cleaned up data older than {days_old} days",
@@ -0,0 +1,232 @@
+from typing import List, Optional
+import os
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx.npz"
+READ_CHUNK_SIZE = 1024 * 1024
+
+_NEWLINE = ord("\n")
+_CARRIAGE_RETURN = ord("\r")
+_QUOTE = ord('"')
+
+
+class RowIndexBuilder:
+    """
+    Инкрементальный построитель индекса смещений строк CSV.
+
+    Принимает файл кусками произвольного размера и запоминает байтовое
+    смещение каждой stride-й строки данных. Переводы строк внутри кавычек
+    не считаются концом записи, пустые строки пропускаются так же, как это
+    делает pandas.
+    """
+
+    def __init__(self, stride: Optional[int] = None):
+        self.stride = stride or settings.csv_index_stride
+        self.offsets: List[int] = []
+        self.total_rows = 0
+        self.header_seen = False
+        self._position = 0
+        self._record_start = 0
+        self._quote_parity = 0
+        self._last_byte = None
+
+    def feed(self, chunk: bytes):
+        """Обработать очередной кусок файла"""
+        if not chunk:
+            return
+
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        quotes = np.flatnonzero(data == _QUOTE)
+        newlines = np.flatnonzero(data == _NEWLINE)
+
+        if newlines.size:
+            # Перевод строки завершает запись, только если до него чётное число кавычек
+            parity = (np.searchsorted(quotes, newlines) + self._quote_parity) & 1
+            record_ends = newlines[parity == 0]
+            if record_ends.size:
+                self._consume_records(data, record_ends)
+
+        self._quote_parity = (self._quote_parity + quotes.size) & 1
+        self._position += len(chunk)
+        self._last_byte = chunk[-1]
+
+    def _consume_records(self, data: np.ndarray, record_ends: np.ndarray):
+        """Учесть записи, завершившиеся в текущем куске"""
+        ends = record_ends.astype(np.int64) + self._position
+        starts = np.empty_like(ends)
+        starts[0] = self._record_start
+        starts[1:] = ends[:-1] + 1
+
+        lengths = ends - starts
+        non_empty = lengths > 0
+        # Строка из одного '\r' (CRLF-файлы) тоже считается пустой
+        single = np.flatnonzero(lengths == 1)
+        if single.size:
+            before = record_ends[single] - 1
+            prev_bytes = np.where(
+                before >= 0,
+                data[np.maximum(before, 0)],
+                self._last_byte if self._last_byte is not None else 0
+            )
+            non_empty[single[prev_bytes == _CARRIAGE_RETURN]] = False
+
+        self._add_records(starts[non_empty])
+        self._record_start = int(ends[-1]) + 1
+
+    def _add_records(self, starts: np.ndarray):
+        """Добавить начала непустых записей, первая из которых может быть заголовком"""
+        if not self.header_seen and starts.size:
+            self.header_seen = True
+            starts = starts[1:]
+
+        if not starts.size:
+            return
+
+        row_numbers = self.total_rows + np.arange(starts.size)
+        self.offsets.extend(int(x) for x in starts[row_numbers % self.stride == 0])
+        self.total_rows += int(starts.size)
+
+    def finish(self, file_path: str) -> "CSVRowIndex":
+        """Завершить построение индекса (учесть последнюю строку без перевода строки)"""
+        tail_length = self._position - self._record_start
+        if tail_length > 1 or (tail_length == 1 and self._last_byte != _CARRIAGE_RETURN):
+            self._add_records(np.array([self._record_start], dtype=np.int64))
+
+        return CSVRowIndex(
+            file_path=file_path,
+            offsets=np.asarray(self.offsets, dtype=np.uint64),
+            total_rows=self.total_rows,
+            stride=self.stride,
+            file_size=self._position
+        )
+
+
+class CSVRowIndex:
+    """Индекс смещений строк CSV файла для постраничного чтения без полного разбора"""
+
+    def __init__(
+        self,
+        file_path: str,
+        offsets: np.ndarray,
+        total_rows: int,
+        stride: int,
+        file_size: int
+    ):
+        self.file_path = file_path
+        self.offsets = offsets
+        self.total_rows = total_rows
+        self.stride = stride
+        self.file_size = file_size
+        self._columns: Optional[List[str]] = None
+
+    @staticmethod
+    def index_path(file_path: str) -> str:
+        """Путь к файлу индекса рядом с CSV"""
+        return file_path + INDEX_SUFFIX
+
+    @classmethod
+    def build(cls, file_path: str, stride: Optional[int] = None) -> "CSVRowIndex":
+        """Построить индекс по файлу на диске и сохранить его рядом с файлом"""
+        builder = RowIndexBuilder(stride)
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                builder.feed(chunk)
+
+        index = builder.finish(file_path)
+        index.save()
+        return index
+
+    @classmethod
+    def load(cls, file_path: str) -> Optional["CSVRowIndex"]:
+        """Загрузить индекс; None, если он отсутствует или устарел"""
+        path = cls.index_path(file_path)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path) as data:
+                index = cls(
+                    file_path=file_path,
+                    offsets=data["offsets"],
+                    total_rows=int(data["total_rows"]),
+                    stride=int(data["stride"]),
+                    file_size=int(data["file_size"])
+                )
+        except Exception as e:
+            logger.warning(f"Failed to load row index for {file_path}: {e}")
+            return None
+
+        if index.file_size != os.path.getsize(file_path):
+            return None
+        return index
+
+    @classmethod
+    def load_or_build(cls, file_path: str) -> "CSVRowIndex":
+        """Загрузить индекс или построить его (для файлов, загруженных до появления индекса)"""
+        index = cls.load(file_path)
+        if index is None:
+            logger.info(f"Building row index for {file_path}")
+            index = cls.build(file_path)
+        return index
+
+    @classmethod
+    def remove(cls, file_path: str):
+        """Удалить файл индекса"""
+        path = cls.index_path(file_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def save(self):
+        """Сохранить индекс рядом с CSV файлом"""
+        # np.savez сам добавляет расширение .npz, поэтому пишем через открытый файл
+        with open(self.index_path(self.file_path), "wb") as f:
+            np.savez(
+                f,
+                offsets=self.offsets,
+                total_rows=self.total_rows,
+                stride=self.stride,
+                file_size=self.file_size
+            )
+
+    @property
+    def columns(self) -> List[str]:
+        """Имена колонок из заголовка файла"""
+        if self._columns is None:
+            self._columns = list(pd.read_csv(self.file_path, nrows=0).columns)
+        return self._columns
+
+    def read_rows(
+        self,
+        offset: int,
+        limit: int,
+        columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Прочитать limit строк начиная с offset, разбирая не более stride + limit строк"""
+        if offset >= self.total_rows or limit <= 0 or not len(self.offsets):
+            return pd.DataFrame(columns=columns or self.columns)
+
+        offset = max(offset, 0)
+        block = offset // self.stride
+        skip = offset - block * self.stride
+
+        with open(self.file_path, "rb") as f:
+            f.seek(int(self.offsets[block]))
+            df = pd.read_csv(
+                f,
+                header=None,
+                names=self.columns,
+                usecols=columns,
+                nrows=skip + limit
+            )
+
+        return df.iloc[skip:].reset_index(drop=True)
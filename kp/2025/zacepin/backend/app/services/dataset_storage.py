@@ -0,0 +1,155 @@
+from typing import List, Optional, Union
+import os
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.csv_index import CSVRowIndex
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pragma: no cover - pyarrow нужен только для колоночного хранения
+    pa = None
+    pa_csv = None
+
+logger = logging.getLogger(__name__)
+
+ARROW_SUFFIX = ".arrow"
+
+STORAGE_CSV = "csv"
+STORAGE_ARROW = "arrow"
+
+# Файлы, которые не удалось сконвертировать: повторно не пытаемся
+_conversion_failed = set()
+
+
+class ArrowDataset:
+    """
+    Колоночная копия CSV файла в формате Arrow IPC.
+
+    Файл открывается через memory map, поэтому выбор колонок и срез
+    record batch'ей не копируют данные; в pandas преобразуется только
+    запрошенная страница.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.arrow_path = self.arrow_path_for(file_path)
+        self._reader = pa.ipc.open_file(pa.memory_map(self.arrow_path, "r"))
+        batch_rows = [
+            self._reader.get_batch(i).num_rows
+            for i in range(self._reader.num_record_batches)
+        ]
+        # batch_starts[i] - номер первой строки i-го record batch
+        self._batch_starts = np.concatenate(([0], np.cumsum(batch_rows))).astype(np.int64)
+        self.total_rows = int(self._batch_starts[-1])
+
+    @staticmethod
+    def arrow_path_for(file_path: str) -> str:
+        """Путь к колоночной копии рядом с CSV"""
+        return file_path + ARROW_SUFFIX
+
+    @classmethod
+    def convert(cls, file_path: str) -> "ArrowDataset":
+        """Потоково сконвертировать CSV в Arrow IPC (память ограничена размером блока)"""
+        if pa is None:
+            raise RuntimeError("pyarrow is required for arrow storage format")
+
+        arrow_path = cls.arrow_path_for(file_path)
+        part_path = arrow_path + ".part"
+        try:
+            reader = pa_csv.open_csv(
+                file_path,
+                read_options=pa_csv.ReadOptions(block_size=settings.arrow_block_size)
+            )
+            with pa.OSFile(part_path, "wb") as sink:
+                with pa.ipc.new_file(sink, reader.schema) as writer:
+                    for batch in reader:
+                        writer.write_batch(batch)
+            os.replace(part_path, arrow_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+        return cls(file_path)
+
+    @property
+    def columns(self) -> List[str]:
+        """Имена колонок"""
+        return self._reader.schema.names
+
+    def read_rows(
+        self,
+        offset: int,
+        limit: int,
+        columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Прочитать limit строк начиная с offset, затрагивая только нужные batch'и и колонки"""
+        columns = columns or self.columns
+        if offset >= self.total_rows or limit <= 0:
+            return pd.DataFrame(columns=columns)
+
+        offset = max(offset, 0)
+        end = min(offset + limit, self.total_rows)
+        first = int(np.searchsorted(self._batch_starts, offset, side="right")) - 1
+        last = int(np.searchsorted(self._batch_starts, end, side="left")) - 1
+
+        batches = [
+            self._reader.get_batch(i).select(columns)
+            for i in range(first, last + 1)
+        ]
+        table = pa.Table.from_batches(batches).slice(
+            offset - int(self._batch_starts[first]),
+            end - offset
+        )
+        return table.to_pandas()
+
+
+DatasetReader = Union[CSVRowIndex, ArrowDataset]
+
+
+def prepare_dataset(file_path: str) -> str:
+    """
+    Подготовить загруженный файл к чтению в формате из настроек.
+
+    Возвращает фактический формат хранения: если колоночная копия не
+    построилась (например, типы в колонке не согласованы), остаётся CSV.
+    """
+    _conversion_failed.discard(file_path)
+    if settings.storage_format != STORAGE_ARROW:
+        # Колоночная копия от предыдущей загрузки с тем же именем устарела
+        arrow_path = ArrowDataset.arrow_path_for(file_path)
+        if os.path.exists(arrow_path):
+            os.remove(arrow_path)
+        return STORAGE_CSV
+
+    try:
+        ArrowDataset.convert(file_path)
+        return STORAGE_ARROW
+    except Exception as e:
+        logger.warning(f"Columnar conversion failed for {file_path}, keeping CSV: {e}")
+        _conversion_failed.add(file_path)
+        return STORAGE_CSV
+
+
+def open_dataset(file_path: str) -> DatasetReader:
+    """Открыть файл для постраничного чтения в формате из настроек"""
+    if settings.storage_format == STORAGE_ARROW:
+        if os.path.exists(ArrowDataset.arrow_path_for(file_path)):
+            return ArrowDataset(file_path)
+        if file_path not in _conversion_failed and prepare_dataset(file_path) == STORAGE_ARROW:
+            return ArrowDataset(file_path)
+
+    return CSVRowIndex.load_or_build(file_path)
+
+
+def remove_dataset(file_path: str):
+    """Удалить файл вместе с индексом и колоночной копией"""
+    for path in (file_path, ArrowDataset.arrow_path_for(file_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    CSVRowIndex.remove(file_path)
+    _conversion_failed.discard(file_path)
@@ -0,0 +1,242 @@
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# Ограничение на размер матрицы сравнений (элементов) в одном блоке
+_BLOCK_ELEMENTS = 4_000_000
+
+
+class ClockMatrix:
+    """
+    Набор vector clocks в компактном виде.
+
+    Идентификаторы узлов интернируются в фиксированный индекс колонок,
+    clocks хранятся строками матрицы NumPy int64 (отсутствующий узел = 0,
+    как в VectorClockManager.compare_clocks). Одинаковые clocks схлопываются,
+    поэтому стоимость анализа зависит от числа различных clocks, а не записей.
+    """
+
+    def __init__(self, clocks: List[Dict[str, int]]):
+        self.node_ids: List[str] = []
+        self.node_index: Dict[str, int] = {}
+        for clock in clocks:
+            for node_id in clock:
+                if node_id not in self.node_index:
+                    self.node_index[node_id] = len(self.node_ids)
+                    self.node_ids.append(node_id)
+
+        self.matrix = np.zeros((len(clocks), len(self.node_ids)), dtype=np.int64)
+        for row, clock in enumerate(clocks):
+            for node_id, timestamp in clock.items():
+                self.matrix[row, self.node_index[node_id]] = timestamp
+
+        self._unique: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def to_dict(self, row: int) -> Dict[str, int]:
+        """Восстановить clock записи в виде словаря (без нулевых узлов)"""
+        return {
+            self.node_ids[col]: int(value)
+            for col, value in enumerate(self.matrix[row]) if value
+        }
+
+    def merged(self) -> Dict[str, int]:
+        """Поэлементный максимум всех clocks одной операцией"""
+        if not len(self):
+            return {}
+        maximum = self.matrix.max(axis=0)
+        return {node_id: int(maximum[col]) for col, node_id in enumerate(self.node_ids)}
+
+    def _unique_clocks(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Различные clocks, упорядоченные по сумме компонент.
+
+        Если a < b (a предшествует b), то sum(a) < sum(b), поэтому в этом
+        порядке доминировать над строкой могут только строки после неё.
+        Колонки, одинаковые во всех clocks, на сравнение не влияют и отбрасываются.
+        """
+        if self._unique is None:
+            matrix = self.matrix
+            if len(self) and matrix.shape[1]:
+                varying = (matrix != matrix[0]).any(axis=0)
+                matrix = matrix[:, varying]
+
+            if not len(self):
+                unique = matrix
+                inverse = np.zeros(0, dtype=np.int64)
+                counts = np.zeros(0, dtype=np.int64)
+            elif matrix.shape[1] == 0:
+                unique = matrix[:1]
+                inverse = np.zeros(len(self), dtype=np.int64)
+                counts = np.array([len(self)], dtype=np.int64)
+            else:
+                unique, inverse, counts = np.unique(
+                    matrix, axis=0, return_inverse=True, return_counts=True
+                )
+                inverse = inverse.reshape(-1)
+
+            order = np.argsort(unique.sum(axis=1), kind="stable")
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            self._unique = (unique[order], rank[inverse], counts[order])
+
+        return self._unique
+
+    def count_concurrent(self) -> int:
+        """Количество пар записей с concurrent clocks (без перечисления пар)"""
+        unique, _, counts = self._unique_clocks()
+        dims = unique.shape[1]
+
+        if len(unique) < 2 or dims < 2:
+            # Одна компонента задаёт полный порядок
+            return 0
+
+        if dims == 2:
+            return _count_concurrent_2d(unique, counts)
+
+        total = len(self)
+        distinct_pairs = (total * total - int((counts * counts).sum())) // 2
+
+        comparable = 0
+        for start, end in _blocks(len(unique), dims):
+            comparable_block, _ = _compare_block(unique, start, end)
+            comparable += int(counts[start:end] @ (comparable_block @ counts[start:]))
+
+        return distinct_pairs - comparable
+
+    def concurrent_pairs(self, limit: Optional[int] = None) -> np.ndarray:
+        """
+        Пары индексов записей (i < j) с concurrent clocks.
+
+        Проход останавливается, как только набрано limit пар; пары
+        возвращаются отсортированными.
+        """
+        unique, inverse, _ = self._unique_clocks()
+        pairs = []
+        found = 0
+
+        if len(unique) >= 2 and unique.shape[1] >= 2:
+            # Записи каждой группы одинаковых clocks
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+            members = [order[bounds[g]:bounds[g + 1]] for g in range(len(unique))]
+
+            for start, end in _blocks(len(unique), unique.shape[1]):
+                _, concurrent_block = _compare_block(unique, start, end)
+                rows, cols = np.nonzero(concurrent_block)
+                for a, b in zip(rows + start, cols + start):
+                    left, right = members[a], members[b]
+                    block = np.stack([
+                        np.repeat(left, len(right)),
+                        np.tile(right, len(left))
+                    ], axis=1)
+                    pairs.append(np.sort(block, axis=1))
+                    found += len(block)
+                    if limit is not None and found >= limit:
+                        break
+                if limit is not None and found >= limit:
+                    break
+
+        if not pairs:
+            return np.zeros((0, 2), dtype=np.int64)
+
+        result = np.concatenate(pairs)
+        result = result[np.lexsort((result[:, 1], result[:, 0]))]
+        return result[:limit] if limit is not None else result
+
+
+def check_concurrency(
+    clocks: List[Dict[str, int]],
+    max_issues: Optional[int] = None,
+    count_only: bool = False
+) -> Dict[str, Any]:
+    """
+    Проверить набор clocks на concurrent операции.
+
+    Возвращает ту же структуру issues, что и попарное сравнение в
+    ConsistencyService, плюс общее число concurrent пар.
+    """
+    matrix = ClockMatrix(clocks)
+    concurrent = matrix.count_concurrent()
+
+    issues = []
+    if concurrent and not count_only:
+        for i, j in matrix.concurrent_pairs(max_issues):
+            issues.append({
+                "type": "concurrent_operations",
+                "record1": int(i),
+                "record2": int(j),
+                "clock1": clocks[i],
+                "clock2": clocks[j]
+            })
+
+    return {
+        "status": "consistent" if not concurrent else "inconsistent",
+        "issues": issues,
+        "total_clocks": len(clocks),
+        "concurrent_pairs": concurrent,
+        "issues_truncated": len(issues) < concurrent and not count_only
+    }
+
+
+def _blocks(rows: int, dims: int):
+    """Разбиение строк на блоки, чтобы матрица сравнений помещалась в _BLOCK_ELEMENTS"""
+    size = max(1, _BLOCK_ELEMENTS // max(1, rows))
+    for start in range(0, rows, size):
+        yield start, min(start + size, rows)
+
+
+def _compare_block(unique: np.ndarray, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Сравнить строки [start, end) со всеми строками после них.
+
+    Возвращает две матрицы (end - start) x (len(unique) - start): comparable[i, j]
+    - clock (start + j) доминирует над clock (start + i), concurrent[i, j] - нет.
+    Учитываются только пары с j > i.
+    """
+    block = unique[start:end]
+    rest = unique[start:]
+    # Поколоночное сравнение: без промежуточного трёхмерного массива
+    dominated = rest[None, :, 0] >= block[:, 0, None]
+    for col in range(1, unique.shape[1]):
+        dominated &= rest[None, :, col] >= block[:, col, None]
+    upper = np.arange(end - start)[:, None] < np.arange(len(rest))[None, :]
+    return dominated & upper, ~dominated & upper
+
+
+def _count_concurrent_2d(unique: np.ndarray, counts: np.ndarray) -> int:
+    """
+    Число concurrent пар для двух узлов за O(n log n).
+
+    После сортировки по (x, y) пара i < j concurrent тогда и только тогда,
+    когда y_i > y_j, то есть это взвешенная инверсия, которую считает дерево Фенвика.
+    """
+    order = np.lexsort((unique[:, 1], unique[:, 0]))
+    ys = unique[order, 1]
+    weights = counts[order]
+
+    _, ranks = np.unique(ys, return_inverse=True)
+    ranks = ranks.reshape(-1)
+    size = int(ranks.max()) + 1
+    tree = [0] * (size + 1)
+    seen = 0
+    inversions = 0
+
+    for rank, weight in zip(ranks.tolist(), weights.tolist()):
+        # Сумма весов с y <= текущего
+        not_greater = 0
+        i = rank + 1
+        while i > 0:
+            not_greater += tree[i]
+            i -= i & -i
+        inversions += weight * (seen - not_greater)
+
+        i = rank + 1
+        while i <= size:
+            tree[i] += weight
+            i += i & -i
+        seen += weight
+
+    return inversions
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк опроса статистики разметчиков дашбордом: прежние четыре запроса
+на разметчика (уверенности усредняются в Python), один агрегирующий запрос
+на разметчика и чтение rollup-таблицы annotator_stats одним запросом.
+
+По умолчанию используется временная SQLite база; для замера на PostgreSQL
+передайте --db-url.
+
+Запуск из каталога backend:
+    python benchmarks/bench_annotator_stats.py --annotators 500 --labels-per-annotator 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import fakeredis
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.v1.endpoints.labeling import get_labeling_stats
+from app.api.v1.endpoints.monitoring import get_annotator_stats
+from app.core.database import Base, async_db_url, compact_json
+from app.core.monitoring import metrics
+from app.models.annotator_stats import AnnotatorStats
+from app.models.labeled_data import LabeledData
+from app.services.annotator_stats import StatsDelta
+
+TABLES = [LabeledData.__table__, AnnotatorStats.__table__]
+
+
+def fill(engine, annotators: int, labels_per_annotator: int):
+    """Разметки annotators разметчиков и их rollup, как после записи эндпоинтами"""
+    db = sessionmaker(bind=engine)()
+    try:
+        for annotator in range(annotators):
+            rows = [
+                {
+                    "session_id": f"session_{annotator}",
+                    "annotator_id": f"annotator_{annotator:04d}",
+                    "data_id": f"data_{i}",
+                    "original_text": f"Sample text number {i}",
+                    "label": "positive" if i % 2 else "negative",
+                    "confidence": (i % 10) / 10,
+                    "vector_clock": {"master": i},
+                    "is_conflict": i % 17 == 0
+                }
+                for i in range(labels_per_annotator)
+            ]
+            db.execute(insert(LabeledData), rows)
+            stats = StatsDelta()
+            for row in rows:
+                stats.add(row["annotator_id"], row["confidence"], row["is_conflict"])
+            stats.apply(db)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def legacy_stats(db, annotator_id: str):
+    """Прежняя реализация get_labeling_stats"""
+    total_labels = await db.scalar(
+        select(func.count(LabeledData.id)).where(LabeledData.annotator_id == annotator_id)
+    )
+    conflicts = await db.scalar(
+        select(func.count(LabeledData.id)).where(
+            LabeledData.annotator_id == annotator_id,
+            LabeledData.is_conflict == True
+        )
+    )
+    confidences = [
+        float(item.confidence)
+        for item in (await db.execute(
+            select(LabeledData.confidence).where(LabeledData.annotator_id == annotator_id)
+        )).all()
+        if item.confidence
+    ]
+    last_activity = (await db.execute(
+        select(LabeledData.updated_at).where(
+            LabeledData.annotator_id == annotator_id
+        ).order_by(LabeledData.updated_at.desc()).limit(1)
+    )).first()
+    return total_labels, conflicts, sum(confidences) / len(confidences) if confidences else 0.0, last_activity
+
+
+async def poll(session_factory, annotator_ids, mode: str):
+    """Один опрос дашборда: статистика всех разметчиков"""
+    async with session_factory() as db:
+        if mode == "legacy":
+            return [await legacy_stats(db, annotator_id) for annotator_id in annotator_ids]
+        if mode == "aggregate":
+            return [await get_labeling_stats(annotator_id, db=db) for annotator_id in annotator_ids]
+        return (await get_annotator_stats(annotator_id=None, db=db))["annotators"]
+
+
+async def measure(session_factory, annotators: int, repeats: int):
+    annotator_ids = [f"annotator_{annotator:04d}" for annotator in range(annotators)]
+    results = {}
+    for mode in ("legacy", "aggregate", "rollup"):
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            rows = await poll(session_factory, annotator_ids, mode)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        assert len(rows) == annotators
+        results[mode] = best
+
+    # Rollup совпадает с агрегацией по разметкам
+    async with session_factory() as db:
+        rollup = {item["annotator_id"]: item for item in (await get_annotator_stats(annotator_id=None, db=db))["annotators"]}
+        for annotator_id in annotator_ids[:10]:
+            stats = await get_labeling_stats(annotator_id, db=db)
+            assert (rollup[annotator_id]["total_labels"], rollup[annotator_id]["conflicts"]) == (stats.total_labels, stats.conflicts)
+            assert abs(rollup[annotator_id]["avg_confidence"] - stats.avg_confidence) < 1e-6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--annotators", type=int, default=500)
+    parser.add_argument("--labels-per-annotator", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--db-url", type=str, default=None)
+    args = parser.parse_args()
+
+    # Метрики пишутся в fakeredis: настоящий Redis для бенчмарка не нужен
+    metrics.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_engine(db_url, json_serializer=compact_json)
+        Base.metadata.drop_all(bind=engine, tables=TABLES)
+        Base.metadata.create_all(bind=engine, tables=TABLES)
+        fill(engine, args.annotators, args.labels_per_annotator)
+        async_engine = create_async_engine(async_db_url(db_url), json_serializer=compact_json)
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+        results = asyncio.run(measure(AsyncSessionLocal, args.annotators, args.repeats))
+
+        print(f"{args.annotators} annotators x {args.labels_per_annotator} labels, one dashboard poll")
+        print(f"{'mode':>10} {'poll, ms':>10} {'speedup':>8}")
+        for mode, elapsed in results.items():
+            print(f"{mode:>10} {elapsed:>10.2f} {results['legacy'] / elapsed:>7.1f}x")
+
+        engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+
+if __name__ == "__main__":
+    main()
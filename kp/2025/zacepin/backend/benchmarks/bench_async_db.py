@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк слоя БД под конкурентной нагрузкой: синхронная сессия в async-эндпоинте
+против асинхронной (aiosqlite / asyncpg).
+
+200 клиентов параллельно читают разметку своих сессий с заданным интервалом.
+Задержка считается от запланированного момента запроса, поэтому включает
+ожидание в очереди event loop. К каждому запросу добавляется --delay-ms
+ожидания БД (сеть, выполнение на сервере): синхронный драйвер ждёт, блокируя
+event loop, асинхронный отдаёт управление другим запросам.
+Печатаются p50/p99 задержки и RPS.
+
+По умолчанию используется временная SQLite база; для замера на PostgreSQL
+передайте --db-url и --delay-ms 0.
+
+Запуск из каталога backend:
+    python benchmarks/bench_async_db.py --clients 200 --requests 10 --interval-ms 1000 --delay-ms 5
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import fakeredis
+import numpy as np
+from fastapi import Response
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util import await_only
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.v1.endpoints.labeling import get_labeled_data_by_session
+from app.core.database import Base, async_db_url, compact_json
+from app.core.monitoring import metrics
+from app.models.labeled_data import LabeledData
+
+
+def inject_delay(engine, delay: float, blocking: bool):
+    """Добавить ожидание БД перед каждым запросом"""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if blocking:
+            time.sleep(delay)
+        else:
+            # Слушатель асинхронного движка выполняется в greenlet и может ждать корутину
+            await_only(asyncio.sleep(delay))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def populate(engine, sessions: int, rows_per_session: int, filler_rows: int):
+    """Сессии клиентов и «чужие» записи, которые запрос должен отфильтровать"""
+    rows = [
+        {
+            "session_id": f"session_{k}",
+            "annotator_id": f"annotator_{k % 10}",
+            "data_id": f"data_{k}_{i}",
+            "original_text": f"Sample text {i}",
+            "label": "positive" if i % 2 else "negative",
+            "confidence": 0.9,
+            "vector_clock": {"master": i},
+        }
+        for k in range(sessions)
+        for i in range(rows_per_session)
+    ]
+    rows += [
+        {
+            "session_id": f"other_{i % 1000}",
+            "annotator_id": "other",
+            "data_id": f"other_{i}",
+            "original_text": "Other text",
+            "label": "neutral",
+            "confidence": 0.5,
+            "vector_clock": {},
+        }
+        for i in range(filler_rows)
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(LabeledData), rows)
+
+
+async def sync_request(session_factory, session_id: str, limit: int):
+    """Прежний вариант: async def эндпоинт с синхронной сессией"""
+    db = session_factory()
+    try:
+        return db.query(LabeledData).filter(
+            LabeledData.session_id == session_id
+        ).offset(0).limit(limit).all()
+    finally:
+        db.close()
+
+
+async def async_request(session_factory, session_id: str, limit: int):
+    """Текущий эндпоинт на асинхронной сессии"""
+    async with session_factory() as db:
+        return await get_labeled_data_by_session(session_id, response=Response(), limit=limit, offset=0, db=db)
+
+
+async def run_clients(handler, session_factory, clients: int, requests: int,
+                      interval: float, limit: int):
+    """Запустить клиентов одновременно и собрать задержки запросов"""
+    latencies = []
+    start = time.perf_counter()
+
+    async def client(k: int):
+        # Клиенты стартуют равномерно в пределах первого интервала
+        offset = interval * k / clients
+        for i in range(requests):
+            scheduled = start + offset + i * interval
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            await handler(session_factory, f"session_{k}", limit)
+            latencies.append(time.perf_counter() - scheduled)
+
+    await asyncio.gather(*(client(k) for k in range(clients)))
+    return np.array(latencies) * 1000, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--interval-ms", type=float, default=1000.0,
+                        help="интервал между запросами одного клиента")
+    parser.add_argument("--delay-ms", type=float, default=5.0,
+                        help="имитация ожидания БД на каждый запрос")
+    parser.add_argument("--rows-per-session", type=int, default=20)
+    parser.add_argument("--filler-rows", type=int, default=100_000)
+    parser.add_argument("--pool-size", type=int, default=30)
+    parser.add_argument("--db-url", type=str, default=None)
+    args = parser.parse_args()
+
+    # Метрики пишутся в fakeredis: настоящий Redis для бенчмарка не нужен
+    metrics.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        pool = {"pool_size": args.pool_size, "max_overflow": 0}
+        engine = create_engine(db_url, poolclass=QueuePool, json_serializer=compact_json, **pool)
+        Base.metadata.drop_all(bind=engine, tables=[LabeledData.__table__])
+        Base.metadata.create_all(bind=engine, tables=[LabeledData.__table__])
+        populate(engine, args.clients, args.rows_per_session, args.filler_rows)
+
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        async_engine = create_async_engine(
+            async_db_url(db_url), poolclass=AsyncAdaptedQueuePool, json_serializer=compact_json, **pool
+        )
+        AsyncSessionLocal = async_sessionmaker(
+            bind=async_engine, autoflush=False, expire_on_commit=False
+        )
+        if args.delay_ms:
+            inject_delay(engine, args.delay_ms / 1000, blocking=True)
+            inject_delay(async_engine.sync_engine, args.delay_ms / 1000, blocking=False)
+
+        interval = args.interval_ms / 1000
+
+        async def run(handler, session_factory):
+            # Прогрев пула соединений
+            await run_clients(handler, session_factory, args.pool_size, 1, interval, args.rows_per_session)
+            return await run_clients(
+                handler, session_factory, args.clients, args.requests, interval, args.rows_per_session
+            )
+
+        print(f"{args.clients} clients x {args.requests} requests every {args.interval_ms:.0f} ms, "
+              f"db delay {args.delay_ms:.0f} ms, pool {args.pool_size}")
+        print(f"{'session':>8} {'p50, ms':>9} {'p99, ms':>9} {'max, ms':>9} {'rps':>8}")
+        for name, handler, factory in (
+            ("sync", sync_request, SessionLocal),
+            ("async", async_request, AsyncSessionLocal),
+        ):
+            latencies, elapsed = asyncio.run(run(handler, factory))
+            p50, p99 = np.percentile(latencies, [50, 99])
+            print(f"{name:>8} {p50:>9.1f} {p99:>9.1f} {latencies.max():>9.1f} "
+                  f"{len(latencies) / elapsed:>8.0f}")
+
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пакетной разметки: поштучные ORM-вставки против INSERT ... RETURNING.
+
+По умолчанию используется временная SQLite база; для замера на PostgreSQL
+передайте --db-url.
+
+Запуск из каталога backend:
+    python benchmarks/bench_batch_labeling.py --sizes 100,1000,10000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import fakeredis
+from fastapi import Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.v1.endpoints.labeling import batch_labeling
+from app.core.database import Base, async_db_url, compact_json
+from app.core.monitoring import metrics
+from app.models.annotator_stats import AnnotatorStats
+from app.models.labeled_data import LabeledData
+from app.models.vector_clock import vector_clock_manager
+from app.schemas.labeling import BatchLabelingRequest, LabeledDataResponse
+
+
+def make_request(session_id: str, size: int) -> BatchLabelingRequest:
+    """Пакет из size меток с vector clocks трёх узлов"""
+    return BatchLabelingRequest(
+        session_id=session_id,
+        annotator_id="bench_annotator",
+        labels=[
+            {
+                "data_id": f"data_{i}",
+                "original_text": f"Sample text number {i}",
+                "label": "positive" if i % 2 else "negative",
+                "confidence": 0.9,
+                "vector_clock": {"master": i, f"replica{i % 2 + 1}": i // 2}
+            }
+            for i in range(size)
+        ]
+    )
+
+
+def legacy_batch(batch_request: BatchLabelingRequest, db):
+    """Прежняя реализация: add + commit, затем refresh и merge на каждую запись"""
+    results = []
+    for label_data in batch_request.labels:
+        db_labeled_data = LabeledData(
+            session_id=batch_request.session_id,
+            annotator_id=batch_request.annotator_id,
+            data_id=label_data.get('data_id'),
+            original_text=label_data.get('original_text'),
+            label=label_data.get('label'),
+            confidence=label_data.get('confidence', 0.0),
+            vector_clock=label_data.get('vector_clock', {})
+        )
+        db.add(db_labeled_data)
+        results.append(db_labeled_data)
+    db.commit()
+
+    for result in results:
+        db.refresh(result)
+        vector_clock_manager.merge_clocks(batch_request.session_id, result.vector_clock)
+
+    return [
+        LabeledDataResponse(
+            id=item.id,
+            session_id=item.session_id,
+            annotator_id=item.annotator_id,
+            data_id=item.data_id,
+            original_text=item.original_text,
+            label=item.label,
+            confidence=item.confidence,
+            vector_clock=item.vector_clock,
+            created_at=item.created_at,
+            updated_at=item.updated_at,
+            is_conflict=item.is_conflict,
+            conflict_resolution=item.conflict_resolution
+        )
+        for item in results
+    ]
+
+
+async def bulk_batch(batch_request: BatchLabelingRequest, session_factory):
+    """Текущая реализация эндпоинта на асинхронной сессии"""
+    async with session_factory() as db:
+        return await batch_labeling(batch_request, response=Response(), db=db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=str, default="100,1000,10000")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--db-url", type=str, default=None)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    # Метрики пишутся в fakeredis: настоящий Redis для бенчмарка не нужен
+    metrics.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_engine(db_url, json_serializer=compact_json)
+        Base.metadata.create_all(bind=engine, tables=[LabeledData.__table__, AnnotatorStats.__table__])
+        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        async_engine = create_async_engine(async_db_url(db_url), json_serializer=compact_json)
+        AsyncSessionLocal = async_sessionmaker(
+            bind=async_engine, autoflush=False, expire_on_commit=False
+        )
+
+        statements = {"count": 0}
+
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            statements["count"] += 1
+
+        event.listen(engine, "before_cursor_execute", count_statements)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", count_statements)
+
+        print(f"{'batch':>7} {'legacy, ms':>11} {'stmts':>7} {'bulk, ms':>10} {'stmts':>7} {'speedup':>8}")
+        for size in sizes:
+            timings = {}
+            for name in ("legacy", "bulk"):
+                best = None
+                for repeat in range(args.repeats):
+                    request = make_request(f"bench-{name}-{size}-{repeat}", size)
+                    statements["count"] = 0
+                    start = time.perf_counter()
+                    if name == "legacy":
+                        db = SessionLocal()
+                        legacy_batch(request, db)
+                        db.close()
+                    else:
+                        asyncio.run(bulk_batch(request, AsyncSessionLocal))
+                    elapsed = (time.perf_counter() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[name] = (best, statements["count"])
+
+            legacy_ms, legacy_statements = timings["legacy"]
+            bulk_ms, bulk_statements = timings["bulk"]
+            print(f"{size:>7} {legacy_ms:>11.1f} {legacy_statements:>7} "
+                  f"{bulk_ms:>10.1f} {bulk_statements:>7} {legacy_ms / bulk_ms:>7.1f}x")
+
+        engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+
+if __name__ == "__main__":
+    main()
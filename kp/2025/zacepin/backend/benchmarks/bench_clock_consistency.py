@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк проверки vector clocks: попарное сравнение против ClockMatrix.
+
+Запуск из каталога backend:
+    python benchmarks/bench_clock_consistency.py --records 50000 --nodes 3
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.vector_clock import vector_clock_manager
+from app.services.vector_clock_engine import check_concurrency
+
+
+def generate_clocks(records: int, nodes: int, max_value: int):
+    """Сгенерировать clocks сессии"""
+    rng = random.Random(42)
+    node_ids = [f"node{k}" for k in range(nodes)]
+    return [
+        {node: rng.randint(0, max_value) for node in node_ids}
+        for _ in range(records)
+    ]
+
+
+def pairwise_count(clocks):
+    """Исходный алгоритм: сравнение каждой пары"""
+    count = 0
+    for i, clock1 in enumerate(clocks):
+        for clock2 in clocks[i + 1:]:
+            if vector_clock_manager.compare_clocks(clock1, clock2) == "concurrent":
+                count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=50_000)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--max-value", type=int, default=30)
+    parser.add_argument("--pairwise-records", type=int, default=2_000,
+                        help="размер выборки для попарного алгоритма")
+    args = parser.parse_args()
+
+    clocks = generate_clocks(args.records, args.nodes, args.max_value)
+
+    sample = clocks[:args.pairwise_records]
+    start = time.perf_counter()
+    pairwise_count(sample)
+    pairwise_s = time.perf_counter() - start
+    scale = (args.records / len(sample)) ** 2
+    print(f"pairwise, {len(sample)} records: {pairwise_s:.2f} s "
+          f"(~{pairwise_s * scale:.0f} s extrapolated to {args.records})")
+
+    for count_only in (True, False):
+        start = time.perf_counter()
+        result = check_concurrency(clocks, max_issues=1000, count_only=count_only)
+        label = "count only" if count_only else "with issues"
+        print(f"ClockMatrix {label}, {args.records} records: "
+              f"{time.perf_counter() - start:.2f} s, "
+              f"{result['concurrent_pairs']} concurrent pairs")
+
+
+if __name__ == "__main__":
+    main()
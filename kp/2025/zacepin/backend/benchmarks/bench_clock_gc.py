@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Soak-симуляция vector clocks: 7 дней модельного времени со сборкой мусора и без.
+
+Каждый час открываются новые короткие сессии, часть сессий живёт всю неделю,
+реплики периодически сменяются. Печатается число clocks, их объём и память
+процесса (tracemalloc) по дням.
+
+Запуск из каталога backend:
+    python benchmarks/bench_clock_gc.py --days 7 --sessions-per-hour 100
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+import fakeredis
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.clock_store import InMemoryClockStore
+from app.core.config import settings
+from app.core.monitoring import metrics
+from app.models.vector_clock import VectorClockManager
+
+
+class SimulatedTime:
+    """Модельное время вместо time.time"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def simulate(args, gc_enabled: bool):
+    """Прогнать симуляцию и вернуть статистику по дням"""
+    clock = SimulatedTime()
+    manager = VectorClockManager(InMemoryClockStore(time_func=clock))
+    step = 3600 // args.gc_per_hour
+    daily = []
+
+    tracemalloc.start()
+    for hour in range(args.days * 24):
+        replica = hour // args.replica_lifetime_hours
+        for tick in range(args.gc_per_hour):
+            clock.now += step
+            for k in range(args.sessions_per_hour // args.gc_per_hour):
+                session_id = f"s{hour}-{tick}-{k}"
+                for event in range(args.events_per_session):
+                    manager.increment_clock(session_id, f"replica{replica + event % 3}")
+            for k in range(args.long_sessions):
+                manager.increment_clock(f"long-{k}", f"replica{replica + tick % 3}")
+                manager.merge_clocks(f"long-{k}", {f"annotator-{hour}": tick + 1})
+
+            if gc_enabled:
+                stats = manager.cleanup_old_clocks()
+
+        if (hour + 1) % 24 == 0:
+            if not gc_enabled:
+                stats = {"clocks_held": len(manager.clocks), "bytes_used": 0, "entries_pruned": 0}
+            current, _ = tracemalloc.get_traced_memory()
+            longest = max((len(manager.get_clock(f"long-{k}")) for k in range(args.long_sessions)), default=0)
+            daily.append((stats["clocks_held"], stats["bytes_used"], longest, current / 1024 / 1024))
+    tracemalloc.stop()
+
+    return daily
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--sessions-per-hour", type=int, default=100)
+    parser.add_argument("--events-per-session", type=int, default=20)
+    parser.add_argument("--long-sessions", type=int, default=20)
+    parser.add_argument("--replica-lifetime-hours", type=int, default=2)
+    parser.add_argument("--gc-per-hour", type=int, default=4)
+    args = parser.parse_args()
+
+    settings.vector_clock_ttl = 6 * 3600
+    settings.vector_clock_node_ttl = 3600
+    # Метрики пишутся в fakeredis: настоящий Redis для симуляции не нужен
+    metrics.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    for gc_enabled in (False, True):
+        print(f"GC {'enabled' if gc_enabled else 'disabled'}")
+        print(f"{'day':>4} {'clocks':>8} {'bytes':>10} {'long clock':>11} {'heap MB':>8}")
+        for day, (held, used_bytes, longest, heap) in enumerate(simulate(args, gc_enabled), start=1):
+            print(f"{day:>4} {held:>8} {used_bytes:>10} {longest:>11} {heap:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
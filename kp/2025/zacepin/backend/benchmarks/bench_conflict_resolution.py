@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк разрешения конфликтов: загрузка строк в Python и поштучный
+db.delete против оконной функции и пакетных DELETE / UPDATE в БД.
+
+По умолчанию используется временная SQLite база; для замера на PostgreSQL
+передайте --db-url. Прежняя реализация на 100k конфликтов работает минутами,
+поэтому она замеряется на --legacy-conflicts строках.
+
+Запуск из каталога backend:
+    python benchmarks/bench_conflict_resolution.py --conflicts 100000 --legacy-conflicts 10000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import fakeredis
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import Base
+from app.core.monitoring import metrics
+from app.models.annotator_stats import AnnotatorStats
+from app.models.labeled_data import LabeledData
+from app.services.consistency_service import ConsistencyService
+
+SESSION_ID = "bench_session"
+
+
+def fill(db, conflicts: int):
+    """conflicts лишних записей: по две конфликтующие записи на data_id"""
+    start = datetime(2025, 1, 1)
+    rows = [
+        {
+            "session_id": SESSION_ID,
+            "annotator_id": f"annotator_{copy}",
+            "data_id": f"data_{i:08d}",
+            "original_text": f"Sample text number {i}",
+            "label": "positive" if copy else "negative",
+            "confidence": 0.5 + copy * 0.25,
+            "vector_clock": {"master": i},
+            "updated_at": start + timedelta(seconds=i * 2 + copy),
+            "is_conflict": True
+        }
+        for i in range(conflicts)
+        for copy in range(2)
+    ]
+    for offset in range(0, len(rows), 10_000):
+        db.execute(insert(LabeledData), rows[offset:offset + 10_000])
+    db.commit()
+
+
+def legacy_last_write_wins(db) -> int:
+    """Прежняя реализация: все конфликтные строки в Python, удаление по одной"""
+    conflicts = db.query(LabeledData).filter(
+        LabeledData.session_id == SESSION_ID,
+        LabeledData.is_conflict == True
+    ).all()
+
+    data_groups = {}
+    for conflict in conflicts:
+        data_groups.setdefault(conflict.data_id, []).append(conflict)
+
+    resolved = 0
+    for items in data_groups.values():
+        latest_item = max(items, key=lambda x: x.updated_at)
+        for item in items:
+            if item.id != latest_item.id:
+                db.delete(item)
+                resolved += 1
+            else:
+                item.is_conflict = False
+                item.conflict_resolution = 'last_write_wins'
+
+    db.commit()
+    return resolved
+
+
+def run(db_url: str, conflicts: int, legacy: bool) -> float:
+    engine = create_engine(db_url)
+    Base.metadata.drop_all(bind=engine, tables=[LabeledData.__table__, AnnotatorStats.__table__])
+    Base.metadata.create_all(bind=engine, tables=[LabeledData.__table__, AnnotatorStats.__table__])
+    db = sessionmaker(bind=engine)()
+    try:
+        fill(db, conflicts)
+        start = time.perf_counter()
+        if legacy:
+            resolved = legacy_last_write_wins(db)
+        else:
+            resolved = ConsistencyService().resolve_conflicts(SESSION_ID, "last_write_wins", db)["resolved"]
+        elapsed = time.perf_counter() - start
+        assert resolved == conflicts
+        assert db.query(LabeledData).count() == conflicts
+        return elapsed
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conflicts", type=int, default=100_000)
+    parser.add_argument("--legacy-conflicts", type=int, default=10_000)
+    parser.add_argument("--db-url", type=str, default=None)
+    args = parser.parse_args()
+
+    metrics.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        print(f"{'mode':>10} {'conflicts':>10} {'total, s':>9} {'per 100k, s':>12}")
+        for mode, conflicts in (("legacy", args.legacy_conflicts), ("set-based", args.conflicts)):
+            elapsed = run(db_url, conflicts, legacy=mode == "legacy")
+            print(f"{mode:>10} {conflicts:>10} {elapsed:>9.2f} {elapsed * 100_000 / conflicts:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
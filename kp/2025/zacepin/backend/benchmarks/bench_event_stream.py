@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест push-потока событий разметки: --clients SSE-клиентов на
+--sessions сессиях держат HTTP-соединения с uvicorn, события публикуются
+с заданной частотой, замеряется задержка доставки (публикация -> получение
+клиентом) и проверяется возобновление по Last-Event-ID.
+
+Сервер работает в отдельном потоке того же процесса, клиенты - httpx в
+основном event loop. По умолчанию поток событий в памяти процесса;
+--store redis использует RedisEventStream поверх fakeredis (одна подписка
+на канал, история в Redis Streams).
+
+Запуск из каталога backend:
+    python benchmarks/bench_event_stream.py --clients 1000 --sessions 50 --events 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+import fakeredis
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.v1.endpoints import labeling
+from app.core.event_stream import EventStream, RedisEventStream
+from app.core.monitoring import metrics
+
+
+class Client:
+    """SSE-клиент: запоминает id последнего события и задержки доставки"""
+
+    def __init__(self, http: httpx.AsyncClient, url: str):
+        self.http = http
+        self.url = url
+        self.last_id = None
+        self.received = 0
+        self.latencies = []
+        self.connected = asyncio.Event()
+
+    async def run(self):
+        headers = {"Last-Event-ID": self.last_id} if self.last_id else {}
+        async with self.http.stream("GET", self.url, headers=headers) as response:
+            self.connected.set()
+            event_id = None
+            async for line in response.aiter_lines():
+                if line.startswith("id: "):
+                    event_id = line[4:]
+                elif line.startswith("data: ") and event_id:
+                    sent = json.loads(line[6:])["t"]
+                    self.latencies.append(time.perf_counter() - sent)
+                    self.last_id = event_id
+                    self.received += 1
+                    event_id = None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int) -> uvicorn.Server:
+    app = FastAPI()
+    app.include_router(labeling.router, prefix="/api/v1/labeling")
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="127.0.0.1", port=port, log_level="warning", lifespan="off", backlog=4096
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+async def wait_until(predicate, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("load test did not converge")
+        await asyncio.sleep(0.01)
+
+
+async def publish(stream: EventStream, sessions: int, events: int, rate: float) -> dict:
+    """events публикаций по кругу сессий с частотой rate в секунду"""
+    published = {}
+    for n in range(events):
+        session_id = f"session_{n % sessions}"
+        await stream.publish(session_id, [("label_created", {"n": n, "t": time.perf_counter()})])
+        published[session_id] = published.get(session_id, 0) + 1
+        await asyncio.sleep(1 / rate)
+    return published
+
+
+async def run(args, stream: EventStream, publisher: EventStream, base_url: str):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as http:
+        clients = [
+            Client(http, f"{base_url}/api/v1/labeling/stream/session_{i % args.sessions}")
+            for i in range(args.clients)
+        ]
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        await wait_until(lambda: stream.connections() == args.clients)
+        connect_seconds = time.perf_counter() - start
+
+        published = await publish(publisher, args.sessions, args.events, args.rate)
+        expected = [published.get(f"session_{i % args.sessions}", 0) for i in range(args.clients)]
+        await wait_until(lambda: all(c.received == e for c, e in zip(clients, expected)))
+        latencies = sorted(latency for client in clients for latency in client.latencies)
+
+        # Возобновление: часть клиентов отключается, пропускает события и
+        # переподключается с Last-Event-ID
+        resumed = clients[:max(1, args.clients // 10)]
+        for client in resumed:
+            tasks[clients.index(client)].cancel()
+        await wait_until(lambda: stream.connections() == args.clients - len(resumed))
+        missed = await publish(publisher, args.sessions, args.sessions * 2, args.rate)
+        for client in resumed:
+            client.received = 0
+            tasks[clients.index(client)] = asyncio.create_task(client.run())
+        await wait_until(lambda: all(
+            client.received == missed.get(f"session_{clients.index(client) % args.sessions}", 0)
+            for client in resumed
+        ))
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    deliveries = sum(expected)
+    print(f"store={args.store} clients={args.clients} sessions={args.sessions} events={args.events}")
+    print(f"  connect {args.clients} clients: {connect_seconds:.2f} s")
+    print(f"  deliveries: {deliveries} ({deliveries / args.events:.0f} per event)")
+    print(
+        f"  latency ms: p50 {statistics.median(latencies) * 1000:.2f}"
+        f"  p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}"
+        f"  p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}"
+        f"  max {latencies[-1] * 1000:.2f}"
+    )
+    print(f"  resumed {len(resumed)} clients via Last-Event-ID without loss")
+    print(f"  equivalent polling load at {args.poll_interval:.0f} s interval: "
+          f"{2 * args.clients / args.poll_interval:.0f} req/s (session + conflicts)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=100.0, help="публикаций в секунду")
+    parser.add_argument("--store", choices=["memory", "redis"], default="memory")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    args = parser.parse_args()
+
+    # Метрики пишутся в fakeredis: настоящий Redis для бенчмарка не нужен
+    metrics.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    if args.store == "redis":
+        # Клиент redis.asyncio привязан к своему event loop: бенчмарк публикует
+        # отдельным потоком на том же сервере, как другой worker
+        server = fakeredis.FakeServer()
+        stream = RedisEventStream(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+        publisher = RedisEventStream(fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    else:
+        stream = publisher = EventStream()
+    labeling.event_stream = stream
+
+    port = free_port()
+    server = start_server(port)
+    try:
+        asyncio.run(run(args, stream, publisher, f"http://127.0.0.1:{port}"))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк постраничного чтения CSV: полный разбор pandas против индекса смещений.
+
+Запуск из каталога backend:
+    python benchmarks/bench_file_pages.py --rows 2000000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.csv_index import CSVRowIndex
+
+
+def generate_csv(path: str, rows: int):
+    """Сгенерировать синтетический датасет для разметки"""
+    chunk = 200_000
+    for start in range(0, rows, chunk):
+        ids = np.arange(start, min(start + chunk, rows))
+        df = pd.DataFrame({
+            "data_id": ids,
+            "text": [f"Sample text number {i}, with some words" for i in ids],
+            "label": np.where(ids % 3 == 0, "positive", "negative")
+        })
+        df.to_csv(path, mode="a", header=start == 0, index=False)
+
+
+def measure(func, repeats: int) -> float:
+    """Медианное время выполнения в миллисекундах"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--skip-full", action="store_true", help="не измерять полный разбор")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.csv")
+        generate_csv(path, args.rows)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"File: {args.rows} rows, {size_mb:.1f} MB")
+
+        start = time.perf_counter()
+        index = CSVRowIndex.build(path)
+        print(f"Index build: {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"{len(index.offsets)} offsets")
+
+        print(f"{'offset':>12} {'indexed, ms':>12} {'full parse, ms':>15}")
+        for fraction in (0.0, 0.1, 0.5, 0.9, 0.999):
+            offset = int(args.rows * fraction)
+            indexed = measure(lambda: index.read_rows(offset, args.limit), args.repeats)
+            if args.skip_full:
+                full = float("nan")
+            else:
+                full = measure(
+                    lambda: pd.read_csv(path).iloc[offset:offset + args.limit],
+                    1
+                )
+            print(f"{offset:>12} {indexed:>12.2f} {full:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
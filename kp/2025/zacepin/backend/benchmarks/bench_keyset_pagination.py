@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк глубоких страниц разметки сессии: OFFSET/LIMIT против курсора
+по индексу (session_id, id).
+
+В базе одна большая сессия (--labels записей) и записи других сессий;
+замеряется латентность страницы эндпоинта get_labeled_data_by_session на
+разной глубине. По умолчанию используется временная SQLite база; для замера
+на PostgreSQL передайте --db-url.
+
+Запуск из каталога backend:
+    python benchmarks/bench_keyset_pagination.py --labels 100000 --page-size 100
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import fakeredis
+from fastapi import Response
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.api.v1.endpoints.labeling import get_labeled_data_by_session
+from app.core.database import Base, async_db_url, compact_json
+from app.core.monitoring import metrics
+from app.core.pagination import encode_cursor
+from app.models.labeled_data import LabeledData
+
+SESSION_ID = "bench_session"
+
+
+def fill(engine, labels: int, other_sessions: int):
+    """labels записей в SESSION_ID вперемешку с записями других сессий"""
+    with engine.begin() as conn:
+        for offset in range(0, labels, 10_000):
+            rows = []
+            for i in range(offset, min(offset + 10_000, labels)):
+                for session in [SESSION_ID] + [f"other_{s}" for s in range(other_sessions)]:
+                    rows.append({
+                        "session_id": session,
+                        "annotator_id": "bench_annotator",
+                        "data_id": f"data_{i}",
+                        "original_text": f"Sample text number {i}",
+                        "label": "positive" if i % 2 else "negative",
+                        "confidence": 0.9,
+                        "vector_clock": {"master": i}
+                    })
+            conn.execute(insert(LabeledData), rows)
+
+
+async def fetch_page(session_factory, page_size: int, offset: int = 0, cursor: str = None):
+    async with session_factory() as db:
+        return await get_labeled_data_by_session(
+            SESSION_ID, response=Response(), limit=page_size, offset=offset, cursor=cursor, db=db
+        )
+
+
+async def measure(session_factory, page_size: int, pages, repeats: int):
+    """Лучшее время страницы (мс) для offset и курсора на каждой глубине"""
+    async with session_factory() as db:
+        ids = (await db.scalars(
+            select(LabeledData.id).where(LabeledData.session_id == SESSION_ID).order_by(LabeledData.id)
+        )).all()
+
+    results = []
+    for page in pages:
+        offset = page * page_size
+        cursor = encode_cursor(SESSION_ID, ids[offset - 1]) if offset else None
+        timings = {}
+        for name, kwargs in (("offset", {"offset": offset}), ("cursor", {"cursor": cursor})):
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                rows = await fetch_page(session_factory, page_size, **kwargs)
+                elapsed = (time.perf_counter() - start) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            assert json.loads(rows.body)[0]["id"] == ids[offset]
+            timings[name] = best
+        results.append((page, timings["offset"], timings["cursor"]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--labels", type=int, default=100_000)
+    parser.add_argument("--other-sessions", type=int, default=1)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--db-url", type=str, default=None)
+    args = parser.parse_args()
+
+    # Метрики пишутся в fakeredis: настоящий Redis для бенчмарка не нужен
+    metrics.redis_client = fakeredis.FakeRedis(decode_responses=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_engine(db_url, json_serializer=compact_json)
+        Base.metadata.drop_all(bind=engine, tables=[LabeledData.__table__])
+        Base.metadata.create_all(bind=engine, tables=[LabeledData.__table__])
+        fill(engine, args.labels, args.other_sessions)
+        async_engine = create_async_engine(async_db_url(db_url), json_serializer=compact_json)
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+        last_page = args.labels // args.page_size - 1
+        pages = sorted({0, 10, last_page // 10, last_page // 2, last_page})
+        results = asyncio.run(measure(AsyncSessionLocal, args.page_size, pages, args.repeats))
+
+        print(f"{args.labels} labels, page size {args.page_size}")
+        print(f"{'page':>7} {'offset, ms':>11} {'cursor, ms':>11} {'speedup':>8}")
+        for page, offset_ms, cursor_ms in results:
+            print(f"{page:>7} {offset_ms:>11.2f} {cursor_ms:>11.2f} {offset_ms / cursor_ms:>7.1f}x")
+
+        engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+
+if __name__ == "__main__":
+    main()
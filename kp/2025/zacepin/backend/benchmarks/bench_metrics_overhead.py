@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк накладных расходов monitor_performance: запись метрик в Redis
+на каждый запрос против буфера в памяти с фоновым сбросом одним pipeline.
+
+По умолчанию поднимается TCP fakeredis на localhost (реальные round trip
+по сети, но медленнее настоящего Redis); для замера на Redis передайте
+--redis-url.
+
+Запуск из каталога backend:
+    python benchmarks/bench_metrics_overhead.py --requests 5000
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+import redis
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.core.monitoring import metrics, monitor_performance
+
+
+class CountingRedis(redis.Redis):
+    """Клиент, считающий сетевые round trip: команды и выполнения pipeline"""
+
+    round_trips = 0
+
+    def execute_command(self, *args, **kwargs):
+        CountingRedis.round_trips += 1
+        return super().execute_command(*args, **kwargs)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction, shard_hint)
+        execute = pipe.execute
+
+        def counted_execute(*args, **kwargs):
+            CountingRedis.round_trips += 1
+            return execute(*args, **kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+
+@monitor_performance("bench_endpoint")
+async def endpoint():
+    """Пустой эндпоинт: измеряются только расходы на метрики"""
+    return None
+
+
+async def run(requests: int):
+    """Вызвать эндпоинт requests раз и вернуть задержки в микросекундах"""
+    latencies = np.empty(requests)
+    for i in range(requests):
+        start = time.perf_counter()
+        await endpoint()
+        latencies[i] = time.perf_counter() - start
+    return latencies * 1e6
+
+
+def start_fake_server():
+    from fakeredis import TcpFakeServer
+
+    class NoDelayServer(TcpFakeServer):
+        """Как настоящий Redis, отвечает без задержки Nagle"""
+
+        def get_request(self):
+            connection, address = super().get_request()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return connection, address
+
+    server = NoDelayServer(("127.0.0.1", 0), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"redis://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--redis-url", type=str, default=None)
+    args = parser.parse_args()
+
+    server = None
+    redis_url = args.redis_url
+    if redis_url is None:
+        server, redis_url = start_fake_server()
+    client = CountingRedis.from_url(redis_url, decode_responses=True)
+    metrics.redis_client = client
+    settings.metrics_flush_interval = args.flush_interval
+
+    print(f"{args.requests} requests, redis {redis_url}")
+    print(f"{'mode':>9} {'p50, us':>9} {'p99, us':>9} {'total, s':>9} {'round trips':>12}")
+    for mode in ("direct", "buffered"):
+        client.flushdb()
+        CountingRedis.round_trips = 0
+        if mode == "buffered":
+            metrics.start()
+        start = time.perf_counter()
+        latencies = asyncio.run(run(args.requests))
+        total = time.perf_counter() - start
+        if mode == "buffered":
+            metrics.stop()
+        round_trips = CountingRedis.round_trips
+
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{mode:>9} {p50:>9.1f} {p99:>9.1f} {total:>9.2f} {round_trips:>12}")
+
+        counter = client.get(f"{metrics.metrics_prefix}counter:bench_endpoint.success")
+        assert int(counter) == args.requests
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
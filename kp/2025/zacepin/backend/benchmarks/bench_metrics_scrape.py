@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк чтения метрик (/monitoring/metrics): KEYS по шаблонам и GET на
+каждый ключ против реестра метрик (SMEMBERS + pipeline MGET / HGETALL).
+
+В Redis лежит фиксированный набор метрик и растущее число посторонних
+ключей (сессии, кэш): стоимость KEYS растёт с размером keyspace, стоимость
+чтения по реестру от него не зависит.
+
+Запуск из каталога backend:
+    python benchmarks/bench_metrics_scrape.py --keys 1000 10000 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.monitoring import metrics
+
+from bench_metrics_overhead import CountingRedis, start_fake_server
+
+
+def keys_scrape(client, prefix: str):
+    """Прежний способ: KEYS по каждому типу, GET на ключ, окно гистограммы на метрику"""
+    result = {}
+    for kind in ("counter", "gauge"):
+        for key in client.keys(f"{prefix}{kind}:*"):
+            result[key] = client.get(key)
+    names = {key[len(f"{prefix}hist:"):].rsplit(":", 1)[0] for key in client.keys(f"{prefix}hist:*")}
+    for name in names:
+        result[name] = metrics.timing_stats(name, window=300)
+    return result
+
+
+def fill(client, unrelated: int, metric_names: int):
+    """Посторонние ключи и metric_names метрик каждого типа"""
+    pipe = client.pipeline(transaction=False)
+    for i in range(unrelated):
+        pipe.set(f"session:{i}", "x")
+        if len(pipe) >= 10_000:
+            pipe.execute()
+    pipe.execute()
+
+    metrics.buffered = True
+    for i in range(metric_names):
+        metrics.increment_counter(f"requests_{i}")
+        metrics.set_gauge(f"active_{i}", i)
+        metrics.record_timing(f"latency_{i}", 0.001 * (i + 1))
+    metrics.flush()
+    metrics.buffered = False
+
+
+def measure(func, repeat: int):
+    """Медиана времени вызова (мс) и round trip на вызов"""
+    timings = []
+    CountingRedis.round_trips = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return np.median(timings) * 1000, CountingRedis.round_trips / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--metrics", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--redis-url", type=str, default=None)
+    args = parser.parse_args()
+
+    server = None
+    redis_url = args.redis_url
+    if redis_url is None:
+        server, redis_url = start_fake_server()
+    client = CountingRedis.from_url(redis_url, decode_responses=True)
+    metrics.redis_client = client
+
+    print(f"{args.metrics} metrics of each kind, redis {redis_url}")
+    print(f"{'keys':>8} {'KEYS, ms':>10} {'trips':>7} {'registry, ms':>13} {'trips':>7}")
+    for unrelated in args.keys:
+        client.flushdb()
+        fill(client, unrelated, args.metrics)
+
+        keys_ms, keys_trips = measure(lambda: keys_scrape(client, metrics.metrics_prefix), args.repeat)
+        registry_ms, registry_trips = measure(lambda: metrics.snapshot(window=300), args.repeat)
+        print(f"{unrelated:>8} {keys_ms:>10.1f} {keys_trips:>7.0f} {registry_ms:>13.1f} {registry_trips:>7.0f}")
+
+        snapshot = metrics.snapshot(window=300)
+        assert len(snapshot["counters"]) == len(snapshot["gauges"]) == len(snapshot["timings"]) == args.metrics
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
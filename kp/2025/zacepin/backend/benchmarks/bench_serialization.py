@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк сериализации страниц разметки: прежний путь (ORM-объекты ->
+LabeledDataResponse -> валидация response_model и JSONResponse FastAPI)
+против выборки кортежами и кодирования сразу в JSON-байты (orjson).
+
+Замеряется отдельно сериализация готовых строк и выборка + сериализация
+страницы из базы. По умолчанию используется временная SQLite база; для
+замера на PostgreSQL передайте --db-url.
+
+Запуск из каталога backend:
+    python benchmarks/bench_serialization.py --page-size 1000
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import Base, async_db_url, compact_json
+from app.core.serialization import LABELED_DATA_COLUMNS, labeled_data_json
+from app.models.labeled_data import LabeledData
+from app.schemas.labeling import LabeledDataResponse
+
+SESSION_ID = "bench_session"
+
+RESPONSE_FIELD = create_response_field(name="response", type_=List[LabeledDataResponse])
+
+
+def fill(engine, rows: int):
+    with engine.begin() as conn:
+        conn.execute(insert(LabeledData), [
+            {
+                "session_id": SESSION_ID,
+                "annotator_id": f"annotator_{i % 20}",
+                "data_id": f"data_{i}",
+                "original_text": f"Sample text number {i} with some words to label",
+                "label": "positive" if i % 2 else "negative",
+                "confidence": (i % 100) / 100,
+                "vector_clock": {"master": i, "replica1": i // 2, "replica2": i // 3}
+            }
+            for i in range(rows)
+        ])
+
+
+async def legacy_encode(items) -> bytes:
+    """Прежний путь эндпоинта: модели по полям, затем сериализация FastAPI"""
+    result = [
+        LabeledDataResponse(
+            id=item.id,
+            session_id=item.session_id,
+            annotator_id=item.annotator_id,
+            data_id=item.data_id,
+            original_text=item.original_text,
+            label=item.label,
+            confidence=item.confidence,
+            vector_clock=item.vector_clock,
+            created_at=item.created_at,
+            updated_at=item.updated_at,
+            is_conflict=item.is_conflict,
+            conflict_resolution=item.conflict_resolution
+        )
+        for item in items
+    ]
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=result)
+    return JSONResponse(content).body
+
+
+async def legacy_page(db, limit: int) -> bytes:
+    items = (await db.scalars(
+        select(LabeledData).where(LabeledData.session_id == SESSION_ID).order_by(LabeledData.id).limit(limit)
+    )).all()
+    return await legacy_encode(items)
+
+
+async def fast_page(db, limit: int) -> bytes:
+    rows = (await db.execute(
+        select(*LABELED_DATA_COLUMNS).where(LabeledData.session_id == SESSION_ID).order_by(LabeledData.id).limit(limit)
+    )).all()
+    return labeled_data_json(rows)
+
+
+async def best_of(repeats: int, func, *args) -> float:
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def measure(session_factory, page_size: int, repeats: int):
+    async with session_factory() as db:
+        items = (await db.scalars(select(LabeledData).limit(page_size))).all()
+        rows = (await db.execute(select(*LABELED_DATA_COLUMNS).limit(page_size))).all()
+
+        async def fast_encode(rows):
+            return labeled_data_json(rows)
+
+        # Оба пути дают одинаковые байты
+        assert await legacy_encode(items) == await fast_encode(rows)
+
+        results = [
+            ("serialize", await best_of(repeats, legacy_encode, items), await best_of(repeats, fast_encode, rows)),
+            ("fetch+serialize", await best_of(repeats, legacy_page, db, page_size),
+             await best_of(repeats, fast_page, db, page_size)),
+        ]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--db-url", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = args.db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_engine(db_url, json_serializer=compact_json)
+        Base.metadata.drop_all(bind=engine, tables=[LabeledData.__table__])
+        Base.metadata.create_all(bind=engine, tables=[LabeledData.__table__])
+        fill(engine, args.page_size)
+        async_engine = create_async_engine(async_db_url(db_url), json_serializer=compact_json)
+        AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+        results = asyncio.run(measure(AsyncSessionLocal, args.page_size, args.repeats))
+
+        print(f"page of {args.page_size} labels")
+        print(f"{'step':>16} {'legacy, ms':>11} {'orjson, ms':>11} {'speedup':>8}")
+        for step, legacy_ms, fast_ms in results:
+            print(f"{step:>16} {legacy_ms:>11.2f} {fast_ms:>11.2f} {legacy_ms / fast_ms:>7.1f}x")
+
+        engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк форматов хранения датасетов: CSV с индексом смещений против Arrow IPC.
+
+Для каждого формата страницы читаются в отдельном процессе, чтобы пиковый
+RSS одного формата не влиял на другой.
+
+Запуск из каталога backend:
+    python benchmarks/bench_storage_formats.py --rows 2000000 --columns text
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Добавление пути к приложению
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.services.csv_index import CSVRowIndex
+from app.services.dataset_storage import ArrowDataset, open_dataset
+
+from bench_file_pages import generate_csv
+
+
+def run_format(storage_format, path, offsets, limit, columns, repeats, queue):
+    """Измерить латентность страниц и пиковый RSS в отдельном процессе"""
+    settings.storage_format = storage_format
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    dataset = open_dataset(path)
+    open_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for offset in offsets:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            dataset.read_rows(offset, limit, columns)
+            timings.append((time.perf_counter() - start) * 1000)
+        latencies.append(float(np.median(timings)))
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((open_ms, latencies, (rss_after - rss_before) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--columns", type=str, default=None, help="колонки через запятую")
+    args = parser.parse_args()
+    columns = args.columns.split(",") if args.columns else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.csv")
+        generate_csv(path, args.rows)
+        print(f"File: {args.rows} rows, {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+        start = time.perf_counter()
+        CSVRowIndex.build(path)
+        print(f"CSV index build: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        start = time.perf_counter()
+        ArrowDataset.convert(path)
+        print(f"Arrow conversion: {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"{os.path.getsize(ArrowDataset.arrow_path_for(path)) / 1024 / 1024:.1f} MB")
+
+        offsets = [int(args.rows * f) for f in (0.0, 0.1, 0.5, 0.9, 0.999)]
+        results = {}
+        for storage_format in ("csv", "arrow"):
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=run_format,
+                args=(storage_format, path, offsets, args.limit, columns, args.repeats, queue)
+            )
+            process.start()
+            results[storage_format] = queue.get()
+            process.join()
+
+        print(f"{'':>12} {'csv':>10} {'arrow':>10}")
+        print(f"{'open, ms':>12} {results['csv'][0]:>10.2f} {results['arrow'][0]:>10.2f}")
+        for i, offset in enumerate(offsets):
+            print(f"{offset:>12} {results['csv'][1][i]:>10.2f} {results['arrow'][1][i]:>10.2f}")
+        print(f"{'RSS +MB':>12} {results['csv'][2]:>10.1f} {results['arrow'][2]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
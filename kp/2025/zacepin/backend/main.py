@@ -5,9 +5,12 @@ import uvicorn
 from contextlib import asynccontextmanager
 
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import db_manager, init_db
+from app.core.event_stream import event_stream
 from app.api.v1.api import api_router
-from app.core.monitoring import setup_monitoring
+from app.core.monitoring import metrics, setup_monitoring
+from app.models.vector_clock import vector_clock_manager
+from app.services.consistency_monitor import consistency_monitor
 
 
 @asynccontextmanager
@@ -15,9 +18,18 @@ async def lifespan(app: FastAPI):
     # Startup
     await init_db()
     setup_monitoring()
+    metrics.start()
+    vector_clock_manager.start()
+    db_manager.start()
+    consistency_monitor.start()
+    event_stream.start()
     yield
     # Shutdown
-    pass
+    await event_stream.stop()
+    consistency_monitor.stop()
+    await db_manager.stop()
+    vector_clock_manager.stop()
+    metrics.stop()
 
 
 app = FastAPI(
@@ -1,17 +1,30 @@
+import asyncio
+import tempfile
+from pathlib import Path
+
+import fakeredis
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from main import app
+from app.core.clock_store import InMemoryClockStore
+from app.core.config import settings
 from app.core.database import Base, get_db_write, get_db_read
+from app.core.event_stream import event_stream
+from app.core.monitoring import metrics
 from app.models.annotator_session import AnnotatorSession
 from app.models.labeled_data import LabeledData
+from app.models.vector_clock import vector_clock_manager
 
 
-# Создание тестовой базы данных в памяти
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+# Тестовая база во временном каталоге, а не в рабочей копии
+TEST_DB_DIR = tempfile.TemporaryDirectory()
+TEST_DB_PATH = Path(TEST_DB_DIR.name) / "test.db"
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{TEST_DB_PATH}"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
@@ -19,21 +32,24 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Эндпоинты работают с асинхронными сессиями (aiosqlite поверх того же файла)
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{TEST_DB_PATH}",
+    poolclass=StaticPool,
+)
+TestingAsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 
-def override_get_db_write():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db_write():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def override_get_db_read():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db_read():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db_write] = override_get_db_write
@@ -85,6 +101,22 @@ class TestSessionsAPI:
         assert data["session_id"] == session_id
         assert data["annotator_id"] == "test_annotator"
     
+    def test_session_token_grows_with_writes(self, setup_database):
+        """Записи сессии возвращают растущий high-water mark"""
+        create_response = client.post(
+            "/api/v1/sessions/create",
+            json={"annotator_id": "test_annotator"}
+        )
+        session_id = create_response.json()["session_id"]
+        first = int(create_response.headers["X-Session-Token"])
+        assert create_response.json()["session_token"] == first
+        
+        response = client.put(f"/api/v1/sessions/{session_id}/update-activity")
+        assert int(response.headers["X-Session-Token"]) > first
+        
+        response = client.get(f"/api/v1/sessions/{session_id}")
+        assert response.json()["session_token"] > first
+    
     def test_get_nonexistent_session(self, setup_database):
         """Тест получения несуществующей сессии"""
         response = client.get("/api/v1/sessions/nonexistent")
@@ -204,6 +236,41 @@ class TestLabelingAPI:
         assert len(data) == 1
         assert data[0]["label"] == "positive"
     
+    def test_cursor_pagination(self, setup_database):
+        """Keyset-страницы по курсору совпадают со страницами по offset"""
+        session_id = client.post(
+            "/api/v1/sessions/create",
+            json={"annotator_id": "test_annotator"}
+        ).json()["session_id"]
+        client.post("/api/v1/labeling/batch", json={
+            "session_id": session_id,
+            "annotator_id": "test_annotator",
+            "labels": [
+                {"data_id": f"data_{i}", "original_text": f"Text {i}", "label": "positive"}
+                for i in range(5)
+            ]
+        })
+        
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+            response = client.get(f"/api/v1/labeling/{session_id}", params=params)
+            assert response.status_code == 200
+            pages.append([item["data_id"] for item in response.json()])
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        
+        assert pages == [["data_0", "data_1"], ["data_2", "data_3"], ["data_4"]]
+        offset_page = client.get(f"/api/v1/labeling/{session_id}", params={"limit": 2, "offset": 2}).json()
+        assert [item["data_id"] for item in offset_page] == pages[1]
+        
+        # Испорченный курсор и курсор другой сессии отклоняются
+        assert client.get(f"/api/v1/labeling/{session_id}", params={"cursor": "garbage"}).status_code == 400
+        first = client.get(f"/api/v1/labeling/{session_id}", params={"limit": 2})
+        other = client.get("/api/v1/labeling/other_session", params={"cursor": first.headers["X-Next-Cursor"]})
+        assert other.status_code == 400
+    
     def test_update_labeled_data(self, setup_database):
         """Тест обновления разметки"""
         # Создание сессии и разметки
@@ -279,6 +346,73 @@ class TestLabelingAPI:
         assert data[0]["label"] == "positive"
         assert data[1]["label"] == "negative"
     
+    def test_batch_labeling_returns_rows_in_order(self, setup_database):
+        """Тест пакетной вставки: порядок ответа и объединённый vector clock"""
+        session_response = client.post(
+            "/api/v1/sessions/create",
+            json={"annotator_id": "test_annotator"}
+        )
+        session_id = session_response.json()["session_id"]
+        
+        labels = [
+            {
+                "data_id": f"data_{i}",
+                "original_text": f"Text {i}",
+                "label": "positive" if i % 2 else "negative",
+                "vector_clock": {"master": i, f"replica{i % 3}": i + 1}
+            }
+            for i in range(50)
+        ]
+        response = client.post("/api/v1/labeling/batch", json={
+            "session_id": session_id,
+            "annotator_id": "test_annotator",
+            "labels": labels
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["data_id"] for item in data] == [f"data_{i}" for i in range(50)]
+        assert len({item["id"] for item in data}) == 50
+        assert all(item["created_at"] and item["conflict_resolution"] == "pending" for item in data)
+        
+        session = client.get(f"/api/v1/sessions/{session_id}").json()
+        assert session["vector_clock"] == {
+            "master": 49, "replica0": 49, "replica1": 50, "replica2": 48
+        }
+    
+    def test_labeling_writes_feed_clock_gc(self, setup_database, monkeypatch):
+        """Тест: разметки через API обновляют view узлов, GC убирает выбывший узел"""
+        now = [1000.0]
+        monkeypatch.setattr(vector_clock_manager, "store", InMemoryClockStore(lambda: now[0]))
+        monkeypatch.setattr(settings, "vector_clock_node_ttl", 600)
+        monkeypatch.setattr(metrics, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+        
+        session_id = client.post(
+            "/api/v1/sessions/create",
+            json={"annotator_id": "test_annotator"}
+        ).json()["session_id"]
+        
+        def label(data_id, vector_clock):
+            response = client.post("/api/v1/labeling/", json={
+                "session_id": session_id,
+                "annotator_id": "test_annotator",
+                "data_id": data_id,
+                "original_text": "Text",
+                "label": "positive",
+                "vector_clock": vector_clock
+            })
+            assert response.status_code == 200
+        
+        label("data_1", {"old_replica": 3})
+        now[0] += 700
+        # master видел последнее событие old_replica, old_replica больше не пишет
+        label("data_2", {"master": 1, "old_replica": 3})
+        
+        assert set(vector_clock_manager.store.views(session_id)) == {"master", "old_replica"}
+        assert vector_clock_manager.cleanup_old_clocks()["entries_pruned"] == 1
+        assert vector_clock_manager.get_clock(session_id) == {"master": 1}
+        assert vector_clock_manager.store.retired(session_id) == {"old_replica": 3}
+    
     def test_get_conflicts(self, setup_database):
         """Тест получения конфликтов"""
         # Создание сессии
@@ -308,6 +442,163 @@ class TestLabelingAPI:
         data = response.json()
         # В тестовой среде конфликты могут не обнаруживаться из-за упрощенной логики
         assert isinstance(data, list)
+    
+    def test_get_label_conflicts(self, setup_database):
+        """Разные метки одного data_id возвращаются как конфликт по индексу"""
+        session_id = client.post(
+            "/api/v1/sessions/create",
+            json={"annotator_id": "test_annotator"}
+        ).json()["session_id"]
+        
+        ids = []
+        for label in ("positive", "negative", "positive"):
+            response = client.post("/api/v1/labeling/", json={
+                "session_id": session_id,
+                "annotator_id": "test_annotator",
+                "data_id": "disputed",
+                "original_text": "Text",
+                "label": label,
+                "confidence": 0.5,
+                "vector_clock": {}
+            })
+            ids.append(response.json()["id"])
+        
+        data = client.get(f"/api/v1/labeling/conflicts/{session_id}").json()
+        assert sorted(item["id"] for item in data) == ids
+        
+        # Исправление метки снимает конфликт
+        client.put(f"/api/v1/labeling/{ids[1]}", json={"label": "positive"})
+        assert client.get(f"/api/v1/labeling/conflicts/{session_id}").json() == []
+    
+    def test_labeling_stats_rollup(self, setup_database):
+        """Rollup-статистика разметчика совпадает с агрегацией по разметкам"""
+        session_id = client.post(
+            "/api/v1/sessions/create",
+            json={"annotator_id": "stats_annotator"}
+        ).json()["session_id"]
+        
+        ids = []
+        for i, confidence in enumerate((0.9, 0.0)):
+            response = client.post("/api/v1/labeling/", json={
+                "session_id": session_id,
+                "annotator_id": "stats_annotator",
+                "data_id": f"data_{i}",
+                "original_text": "Text",
+                "label": "positive",
+                "confidence": confidence,
+                "vector_clock": {}
+            })
+            ids.append(response.json()["id"])
+        client.post("/api/v1/labeling/batch", json={
+            "session_id": session_id,
+            "annotator_id": "stats_annotator",
+            "labels": [
+                {"data_id": "data_2", "original_text": "Text", "label": "negative", "confidence": 0.5},
+                {"data_id": "data_3", "original_text": "Text", "label": "negative"}
+            ]
+        })
+        client.put(f"/api/v1/labeling/{ids[1]}", json={"confidence": 0.4})
+        client.post("/api/v1/labeling/resolve-conflict", json={
+            "conflict_id": ids[0], "resolution": "manual"
+        })
+        
+        stats = client.get("/api/v1/labeling/stats/stats_annotator").json()
+        assert stats["total_labels"] == 4
+        assert stats["conflicts"] == 0
+        # Нулевые уверенности в среднее не входят
+        assert stats["avg_confidence"] == pytest.approx(0.6)
+        assert stats["last_activity"]
+        
+        response = client.get("/api/v1/monitoring/annotators/stats", params={"annotator_id": "stats_annotator"})
+        assert response.status_code == 200
+        rollup = response.json()["annotators"]
+        assert len(rollup) == 1
+        assert rollup[0]["annotator_id"] == "stats_annotator"
+        assert rollup[0]["total_labels"] == stats["total_labels"]
+        assert rollup[0]["conflicts"] == stats["conflicts"]
+        assert rollup[0]["avg_confidence"] == pytest.approx(stats["avg_confidence"])
+        assert rollup[0]["last_activity"]
+        
+        assert client.get("/api/v1/labeling/stats/unknown").json()["total_labels"] == 0
+    
+    def test_label_events_published(self, setup_database):
+        """Записи разметок публикуются в поток событий сессии"""
+        session_id = client.post(
+            "/api/v1/sessions/create",
+            json={"annotator_id": "test_annotator"}
+        ).json()["session_id"]
+        
+        created = client.post("/api/v1/labeling/", json={
+            "session_id": session_id,
+            "annotator_id": "test_annotator",
+            "data_id": "data_1",
+            "original_text": "Text",
+            "label": "positive",
+            "vector_clock": {}
+        }).json()
+        client.put(f"/api/v1/labeling/{created['id']}", json={"label": "negative"})
+        client.post("/api/v1/labeling/resolve-conflict", json={
+            "conflict_id": created["id"], "resolution": "manual"
+        })
+        
+        events, truncated = asyncio.run(event_stream.history(session_id, (0, 0)))
+        assert not truncated
+        assert [frame.split("\n")[1] for _, frame in events] == [
+            "event: label_created", "event: label_updated", "event: conflict_resolved"
+        ]
+        assert f'"id":{created["id"]}' in events[0][1]
+        
+        response = client.get(f"/api/v1/labeling/stream/{session_id}", headers={"Last-Event-ID": "bogus"})
+        assert response.status_code == 400
+
+
+class TestFilesAPI:
+    """Тесты для API файлов"""
+    
+    @pytest.fixture
+    def upload_dir(self, tmp_path, monkeypatch):
+        """Временный каталог загрузки и маленький размер куска"""
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "upload_dir", str(tmp_path))
+        monkeypatch.setattr(settings, "upload_chunk_size", 16)
+        return tmp_path
+    
+    def test_upload_and_read_pages(self, setup_database, upload_dir):
+        """Тест потоковой загрузки CSV и постраничного чтения"""
+        rows = "".join(f'{i},"text {i}",positive\n' for i in range(250))
+        content = "data_id,text,label\n" + rows
+        
+        response = client.post(
+            "/api/v1/files/upload",
+            files={"file": ("dataset.csv", content.encode(), "text/csv")}
+        )
+        
+        assert response.status_code == 200
+        file_id = response.json()["id"]
+        assert response.json()["total_rows"] == 250
+        assert (upload_dir / "dataset.csv").read_text() == content
+        assert not (upload_dir / "dataset.csv.part").exists()
+        
+        response = client.get(f"/api/v1/files/{file_id}/data?offset=240&limit=20")
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert [row["data_id"] for row in data["data"]] == list(range(240, 250))
+        assert data["total_rows"] == 250
+        assert data["has_more"] == False
+    
+    def test_upload_rejects_oversized_file(self, setup_database, upload_dir, monkeypatch):
+        """Тест ограничения размера загружаемого файла"""
+        from app.core.config import settings
+        monkeypatch.setattr(settings, "max_file_size", 64)
+        
+        response = client.post(
+            "/api/v1/files/upload",
+            files={"file": ("big.csv", b"a,b\n" + b"1,2\n" * 100, "text/csv")}
+        )
+        
+        assert response.status_code == 413
+        assert list(upload_dir.iterdir()) == []
 
 
 class TestMonitoringAPI:
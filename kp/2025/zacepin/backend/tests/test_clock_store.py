@@ -0,0 +1,332 @@
+import multiprocessing
+import threading
+
+import pytest
+import redis
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.clock_store import (
+    ClockStore, InMemoryClockStore, RedisClockStore, WriteBehindClockStore, compact_clock
+)
+from app.core.config import settings
+from app.core.database import Base
+from app.core.monitoring import metrics
+from app.models.vector_clock import VectorClock, VectorClockManager
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeTime:
+    """Управляемые часы для проверки TTL"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def fake_time():
+    return FakeTime()
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, fake_time):
+    if request.param == "memory":
+        return InMemoryClockStore(time_func=fake_time)
+    return RedisClockStore(fakeredis.FakeRedis(decode_responses=True), time_func=fake_time)
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Отдельная SQLite база с таблицей vector_clocks"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'clocks.db'}",
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine, tables=[VectorClock.__table__])
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def redis_server():
+    """TCP fakeredis сервер, доступный из дочерних процессов"""
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    # Потоки соединений не должны блокировать остановку сервера
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def _stress_worker(address, worker_id, operations):
+    client = redis.Redis(host=address[0], port=address[1], decode_responses=True)
+    store = RedisClockStore(client)
+    # Как в lifespan приложения: каждый worker загружает скрипты при старте
+    store.start()
+    for i in range(operations):
+        store.increment("stress", "shared")
+        store.increment("stress", f"worker{worker_id}")
+        store.merge("stress", {"merged": worker_id * operations + i})
+
+
+class TestClockStore:
+    """Тесты хранилищ vector clocks"""
+
+    def test_increment_and_merge(self, store):
+        """Инкремент и объединение возвращают итоговый clock"""
+        assert store.get("session") == {}
+        assert store.set("session", {"master": 0}) == {"master": 0}
+        assert store.increment("session", "master") == {"master": 1}
+        assert store.increment("session", "replica1") == {"master": 1, "replica1": 1}
+
+        merged = store.merge("session", {"master": 0, "replica1": 5, "replica2": 2})
+        assert merged == {"master": 1, "replica1": 5, "replica2": 2}
+        assert store.get("session") == merged
+
+    def test_set_replaces_and_delete(self, store):
+        """set заменяет clock целиком, delete удаляет его"""
+        store.set("session", {"a": 3, "b": 1})
+        store.set("session", {"c": 2})
+        assert store.get("session") == {"c": 2}
+
+        store.delete("session")
+        assert store.get("session") == {}
+
+    def test_incomplete_store_fails_on_creation(self):
+        """Хранилище без реализации всех операций не создаётся"""
+        class GetOnly(ClockStore):
+            def get(self, session_id):
+                return {}
+
+        with pytest.raises(TypeError):
+            GetOnly()
+
+    def test_manager_uses_store(self, store):
+        """VectorClockManager работает поверх любого хранилища"""
+        manager = VectorClockManager(store)
+        manager.create_clock("session", "node1")
+        manager.increment_clock("session", "node1")
+
+        assert manager.merge_clocks("session", {"node2": 4}) == {"node1": 1, "node2": 4}
+        assert manager.get_clock("session") == {"node1": 1, "node2": 4}
+
+
+class TestClockGarbageCollection:
+    """Тесты сборки мусора vector clocks"""
+
+    @pytest.fixture(autouse=True)
+    def gc_settings(self, monkeypatch):
+        monkeypatch.setattr(settings, "vector_clock_ttl", 3600)
+        monkeypatch.setattr(settings, "vector_clock_node_ttl", 600)
+        monkeypatch.setattr(metrics, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+
+    def test_evicts_idle_sessions(self, store, fake_time):
+        """Сессии без записей дольше TTL вытесняются, активные остаются"""
+        manager = VectorClockManager(store)
+        manager.create_clock("idle", "master")
+        fake_time.now += 3000
+        manager.increment_clock("active", "master")
+        fake_time.now += 1000
+
+        stats = manager.cleanup_old_clocks()
+
+        assert stats["sessions_evicted"] == 1
+        assert stats["clocks_held"] == 1
+        assert store.sessions() == ["active"]
+        assert manager.get_clock("idle") == {}
+        assert metrics.redis_client.get(f"{metrics.metrics_prefix}gauge:vector_clocks.held") == "1"
+
+    def test_max_age_hours_overrides_ttl(self, store, fake_time):
+        """max_age_hours задаёт TTL явно"""
+        manager = VectorClockManager(store)
+        manager.increment_clock("session", "master")
+        fake_time.now += 2 * 3600
+
+        assert manager.cleanup_old_clocks(max_age_hours=3)["sessions_evicted"] == 0
+        assert manager.cleanup_old_clocks(max_age_hours=1)["sessions_evicted"] == 1
+
+    def test_prunes_entries_seen_by_all_live_nodes(self, store, fake_time):
+        """Запись выбывшего узла убирается, когда её видели все живые узлы"""
+        manager = VectorClockManager(store)
+        for _ in range(3):
+            manager.increment_clock("session", "old_replica")
+        fake_time.now += 700
+        manager.increment_clock("session", "replica1")
+        manager.increment_clock("session", "replica2")
+        # Запоздавшие события old_replica живые узлы ещё не видели,
+        # а сам узел снова считается живым до истечения node TTL
+        manager.merge_clocks("session", {"old_replica": 5})
+        assert "old_replica" in store.views("session")
+
+        assert manager.cleanup_old_clocks()["entries_pruned"] == 0
+
+        fake_time.now += 300
+        manager.increment_clock("session", "replica1")
+        assert manager.cleanup_old_clocks()["entries_pruned"] == 0
+
+        fake_time.now += 350
+        manager.increment_clock("session", "replica2")
+        stats = manager.cleanup_old_clocks()
+        assert stats["entries_pruned"] == 1
+        assert stats["clocks_held"] == 1
+        assert manager.get_clock("session") == {"replica1": 2, "replica2": 2}
+        assert store.retired("session") == {"old_replica": 5}
+        assert "old_replica" not in store.views("session")
+
+    def test_retired_entries_do_not_grow_back(self, store, fake_time):
+        """Устаревшие значения выбывшего узла игнорируются, новые события учитываются"""
+        manager = VectorClockManager(store)
+        manager.increment_clock("session", "old_replica")
+        fake_time.now += 700
+        manager.increment_clock("session", "replica1")
+        manager.cleanup_old_clocks()
+
+        stale = {"old_replica": 1, "replica1": 1}
+        assert manager.detect_conflicts("session", stale) == []
+        assert manager.merge_clocks("session", stale) == {"replica1": 1}
+
+        # Узел вернулся: счёт продолжается с сохранённого значения
+        assert manager.increment_clock("session", "old_replica") == {"old_replica": 2, "replica1": 1}
+        assert store.retired("session") == {}
+
+    def test_live_nodes_are_not_pruned(self, store, fake_time):
+        """Без выбывших узлов clock не меняется"""
+        manager = VectorClockManager(store)
+        manager.increment_clock("session", "replica1")
+        manager.increment_clock("session", "replica2")
+
+        assert manager.cleanup_old_clocks()["entries_pruned"] == 0
+        assert manager.get_clock("session") == {"replica1": 1, "replica2": 1}
+
+    def test_compact_clock(self):
+        """Нулевые и выбывшие записи не сохраняются"""
+        clock = {"master": 0, "replica1": 3, "replica2": 5}
+        assert compact_clock(clock) == {"replica1": 3, "replica2": 5}
+        assert compact_clock(clock, {"replica1": 3}) == {"replica2": 5}
+
+    def test_memory_stays_flat(self, fake_time):
+        """Симуляция 7 дней: число clocks и их объём выходят на плато"""
+        store = InMemoryClockStore(time_func=fake_time)
+        manager = VectorClockManager(store)
+        held = []
+
+        for hour in range(7 * 24):
+            # Каждый час новые сессии, реплики сменяются каждые 2 часа
+            fake_time.now += 3600
+            for k in range(20):
+                session_id = f"s{hour}-{k}"
+                for step in range(10):
+                    manager.increment_clock(session_id, f"replica{(hour + step) // 2}")
+            for k in range(20):
+                manager.increment_clock(f"long-{k}", f"replica{hour // 2}")
+            stats = manager.cleanup_old_clocks()
+            held.append((stats["clocks_held"], stats["bytes_used"]))
+
+        day2, day7 = held[2 * 24 - 1], held[-1]
+        assert day7[0] == day2[0]
+        assert day7[1] <= day2[1] * 1.1
+        # Долгие сессии не накапливают записи всех когда-либо живших реплик
+        assert len(manager.get_clock("long-0")) <= 2
+
+
+class TestWriteBehindClockStore:
+    """Тесты отложенной записи clocks в БД"""
+
+    def test_flush_persists_dirty_sessions(self, session_factory):
+        """Изменённые сессии сохраняются одним сбросом"""
+        store = WriteBehindClockStore(InMemoryClockStore(), session_factory, VectorClock)
+        store.set("s1", {"master": 0})
+        store.increment("s1", "master")
+        store.merge("s2", {"replica1": 3})
+
+        assert store.flush() == 2
+        assert store.flush() == 0
+
+        db = session_factory()
+        rows = {row.session_id: row.clock_data for row in db.query(VectorClock).all()}
+        db.close()
+        assert rows == {"s1": {"master": 1}, "s2": {"replica1": 3}}
+
+        # Повторный сброс обновляет существующую строку
+        store.increment("s1", "master")
+        store.flush()
+        db = session_factory()
+        assert db.query(VectorClock).filter(VectorClock.session_id == "s1").count() == 1
+        assert db.query(VectorClock).filter(
+            VectorClock.session_id == "s1"
+        ).one().clock_data == {"master": 2}
+        db.close()
+
+    def test_hydrate_after_restart(self, session_factory):
+        """После перезапуска clock продолжает счёт с сохранённого значения"""
+        store = WriteBehindClockStore(InMemoryClockStore(), session_factory, VectorClock)
+        store.merge("session", {"master": 7, "replica1": 2})
+        store.stop()
+
+        restarted = WriteBehindClockStore(InMemoryClockStore(), session_factory, VectorClock)
+        assert restarted.increment("session", "master") == {"master": 8, "replica1": 2}
+        assert restarted.get("session") == {"master": 8, "replica1": 2}
+
+    def test_hydrated_marks_pruned(self, session_factory, fake_time):
+        """Отметки подгрузки остаются только у сессий основного хранилища"""
+        store = WriteBehindClockStore(InMemoryClockStore(time_func=fake_time), session_factory, VectorClock)
+        store.merge("idle", {"master": 1})
+        fake_time.now += 3600
+        store.merge("active", {"master": 1})
+        for i in range(100):
+            store.get(f"unknown{i}")
+
+        assert store.evict_idle(1800) == ["idle"]
+        assert store._hydrated == {"active"}
+        # Вытесненная сессия подгружается из БД при следующем обращении
+        assert store.get("idle") == {"master": 1}
+
+    def test_background_flush(self, session_factory):
+        """Фоновый поток сбрасывает clocks и останавливается"""
+        store = WriteBehindClockStore(
+            InMemoryClockStore(), session_factory, VectorClock, flush_interval=0.05
+        )
+        store.start()
+        try:
+            store.increment("session", "master")
+            store._stop_event.wait(0.3)
+        finally:
+            store.stop()
+
+        db = session_factory()
+        assert db.query(VectorClock).one().clock_data == {"master": 1}
+        db.close()
+
+
+class TestRedisClockStoreConcurrency:
+    """Нагрузочный тест атомарности операций между процессами"""
+
+    def test_multi_process_increments_and_merges(self, redis_server):
+        """Ни один инкремент не теряется, merge сохраняет максимум"""
+        workers, operations = 4, 100
+        client = redis.Redis(host=redis_server[0], port=redis_server[1], decode_responses=True)
+
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=_stress_worker, args=(redis_server, worker_id, operations))
+            for worker_id in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=120)
+            assert process.exitcode == 0
+
+        clock = RedisClockStore(client).get("stress")
+        assert clock["shared"] == workers * operations
+        for worker_id in range(workers):
+            assert clock[f"worker{worker_id}"] == operations
+        assert clock["merged"] == workers * operations - 1
@@ -0,0 +1,198 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.conflict_index import ConflictIndex, InMemoryConflictIndex, RedisConflictIndex
+from app.core.database import Base, db_manager
+from app.models.annotator_session import AnnotatorSession
+from app.models.annotator_stats import AnnotatorStats
+from app.models.labeled_data import LabeledData
+from app.services import consistency_service as consistency_module
+from app.services.consistency_service import ConsistencyService
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture(params=["memory", "redis"])
+def index(request):
+    if request.param == "memory":
+        return InMemoryConflictIndex()
+    return RedisConflictIndex(fakeredis.FakeRedis(decode_responses=True))
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Отдельная SQLite база с сессиями и разметками"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'labels.db'}")
+    Base.metadata.create_all(bind=engine, tables=[AnnotatorSession.__table__, LabeledData.__table__, AnnotatorStats.__table__])
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def add_label(db, session_id: str, data_id: str, label: str) -> LabeledData:
+    item = LabeledData(
+        session_id=session_id, annotator_id="annotator", data_id=data_id,
+        original_text="text", label=label, vector_clock={}
+    )
+    db.add(item)
+    db.commit()
+    return item
+
+
+class TestConflictIndex:
+    """Тесты инкрементального индекса конфликтов"""
+
+    def test_conflict_appears_and_disappears(self, index):
+        """Конфликт появляется со второй различной меткой и пропадает при исправлении"""
+        index.record("s1", [("d1", 1, "pos"), ("d1", 2, "pos"), ("d2", 3, "neg")])
+        assert index.conflicts("s1") == []
+
+        index.record("s1", [("d1", 4, "neg")])
+        assert index.conflicts("s1") == [{
+            "type": "label_conflict",
+            "data_id": "d1",
+            "conflicting_labels": ["neg", "pos"],
+            "records": [1, 2, 4]
+        }]
+        assert index.conflict_counts() == {"s1": 1}
+
+        # Обновление метки записи заменяет её, а не добавляет
+        index.record("s1", [("d1", 4, "pos")])
+        assert index.conflicts("s1") == []
+        assert index.conflict_counts() == {}
+
+    def test_discard(self, index):
+        """Удаление записи снимает конфликт"""
+        index.record("s1", [("d1", 1, "pos"), ("d1", 2, "neg"), ("d2", 3, "a"), ("d2", 4, "b")])
+        assert index.conflict_counts() == {"s1": 2}
+
+        index.discard("s1", [("d1", 2)])
+        assert [conflict["data_id"] for conflict in index.conflicts("s1")] == ["d2"]
+        index.discard("s1", [("d2", 3), ("d2", 4), ("missing", 5)])
+        assert index.conflicts("s1") == []
+
+    def test_sessions_are_isolated(self, index):
+        """Одинаковые data_id разных сессий не конфликтуют"""
+        index.record("s1", [("d1", 1, "pos")])
+        index.record("s2", [("d1", 2, "neg"), ("d3", 3, "x"), ("d3", 4, "y")])
+
+        assert index.conflicts("s1") == []
+        assert index.conflict_counts() == {"s2": 1}
+
+        index.delete("s2")
+        assert index.conflicts("s2") == []
+        assert index.conflict_counts() == {}
+
+    def test_incomplete_index_fails_on_creation(self):
+        """Индекс без реализации всех операций не создаётся"""
+        class RecordOnly(ConflictIndex):
+            def record(self, session_id, entries):
+                pass
+
+        with pytest.raises(TypeError):
+            RecordOnly()
+
+    def test_rebuild_marks_indexed(self, index):
+        """rebuild заполняет индекс поверх уже проиндексированных записей"""
+        index.record("s1", [("d1", 2, "neg")])
+        assert not index.is_indexed("s1")
+
+        index.rebuild("s1", [("d1", 1, "pos")])
+        assert index.is_indexed("s1")
+        assert index.conflicts("s1")[0]["records"] == [1, 2]
+
+        index.delete("s1")
+        assert not index.is_indexed("s1")
+
+    def test_in_memory_index_is_bounded(self):
+        """In-memory индекс вытесняет давние и неактивные сессии"""
+        now = [0.0]
+        index = InMemoryConflictIndex(max_sessions=2, ttl=100, time_func=lambda: now[0])
+        for session_id in ["s1", "s2"]:
+            index.rebuild(session_id, [("d1", 1, "pos"), ("d1", 2, "neg")])
+        index.conflicts("s1")
+
+        # Третья сессия вытесняет s2, к которой обращались раньше всех
+        index.rebuild("s3", [("d1", 3, "pos")])
+        assert set(index.accessed) == {"s1", "s3"}
+        assert not index.is_indexed("s2")
+        assert index.conflict_counts() == {"s1": 1}
+
+        now[0] += 101
+        index.record("s3", [("d2", 4, "pos")])
+        assert set(index.labels) == {"s3"}
+        assert not index.is_indexed("s1")
+
+        # Вытесненная сессия строится заново
+        index.rebuild("s1", [("d1", 1, "pos"), ("d1", 2, "neg")])
+        assert index.conflicts("s1")[0]["records"] == [1, 2]
+
+
+class TestConsistencyServiceIndex:
+    """Тесты использования индекса сервисом согласованности"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_index(self, monkeypatch):
+        index = InMemoryConflictIndex()
+        monkeypatch.setattr(consistency_module, "conflict_index", index)
+        return index
+
+    def test_check_consistency_builds_index_once(self, db, fresh_index):
+        """Первая проверка строит индекс из записей сессии, дальше он ведётся записью"""
+        first = add_label(db, "s1", "d1", "pos")
+        add_label(db, "s1", "d1", "neg")
+        service = ConsistencyService()
+
+        report = service.check_consistency("s1", db, count_only=True)
+        assert report["conflicts"][0]["conflicting_labels"] == ["neg", "pos"]
+        assert fresh_index.is_indexed("s1")
+
+        # Изменения после построения приходят только через индекс
+        fresh_index.record("s1", [("d1", first.id, "neg")])
+        assert service.check_consistency("s1", db, count_only=True)["conflicts"] == []
+
+    def test_monitor_reads_counts(self, db, fresh_index, monkeypatch):
+        """Монитор индексирует новые сессии одним запросом и берёт счётчики из индекса"""
+        for i in range(3):
+            db.add(AnnotatorSession(session_id=f"s{i}", annotator_id="annotator", is_active=True))
+        db.commit()
+        add_label(db, "s0", "d1", "pos")
+        add_label(db, "s0", "d1", "neg")
+        add_label(db, "s1", "d1", "pos")
+        monkeypatch.setattr(db_manager, "get_read_session", lambda *args, **kwargs: db)
+
+        report = ConsistencyService().monitor_consistency()
+        assert report["sessions_checked"] == 3
+        assert report["conflicts_found"] == 1
+        assert report["overall_status"] == "degraded"
+        assert all(fresh_index.is_indexed(f"s{i}") for i in range(3))
+
+    def test_monitor_closes_read_session(self, db, fresh_index, monkeypatch):
+        """Монитор читает через одну сессию и закрывает её"""
+        db.add(AnnotatorSession(session_id="s1", annotator_id="annotator", is_active=True))
+        db.commit()
+        engine = db.get_bind()
+        sessions = []
+
+        def get_read_session(*args, **kwargs):
+            sessions.append(Session(bind=engine))
+            return sessions[-1]
+
+        monkeypatch.setattr(db_manager, "get_read_session", get_read_session)
+        assert ConsistencyService().monitor_consistency()["sessions_checked"] == 1
+        assert len(sessions) == 1
+        assert engine.pool.checkedout() == 0
+
+    def test_resolution_discards_deleted(self, db, fresh_index):
+        """Удалённые при разрешении записи убираются из индекса"""
+        for label in ("pos", "neg"):
+            item = add_label(db, "s1", "d1", label)
+            item.is_conflict = True
+        db.commit()
+        service = ConsistencyService()
+        assert len(service.check_consistency("s1", db)["conflicts"]) == 1
+
+        assert service.resolve_conflicts("s1", "last_write_wins", db)["resolved"] == 1
+        assert fresh_index.conflicts("s1") == []
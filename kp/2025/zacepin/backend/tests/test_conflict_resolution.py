@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.core.conflict_index import InMemoryConflictIndex
+from app.core.database import Base
+from app.core.monitoring import metrics
+from app.models.annotator_stats import AnnotatorStats
+from app.models.labeled_data import LabeledData
+from app.services import consistency_service as consistency_module
+from app.services.annotator_stats import StatsDelta
+from app.services.consistency_service import ConsistencyService
+
+fakeredis = pytest.importorskip("fakeredis")
+
+START = datetime(2025, 1, 1)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """SQLite база с разметками; считает выполненные SQL-запросы"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'labels.db'}")
+    Base.metadata.create_all(bind=engine, tables=[LabeledData.__table__, AnnotatorStats.__table__])
+    session = sessionmaker(bind=engine)()
+    session.statements = []
+    event.listen(
+        engine, "before_cursor_execute",
+        lambda conn, cursor, statement, *args: session.statements.append(statement)
+    )
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def fresh_index(monkeypatch):
+    monkeypatch.setattr(metrics, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    index = InMemoryConflictIndex()
+    monkeypatch.setattr(consistency_module, "conflict_index", index)
+    return index
+
+
+def add_conflicts(db, rows, session_id: str = "s1"):
+    """rows: (data_id, метка, уверенность, сдвиг updated_at в минутах)"""
+    items = [
+        LabeledData(
+            session_id=session_id, annotator_id="annotator", data_id=data_id,
+            original_text="text", label=label, confidence=confidence, vector_clock={},
+            updated_at=START + timedelta(minutes=minutes), is_conflict=True
+        )
+        for data_id, label, confidence, minutes in rows
+    ]
+    db.add_all(items)
+    stats = StatsDelta()
+    for item in items:
+        stats.add(item.annotator_id, item.confidence, is_conflict=True)
+    stats.apply(db)
+    db.commit()
+    return [item.id for item in items]
+
+
+def remaining(db, session_id: str = "s1"):
+    return {
+        item.data_id: (item.label, item.is_conflict, item.conflict_resolution)
+        for item in db.query(LabeledData).filter(LabeledData.session_id == session_id)
+    }
+
+
+class TestSetBasedResolution:
+    """Тесты разрешения конфликтов запросами над множествами строк"""
+
+    ROWS = [
+        ("d1", "old", 0.9, 0), ("d1", "new", 0.1, 5),
+        ("d2", "a", 0.2, 3), ("d2", "b", 0.8, 1), ("d2", "c", 0.5, 2),
+        ("d3", "single", 0.5, 0),
+    ]
+
+    def test_last_write_wins(self, db, fresh_index):
+        """Остаётся последняя обновлённая запись каждого data_id"""
+        ids = add_conflicts(db, self.ROWS)
+        add_conflicts(db, [("d1", "other", 0.5, 9)], session_id="s2")
+        fresh_index.record("s1", [
+            (data_id, record_id, label)
+            for (data_id, label, _, _), record_id in zip(self.ROWS, ids)
+        ])
+
+        result = ConsistencyService().resolve_conflicts("s1", "last_write_wins", db)
+
+        assert result["resolved"] == 3
+        assert remaining(db) == {
+            "d1": ("new", False, "last_write_wins"),
+            "d2": ("a", False, "last_write_wins"),
+            "d3": ("single", False, "last_write_wins"),
+        }
+        # Другая сессия не затронута
+        assert remaining(db, "s2") == {"d1": ("other", True, "pending")}
+        assert fresh_index.conflicts("s1") == []
+        # Rollup разметчика: 3 записи удалены, конфликт остался только в s2
+        stats = db.get(AnnotatorStats, "annotator")
+        assert (stats.total_labels, stats.conflicts, stats.confidence_count) == (4, 1, 4)
+        assert float(stats.confidence_sum) == pytest.approx(0.1 + 0.2 + 0.5 + 0.5)
+
+    def test_confidence_based(self, db):
+        """Остаётся запись с наибольшей уверенностью"""
+        add_conflicts(db, self.ROWS)
+
+        assert ConsistencyService().resolve_conflicts("s1", "confidence_based", db)["resolved"] == 3
+        assert {data_id: label for data_id, (label, _, _) in remaining(db).items()} == {
+            "d1": "old", "d2": "b", "d3": "single"
+        }
+
+    def test_chunks(self, db, monkeypatch):
+        """Большие сессии разрешаются диапазонами data_id, число запросов не зависит от строк"""
+        monkeypatch.setattr(settings, "conflict_resolution_chunk_size", 4)
+        rows = [(f"d{i:03d}", label, 0.5, minutes) for i in range(10) for minutes, label in enumerate("xyz")]
+        add_conflicts(db, rows)
+        db.statements.clear()
+
+        assert ConsistencyService().resolve_conflicts("s1", "last_write_wins", db)["resolved"] == 20
+        # Проверка наличия + 3 диапазона по (граница, DELETE, UPDATE) + пустая граница
+        assert len([s for s in db.statements if s.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE"))]) == 11
+        assert {label for label, _, _ in remaining(db).values()} == {"z"}
+        assert len(remaining(db)) == 10
+
+    def test_manual_resolution(self, db):
+        """Ручная стратегия снимает флаги одним UPDATE, не удаляя записи"""
+        add_conflicts(db, self.ROWS)
+
+        assert ConsistencyService().resolve_conflicts("s1", "manual_resolution", db)["resolved"] == 6
+        assert db.query(LabeledData).filter(LabeledData.is_conflict == True).count() == 0
+
+    def test_registered_strategy(self, db):
+        """Стратегии подключаются через register_strategy"""
+        add_conflicts(db, self.ROWS)
+        service = ConsistencyService()
+        calls = []
+        service.register_strategy("noop", lambda session_id, session: calls.append(session_id) or 0)
+
+        assert service.resolve_conflicts("s1", "noop", db)["resolved"] == 0
+        assert calls == ["s1"]
+        with pytest.raises(ValueError):
+            service.resolve_conflicts("s1", "unknown", db)
+
+    def test_no_conflicts(self, db):
+        assert ConsistencyService().resolve_conflicts("s1", "last_write_wins", db)["resolved"] == 0
@@ -0,0 +1,208 @@
+import itertools
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.conflict_index import InMemoryConflictIndex
+from app.core.database import Base, db_manager
+from app.core.monitoring import metrics
+from app.models.labeled_data import LabeledData
+from app.services import consistency_service as consistency_module
+from app.services.consistency_monitor import (
+    ConsistencyMonitor, DirtySessions, RateBudget, RedisDirtySessions
+)
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeClock:
+    """Управляемые часы: sleep сдвигает время"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class RecordingService:
+    """Проверка сессии без БД: считает параллельные вызовы"""
+
+    def __init__(self, delay: float = 0.0, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.checked = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def check_consistency(self, session_id, db, count_only=False):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if session_id in self.failing:
+                raise RuntimeError("replica unavailable")
+            self.checked.append(session_id)
+            return {"conflicts": [{}] if session_id.endswith("0") else [], "clock_consistency": {}}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def replicas(tmp_path, monkeypatch):
+    """Две SQLite реплики с таблицей разметок; выбор реплики по кругу"""
+    makers = {}
+    for name in ("replica1", "replica2"):
+        engine = create_engine(f"sqlite:///{tmp_path / name}.db", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(bind=engine, tables=[LabeledData.__table__])
+        makers[name] = sessionmaker(bind=engine)
+    names = itertools.cycle(list(makers))
+    lock = threading.Lock()
+
+    def select_read_replica(*args, **kwargs):
+        with lock:
+            return next(names)
+
+    monkeypatch.setattr(db_manager, "replicas", makers)
+    monkeypatch.setattr(db_manager, "select_read_replica", select_read_replica)
+    monkeypatch.setattr(metrics, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    return makers
+
+
+class TestRateBudget:
+    """Тесты бюджета запросов к реплике"""
+
+    def test_waits_when_exhausted(self):
+        """После burst запросы идут не чаще rate в секунду"""
+        clock = FakeClock()
+        budget = RateBudget(10, burst=2, time_func=clock, sleep=clock.sleep)
+
+        waits = [budget.acquire() for _ in range(4)]
+        assert waits == [0.0, 0.0, pytest.approx(0.1), pytest.approx(0.1)]
+        assert clock.now == pytest.approx(0.2)
+
+        # Простой восстанавливает бюджет не выше burst
+        clock.now += 10
+        assert [budget.acquire() for _ in range(2)] == [0.0, 0.0]
+
+    def test_unlimited(self):
+        assert RateBudget(0).acquire() == 0.0
+
+
+class TestDirtySessions:
+    """Тесты множества изменённых сессий"""
+
+    @pytest.mark.parametrize("dirty", [
+        DirtySessions(),
+        RedisDirtySessions(fakeredis.FakeRedis(decode_responses=True)),
+    ])
+    def test_drain(self, dirty):
+        for session_id, position in (("b", 7), ("a", 0), ("b", 3)):
+            dirty.add(session_id, position)
+        assert dirty.pending() == 2
+        # Позиция сессии - максимум из позиций её записей
+        assert dirty.drain() == {"a": 0, "b": 7}
+        assert dirty.drain() == {}
+
+
+class TestConsistencyMonitor:
+    """Тесты параллельной проверки изменённых сессий"""
+
+    def test_checks_only_dirty_sessions(self, replicas):
+        """Проверяются только сессии, отмеченные с прошлого запуска"""
+        service = RecordingService()
+        monitor = ConsistencyMonitor(service=service, workers=2, shard_size=3)
+        for i in range(7):
+            monitor.mark_dirty(f"s{i}")
+
+        report = monitor.run_once()
+        assert sorted(service.checked) == [f"s{i}" for i in range(7)]
+        assert report["sessions_checked"] == 7
+        assert report["conflicts_found"] == 1
+        assert report["overall_status"] == "degraded"
+        assert [shard["sessions"] for shard in report["shards"]] == [3, 3, 1]
+        assert {shard["replica"] for shard in report["shards"]} == {"replica1", "replica2"}
+        assert all(shard["seconds"] >= 0 for shard in report["shards"])
+
+        service.checked.clear()
+        assert monitor.run_once()["sessions_checked"] == 0
+        assert service.checked == []
+
+    def test_bounded_concurrency(self, replicas):
+        """Одновременно выполняется не больше workers shard'ов"""
+        service = RecordingService(delay=0.02)
+        monitor = ConsistencyMonitor(service=service, workers=3, shard_size=1, replica_qps=0)
+        for i in range(12):
+            monitor.mark_dirty(f"s{i}")
+
+        monitor.run_once()
+        assert service.max_active == 3
+
+    def test_replica_budget_shared_by_shards(self, replicas):
+        """Shard'ы одной реплики делят её бюджет запросов"""
+        service = RecordingService()
+        monitor = ConsistencyMonitor(service=service, workers=4, shard_size=5, replica_qps=20)
+        for i in range(60):
+            monitor.mark_dirty(f"s{i:02d}")
+
+        started = time.perf_counter()
+        report = monitor.run_once()
+        elapsed = time.perf_counter() - started
+
+        # 30 запросов на реплику при burst 20 и 20 в секунду: не меньше 0.5 s
+        assert elapsed >= 0.45
+        assert sum(shard["budget_wait_seconds"] for shard in report["shards"]) > 0
+
+    def test_failed_sessions_retried(self, replicas):
+        """Сессии с ошибкой проверки возвращаются в dirty-множество"""
+        service = RecordingService(failing={"s1"})
+        monitor = ConsistencyMonitor(service=service, workers=2, shard_size=2)
+        for i in range(3):
+            monitor.mark_dirty(f"s{i}")
+
+        report = monitor.run_once()
+        assert report["sessions_failed"] == 1
+        assert report["overall_status"] == "error"
+        assert monitor.dirty.drain() == {"s1": 0}
+
+    def test_lagging_replica_replaced_by_master(self, replicas, monkeypatch):
+        """Shard со свежими записями читает master, если реплика их ещё не видит"""
+        monkeypatch.setitem(replicas, "master", replicas["replica1"])
+        service = RecordingService()
+        monitor = ConsistencyMonitor(service=service, workers=1, shard_size=1)
+        # SQLite не сообщает позицию репликации: реплика не считается догнавшей
+        monitor.mark_dirty("s1", 5)
+        monitor.mark_dirty("s2")
+
+        report = monitor.run_once()
+        assert [shard["replica"] for shard in report["shards"]] == ["master", "replica2"]
+        assert sorted(service.checked) == ["s1", "s2"]
+
+    def test_real_checks(self, replicas, monkeypatch):
+        """Проверка настоящим сервисом читает разметки с реплики shard'а"""
+        monkeypatch.setattr(consistency_module, "conflict_index", InMemoryConflictIndex())
+        for maker in replicas.values():
+            db = maker()
+            for label in ("pos", "neg"):
+                db.add(LabeledData(
+                    session_id="s1", annotator_id="a", data_id="d1", original_text="t",
+                    label=label, vector_clock={"a": 1} if label == "pos" else {"b": 1}
+                ))
+            db.commit()
+            db.close()
+        monitor = ConsistencyMonitor(workers=1, shard_size=1)
+        monitor.mark_dirty("s1")
+
+        report = monitor.run_once()
+        assert report["conflicts_found"] == 1
+        assert report["concurrent_pairs"] == 1
+        assert monitor.last_report is report
@@ -0,0 +1,110 @@
+import pytest
+import pandas as pd
+
+from app.services.csv_index import CSVRowIndex, RowIndexBuilder
+
+
+CSV_CONTENT = (
+    'data_id,text,score\n'
+    '1,"first line\nsecond line",0.5\n'
+    '\n'
+    '2,"quoted ""comma"", here",0.7\n'
+    '3,plain,0.1\r\n'
+    '4,"multi\r\nline\r\n",0.2\n'
+    '5,last,0.9'
+)
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    """CSV файл с кавычками, пустыми строками и без завершающего перевода строки"""
+    path = tmp_path / "data.csv"
+    path.write_bytes(CSV_CONTENT.encode("utf-8"))
+    return str(path)
+
+
+@pytest.fixture
+def large_csv_file(tmp_path):
+    """CSV файл на несколько блоков индекса"""
+    path = tmp_path / "large.csv"
+    df = pd.DataFrame({
+        "data_id": range(2500),
+        "text": [f'text "{i}",\nline' if i % 7 == 0 else f"text {i}" for i in range(2500)],
+        "label": ["positive" if i % 2 else "negative" for i in range(2500)]
+    })
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+class TestCSVRowIndex:
+    """Тесты индекса смещений строк CSV"""
+
+    def test_total_rows_matches_pandas(self, csv_file):
+        """Количество строк совпадает с полным разбором pandas"""
+        index = CSVRowIndex.build(csv_file, stride=2)
+
+        assert index.total_rows == len(pd.read_csv(csv_file))
+
+    def test_read_rows_matches_full_parse(self, csv_file):
+        """Каждая страница совпадает с соответствующим срезом полного разбора"""
+        index = CSVRowIndex.build(csv_file, stride=2)
+        full = pd.read_csv(csv_file)
+
+        for offset in range(len(full) + 1):
+            for limit in (1, 2, 3, 10):
+                page = index.read_rows(offset, limit)
+                expected = full.iloc[offset:offset + limit].reset_index(drop=True)
+                assert page["data_id"].tolist() == expected["data_id"].tolist()
+                assert page["text"].tolist() == expected["text"].tolist()
+
+    def test_incremental_feed_is_chunk_independent(self, large_csv_file):
+        """Индекс не зависит от того, какими кусками подаётся файл"""
+        with open(large_csv_file, "rb") as f:
+            content = f.read()
+
+        reference = CSVRowIndex.build(large_csv_file, stride=100)
+
+        for chunk_size in (1, 7, 4096):
+            builder = RowIndexBuilder(stride=100)
+            for start in range(0, len(content), chunk_size):
+                builder.feed(content[start:start + chunk_size])
+            index = builder.finish(large_csv_file)
+
+            assert index.total_rows == reference.total_rows == 2500
+            assert index.offsets.tolist() == reference.offsets.tolist()
+
+    def test_deep_offsets(self, large_csv_file):
+        """Чтение с глубоких смещений через несколько блоков индекса"""
+        index = CSVRowIndex.build(large_csv_file, stride=100)
+        full = pd.read_csv(large_csv_file)
+
+        for offset in (0, 99, 100, 101, 1234, 2450, 2499):
+            page = index.read_rows(offset, 50)
+            expected = full.iloc[offset:offset + 50].reset_index(drop=True)
+            pd.testing.assert_frame_equal(page, expected)
+
+    def test_load_saved_index(self, large_csv_file):
+        """Индекс сохраняется рядом с файлом и загружается без перестроения"""
+        built = CSVRowIndex.build(large_csv_file, stride=100)
+        loaded = CSVRowIndex.load(large_csv_file)
+
+        assert loaded is not None
+        assert loaded.total_rows == built.total_rows
+        assert loaded.offsets.tolist() == built.offsets.tolist()
+
+    def test_stale_index_is_rebuilt(self, csv_file):
+        """Устаревший индекс (файл изменился) перестраивается"""
+        CSVRowIndex.build(csv_file, stride=2)
+        with open(csv_file, "a") as f:
+            f.write("\n6,appended,0.3\n")
+
+        assert CSVRowIndex.load(csv_file) is None
+        assert CSVRowIndex.load_or_build(csv_file).total_rows == 6
+
+    def test_read_past_end(self, csv_file):
+        """Чтение за пределами файла возвращает пустую страницу с колонками"""
+        index = CSVRowIndex.build(csv_file, stride=2)
+        page = index.read_rows(100, 10)
+
+        assert page.empty
+        assert list(page.columns) == ["data_id", "text", "score"]
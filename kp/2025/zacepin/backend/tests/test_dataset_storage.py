@@ -0,0 +1,83 @@
+import pytest
+import pandas as pd
+
+from app.core.config import settings
+from app.services.csv_index import CSVRowIndex
+from app.services.dataset_storage import (
+    ArrowDataset, open_dataset, prepare_dataset, remove_dataset,
+    STORAGE_ARROW, STORAGE_CSV
+)
+
+
+@pytest.fixture
+def arrow_storage(monkeypatch):
+    """Колоночное хранение с маленькими record batch'ами"""
+    monkeypatch.setattr(settings, "storage_format", STORAGE_ARROW)
+    monkeypatch.setattr(settings, "arrow_block_size", 4096)
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "dataset.csv"
+    pd.DataFrame({
+        "data_id": range(3000),
+        "text": [f"text, number {i}" for i in range(3000)],
+        "score": [i / 3000 for i in range(3000)]
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+class TestDatasetStorage:
+    """Тесты колоночного хранения загруженных датасетов"""
+
+    def test_arrow_pages_match_csv(self, arrow_storage, csv_file):
+        """Страницы из Arrow совпадают с полным разбором CSV"""
+        assert prepare_dataset(csv_file) == STORAGE_ARROW
+        dataset = open_dataset(csv_file)
+        full = pd.read_csv(csv_file)
+
+        assert isinstance(dataset, ArrowDataset)
+        assert dataset._reader.num_record_batches > 1
+        assert dataset.total_rows == len(full)
+
+        for offset in (0, 1, 150, 999, 2990, 2999):
+            page = dataset.read_rows(offset, 100)
+            expected = full.iloc[offset:offset + 100].reset_index(drop=True)
+            pd.testing.assert_frame_equal(page, expected)
+
+    def test_column_projection(self, arrow_storage, csv_file):
+        """Читаются только запрошенные колонки в обоих форматах"""
+        prepare_dataset(csv_file)
+        arrow_page = open_dataset(csv_file).read_rows(10, 5, ["text"])
+        csv_page = CSVRowIndex.build(csv_file).read_rows(10, 5, ["text"])
+
+        assert list(arrow_page.columns) == ["text"]
+        pd.testing.assert_frame_equal(arrow_page, csv_page)
+
+    def test_fallback_to_csv_on_inconsistent_types(self, arrow_storage, tmp_path):
+        """При несогласованных типах колонок файл остаётся в CSV"""
+        path = tmp_path / "mixed.csv"
+        rows = [f"{i},text" for i in range(2000)] + ["not_a_number,text"]
+        path.write_text("value,text\n" + "\n".join(rows) + "\n")
+
+        assert prepare_dataset(str(path)) == STORAGE_CSV
+        dataset = open_dataset(str(path))
+        assert isinstance(dataset, CSVRowIndex)
+        assert dataset.total_rows == 2001
+
+    def test_csv_mode_ignores_stale_copy(self, monkeypatch, arrow_storage, csv_file):
+        """В режиме CSV устаревшая колоночная копия удаляется"""
+        prepare_dataset(csv_file)
+        monkeypatch.setattr(settings, "storage_format", STORAGE_CSV)
+
+        assert prepare_dataset(csv_file) == STORAGE_CSV
+        assert isinstance(open_dataset(csv_file), CSVRowIndex)
+
+    def test_remove_dataset(self, arrow_storage, csv_file, tmp_path):
+        """Удаление файла вместе с индексом и колоночной копией"""
+        CSVRowIndex.build(csv_file)
+        prepare_dataset(csv_file)
+
+        remove_dataset(csv_file)
+
+        assert list(tmp_path.iterdir()) == []
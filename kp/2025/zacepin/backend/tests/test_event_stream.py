@@ -0,0 +1,230 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.core import event_stream as event_stream_module
+from app.core.event_stream import EventStream, RedisEventStream, parse_event_id
+from app.core.monitoring import metrics
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture(autouse=True)
+def fake_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+
+
+def redis_stream(**kwargs) -> RedisEventStream:
+    """Поток на асинхронном клиенте fakeredis"""
+    return RedisEventStream(fakeredis.aioredis.FakeRedis(decode_responses=True), **kwargs)
+
+
+def parse_frames(chunk: str):
+    """SSE-кадры в (id, тип, данные); keepalive-комментарии пропускаются"""
+    events = []
+    for frame in chunk.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class Client:
+    """Клиент, читающий SSE-поток сессии в фоновой задаче"""
+
+    def __init__(self, stream: EventStream, session_id: str, after: str = None):
+        self.frames = stream.events(session_id, after)
+        self.events = []
+        self.task = None
+
+    async def connect(self, stream: EventStream):
+        before = stream.connections()
+        self.task = asyncio.create_task(self._read())
+        while stream.connections() == before:
+            await asyncio.sleep(0)
+
+    async def _read(self):
+        async for chunk in self.frames:
+            self.events.extend(parse_frames(chunk))
+
+    async def wait_for(self, count: int):
+        while len(self.events) < count and not self.task.done():
+            await asyncio.sleep(0.001)
+        return self.events
+
+    async def close(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+class TestEventStream:
+    """Тесты потока событий разметки в памяти процесса"""
+
+    @pytest.mark.asyncio
+    async def test_live_and_resume(self):
+        """Живые события приходят подписчикам сессии, пропущенное дочитывается по id"""
+        stream = EventStream(heartbeat=0.01)
+        client, other = Client(stream, "s1"), Client(stream, "s2")
+        await client.connect(stream)
+        await other.connect(stream)
+
+        ids = await stream.publish("s1", [("label_created", {"n": i}) for i in range(3)])
+        await stream.publish("s2", [("label_created", {"n": 9})])
+
+        events = await client.wait_for(3)
+        assert [(event_id, data["n"]) for event_id, _, data in events] == list(zip(ids, range(3)))
+        assert [data["n"] for _, _, data in await other.wait_for(1)] == [9]
+        await client.close()
+        assert stream.connections() == 1
+
+        # Переподключение с id первого события: приходят только следующие
+        resumed = Client(stream, "s1", after=ids[0])
+        await resumed.connect(stream)
+        await stream.publish("s1", [("label_updated", {"n": 3})])
+        events = await resumed.wait_for(3)
+        assert [(event_type, data["n"]) for _, event_type, data in events] == [
+            ("label_created", 1), ("label_created", 2), ("label_updated", 3)
+        ]
+        await resumed.close()
+        await other.close()
+
+    @pytest.mark.asyncio
+    async def test_slow_client_disconnected(self):
+        """Переполненная очередь отключает только отставшего клиента"""
+        stream = EventStream(queue_size=2, heartbeat=0.01)
+        slow = await stream.subscribe("s1")
+        fast = Client(stream, "s1")
+        await fast.connect(stream)
+
+        for i in range(5):
+            await stream.publish("s1", [("label_created", {"n": i})])
+            await asyncio.sleep(0.01)
+
+        assert slow.closed
+        assert slow.queue.get_nowait() == "lagged"
+        assert [data["n"] for _, _, data in await fast.wait_for(5)] == list(range(5))
+        stream.unsubscribe(slow)
+        await fast.close()
+
+    @pytest.mark.asyncio
+    async def test_reconnect_event_on_lag(self):
+        """Отключённый клиент получает событие reconnect, и поток закрывается"""
+        stream = EventStream(queue_size=1, heartbeat=0.01)
+        frames = stream.events("s1")
+        pending = asyncio.ensure_future(frames.__anext__())
+        while not stream.connections():
+            await asyncio.sleep(0)
+        for i in range(3):
+            await stream.publish("s1", [("label_created", {"n": i})])
+
+        assert parse_frames(await pending) == [(None, "reconnect", {"reason": "lagged"})]
+        with pytest.raises(StopAsyncIteration):
+            await frames.__anext__()
+        assert stream.connections() == 0
+
+    @pytest.mark.asyncio
+    async def test_truncated_history_resets(self):
+        """Клиент, чья позиция вытеснена из истории, получает reset"""
+        stream = EventStream(history=3, heartbeat=0.01)
+        ids = await stream.publish("s1", [("label_created", {"n": i}) for i in range(5)])
+
+        client = Client(stream, "s1", after=ids[0])
+        await client.connect(stream)
+        events = await client.wait_for(4)
+        assert events[0][1] == "reset"
+        assert [data["n"] for _, _, data in events[1:]] == [2, 3, 4]
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_idle_sessions_evicted(self, monkeypatch):
+        """История сессии без публикаций дольше ttl удаляется"""
+        now = [1000.0]
+        monkeypatch.setattr(event_stream_module, "time", SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+        stream = EventStream(ttl=60)
+        await stream.publish("idle", [("label_created", {"n": 0})])
+        now[0] += 30
+        await stream.publish("active", [("label_created", {"n": 1})])
+
+        now[0] += 40
+        await stream.publish("active", [("label_created", {"n": 2})])
+        assert set(stream._events) == {"active"}
+        assert await stream.history("idle", (0, 0)) == ([], False)
+
+        now[0] += 60
+        assert await stream.history("active", (0, 0)) == ([], False)
+        assert not stream._events and not stream._published
+
+    def test_parse_event_id(self):
+        assert parse_event_id("1700000000000-5") == (1700000000000, 5)
+        assert parse_event_id("12") == (12, 0)
+        for invalid in ("", "abc", "1-x", "-1"):
+            with pytest.raises(ValueError):
+                parse_event_id(invalid)
+
+
+class TestRedisEventStream:
+    """Тесты потока событий в Redis: одна подписка на worker"""
+
+    @pytest.mark.asyncio
+    async def test_single_subscription_fans_out(self):
+        """Клиенты worker'а получают события через одну подписку на канал"""
+        stream = redis_stream(heartbeat=0.01)
+        clients = [Client(stream, f"s{i % 2}") for i in range(4)]
+        for client in clients:
+            await client.connect(stream)
+        assert await stream.async_redis.pubsub_numsub(stream.channel) == [(stream.channel, 1)]
+
+        ids = await stream.publish("s0", [("label_created", {"n": 1}), ("conflict_detected", {"n": 2})])
+        for client in clients[::2]:
+            assert [(event_id, event_type) for event_id, event_type, _ in await client.wait_for(2)] == [
+                (ids[0], "label_created"), (ids[1], "conflict_detected")
+            ]
+        assert all(client.events == [] for client in clients[1::2])
+
+        for client in clients:
+            await client.close()
+        await stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_resume_from_stream_history(self):
+        """Пропущенное дочитывается из Redis Stream сессии"""
+        stream = redis_stream(heartbeat=0.01)
+        ids = await stream.publish("s1", [("label_created", {"n": i}) for i in range(3)])
+
+        client = Client(stream, "s1", after=ids[1])
+        await client.connect(stream)
+        await stream.publish("s1", [("label_updated", {"n": 3})])
+        assert [data["n"] for _, _, data in await client.wait_for(2)] == [2, 3]
+        assert await stream.async_redis.ttl(stream._stream_key("s1")) > 0
+
+        await client.close()
+        await stream.stop()
+
+    @pytest.mark.asyncio
+    async def test_thousand_clients(self):
+        """1000 клиентов на 50 сессиях получают ровно события своей сессии"""
+        stream = redis_stream(heartbeat=1.0)
+        clients = [Client(stream, f"s{i % 50}") for i in range(1000)]
+        for client in clients:
+            await client.connect(stream)
+        assert stream.connections() == 1000
+        assert await stream.async_redis.pubsub_numsub(stream.channel) == [(stream.channel, 1)]
+
+        published = {
+            f"s{session}": await stream.publish(f"s{session}", [("label_created", {"n": n}) for n in range(5)])
+            for session in range(50)
+        }
+        for i, client in enumerate(clients):
+            events = await client.wait_for(5)
+            assert [event_id for event_id, _, _ in events] == published[f"s{i % 50}"]
+
+        for client in clients:
+            await client.close()
+        assert stream.connections() == 0
+        await stream.stop()
@@ -0,0 +1,312 @@
+import json
+import random
+import threading
+
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.core.histogram import RELATIVE_ACCURACY, LogHistogram, percentile_name
+from app.core.monitoring import HISTORY_SIZE, MetricsCollector
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class CountingRedis(fakeredis.FakeRedis):
+    """fakeredis, считающий команды вне pipeline"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.direct_commands = 0
+
+    def execute_command(self, *args, **kwargs):
+        self.direct_commands += 1
+        return super().execute_command(*args, **kwargs)
+
+
+@pytest.fixture
+def collector():
+    collector = MetricsCollector()
+    collector.redis_client = CountingRedis(decode_responses=True)
+    yield collector
+    collector.stop()
+
+
+class TestMetricsCollector:
+    """Тесты буферизованного сборщика метрик"""
+
+    def test_unbuffered_writes_immediately(self, collector):
+        """До start() каждая метрика сразу пишется в Redis"""
+        collector.increment_counter("requests", tags={"path": "/"})
+        collector.set_gauge("active", 3)
+
+        prefix = collector.metrics_prefix
+        assert collector.redis_client.get(f"{prefix}counter:requests:path=/") == "1"
+        assert collector.redis_client.get(f"{prefix}gauge:active") == "3"
+
+    def test_buffer_aggregates_until_flush(self, collector):
+        """Буфер суммирует счётчики, хранит последний gauge и историю timing"""
+        collector.buffered = True
+        for i in range(5):
+            collector.increment_counter("requests", 2)
+            collector.set_gauge("active", i)
+            collector.record_timing("latency", i / 10)
+        collector.record_event("session_created", {"session_id": "s1"})
+
+        client = collector.redis_client
+        assert client.direct_commands == 0
+        assert collector.flush() == 4
+        # Все команды ушли одним pipeline
+        assert client.direct_commands == 0
+
+        prefix = collector.metrics_prefix
+        assert client.get(f"{prefix}counter:requests") == "10"
+        assert client.get(f"{prefix}gauge:active") == "4"
+        assert collector.timing_stats("latency")["count"] == 5
+        event = json.loads(client.lindex(f"{prefix}events:session_created", 0))
+        assert event["data"] == {"session_id": "s1"}
+        assert 0 < client.ttl(f"{prefix}counter:requests") <= 86400
+
+        # Пустой буфер не обращается к Redis
+        assert collector.flush() == 0
+
+    def test_flush_merges_with_stored_values(self, collector):
+        """Повторные сбросы накапливают счётчики и обрезают историю событий"""
+        collector.buffered = True
+        for _ in range(3):
+            collector.increment_counter("requests")
+            for i in range(HISTORY_SIZE):
+                collector.record_event("tick", {"i": i})
+            collector.flush()
+
+        prefix = collector.metrics_prefix
+        assert collector.redis_client.get(f"{prefix}counter:requests") == "3"
+        assert collector.redis_client.llen(f"{prefix}events:tick") == HISTORY_SIZE
+
+    def test_concurrent_increments(self, collector):
+        """Инкременты из нескольких потоков не теряются"""
+        collector.buffered = True
+
+        def worker():
+            for _ in range(1000):
+                collector.increment_counter("requests")
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        collector.flush()
+
+        assert collector.redis_client.get(f"{collector.metrics_prefix}counter:requests") == "8000"
+
+    def test_background_flush(self, collector, monkeypatch):
+        """Фоновый поток сбрасывает буфер, stop() записывает остаток"""
+        monkeypatch.setattr(settings, "metrics_flush_interval", 0.05)
+        collector.start()
+        collector.increment_counter("requests")
+        collector._flush_stop.wait(0.3)
+
+        key = f"{collector.metrics_prefix}counter:requests"
+        assert collector.redis_client.get(key) == "1"
+
+        collector.increment_counter("requests")
+        collector.stop()
+        assert collector.redis_client.get(key) == "2"
+        assert collector.buffered is False
+
+
+class FakeTime:
+    """Управляемые часы для скользящих окон"""
+
+    def __init__(self):
+        self.now = 1_000_020.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestLogHistogram:
+    """Тесты логарифмической гистограммы"""
+
+    def test_quantiles_within_relative_accuracy(self):
+        """Квантили отличаются от точных не более чем на относительную погрешность"""
+        rng = np.random.default_rng(42)
+        values = rng.lognormal(mean=-4, sigma=1.5, size=100_000)
+        histogram = LogHistogram()
+        for value in values:
+            histogram.add(float(value))
+
+        ordered = np.sort(values)
+        for q in (0.5, 0.95, 0.99, 0.999):
+            exact = ordered[int(q * (len(values) - 1))]
+            assert abs(histogram.quantile(q) - exact) <= RELATIVE_ACCURACY * exact * 1.0001
+        assert histogram.mean == pytest.approx(values.mean())
+        # Хранятся корзины, а не значения
+        assert len(histogram.buckets) < 2000
+
+    def test_merge_equals_union(self):
+        """Объединение гистограмм равно гистограмме объединения значений"""
+        values = [random.Random(1).expovariate(10) for _ in range(1000)] + [0.0]
+        left, right, union = LogHistogram(), LogHistogram(), LogHistogram()
+        for i, value in enumerate(values):
+            (left if i % 2 else right).add(value)
+            union.add(value)
+        left.merge(right)
+
+        assert dict(left.buckets) == dict(union.buckets)
+        assert left.count == union.count == 1001
+        assert left.quantile(0) == 0.0
+        assert left.percentiles((0.5, 0.99)) == union.percentiles((0.5, 0.99))
+
+    def test_fields_round_trip(self):
+        """Сериализация в поля hash и обратно без потерь"""
+        histogram = LogHistogram()
+        for value in (0.0, 0.001, 0.002, 0.5, 3.0):
+            histogram.add(value)
+        fields = {k: str(v) for k, v in histogram.to_fields().items()}
+        restored = LogHistogram.from_fields(fields)
+
+        assert restored.percentiles((0.25, 0.5, 1.0)) == histogram.percentiles((0.25, 0.5, 1.0))
+        assert restored.count == 5 and restored.zero_count == 1
+        assert LogHistogram().quantile(0.5) is None
+
+    def test_percentile_names(self):
+        assert [percentile_name(q) for q in (0.5, 0.95, 0.99, 0.999)] == ["p50", "p95", "p99", "p999"]
+
+
+class TestTimingHistograms:
+    """Тесты гистограмм времени выполнения в Redis"""
+
+    def test_sliding_window(self, collector):
+        """Квантили считаются только по слотам внутри окна"""
+        clock = FakeTime()
+        collector.time_func = clock
+        for _ in range(10):
+            collector.record_timing("latency", 0.010, tags={"path": "/a"})
+        clock.now += 180
+        for _ in range(10):
+            collector.record_timing("latency", 1.0, tags={"path": "/a"})
+
+        recent = collector.timing_stats("latency", tags={"path": "/a"}, window=60)
+        assert recent["count"] == 10
+        assert recent["p50"] == pytest.approx(1.0, rel=RELATIVE_ACCURACY)
+
+        wide = collector.timing_stats("latency", tags={"path": "/a"}, window=600)
+        assert wide["count"] == 20
+        assert wide["p50"] == pytest.approx(0.010, rel=RELATIVE_ACCURACY)
+        assert wide["p999"] == pytest.approx(1.0, rel=RELATIVE_ACCURACY)
+        assert collector.timing_metrics() == ["latency:path=/a"]
+
+    def test_window_bounds(self, collector):
+        """Окно ограничено сроком хранения слотов, неположительное окно отклоняется"""
+        collector.time_func = FakeTime()
+        slots = settings.metrics_histogram_retention // settings.metrics_histogram_slot
+        assert len(collector._slot_keys("latency", 10 ** 9)) == slots + 1
+        for window in (0, -60):
+            with pytest.raises(ValueError):
+                collector.timing_stats("latency", window=window)
+
+    def test_workers_merge_in_redis(self, collector):
+        """Гистограммы нескольких worker'ов складываются в одном hash"""
+        clock = FakeTime()
+        workers = []
+        for _ in range(3):
+            worker = MetricsCollector()
+            worker.redis_client = collector.redis_client
+            worker.time_func = clock
+            worker.buffered = True
+            workers.append(worker)
+        for i in range(3000):
+            workers[i % 3].record_timing("latency", (i + 1) / 1000)
+        for worker in workers:
+            worker.flush()
+        collector.time_func = clock
+
+        stats = collector.timing_stats("latency")
+        assert stats["count"] == 3000
+        assert stats["avg"] == pytest.approx(1.5005)
+        assert stats["p99"] == pytest.approx(2.970, rel=RELATIVE_ACCURACY)
+        # Вместо 3000 значений хранятся только корзины
+        keys = collector.redis_client.keys(f"{collector.metrics_prefix}hist:*")
+        assert len(keys) == 1
+        assert collector.redis_client.hlen(keys[0]) < 400
+
+
+class TestMetricRegistry:
+    """Тесты реестра ключей метрик вместо KEYS"""
+
+    def test_writes_register_keys(self, collector):
+        """Каждая запись, прямая и через буфер, добавляет ключ в реестр своего типа"""
+        collector.increment_counter("requests", tags={"path": "/"})
+        collector.buffered = True
+        collector.set_gauge("active", 3)
+        collector.record_timing("latency", 0.01)
+        collector.record_event("session_created", {"session_id": "s1"})
+        collector.flush()
+
+        client, prefix = collector.redis_client, collector.metrics_prefix
+        assert client.smembers(f"{prefix}registry:counter") == {f"{prefix}counter:requests:path=/"}
+        assert client.smembers(f"{prefix}registry:gauge") == {f"{prefix}gauge:active"}
+        assert client.zrange(f"{prefix}registry:hist_slots", 0, -1) == [f"{prefix}hist:latency"]
+        assert client.smembers(f"{prefix}registry:events") == {f"{prefix}events:session_created"}
+
+    def test_snapshot_without_keyspace_scan(self, collector, monkeypatch):
+        """Снимок читает только зарегистрированные ключи за два pipeline"""
+        clock = FakeTime()
+        collector.time_func = clock
+        client, prefix = collector.redis_client, collector.metrics_prefix
+        for i in range(500):
+            client.set(f"session:{i}", "x")
+        collector.increment_counter("requests", 5)
+        collector.set_gauge("active", 2.5)
+        collector.record_timing("latency", 0.5, tags={"path": "/a"})
+
+        def forbidden(*args, **kwargs):
+            raise AssertionError("keyspace scan")
+
+        monkeypatch.setattr(client, "keys", forbidden)
+        monkeypatch.setattr(client, "scan_iter", forbidden)
+        client.direct_commands = 0
+        snapshot = collector.snapshot(window=60)
+
+        assert client.direct_commands == 0
+        assert snapshot["counters"] == {"requests": 5}
+        assert snapshot["gauges"] == {"active": 2.5}
+        assert snapshot["timings"]["latency:path=/a"]["count"] == 1
+        assert snapshot["timings"]["latency:path=/a"]["p50"] == pytest.approx(0.5, rel=RELATIVE_ACCURACY)
+
+    def test_expired_keys_pruned(self, collector):
+        """Ключи с истёкшим TTL выпадают из снимка и удаляются из реестра"""
+        collector.increment_counter("requests")
+        collector.increment_counter("errors")
+        prefix = collector.metrics_prefix
+        collector.redis_client.delete(f"{prefix}counter:errors")
+
+        assert collector.snapshot()["counters"] == {"requests": 1}
+        assert collector.redis_client.smembers(f"{prefix}registry:counter") == {f"{prefix}counter:requests"}
+
+    def test_expired_histograms_pruned(self, collector):
+        """Гистограмма, все слоты которой истекли, удаляется из реестра"""
+        clock = FakeTime()
+        collector.time_func = clock
+        collector.record_timing("old", 0.1)
+        clock.now += settings.metrics_histogram_retention - settings.metrics_histogram_slot
+        collector.record_timing("recent", 0.1)
+        assert collector.timing_metrics() == ["old", "recent"]
+
+        clock.now += 2 * settings.metrics_histogram_slot
+        assert collector.timing_metrics() == ["recent"]
+        registry = f"{collector.metrics_prefix}registry:hist_slots"
+        assert collector.redis_client.zrange(registry, 0, -1) == [f"{collector.metrics_prefix}hist:recent"]
+
+    def test_read_events(self, collector):
+        """События всех типов читаются по реестру, новые первыми"""
+        for i in range(3):
+            collector.record_event("tick", {"i": i})
+        collector.record_event("tock", {})
+
+        events = collector.read_events()
+        assert [event["event_type"] for event in events].count("tick") == 3
+        assert events[0]["event_type"] == "tock"
+        assert [event["data"] for event in collector.read_events("tick", limit=2)] == [{"i": 2}, {"i": 1}]
@@ -0,0 +1,302 @@
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.util import await_only
+
+from app.core.config import settings
+from app.core.database import DatabaseManager
+from app.core.monitoring import metrics
+from app.core.replica_router import ReplicaRouter
+
+fakeredis = pytest.importorskip("fakeredis")
+
+REPLICAS = ["master", "replica1", "replica2"]
+
+
+class StandInReplica:
+    """SQLite база вместо реплики: задержка запросов и отставание задаются в тесте"""
+
+    def __init__(self, path, delay: float = 0.0, lag: float = 0.0, position: int = 0):
+        self.delay = delay
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE replication_status (lag FLOAT, position INTEGER)"))
+            conn.execute(text("INSERT INTO replication_status VALUES (0, :position)"), {"position": position})
+        engine.dispose()
+
+        self.sync_engine = create_engine(f"sqlite:///{path}")
+        self.async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        event.listen(self.async_engine.sync_engine, "before_cursor_execute", self._before_execute)
+        self.set_lag(lag)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.delay:
+            # Ожидание «сети» без блокировки event loop
+            await_only(asyncio.sleep(self.delay))
+
+    def set_lag(self, lag: float):
+        with self.sync_engine.begin() as conn:
+            conn.execute(text("UPDATE replication_status SET lag = :lag"), {"lag": lag})
+
+    def set_position(self, position: int):
+        with self.sync_engine.begin() as conn:
+            conn.execute(text("UPDATE replication_status SET position = :p"), {"p": position})
+
+
+@pytest.fixture(autouse=True)
+def fake_metrics(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(metrics, "redis_client", client)
+    return client
+
+
+@pytest.fixture
+def stand_ins(tmp_path):
+    replicas = {
+        "master": StandInReplica(tmp_path / "master.db", delay=0.03, position=100),
+        "replica1": StandInReplica(tmp_path / "replica1.db", delay=0.0, lag=0.5, position=90),
+        "replica2": StandInReplica(tmp_path / "replica2.db", delay=0.015, lag=1.0, position=100),
+    }
+    yield replicas
+    for replica in replicas.values():
+        replica.sync_engine.dispose()
+
+
+def make_manager(stand_ins, strategy="power_of_two"):
+    manager = DatabaseManager(
+        replicas={name: sessionmaker(bind=r.sync_engine) for name, r in stand_ins.items()},
+        async_replicas={
+            name: async_sessionmaker(bind=r.async_engine, expire_on_commit=False)
+            for name, r in stand_ins.items()
+        },
+        router=ReplicaRouter(REPLICAS, strategy=strategy, alpha=0.5, rng=random.Random(0))
+    )
+    manager.lag_queries["sqlite"] = "SELECT lag FROM replication_status"
+    manager.position_queries["sqlite"] = "SELECT position FROM replication_status"
+    return manager
+
+
+def replica_of(session, stand_ins) -> str:
+    """Имя stand-in, к которому привязана сессия"""
+    for name, replica in stand_ins.items():
+        if session.bind is replica.async_engine:
+            return name
+
+
+class TestReplicaRouter:
+    """Тесты выбора реплики по замерам"""
+
+    def test_ewma_latency(self):
+        """Задержка сглаживается экспоненциальным средним"""
+        router = ReplicaRouter(REPLICAS, alpha=0.5)
+        router.observe("replica1", 0.010, lag=0.0)
+        router.observe("replica1", 0.030, lag=2.0)
+
+        assert router.states["replica1"].latency == pytest.approx(0.020)
+        assert router.states["replica1"].lag == 2.0
+        # Отставание master всегда 0
+        router.observe("master", 0.010, lag=7.0)
+        assert router.states["master"].lag == 0.0
+
+    def test_unknown_strategy(self):
+        """Неизвестная стратегия отклоняется"""
+        with pytest.raises(ValueError):
+            ReplicaRouter(REPLICAS, strategy="random")
+
+    def test_unprobed_replicas_are_stale(self):
+        """Без замеров отставания реплики не проходят ограничение свежести"""
+        router = ReplicaRouter(REPLICAS)
+
+        assert router.choose(REPLICAS, max_staleness=5.0) == ("master", "power_of_two")
+        assert router.choose([], max_staleness=5.0) == ("master", "fallback")
+
+
+class TestReplicaRouting:
+    """Тесты маршрутизации чтения на SQLite-репликах с задержками"""
+
+    @pytest.mark.asyncio
+    async def test_probe_measures_latency_and_lag(self, stand_ins):
+        """Проба замеряет задержку и отставание каждой реплики"""
+        manager = make_manager(stand_ins)
+        await manager.update_replica_health()
+
+        status = manager.replica_status()
+        assert all(replica["healthy"] for replica in status.values())
+        assert status["replica1"]["latency_ms"] < status["replica2"]["latency_ms"]
+        assert status["replica2"]["latency_ms"] < status["master"]["latency_ms"]
+        assert status["replica1"]["lag_seconds"] == 0.5
+        assert status["replica2"]["lag_seconds"] == 1.0
+        assert status["master"]["lag_seconds"] == 0.0
+
+    @pytest.mark.asyncio
+    async def test_least_latency(self, stand_ins):
+        """least_latency всегда выбирает самую быструю реплику"""
+        manager = make_manager(stand_ins, strategy="least_latency")
+        await manager.update_replica_health()
+
+        chosen = Counter(manager.select_read_replica() for _ in range(50))
+        assert chosen == {"replica1": 50}
+
+    @pytest.mark.asyncio
+    async def test_power_of_two_avoids_slowest(self, stand_ins):
+        """Из двух случайных кандидатов берётся быстрый: самая медленная не выбирается"""
+        manager = make_manager(stand_ins)
+        await manager.update_replica_health()
+
+        chosen = Counter(manager.select_read_replica() for _ in range(300))
+        assert chosen["master"] == 0
+        assert chosen["replica1"] > chosen["replica2"] > 0
+
+    @pytest.mark.asyncio
+    async def test_max_staleness(self, stand_ins):
+        """Отстающие сильнее ограничения реплики исключаются, иначе чтение с master"""
+        manager = make_manager(stand_ins)
+        await manager.update_replica_health()
+
+        assert {manager.select_read_replica(max_staleness=0.75) for _ in range(30)} == {"replica1"}
+        assert manager.select_read_replica(max_staleness=0.1) == "master"
+
+        # Реплика догнала master: после следующей пробы снова доступна
+        stand_ins["replica2"].set_lag(0.0)
+        await manager.update_replica_health()
+        assert "replica2" in {manager.select_read_replica(max_staleness=0.1) for _ in range(30)}
+
+    @pytest.mark.asyncio
+    async def test_slow_replica_marked_unhealthy(self, stand_ins, monkeypatch):
+        """Реплика, не ответившая за replica_read_timeout, исключается из чтения"""
+        monkeypatch.setattr(settings, "replica_read_timeout", 0.1)
+        manager = make_manager(stand_ins)
+        stand_ins["replica1"].delay = 0.5
+        await manager.update_replica_health()
+
+        assert manager.replica_health["replica1"] is False
+        assert "replica1" not in {manager.select_read_replica() for _ in range(30)}
+        # Явно запрошенная реплика выдаётся как есть
+        assert manager.select_read_replica("replica1") == "replica1"
+
+    @pytest.mark.asyncio
+    async def test_routing_metrics(self, stand_ins, fake_metrics):
+        """Решения маршрутизации и замеры проб публикуются в метрики пачкой"""
+        manager = make_manager(stand_ins, strategy="least_latency")
+        await manager.update_replica_health()
+        for _ in range(3):
+            manager.select_read_replica()
+        manager.select_read_replica(max_staleness=0.1)
+        manager.replica_health["master"] = False
+        manager.select_read_replica(max_staleness=0.1)
+        manager.publish_metrics()
+
+        prefix = metrics.metrics_prefix
+        assert fake_metrics.get(
+            f"{prefix}counter:db.read_route:replica=replica1:reason=least_latency"
+        ) == "3"
+        assert fake_metrics.get(
+            f"{prefix}counter:db.read_route:replica=master:reason=least_latency"
+        ) == "1"
+        assert fake_metrics.get(f"{prefix}counter:db.read_route:replica=master:reason=fallback") == "1"
+        assert fake_metrics.get(f"{prefix}gauge:db.replica_lag_seconds:replica=replica2") == "1.0"
+        assert float(fake_metrics.get(f"{prefix}gauge:db.replica_latency_ms:replica=master")) >= 30
+
+    @pytest.mark.asyncio
+    async def test_background_prober(self, stand_ins, monkeypatch):
+        """Фоновая проба обновляет состояние реплик и останавливается"""
+        monkeypatch.setattr(settings, "replica_health_check_interval", 0.05)
+        manager = make_manager(stand_ins)
+        manager.start()
+        try:
+            await asyncio.sleep(0.3)
+        finally:
+            await manager.stop()
+
+        assert manager.router.states["replica2"].lag == 1.0
+        assert manager._probe_task is None
+
+
+class TestReadYourWrites:
+    """Тесты чтения собственных записей сессии с реплик"""
+
+    @pytest.mark.asyncio
+    async def test_write_returns_high_water_mark(self, stand_ins):
+        """Запись возвращает позицию master, high-water mark сессии не убывает"""
+        manager = make_manager(stand_ins)
+        async with manager.get_async_write_session() as db:
+            assert await manager.mark_write(db, "session") == 100
+            stand_ins["master"].set_position(50)
+            assert await manager.mark_write(db, "other") == 50
+            assert await manager.mark_write(db, "session") == 100
+
+        assert manager.session_position("session") == 100
+        assert manager.session_position("session", token="120") == 120
+        assert manager.session_position("unknown") is None
+
+    @pytest.mark.asyncio
+    async def test_prefers_caught_up_replica(self, stand_ins):
+        """Самая быстрая реплика отстаёт от токена: чтение идёт на догнавшую"""
+        manager = make_manager(stand_ins, strategy="least_latency")
+        await manager.update_replica_health()
+
+        session = await manager.get_consistent_read_session(min_position=100)
+        assert replica_of(session, stand_ins) == "replica2"
+        await session.close()
+
+        # Без токена по-прежнему выбирается самая быстрая реплика
+        session = await manager.get_consistent_read_session()
+        assert replica_of(session, stand_ins) == "replica1"
+        await session.close()
+
+    @pytest.mark.asyncio
+    async def test_live_position_check(self, stand_ins):
+        """Реплика, догнавшая позицию после пробы, проверяется запросом и используется"""
+        manager = make_manager(stand_ins, strategy="least_latency")
+        await manager.update_replica_health()
+        stand_ins["replica1"].set_position(110)
+
+        session = await manager.get_consistent_read_session(min_position=105)
+        assert replica_of(session, stand_ins) == "replica1"
+        await session.close()
+        assert manager.router.states["replica1"].position == 110
+        assert manager.router.drain_decisions() == {("replica1", "caught_up"): 1}
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_master(self, stand_ins):
+        """Ни одна реплика не догнала запись: чтение с master"""
+        manager = make_manager(stand_ins)
+        await manager.update_replica_health()
+        stand_ins["master"].set_position(200)
+        async with manager.get_async_write_session() as db:
+            await manager.mark_write(db, "session")
+
+        for _ in range(5):
+            session = await manager.get_consistent_read_session(
+                min_position=manager.session_position("session")
+            )
+            assert replica_of(session, stand_ins) == "master"
+            await session.close()
+        assert manager.router.drain_decisions() == {("master", "read_your_writes"): 5}
+
+    @pytest.mark.asyncio
+    async def test_without_position_query(self, stand_ins):
+        """Без позиции журнала записавшая сессия читает с master, остальные - с реплик"""
+        manager = make_manager(stand_ins, strategy="least_latency")
+        manager.position_queries.clear()
+        await manager.update_replica_health()
+        async with manager.get_async_write_session() as db:
+            first = await manager.mark_write(db, "writer")
+            assert await manager.mark_write(db, "writer") == first + 1
+
+        session = await manager.get_consistent_read_session(
+            min_position=manager.session_position("writer")
+        )
+        assert replica_of(session, stand_ins) == "master"
+        await session.close()
+
+        session = await manager.get_consistent_read_session(
+            min_position=manager.session_position("reader")
+        )
+        assert replica_of(session, stand_ins) == "replica1"
+        await session.close()
@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import List
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.core.serialization import (
+    LABELED_DATA_FIELDS, dumps, json_response, labeled_data_dict, labeled_data_json
+)
+from app.schemas.labeling import LabeledDataResponse
+
+
+def fastapi_body(rows) -> bytes:
+    """Тело ответа по прежнему пути: модели, валидация response_model, JSONResponse"""
+    models = [LabeledDataResponse(**labeled_data_dict(row)) for row in rows]
+    field = create_response_field(name="response", type_=List[LabeledDataResponse])
+    content = asyncio.run(serialize_response(field=field, response_content=models))
+    return JSONResponse(content).body
+
+
+def make_rows():
+    return [
+        (1, "s1", "a1", "d1", "Простой текст", "positive", Decimal("0.95"), {"master": 1},
+         datetime(2025, 1, 1, 12, 0), datetime(2025, 1, 1, 12, 0, 0, 123456), False, "pending"),
+        (2, "s1", "a2", "d\"2", "line\nbreak   😀", "neg", Decimal("0.10"), {},
+         datetime(2025, 1, 2, tzinfo=timezone.utc),
+         datetime(2025, 1, 2, 3, 4, 5, 6, tzinfo=timezone(timedelta(hours=3))), True, "manual"),
+    ]
+
+
+class TestLabeledDataSerialization:
+    """Тесты быстрой сериализации разметок"""
+
+    def test_matches_fastapi_response(self):
+        """Байты совпадают с ответом через response_model"""
+        rows = make_rows()
+        assert labeled_data_json(rows) == fastapi_body(rows)
+        assert labeled_data_json([]) == fastapi_body([]) == b"[]"
+
+    def test_single_record(self):
+        row = make_rows()[0]
+        assert dumps(labeled_data_dict(row)) == fastapi_body([row])[1:-1]
+        assert list(labeled_data_dict(row)) == list(LabeledDataResponse.model_fields) == list(LABELED_DATA_FIELDS)
+
+    def test_json_response_keeps_endpoint_headers(self):
+        sub_response = Response()
+        sub_response.headers["X-Next-Cursor"] = "abc"
+        response = json_response(b"[]", sub_response)
+
+        assert response.body == b"[]"
+        assert response.headers["x-next-cursor"] == "abc"
+        assert response.headers["content-length"] == "2"
+        assert response.media_type == "application/json"
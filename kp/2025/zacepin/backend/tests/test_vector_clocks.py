@@ -1,5 +1,8 @@
 import pytest
+import random
+import time
 from app.models.vector_clock import VectorClockManager, vector_clock_manager
+from app.services.vector_clock_engine import ClockMatrix, check_concurrency
 
 
 class TestVectorClocks:
@@ -181,9 +184,87 @@ class TestVectorClocks:
         # Проверка, что clocks созданы
         assert len(vector_clock_manager.clocks) >= 5
         
-        # Очистка (в реальной реализации здесь была бы логика очистки)
-        vector_clock_manager.cleanup_old_clocks(max_age_hours=0)
+        # Очистка: все сессии старше нулевого TTL вытесняются
+        time.sleep(0.01)
+        stats = vector_clock_manager.cleanup_old_clocks(max_age_hours=0)
         
-        # В текущей реализации очистка не реализована,
-        # поэтому clocks остаются
-        assert len(vector_clock_manager.clocks) >= 5
+        assert stats["sessions_evicted"] >= 5
+        assert not any(
+            session_id.startswith("cleanup_test_")
+            for session_id in vector_clock_manager.clocks
+        )
+
+
+class TestClockMatrix:
+    """Тесты пакетного сравнения vector clocks"""
+    
+    @staticmethod
+    def brute_force_pairs(clocks):
+        """Эталон: попарное сравнение через VectorClockManager"""
+        return [
+            (i, j)
+            for i in range(len(clocks))
+            for j in range(i + 1, len(clocks))
+            if vector_clock_manager.compare_clocks(clocks[i], clocks[j]) == "concurrent"
+        ]
+    
+    @pytest.mark.parametrize("nodes", [0, 1, 2, 3, 5])
+    def test_matches_pairwise_comparison(self, nodes):
+        """Результат совпадает с попарным сравнением для разного числа узлов"""
+        rng = random.Random(nodes)
+        node_ids = [f"node{k}" for k in range(nodes)]
+        
+        for _ in range(20):
+            clocks = [
+                {node: rng.randint(0, 3) for node in node_ids if rng.random() < 0.8}
+                for _ in range(rng.randint(0, 40))
+            ]
+            expected = self.brute_force_pairs(clocks)
+            matrix = ClockMatrix(clocks)
+            
+            assert matrix.count_concurrent() == len(expected)
+            assert [tuple(p) for p in matrix.concurrent_pairs().tolist()] == expected
+    
+    def test_issues_structure(self):
+        """check_concurrency возвращает прежнюю структуру issues"""
+        clocks = [{"node1": 1}, {"node2": 1}, {"node1": 1, "node2": 1}]
+        
+        result = check_concurrency(clocks)
+        
+        assert result["status"] == "inconsistent"
+        assert result["total_clocks"] == 3
+        assert result["concurrent_pairs"] == 1
+        assert result["issues"] == [{
+            "type": "concurrent_operations",
+            "record1": 0,
+            "record2": 1,
+            "clock1": {"node1": 1},
+            "clock2": {"node2": 1}
+        }]
+    
+    def test_count_only_and_limit(self):
+        """Быстрый путь без перечисления пар и ограничение числа issues"""
+        clocks = [{"a": i, "b": 10 - i} for i in range(10)]
+        
+        counted = check_concurrency(clocks, count_only=True)
+        limited = check_concurrency(clocks, max_issues=5)
+        
+        assert counted["concurrent_pairs"] == 45
+        assert counted["issues"] == []
+        assert len(limited["issues"]) == 5
+        assert limited["issues_truncated"] == True
+    
+    def test_duplicate_clocks_are_not_concurrent(self):
+        """Одинаковые clocks не считаются concurrent"""
+        clocks = [{"master": 1}] * 100 + [{"master": 2, "replica1": 0}] * 100
+        
+        result = check_concurrency(clocks)
+        
+        assert result["status"] == "consistent"
+        assert result["concurrent_pairs"] == 0
+    
+    def test_merged(self):
+        """Поэлементный максимум всех clocks"""
+        matrix = ClockMatrix([{"node1": 3}, {"node1": 1, "node2": 5}, {}])
+        
+        assert matrix.merged() == {"node1": 3, "node2": 5}
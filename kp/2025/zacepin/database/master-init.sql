@@ -54,8 +54,19 @@ CREATE TABLE csv_files (
     status VARCHAR(50) DEFAULT 'uploaded'
 );
 
+-- Rollup-статистика разметчиков, обновляется при записи разметок
+CREATE TABLE annotator_stats (
+    annotator_id VARCHAR(255) PRIMARY KEY,
+    total_labels INTEGER NOT NULL DEFAULT 0,
+    conflicts INTEGER NOT NULL DEFAULT 0,
+    confidence_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+    confidence_count INTEGER NOT NULL DEFAULT 0,
+    last_activity TIMESTAMP WITH TIME ZONE
+);
+
 -- Создание индексов для оптимизации запросов
 CREATE INDEX idx_labeled_data_session ON labeled_data(session_id);
+CREATE INDEX idx_labeled_data_session_keyset ON labeled_data(session_id, id);
 CREATE INDEX idx_labeled_data_annotator ON labeled_data(annotator_id);
 CREATE INDEX idx_labeled_data_created_at ON labeled_data(created_at);
 CREATE INDEX idx_annotator_sessions_active ON annotator_sessions(is_active);
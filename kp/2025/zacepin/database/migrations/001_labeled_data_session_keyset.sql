@@ -0,0 +1,8 @@
+-- Композитный индекс для keyset-пагинации разметки сессии:
+-- WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?
+-- Для существующих баз (новые создаются master-init.sql). CONCURRENTLY не
+-- блокирует запись в labeled_data, поэтому выполнять вне транзакции:
+--   psql -d labeling_db -f database/migrations/001_labeled_data_session_keyset.sql
+-- На реплики индекс приходит через потоковую репликацию.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_labeled_data_session_keyset
+    ON labeled_data(session_id, id);
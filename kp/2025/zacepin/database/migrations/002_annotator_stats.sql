@@ -0,0 +1,35 @@
+-- Rollup-статистика разметчиков для дашборда (GET /monitoring/annotators/stats).
+-- Приложение обновляет строки upsert'ом в транзакции каждой записи разметок;
+-- для существующих баз таблица заполняется агрегацией labeled_data.
+-- Выполнять до выкладки версии приложения, пишущей в annotator_stats:
+--   psql -d labeling_db -f database/migrations/002_annotator_stats.sql
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS annotator_stats (
+    annotator_id VARCHAR(255) PRIMARY KEY,
+    total_labels INTEGER NOT NULL DEFAULT 0,
+    conflicts INTEGER NOT NULL DEFAULT 0,
+    confidence_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+    confidence_count INTEGER NOT NULL DEFAULT 0,
+    last_activity TIMESTAMP WITH TIME ZONE
+);
+
+-- Среднее, как в get_labeling_stats, считается только по ненулевым уверенностям
+INSERT INTO annotator_stats (annotator_id, total_labels, conflicts, confidence_sum, confidence_count, last_activity)
+SELECT
+    annotator_id,
+    COUNT(*),
+    COUNT(*) FILTER (WHERE is_conflict),
+    COALESCE(SUM(confidence), 0),
+    COUNT(NULLIF(confidence, 0)),
+    MAX(updated_at)
+FROM labeled_data
+GROUP BY annotator_id
+ON CONFLICT (annotator_id) DO UPDATE SET
+    total_labels = EXCLUDED.total_labels,
+    conflicts = EXCLUDED.conflicts,
+    confidence_sum = EXCLUDED.confidence_sum,
+    confidence_count = EXCLUDED.confidence_count,
+    last_activity = EXCLUDED.last_activity;
+
+COMMIT;